@@ -0,0 +1,117 @@
+"""
+Clients blocked on keys (BLPOP, BRPOP, BLMOVE ...).
+
+A blocked client registers itself on every key it waits for, in FIFO order.
+When a command pushes data to a key, it calls signal_key_as_ready(key), and we serve the blocked clients of
+that key one by one (oldest first) for as long as there is data left:
+the blocked client's serve() callback runs the pop right away, inside the pushing command,
+and the reply is handed over through an asyncio.Future the blocked client is awaiting.
+
+So:
+1. Every pushed element wakes exactly one client, and clients are served in the order they blocked.
+2. Nothing can sneak in between the push and the pop (the pop runs synchronously in the pusher's command).
+3. Blocked clients cost a Future each. No asyncio task per blocked client.
+
+Keys are per database: a client blocked on key in db 1 is not served by a push to key in db 0.
+"""
+import asyncio
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Any
+
+from app import memory_management
+
+
+class BlockedClient:
+
+    def __init__(self, keys: list[bytes], serve: Callable[[bytes], Any]):
+        """
+        serve(key) -> the reply for the client if it could be served from key, None otherwise.
+        """
+        self.keys = keys
+        self.serve = serve
+        # serve() runs in the pushing command, which is in the same database.
+        self.db = memory_management.selected_db
+        self.future = asyncio.get_running_loop().create_future()
+
+
+# (db, key) -> clients blocked on it (FIFO)
+_blocked_clients: dict[tuple[int, bytes], deque[BlockedClient]] = {}
+
+# Cleared while EXEC runs: inside a transaction, blocking commands time out right away (same as redis).
+_blocking_allowed = True
+
+
+def num_blocked_clients() -> int:
+    return len({id(client) for waiting in _blocked_clients.values() for client in waiting})
+
+
+def num_blocking_keys() -> int:
+    return len(_blocked_clients)
+
+
+def is_blocking_allowed() -> bool:
+    return _blocking_allowed
+
+
+@contextmanager
+def blocking_disabled():
+    global _blocking_allowed
+    _blocking_allowed = False
+    try:
+        yield
+    finally:
+        _blocking_allowed = True
+
+
+def _unregister(client: BlockedClient):
+    for key in client.keys:
+        waiting = _blocked_clients.get((client.db, key))
+        if waiting is None:
+            continue
+        try:
+            waiting.remove(client)
+        except ValueError:
+            pass
+        if not waiting:
+            del _blocked_clients[(client.db, key)]
+
+
+async def block_on_keys(keys: list[bytes], serve: Callable[[bytes], Any], timeout_s: float):
+    """
+    Wait until one of keys can serve this client. timeout_s == 0 means wait forever.
+
+    return the reply built by serve(), or None on timeout.
+    """
+    if not _blocking_allowed:
+        return None
+    client = BlockedClient(keys, serve)
+    for key in keys:
+        _blocked_clients.setdefault((client.db, key), deque()).append(client)
+    try:
+        return await asyncio.wait_for(client.future, timeout_s or None)
+    except asyncio.TimeoutError:
+        return None
+    finally:
+        _unregister(client)
+
+
+def signal_key_as_ready(key: bytes):
+    """
+    Called by every command that adds data to key (in the selected database).
+    """
+    waiting = _blocked_clients.get((memory_management.selected_db, key))
+    while waiting:
+        # Take the client out of the queue before serving it: serve() may push to key again (eg: BLMOVE with
+        # source == destination), which signals key again, and that inner call must not serve the same client.
+        client = waiting.popleft()
+        if client.future.done():
+            # Timed out / cancelled, and not unregistered yet.
+            continue
+        reply = client.serve(key)
+        if reply is None:
+            # Nothing left in key to serve, the next push will signal again.
+            waiting.appendleft(client)
+            break
+        client.future.set_result(reply)
+    # Note: empty queues are removed by _unregister(), when the blocked clients resume.
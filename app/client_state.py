@@ -0,0 +1,457 @@
+"""
+Per connection state, and the registry of connected clients.
+
+HELLO [protover [SETNAME clientname]]
+CLIENT ID | SETNAME name | GETNAME | TRACKING ON|OFF [BCAST] [PREFIX prefix ...] [NOLOOP]
+CLIENT LIST [TYPE normal|replica|pubsub] [ID id ...] | INFO
+CLIENT KILL ip:port | KILL [ID id] [ADDR ip:port] [LADDR ip:port] [TYPE type] [SKIPME yes|no] [MAXAGE seconds]
+CLIENT PAUSE timeout-ms [WRITE|ALL] | UNPAUSE
+CLIENT NO-EVICT ON|OFF
+
+Connection limits (config.py): past maxclients, new connections get an error and are closed.
+Clients idle for more than `timeout` seconds are closed by a single task (clients_cron) that looks at all the
+clients once per second (not a timer per connection). Replicas, pub/sub clients and clients waiting in a
+blocking command are never idle. The same task enforces the time based output buffer limits (output_buffer.py).
+"""
+import asyncio
+import itertools
+import time
+
+from app.client_tracking import enable_tracking, disable_tracking
+from app.command_table import COMMAND_TABLE
+from app.config import server_config
+from app.errors import RedisCommandError, RedisSyntaxError
+from app.output_buffer import output_buffer_size, forget_writer, is_over_output_limit, disconnect_over_limit
+from app.pubsub import is_subscribed, _subscribers
+from app.replication import get_replication_role, is_replica_conn, is_master_conn
+from app.server_clock import now_ms
+from app.transaction import unwatch_all
+from app.redis_serialization_protocol import serialize_msg, SerializedTypes, OK_SIMPLE_STRING, NULL_BULK_STRING, \
+    get_resp_array_from_elems, parse_int_token
+
+SERVER_VERSION = '7.2.0'
+
+_next_client_id = itertools.count(1)
+
+# The idle client reaper runs this often.
+CLIENTS_CRON_INTERVAL_S = 1
+# A paused command re-checks the pause this often (CLIENT UNPAUSE can end it early).
+PAUSE_POLL_INTERVAL_S = 0.01
+
+
+class ClientState:
+
+    def __init__(self, writer, addr=None):
+        self.id = next(_next_client_id)
+        self.writer = writer
+        self.addr = addr
+        self.name = b''
+        # 2 or 3 (HELLO)
+        self.resp_version = 2
+        # SELECT: index of the database this client's commands run on (see memory_management.py)
+        self.db = 0
+        # CLIENT TRACKING (see client_tracking.py)
+        self.tracking = False
+        self.tracking_bcast = False
+        self.tracking_noloop = False
+        self.tracking_prefixes: list[bytes] = []
+        # MULTI / EXEC and WATCH (see transaction.py)
+        self.in_multi = False
+        self.multi_queue: list[list[bytes]] = []
+        # A command failed to queue: EXEC fails.
+        self.multi_error = False
+        # (db, key)
+        self.watched_keys: set[tuple[int, bytes]] = set()
+        self.watch_dirty = False
+        # CLIENT LIST / INFO and the idle timeout, in ms of the server clock (server_clock.py).
+        self.created_at = now_ms()
+        self.last_interaction = self.created_at
+        self.last_cmd = b'NULL'
+        # Bytes received but not parsed yet (the start of a command split across reads).
+        self.query_buffer_size = 0
+        # A command is running, maybe blocked waiting for data (or paused): the client is not idle.
+        self.in_command = False
+        # CLIENT NO-EVICT
+        self.no_evict = False
+        # Killed: the connection is closed once the current reply is sent.
+        self.close_after_reply = False
+
+
+# writer -> its ClientState
+_client_states: dict[object, ClientState] = {}
+
+
+def get_client_state(writer, addr=None) -> ClientState:
+    client = _client_states.get(writer)
+    if client is None:
+        client = _client_states[writer] = ClientState(writer, addr)
+    return client
+
+
+def remove_client_state(writer):
+    client = _client_states.pop(writer, None)
+    forget_writer(writer)
+    if client is not None:
+        disable_tracking(client)
+        unwatch_all(client)
+
+
+def too_many_clients() -> bool:
+    return len(_client_states) >= server_config['maxclients']
+
+
+def _format_addr(addr) -> str:
+    return f"{addr[0]}:{addr[1]}" if addr else ''
+
+
+def client_type(client: ClientState) -> str:
+    if is_replica_conn(client.writer):
+        return 'replica'
+    if is_subscribed(client.writer):
+        return 'pubsub'
+    return 'normal'
+
+
+def _flags(client: ClientState) -> str:
+    flags = ''
+    if is_replica_conn(client.writer):
+        flags += 'S'
+    if is_master_conn(client.writer):
+        flags += 'M'
+    if client.in_multi:
+        flags += 'x'
+    if is_subscribed(client.writer):
+        flags += 'P'
+    spec = COMMAND_TABLE.get(client.last_cmd.upper())
+    if client.in_command and spec is not None and spec.is_blocking:
+        flags += 'b'
+    if client.tracking:
+        flags += 't'
+    if client.no_evict:
+        flags += 'e'
+    if client.close_after_reply:
+        flags += 'c'
+    return flags or 'N'
+
+
+def client_info_line(client: ClientState, now: int) -> str:
+    writer = client.writer
+    laddr = writer.get_extra_info('sockname') if hasattr(writer, 'get_extra_info') else None
+    subscriber = _subscribers.get(writer)
+    return (f"id={client.id} addr={_format_addr(client.addr)} laddr={_format_addr(laddr)} "
+            f"name={client.name.decode(errors='replace')} age={(now - client.created_at) // 1000} "
+            f"idle={(now - client.last_interaction) // 1000} flags={_flags(client)} db={client.db} "
+            f"sub={len(subscriber.channels) if subscriber else 0} psub={len(subscriber.patterns) if subscriber else 0} "
+            f"ssub={len(subscriber.shard_channels) if subscriber else 0} "
+            f"multi={len(client.multi_queue) if client.in_multi else -1} qbuf={client.query_buffer_size} "
+            f"omem={output_buffer_size(writer)} cmd={client.last_cmd.decode(errors='replace').lower()} "
+            f"user=default resp={client.resp_version}")
+
+
+def kill_client(client: ClientState, current: ClientState | None = None):
+    """
+    Close the connection of client. The current client is closed after the reply (CLIENT KILL of itself).
+    """
+    client.close_after_reply = True
+    if client is not current:
+        # handle_client reads EOF and cleans up.
+        client.writer.close()
+
+
+def close_idle_clients(now: int) -> int:
+    timeout = server_config['timeout']
+    if timeout <= 0:
+        return 0
+    num_closed = 0
+    for client in list(_client_states.values()):
+        if now - client.last_interaction <= timeout * 1000 or client.in_command or client.close_after_reply:
+            continue
+        if is_replica_conn(client.writer) or is_master_conn(client.writer) or is_subscribed(client.writer):
+            continue
+        print(f"Closing idle client {client_info_line(client, now)}")
+        kill_client(client)
+        num_closed += 1
+    return num_closed
+
+
+def close_clients_over_output_limits() -> int:
+    """
+    The soft limits are time based: a client that stopped reading (and so stopped getting new replies)
+    must be checked even though nothing is written to it.
+    """
+    num_closed = 0
+    for client in list(_client_states.values()):
+        kind = client_type(client)
+        if not client.close_after_reply and is_over_output_limit(client.writer, kind):
+            disconnect_over_limit(client.writer, kind)
+            client.close_after_reply = True
+            num_closed += 1
+    return num_closed
+
+
+async def clients_cron():
+    while True:
+        await asyncio.sleep(CLIENTS_CRON_INTERVAL_S)
+        close_idle_clients(now_ms())
+        close_clients_over_output_limits()
+
+
+# CLIENT PAUSE: commands of normal clients wait until this time.monotonic() deadline (0: not paused).
+_pause_deadline = 0.0
+_pause_writes_only = False
+
+# Paused by CLIENT PAUSE WRITE on top of the write commands: they may write (scripts) or propagate.
+_PAUSED_IN_WRITE_MODE = frozenset({b'EVAL', b'EVALSHA', b'PUBLISH', b'SPUBLISH', b'PFCOUNT'})
+
+
+def is_pause_active() -> bool:
+    return _pause_deadline != 0.0
+
+
+def _is_paused(client: ClientState, first_token: bytes) -> bool:
+    global _pause_deadline
+    if _pause_deadline == 0.0:
+        return False
+    if time.monotonic() >= _pause_deadline:
+        _pause_deadline = 0.0
+        return False
+    if is_replica_conn(client.writer):
+        return False
+    if client.in_multi and first_token not in (b'EXEC', b'DISCARD'):
+        # Only queued: EXEC is what gets paused.
+        return False
+    if not _pause_writes_only:
+        return True
+    if first_token == b'EXEC':
+        commands = [tokens[0].upper() for tokens in client.multi_queue]
+    else:
+        commands = [first_token]
+    for command in commands:
+        spec = COMMAND_TABLE.get(command)
+        if command in _PAUSED_IN_WRITE_MODE or (spec is not None and spec.is_write):
+            return True
+    return False
+
+
+async def wait_while_paused(client: ClientState, tokens: list[bytes]):
+    first_token = tokens[0].upper()
+    while _is_paused(client, first_token):
+        await asyncio.sleep(min(_pause_deadline - time.monotonic(), PAUSE_POLL_INTERVAL_S))
+
+
+def _client_pause(tokens) -> bytes:
+    global _pause_deadline, _pause_writes_only
+    if len(tokens) not in (3, 4):
+        raise RedisSyntaxError()
+    timeout_ms = parse_int_token(tokens[2])
+    if timeout_ms < 0:
+        raise RedisCommandError("ERR timeout is negative")
+    mode = tokens[3].upper() if len(tokens) == 4 else b'ALL'
+    if mode not in (b'WRITE', b'ALL'):
+        raise RedisSyntaxError()
+    deadline = time.monotonic() + timeout_ms / 1000
+    if _pause_deadline and time.monotonic() < _pause_deadline:
+        # A pause can only be extended, and ALL wins over WRITE.
+        deadline = max(deadline, _pause_deadline)
+        writes_only = _pause_writes_only and mode == b'WRITE'
+    else:
+        writes_only = mode == b'WRITE'
+    _pause_deadline, _pause_writes_only = deadline, writes_only
+    return OK_SIMPLE_STRING
+
+
+def _client_unpause() -> bytes:
+    global _pause_deadline
+    _pause_deadline = 0.0
+    return OK_SIMPLE_STRING
+
+
+def _matching_clients(tokens, start: int, current: ClientState) -> list[ClientState]:
+    """
+    The clients matching the CLIENT KILL filters tokens[start:].
+    """
+    clients = list(_client_states.values())
+    skip_me = True
+    i = start
+    while i < len(tokens):
+        if i + 1 >= len(tokens):
+            raise RedisSyntaxError()
+        option, arg = tokens[i].upper(), tokens[i + 1]
+        match option:
+            case b'ID':
+                client_id = parse_int_token(arg)
+                clients = [c for c in clients if c.id == client_id]
+            case b'ADDR':
+                clients = [c for c in clients if _format_addr(c.addr).encode() == arg]
+            case b'LADDR':
+                clients = [c for c in clients if hasattr(c.writer, 'get_extra_info') and
+                           _format_addr(c.writer.get_extra_info('sockname')).encode() == arg]
+            case b'TYPE':
+                kind = _parse_client_type(arg)
+                clients = [c for c in clients if client_type(c) == kind]
+            case b'SKIPME':
+                if arg.lower() not in (b'yes', b'no'):
+                    raise RedisSyntaxError()
+                skip_me = arg.lower() == b'yes'
+            case b'MAXAGE':
+                max_age = parse_int_token(arg)
+                now = now_ms()
+                clients = [c for c in clients if now - c.created_at >= max_age * 1000]
+            case _:
+                raise RedisSyntaxError()
+        i += 2
+    if skip_me:
+        clients = [c for c in clients if c is not current]
+    return clients
+
+
+def _parse_client_type(arg: bytes) -> str:
+    kind = arg.lower().decode(errors='replace')
+    if kind == 'slave':
+        kind = 'replica'
+    if kind not in ('normal', 'replica', 'pubsub', 'master'):
+        raise RedisCommandError(f"ERR Unknown client type '{kind}'")
+    return kind
+
+
+def _client_kill(client: ClientState, tokens) -> bytes:
+    if len(tokens) == 3:
+        # Old form: CLIENT KILL ip:port
+        for other in _client_states.values():
+            if _format_addr(other.addr).encode() == tokens[2]:
+                kill_client(other, client)
+                return OK_SIMPLE_STRING
+        raise RedisCommandError("ERR No such client")
+    clients = _matching_clients(tokens, 2, client)
+    for other in clients:
+        kill_client(other, client)
+    return serialize_msg(len(clients), SerializedTypes.INTEGER)
+
+
+def _client_list(tokens) -> bytes:
+    clients = list(_client_states.values())
+    i = 2
+    while i < len(tokens):
+        option = tokens[i].upper()
+        if option == b'TYPE' and i + 1 < len(tokens):
+            kind = _parse_client_type(tokens[i + 1])
+            clients = [c for c in clients if client_type(c) == kind]
+            i += 2
+        elif option == b'ID' and i + 1 < len(tokens):
+            ids = {parse_int_token(token) for token in tokens[i + 1:]}
+            clients = [c for c in clients if c.id in ids]
+            break
+        else:
+            raise RedisSyntaxError()
+    now = now_ms()
+    return serialize_msg(''.join(client_info_line(c, now) + '\n' for c in clients), SerializedTypes.BULK_STRING)
+
+
+def _validate_name(name: bytes):
+    # Names show up in CLIENT LIST, which is space separated.
+    if any(byte <= 32 or byte > 126 for byte in name):
+        raise RedisCommandError("ERR Client names cannot contain spaces, newlines or special characters.")
+
+
+def _hello(client: ClientState, tokens) -> bytes:
+    if len(tokens) > 1:
+        try:
+            version = int(tokens[1])
+        except ValueError:
+            raise RedisCommandError("ERR Protocol version is not an integer or out of range")
+        if version not in (2, 3):
+            raise RedisCommandError("NOPROTO unsupported protocol version")
+        i = 2
+        while i < len(tokens):
+            if tokens[i].upper() == b'SETNAME' and i + 1 < len(tokens):
+                _validate_name(tokens[i + 1])
+                client.name = tokens[i + 1]
+                i += 2
+            else:
+                raise RedisSyntaxError()
+        client.resp_version = version
+
+    info = {
+        'server': 'redis',
+        'version': SERVER_VERSION,
+        'proto': client.resp_version,
+        'id': client.id,
+        'mode': 'standalone',
+        'role': get_replication_role().value,
+        'modules': [],
+    }
+    if client.resp_version == 3:
+        return serialize_msg(info, SerializedTypes.MAP)
+    elems = []
+    for k, v in info.items():
+        elems.append(serialize_msg(k, SerializedTypes.BULK_STRING))
+        elems.append(serialize_msg(v, SerializedTypes.INTEGER if isinstance(v, int) else
+                                   SerializedTypes.ARRAY if isinstance(v, list) else SerializedTypes.BULK_STRING))
+    return get_resp_array_from_elems(elems)
+
+
+def _client_tracking(client: ClientState, tokens) -> bytes:
+    if len(tokens) < 3 or tokens[2].upper() not in (b'ON', b'OFF'):
+        raise RedisSyntaxError()
+    if tokens[2].upper() == b'OFF':
+        disable_tracking(client)
+        return OK_SIMPLE_STRING
+
+    bcast, noloop, prefixes = False, False, []
+    i = 3
+    while i < len(tokens):
+        option = tokens[i].upper()
+        if option == b'BCAST':
+            bcast = True
+        elif option == b'NOLOOP':
+            noloop = True
+        elif option == b'PREFIX' and i + 1 < len(tokens):
+            prefixes.append(tokens[i + 1])
+            i += 1
+        elif option in (b'REDIRECT', b'OPTIN', b'OPTOUT'):
+            raise RedisCommandError(f"ERR CLIENT TRACKING {option.decode()} is not supported")
+        else:
+            raise RedisSyntaxError()
+        i += 1
+    if prefixes and not bcast:
+        raise RedisCommandError("ERR PREFIX option requires BCAST mode to be enabled")
+    if client.resp_version != 3:
+        # Invalidations are push messages, and there is no REDIRECT to a RESP2 pub/sub connection.
+        raise RedisCommandError("ERR Client tracking requires RESP3, switch with HELLO 3")
+    enable_tracking(client, bcast, prefixes, noloop)
+    return OK_SIMPLE_STRING
+
+
+def handle_client_command(first_token, tokens, client: ClientState | None):
+    if client is None:
+        raise RedisCommandError(f"ERR {first_token.decode()} is only available to connected clients")
+    if first_token == b'HELLO':
+        return _hello(client, tokens)
+
+    sub_cmd = tokens[1].upper()
+    match sub_cmd:
+        case b'ID':
+            return serialize_msg(client.id, SerializedTypes.INTEGER)
+        case b'SETNAME' if len(tokens) == 3:
+            _validate_name(tokens[2])
+            client.name = tokens[2]
+            return OK_SIMPLE_STRING
+        case b'GETNAME':
+            return serialize_msg(client.name, SerializedTypes.BULK_STRING) if client.name else NULL_BULK_STRING
+        case b'TRACKING':
+            return _client_tracking(client, tokens)
+        case b'LIST':
+            return _client_list(tokens)
+        case b'INFO' if len(tokens) == 2:
+            return serialize_msg(client_info_line(client, now_ms()) + '\n', SerializedTypes.BULK_STRING)
+        case b'KILL' if len(tokens) >= 3:
+            return _client_kill(client, tokens)
+        case b'PAUSE':
+            return _client_pause(tokens)
+        case b'UNPAUSE' if len(tokens) == 2:
+            return _client_unpause()
+        case b'NO-EVICT' if len(tokens) == 3 and tokens[2].upper() in (b'ON', b'OFF'):
+            # Nothing is evicted here (no maxmemory): only the flag is kept, for CLIENT LIST.
+            client.no_evict = tokens[2].upper() == b'ON'
+            return OK_SIMPLE_STRING
+    raise RedisSyntaxError()
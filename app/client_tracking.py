@@ -0,0 +1,137 @@
+"""
+Server assisted client side caching (CLIENT TRACKING).
+
+CLIENT TRACKING ON [BCAST] [PREFIX prefix ...] [NOLOOP]
+CLIENT TRACKING OFF
+
+A client that caches values locally asks the server to tell it when they change.
+Invalidations are RESP3 push messages (">2 invalidate [key ...]"), so the client must have sent HELLO 3 first.
+
+Two modes (same as redis):
+1. default: the server remembers the keys each client read (the tracking table, key -> clients).
+   When a key changes, the clients that read it get an invalidation, and the key is forgotten
+   until they read it again. The table has at most tracking-table-max-keys keys (config.py): past that,
+   the oldest keys are evicted, and their clients invalidated (they would not hear about future changes).
+2. BCAST: nothing is remembered. The client subscribes to key prefixes and is told about every change
+   to a key under those prefixes.
+
+Invalidations are collected while a command runs and sent after it (flush_invalidations()),
+so a command touching 100 keys sends one message per client, and a key modified twice is sent once.
+When no client has tracking on, invalidate_key() returns right away.
+"""
+from app.config import server_config
+from app.redis_serialization_protocol import serialize_msg, SerializedTypes
+
+# key -> clients that read it (default mode). Insertion ordered: the first keys are the oldest.
+_tracking_table: dict[bytes, set] = {}
+# prefix -> BCAST clients
+_bcast_prefixes: dict[bytes, set] = {}
+_tracking_clients: set = set()
+# Modified keys, not sent yet.
+_pending_keys: dict[bytes, None] = {}
+# client -> keys to send to it (dict as an ordered set), for evicted keys.
+_outbox: dict[object, dict[bytes, None]] = {}
+
+
+def enable_tracking(client, bcast: bool, prefixes: list[bytes], noloop: bool):
+    disable_tracking(client)
+    client.tracking = True
+    client.tracking_bcast = bcast
+    client.tracking_noloop = noloop
+    client.tracking_prefixes = list(prefixes or [b'']) if bcast else []
+    for prefix in client.tracking_prefixes:
+        _bcast_prefixes.setdefault(prefix, set()).add(client)
+    _tracking_clients.add(client)
+
+
+def disable_tracking(client):
+    if not getattr(client, 'tracking', False):
+        return
+    client.tracking = False
+    for prefix in client.tracking_prefixes:
+        clients = _bcast_prefixes.get(prefix)
+        if clients is not None:
+            clients.discard(client)
+            if not clients:
+                del _bcast_prefixes[prefix]
+    client.tracking_prefixes = []
+    _tracking_clients.discard(client)
+    _outbox.pop(client, None)
+    # Keys read by the client stay in the table (like redis): they are cleaned up when invalidated.
+
+
+def is_tracking_active() -> bool:
+    return bool(_tracking_clients)
+
+
+def track_keys(client, keys):
+    """
+    client read keys (default mode only).
+    """
+    if not client.tracking or client.tracking_bcast:
+        return
+    max_keys = server_config['tracking-table-max-keys']
+    for key in keys:
+        clients = _tracking_table.get(key)
+        if clients is None:
+            if max_keys and len(_tracking_table) >= max_keys:
+                _evict_oldest_key()
+            clients = _tracking_table[key] = set()
+        clients.add(client)
+
+
+def _evict_oldest_key():
+    key = next(iter(_tracking_table))
+    for client in _tracking_table.pop(key):
+        _outbox.setdefault(client, {})[key] = None
+
+
+def invalidate_key(key: bytes):
+    if _tracking_clients:
+        _pending_keys[key] = None
+
+
+def invalidate_all():
+    """
+    FLUSHALL: every tracking client drops its whole cache (a null invalidation).
+    """
+    _tracking_table.clear()
+    _pending_keys.clear()
+    _outbox.clear()
+    frame = _invalidation_frame(None)
+    for client in list(_tracking_clients):
+        client.writer.write(frame)
+
+
+def _invalidation_frame(keys: list[bytes] | None) -> bytes:
+    if keys is None:
+        return SerializedTypes.PUSH.value + b'2\r\n' + serialize_msg(b'invalidate', SerializedTypes.BULK_STRING) + \
+            serialize_msg(None, SerializedTypes.NULL)
+    return serialize_msg([b'invalidate', keys], SerializedTypes.PUSH)
+
+
+def flush_invalidations(origin=None):
+    """
+    Send the invalidations collected during the last command. origin: the client that ran it (for NOLOOP).
+    """
+    if not _pending_keys and not _outbox:
+        return
+    for key in _pending_keys:
+        for client in _tracking_table.pop(key, ()):
+            _outbox.setdefault(client, {})[key] = None
+    for prefix, clients in _bcast_prefixes.items():
+        matching = [key for key in _pending_keys if key.startswith(prefix)]
+        if not matching:
+            continue
+        for client in clients:
+            keys = _outbox.setdefault(client, {})
+            for key in matching:
+                keys[key] = None
+    _pending_keys.clear()
+
+    for client, keys in _outbox.items():
+        if client is origin and client.tracking_noloop:
+            continue
+        if client.tracking:
+            client.writer.write(_invalidation_frame(list(keys)))
+    _outbox.clear()
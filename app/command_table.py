@@ -0,0 +1,199 @@
+"""
+Static metadata about every command (same fields as redis' command table):
+
+arity: number of tokens including the command name. Negative: at least -arity tokens.
+flags: 'write' (may modify the keyspace), 'readonly' (reads keys), 'blocking' (may wait for other clients).
+first_key, last_key, step: positions of the key tokens. last_key < 0 counts from the end. first_key 0: no keys.
+
+Used to find the keys of a command without parsing it (client tracking, WATCH, keyspace stats ...).
+"""
+from typing import NamedTuple
+
+
+class CommandSpec(NamedTuple):
+    arity: int
+    flags: frozenset
+    first_key: int
+    last_key: int
+    step: int
+
+    @property
+    def is_write(self) -> bool:
+        return 'write' in self.flags
+
+    @property
+    def is_readonly(self) -> bool:
+        return 'readonly' in self.flags
+
+    @property
+    def is_blocking(self) -> bool:
+        return 'blocking' in self.flags
+
+
+_WRITE = frozenset({'write'})
+_READONLY = frozenset({'readonly'})
+_WRITE_BLOCKING = frozenset({'write', 'blocking'})
+_READONLY_BLOCKING = frozenset({'readonly', 'blocking'})
+_NO_FLAGS = frozenset()
+
+
+def _cmd(arity, flags=_NO_FLAGS, keys=(1, 1, 1)) -> CommandSpec:
+    return CommandSpec(arity, flags, *keys)
+
+
+_NO_KEYS = (0, 0, 0)
+_ALL_KEYS = (1, -1, 1)
+# Blocking commands end with a timeout.
+_ALL_KEYS_BUT_TIMEOUT = (1, -2, 1)
+
+COMMAND_TABLE: dict[bytes, CommandSpec] = {
+    # Connection / server
+    b'PING': _cmd(-1, keys=_NO_KEYS),
+    b'ECHO': _cmd(2, keys=_NO_KEYS),
+    b'HELLO': _cmd(-1, keys=_NO_KEYS),
+    b'QUIT': _cmd(-1, keys=_NO_KEYS),
+    b'RESET': _cmd(1, keys=_NO_KEYS),
+    b'CLIENT': _cmd(-2, keys=_NO_KEYS),
+    b'CONFIG': _cmd(-2, keys=_NO_KEYS),
+    b'INFO': _cmd(-1, keys=_NO_KEYS),
+    b'SLOWLOG': _cmd(-2, keys=_NO_KEYS),
+    b'LATENCY': _cmd(-2, keys=_NO_KEYS),
+    b'DEBUG': _cmd(-2, keys=_NO_KEYS),
+    b'MEMORY': _cmd(-2, keys=_NO_KEYS),
+    b'PROFILE': _cmd(-2, keys=_NO_KEYS),
+    b'REPLCONF': _cmd(-1, keys=_NO_KEYS),
+    b'PSYNC': _cmd(-3, keys=_NO_KEYS),
+    b'MULTI': _cmd(1, keys=_NO_KEYS),
+    b'EXEC': _cmd(1, keys=_NO_KEYS),
+    b'DISCARD': _cmd(1, keys=_NO_KEYS),
+    b'WATCH': _cmd(-2, keys=_ALL_KEYS),
+    b'UNWATCH': _cmd(1, keys=_NO_KEYS),
+    # The keys touched by a script are handled by the commands it runs.
+    b'EVAL': _cmd(-3, keys=_NO_KEYS),
+    b'EVALSHA': _cmd(-3, keys=_NO_KEYS),
+    b'SCRIPT': _cmd(-2, keys=_NO_KEYS),
+    # Keyspace
+    b'TYPE': _cmd(2, _READONLY),
+    b'EXPIRE': _cmd(-3, _WRITE),
+    b'PEXPIRE': _cmd(-3, _WRITE),
+    b'EXPIREAT': _cmd(-3, _WRITE),
+    b'PEXPIREAT': _cmd(-3, _WRITE),
+    b'TTL': _cmd(2, _READONLY),
+    b'PTTL': _cmd(2, _READONLY),
+    b'EXPIRETIME': _cmd(2, _READONLY),
+    b'PEXPIRETIME': _cmd(2, _READONLY),
+    b'PERSIST': _cmd(2, _WRITE),
+    b'DEL': _cmd(-2, _WRITE, _ALL_KEYS),
+    b'UNLINK': _cmd(-2, _WRITE, _ALL_KEYS),
+    b'SCAN': _cmd(-2, _READONLY, _NO_KEYS),
+    b'KEYS': _cmd(2, _READONLY, _NO_KEYS),
+    b'DBSIZE': _cmd(1, _READONLY, _NO_KEYS),
+    b'FLUSHALL': _cmd(-1, _WRITE, _NO_KEYS),
+    b'FLUSHDB': _cmd(-1, _WRITE, _NO_KEYS),
+    b'SELECT': _cmd(2, keys=_NO_KEYS),
+    b'SWAPDB': _cmd(3, _WRITE, _NO_KEYS),
+    b'MOVE': _cmd(3, _WRITE),
+    # Strings
+    b'GET': _cmd(2, _READONLY),
+    b'SET': _cmd(-3, _WRITE),
+    b'SETEX': _cmd(4, _WRITE),
+    b'PSETEX': _cmd(4, _WRITE),
+    b'GETEX': _cmd(-2, _WRITE),
+    b'GETDEL': _cmd(2, _WRITE),
+    b'INCR': _cmd(2, _WRITE),
+    b'APPEND': _cmd(3, _WRITE),
+    b'SETRANGE': _cmd(4, _WRITE),
+    b'GETRANGE': _cmd(4, _READONLY),
+    b'STRLEN': _cmd(2, _READONLY),
+    # Bitmaps
+    b'SETBIT': _cmd(4, _WRITE),
+    b'GETBIT': _cmd(3, _READONLY),
+    b'BITCOUNT': _cmd(-2, _READONLY),
+    b'BITPOS': _cmd(-3, _READONLY),
+    b'BITOP': _cmd(-4, _WRITE, (2, -1, 1)),
+    b'BITFIELD': _cmd(-2, _WRITE),
+    # HyperLogLogs
+    b'PFADD': _cmd(-2, _WRITE),
+    # PFCOUNT caches the cardinality in the value.
+    b'PFCOUNT': _cmd(-2, _READONLY, _ALL_KEYS),
+    b'PFMERGE': _cmd(-2, _WRITE, _ALL_KEYS),
+    # Hashes
+    b'HSET': _cmd(-4, _WRITE),
+    b'HGET': _cmd(3, _READONLY),
+    b'HMGET': _cmd(-3, _READONLY),
+    b'HDEL': _cmd(-3, _WRITE),
+    b'HINCRBY': _cmd(4, _WRITE),
+    b'HGETALL': _cmd(2, _READONLY),
+    b'HLEN': _cmd(2, _READONLY),
+    b'HEXISTS': _cmd(3, _READONLY),
+    b'HSCAN': _cmd(-3, _READONLY),
+    # Lists
+    b'LPUSH': _cmd(-3, _WRITE),
+    b'RPUSH': _cmd(-3, _WRITE),
+    b'LPUSHX': _cmd(-3, _WRITE),
+    b'RPUSHX': _cmd(-3, _WRITE),
+    b'LPOP': _cmd(-2, _WRITE),
+    b'RPOP': _cmd(-2, _WRITE),
+    b'LLEN': _cmd(2, _READONLY),
+    b'LINDEX': _cmd(3, _READONLY),
+    b'LRANGE': _cmd(4, _READONLY),
+    b'LTRIM': _cmd(4, _WRITE),
+    b'LMOVE': _cmd(5, _WRITE, (1, 2, 1)),
+    b'BLPOP': _cmd(-3, _WRITE_BLOCKING, _ALL_KEYS_BUT_TIMEOUT),
+    b'BRPOP': _cmd(-3, _WRITE_BLOCKING, _ALL_KEYS_BUT_TIMEOUT),
+    b'BLMOVE': _cmd(6, _WRITE_BLOCKING, (1, 2, 1)),
+    # Sets
+    b'SADD': _cmd(-3, _WRITE),
+    b'SREM': _cmd(-3, _WRITE),
+    b'SISMEMBER': _cmd(3, _READONLY),
+    b'SMISMEMBER': _cmd(-3, _READONLY),
+    b'SCARD': _cmd(2, _READONLY),
+    b'SMEMBERS': _cmd(2, _READONLY),
+    b'SINTER': _cmd(-2, _READONLY, _ALL_KEYS),
+    b'SUNION': _cmd(-2, _READONLY, _ALL_KEYS),
+    b'SDIFF': _cmd(-2, _READONLY, _ALL_KEYS),
+    b'SINTERSTORE': _cmd(-3, _WRITE, _ALL_KEYS),
+    b'SUNIONSTORE': _cmd(-3, _WRITE, _ALL_KEYS),
+    b'SDIFFSTORE': _cmd(-3, _WRITE, _ALL_KEYS),
+    b'SSCAN': _cmd(-3, _READONLY),
+    # Sorted sets
+    b'ZADD': _cmd(-4, _WRITE),
+    b'ZSCORE': _cmd(3, _READONLY),
+    b'ZRANK': _cmd(-3, _READONLY),
+    b'ZREVRANK': _cmd(-3, _READONLY),
+    b'ZCARD': _cmd(2, _READONLY),
+    b'ZRANGE': _cmd(-4, _READONLY),
+    b'ZREM': _cmd(-3, _WRITE),
+    b'ZREMRANGEBYSCORE': _cmd(4, _WRITE),
+    b'ZPOPMIN': _cmd(-2, _WRITE),
+    b'BZPOPMIN': _cmd(-3, _WRITE_BLOCKING, _ALL_KEYS_BUT_TIMEOUT),
+    # Streams
+    b'XADD': _cmd(-5, _WRITE),
+    b'XRANGE': _cmd(-4, _READONLY),
+    # Keys come after STREAMS, see command_keys().
+    b'XREAD': _cmd(-4, _READONLY_BLOCKING, _NO_KEYS),
+    # Pub/Sub
+    b'PUBLISH': _cmd(3, keys=_NO_KEYS),
+    b'SPUBLISH': _cmd(3, keys=_NO_KEYS),
+    b'SUBSCRIBE': _cmd(-2, keys=_NO_KEYS),
+    b'UNSUBSCRIBE': _cmd(-1, keys=_NO_KEYS),
+    b'PSUBSCRIBE': _cmd(-2, keys=_NO_KEYS),
+    b'PUNSUBSCRIBE': _cmd(-1, keys=_NO_KEYS),
+    b'SSUBSCRIBE': _cmd(-2, keys=_NO_KEYS),
+    b'SUNSUBSCRIBE': _cmd(-1, keys=_NO_KEYS),
+    b'PUBSUB': _cmd(-2, keys=_NO_KEYS),
+}
+
+
+def command_keys(spec: CommandSpec, tokens: list) -> list[bytes]:
+    if tokens[0].upper() == b'XREAD':
+        upper = [t.upper() for t in tokens]
+        if b'STREAMS' not in upper:
+            return []
+        streams_idx = upper.index(b'STREAMS')
+        num_keys = (len(tokens) - streams_idx - 1) // 2
+        return tokens[streams_idx + 1:streams_idx + 1 + num_keys]
+    if spec.first_key == 0:
+        return []
+    last_key = spec.last_key if spec.last_key > 0 else len(tokens) + spec.last_key
+    return tokens[spec.first_key:last_key + 1:spec.step]
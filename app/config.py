@@ -0,0 +1,109 @@
+"""
+Server config (CONFIG GET / CONFIG SET).
+
+Every tunable lives in server_config with its default value.
+The type of the default decides how CONFIG SET parses the new value.
+"""
+from typing import Callable
+
+from app.errors import RedisCommandError, NotAnInteger
+from app.glob_pattern import compile_glob
+
+server_config: dict[str, int | str] = {
+    # A hash stays in the compact listpack encoding while it has at most this many fields,
+    # and all of its fields/values are at most this many bytes. (see redis_hash.py)
+    'hash-max-listpack-entries': 128,
+    'hash-max-listpack-value': 64,
+    # Size of every chunk of a list. Negative: max bytes per chunk (-1: 4kb, -2: 8kb ... -5: 64kb),
+    # positive: max elements per chunk. (see redis_list.py)
+    'list-max-listpack-size': -2,
+    # A sorted set stays a sorted listpack while it is this small. (see redis_sorted_set.py)
+    'zset-max-listpack-entries': 128,
+    'zset-max-listpack-value': 64,
+    # A set of integers stays a sorted array('q') up to this many members. (see redis_set.py)
+    'set-max-intset-entries': 512,
+    # A HyperLogLog stays sparse up to this many bytes, then it is converted to dense (12KB).
+    # (see redis_hyperloglog.py)
+    'hll-sparse-max-bytes': 3000,
+    # Output buffer limits per client class: a client is disconnected when more than <limit> bytes are waiting
+    # to be sent to it, or more than <limit>-soft bytes for <limit>-soft-seconds. 0: no limit.
+    # (see output_buffer.py)
+    'client-output-buffer-limit-normal': 0,
+    'client-output-buffer-limit-normal-soft': 0,
+    'client-output-buffer-limit-normal-soft-seconds': 0,
+    'client-output-buffer-limit-replica': 256 * 1024 * 1024,
+    'client-output-buffer-limit-replica-soft': 64 * 1024 * 1024,
+    'client-output-buffer-limit-replica-soft-seconds': 60,
+    'client-output-buffer-limit-pubsub': 32 * 1024 * 1024,
+    'client-output-buffer-limit-pubsub-soft': 8 * 1024 * 1024,
+    'client-output-buffer-limit-pubsub-soft-seconds': 60,
+    # Max keys remembered for CLIENT TRACKING (default mode). Past that, the oldest keys are invalidated.
+    # 0: no limit. (see client_tracking.py)
+    'tracking-table-max-keys': 1_000_000,
+    # yes: time every command (INFO commandstats usec). no: only count the calls. (see server_stats.py)
+    'latency-tracking': 'yes',
+    # Commands slower than this many microseconds go to the SLOWLOG (negative: disabled, 0: every command),
+    # which keeps the last slowlog-max-len of them. (see slowlog.py)
+    'slowlog-log-slower-than': 10_000,
+    'slowlog-max-len': 128,
+    # Events (commands, event loop stalls ...) slower than this many milliseconds are recorded by the
+    # latency monitor (LATENCY LATEST / HISTORY). 0: disabled. (see latency_monitor.py)
+    'latency-monitor-threshold': 0,
+    # Number of logical databases (SELECT 0 .. databases-1), set at startup with --databases.
+    # (see memory_management.py)
+    'databases': 16,
+    # Connections past this many clients are refused (also --maxclients). (see client_state.py)
+    'maxclients': 10_000,
+    # Close the connection of a client idle for this many seconds. 0: never. (see client_state.py)
+    'timeout': 0,
+    # A script (EVAL) running longer than this many milliseconds is stopped with an error: the server can't
+    # serve anyone else meanwhile. 0: no limit. (see scripting.py)
+    'busy-reply-threshold': 5000,
+    # Where PROFILE writes its output files. (see profiling.py)
+    'profile-dir': '.',
+    # Keyspace notifications: which event classes are published (K, E, g, $, l, s, h, z, x, e, t, A).
+    # Empty: disabled. (see keyspace_events.py)
+    'notify-keyspace-events': '',
+}
+
+# Only set at startup (command line).
+_IMMUTABLE_CONFIGS = {'databases'}
+
+# name -> called with the new value by CONFIG SET, for the modules that keep a parsed copy of it.
+# It raises RedisCommandError to refuse the value.
+_config_hooks: dict[str, Callable[[str], None]] = {}
+
+
+def on_config_set(name: str, hook: Callable[[str], None]):
+    _config_hooks[name] = hook
+
+
+def get_config_matching(pattern: bytes) -> list[str | int]:
+    """
+    CONFIG GET pattern -> flat list [name1, value1, name2, value2 ...]
+    """
+    glob = compile_glob(pattern.lower())
+    result = []
+    for name, value in server_config.items():
+        if glob.match(name.encode()):
+            result.extend([name, value])
+    return result
+
+
+def set_config(name: bytes, value: bytes):
+    name = name.decode().lower()
+    if name not in server_config:
+        raise RedisCommandError(f"ERR Unknown option or number of arguments for CONFIG SET - '{name}'")
+    if name in _IMMUTABLE_CONFIGS:
+        raise RedisCommandError(f"ERR CONFIG SET failed (possibly related to argument '{name}') - "
+                                f"can't set immutable config")
+    if isinstance(server_config[name], int):
+        try:
+            server_config[name] = int(value)
+        except ValueError:
+            raise NotAnInteger(f"ERR CONFIG SET failed (possibly related to argument '{name}') - argument must be a number")
+    else:
+        hook = _config_hooks.get(name)
+        if hook is not None:
+            hook(value.decode())
+        server_config[name] = value.decode()
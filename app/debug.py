@@ -0,0 +1,164 @@
+"""
+Introspection commands, to find hot and oversized keys.
+
+DEBUG SLEEP seconds        block the server (simulates a slow command)
+DEBUG OBJECT key           encoding, serialized length ... of a value
+MEMORY USAGE key [SAMPLES count]
+
+MEMORY USAGE walks the object graph of the value (sys.getsizeof of every object reached).
+Like redis, big containers are sampled: only the first <count> elements (default 5) of every container
+are measured, and their average size is multiplied by the container length. SAMPLES 0 measures everything.
+Linked nodes (skiplist nodes, stream leaves ...) are not containers: they are all visited, so the walk
+is O(n) for sorted sets in the skiplist encoding and streams.
+"""
+import sys
+import time
+from array import array
+from collections import deque
+
+from app.errors import RedisCommandError, RedisSyntaxError
+from app.key_value_utils import ValueTypes, NULL_VALUE_OBJ, ValueObj
+from app.memory_management import get_from_memstore
+from app.redis_serialization_protocol import serialize_msg, SerializedTypes, OK_SIMPLE_STRING, NULL_BULK_STRING, \
+    parse_int_token
+
+MEMORY_USAGE_DEFAULT_SAMPLES = 5
+
+# Strings up to this size are a single allocation in redis (embstr).
+_EMBSTR_SIZE_LIMIT = 44
+
+_SCALARS = (bytes, bytearray, str, int, float, bool, type(None), array)
+
+
+def _children(obj) -> tuple[list, int]:
+    """
+    The objects directly referenced by obj, and the total number of them (more than len(children) if sampled).
+    """
+    if isinstance(obj, dict):
+        return [x for item in obj.items() for x in item], 2 * len(obj)
+    if isinstance(obj, (list, tuple, set, frozenset, deque)):
+        return list(obj), len(obj)
+    children = list(getattr(obj, '__dict__', {}).values())
+    for slot in getattr(type(obj), '__slots__', ()):
+        if hasattr(obj, slot):
+            children.append(getattr(obj, slot))
+    return children, len(children)
+
+
+def estimate_memory_usage(value, samples: int = MEMORY_USAGE_DEFAULT_SAMPLES) -> int:
+    """
+    Approximate number of bytes used by value (see module docstring).
+    """
+    seen = set()
+    total = 0.0
+    # (object, weight): sampled children stand for the elements that were not measured.
+    stack = [(value, 1.0)]
+    while stack:
+        obj, weight = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj) * weight
+        if isinstance(obj, _SCALARS) or isinstance(obj, type):
+            continue
+        children, num_children = _children(obj)
+        is_container = isinstance(obj, (dict, list, tuple, set, frozenset, deque))
+        if is_container and samples and len(children) > samples:
+            # dict items come in (key, value) pairs: keep the pairs together.
+            sample_size = samples * 2 if isinstance(obj, dict) else samples
+            children = children[:sample_size]
+            weight *= num_children / len(children)
+        for child in children:
+            stack.append((child, weight))
+    return int(total)
+
+
+def object_encoding(value_obj: ValueObj) -> str:
+    val = value_obj.val
+    match value_obj.val_dtype:
+        case ValueTypes.STRING:
+            if isinstance(val, bytearray):
+                return 'raw'
+            if len(val) <= 20:
+                try:
+                    int(val)
+                    return 'int'
+                except ValueError:
+                    pass
+            return 'embstr' if len(val) <= _EMBSTR_SIZE_LIMIT else 'raw'
+        case ValueTypes.LIST:
+            return 'listpack' if val.num_chunks <= 1 else 'quicklist'
+        case ValueTypes.HASH | ValueTypes.SET | ValueTypes.ZSET:
+            return val.encoding
+        case ValueTypes.STREAM:
+            return 'stream'
+    return 'unknown'
+
+
+def serialized_length(value) -> int:
+    """
+    Bytes of payload held by value: the total length of its strings (there is no RDB serializer here).
+    """
+    seen = set()
+    total = 0
+    stack = [value]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        if isinstance(obj, (bytes, bytearray, str)):
+            total += len(obj)
+        elif isinstance(obj, (int, float)):
+            total += 8
+        elif isinstance(obj, array):
+            total += obj.itemsize * len(obj)
+        elif obj is not None and not isinstance(obj, type):
+            stack.extend(_children(obj)[0])
+    return total
+
+
+def _get_existing(key, now) -> ValueObj:
+    value_obj = get_from_memstore(key, now)
+    if value_obj is NULL_VALUE_OBJ:
+        raise RedisCommandError("ERR no such key")
+    return value_obj
+
+
+def handle_debug_command(tokens, now):
+    sub_cmd = tokens[1].upper()
+    match sub_cmd:
+        case b'SLEEP' if len(tokens) == 3:
+            try:
+                seconds = float(tokens[2])
+            except ValueError:
+                raise RedisCommandError("ERR value is not a valid float")
+            # Blocks the whole event loop on purpose.
+            time.sleep(max(seconds, 0))
+            return OK_SIMPLE_STRING
+        case b'OBJECT' if len(tokens) == 3:
+            value_obj = _get_existing(tokens[2], now)
+            return serialize_msg(
+                f"Value at:{hex(id(value_obj.val))} refcount:1 encoding:{object_encoding(value_obj)} "
+                f"serializedlength:{serialized_length(value_obj.val)} lru:0 lru_seconds_idle:0 "
+                f"type:{value_obj.val_dtype.value.decode()}", SerializedTypes.SIMPLE_STRING)
+    raise RedisSyntaxError()
+
+
+def handle_memory_command(tokens, now):
+    sub_cmd = tokens[1].upper()
+    match sub_cmd:
+        case b'USAGE' if len(tokens) in (3, 5):
+            samples = MEMORY_USAGE_DEFAULT_SAMPLES
+            if len(tokens) == 5:
+                if tokens[3].upper() != b'SAMPLES':
+                    raise RedisSyntaxError()
+                samples = parse_int_token(tokens[4])
+                if samples < 0:
+                    raise RedisSyntaxError()
+            value_obj = get_from_memstore(tokens[2], now)
+            if value_obj is NULL_VALUE_OBJ:
+                return NULL_BULK_STRING
+            usage = sys.getsizeof(tokens[2]) + sys.getsizeof(value_obj) + estimate_memory_usage(value_obj.val, samples)
+            return serialize_msg(usage, SerializedTypes.INTEGER)
+    raise RedisSyntaxError()
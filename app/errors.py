@@ -1,7 +1,25 @@
 
+class RedisCommandError(ValueError):
+    """
+    Error that is sent back to the client as a RESP error.
+    str(error) is the error message (eg: "ERR syntax error").
+    """
+    pass
+
+class InvalidStreamEventTsId(RedisCommandError):
+    pass
 
-class InvalidStreamEventTsId(ValueError):
+class IncrOnStringValue(RedisCommandError):
     pass
 
-class IncrOnStringValue(ValueError):
-    pass
\ No newline at end of file
+class RedisSyntaxError(RedisCommandError):
+    def __init__(self, msg="ERR syntax error"):
+        super().__init__(msg)
+
+class NotAnInteger(RedisCommandError):
+    def __init__(self, msg="ERR value is not an integer or out of range"):
+        super().__init__(msg)
+
+class WrongTypeOperation(RedisCommandError):
+    def __init__(self, msg="WRONGTYPE Operation against a key holding the wrong kind of value"):
+        super().__init__(msg)
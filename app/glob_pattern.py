@@ -0,0 +1,115 @@
+"""
+Redis style glob patterns (used by KEYS, SCAN MATCH ...).
+
+h?llo     -> hello, hallo, hxllo
+h*llo     -> hllo, heeeello
+h[ae]llo  -> hello, hallo (not hillo)
+h[^e]llo  -> hallo, hbllo (not hello)
+h[a-b]llo -> hallo, hbllo
+\\ escapes the special characters.
+
+Matching every key against a regex is the expensive part of KEYS/SCAN.
+But most real patterns are just "user:123:*" (a literal prefix followed by '*'),
+or have no special character at all.
+So when compiling a pattern we figure out which case it is, and only fall back to the regex when needed:
+
+1. literal   -> plain bytes comparison
+2. prefix*   -> bytes.startswith()
+3. otherwise -> compiled regex
+"""
+import re
+from functools import lru_cache
+
+_SPECIAL_CHARS = b'*?['
+_ESCAPE = ord('\\')
+
+
+def _split_literal_prefix(pattern: bytes) -> tuple[bytes, bytes]:
+    """
+    return (literal_prefix, rest)
+    literal_prefix has its escapes resolved. rest starts at the first special char.
+    """
+    prefix = bytearray()
+    i = 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == _ESCAPE and i + 1 < len(pattern):
+            prefix.append(pattern[i + 1])
+            i += 2
+            continue
+        if ch in _SPECIAL_CHARS:
+            break
+        prefix.append(ch)
+        i += 1
+    return bytes(prefix), pattern[i:]
+
+
+def _glob_to_regex(pattern: bytes) -> bytes:
+    regex = bytearray()
+    i = 0
+    n = len(pattern)
+    while i < n:
+        ch = pattern[i:i + 1]
+        i += 1
+        if ch == b'\\' and i < n:
+            regex += re.escape(pattern[i:i + 1])
+            i += 1
+        elif ch == b'*':
+            regex += b'.*'
+        elif ch == b'?':
+            regex += b'.'
+        elif ch == b'[':
+            end = pattern.find(b']', i)
+            if end == -1:
+                # Unterminated class, treat '[' as a literal.
+                regex += re.escape(ch)
+                continue
+            char_class = pattern[i:end]
+            i = end + 1
+            negate = char_class.startswith(b'^')
+            if negate:
+                char_class = char_class[1:]
+            # Keep ranges (a-z), escape everything else.
+            escaped = b'-'.join(re.escape(part) for part in char_class.split(b'-'))
+            regex += b'[' + (b'^' if negate else b'') + escaped + b']'
+        else:
+            regex += re.escape(ch)
+    return bytes(regex)
+
+
+class GlobPattern:
+
+    def __init__(self, pattern: bytes):
+        self.pattern = pattern
+        self.literal_prefix, rest = _split_literal_prefix(pattern)
+        self.is_literal = rest == b''
+        self.is_prefix_only = (not self.is_literal) and rest.strip(b'*') == b''
+        self._regex = None
+        if self.is_literal:
+            self.match = self._match_literal
+        elif self.is_prefix_only:
+            self.match = self._match_prefix
+        else:
+            self._regex = re.compile(_glob_to_regex(pattern), re.DOTALL)
+            self.match = self._match_regex
+
+    def _match_literal(self, key: bytes) -> bool:
+        return key == self.literal_prefix
+
+    def _match_prefix(self, key: bytes) -> bool:
+        return key.startswith(self.literal_prefix)
+
+    def _match_regex(self, key: bytes) -> bool:
+        # The literal prefix check is way cheaper than running the regex, and rejects most keys.
+        return key.startswith(self.literal_prefix) and self._regex.fullmatch(key) is not None
+
+    def match_all(self) -> bool:
+        """
+        True for '*' (every key matches, no need to check anything).
+        """
+        return self.is_prefix_only and self.literal_prefix == b''
+
+
+@lru_cache(maxsize=256)
+def compile_glob(pattern: bytes) -> GlobPattern:
+    return GlobPattern(pattern)
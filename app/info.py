@@ -0,0 +1,184 @@
+"""
+INFO [section [section ...]]
+
+Sections: server, clients, memory, persistence, stats, replication, keyspace (the default ones),
+commandstats (only when asked for, or with "all" / "everything").
+
+The reply is a bulk string of "# Section" headers followed by "field:value" lines.
+Building it reads the counters (server_stats.py) and the size of a few registries: no keyspace walk
+(avg_ttl is the estimate kept by the active expire cycle, see Keyspace.sample_ttls).
+"""
+import os
+import platform
+import resource
+import sys
+
+from app import lazy_free
+from app.blocking import num_blocked_clients, num_blocking_keys
+from app.client_state import SERVER_VERSION, _client_states
+from app.client_tracking import _tracking_clients, _tracking_table, _bcast_prefixes
+from app.memory_management import databases
+from app.pubsub import _subscribers, _channels, _patterns, _shard_channels
+from app.redis_serialization_protocol import serialize_msg, SerializedTypes, CLRS
+from app.replication import get_replication_info
+from app.server_clock import now_ms
+from app.server_stats import stat_counters, command_stats
+from app.transaction import _watched_keys
+
+DEFAULT_SECTIONS = ('server', 'clients', 'memory', 'persistence', 'stats', 'replication', 'keyspace')
+ALL_SECTIONS = DEFAULT_SECTIONS + ('commandstats',)
+
+_start_time = now_ms() / 1000
+_tcp_port = 0
+
+
+def init_server_info(port: int):
+    global _start_time, _tcp_port
+    _start_time = now_ms() / 1000
+    _tcp_port = port
+
+
+def _human_bytes(num_bytes: int) -> str:
+    for unit in ('B', 'K', 'M', 'G'):
+        if num_bytes < 1024 or unit == 'G':
+            return f"{num_bytes:.2f}{unit}" if unit != 'B' else f"{num_bytes}B"
+        num_bytes /= 1024
+
+
+def _rss_bytes() -> int:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # No procfs: the peak is the best we have.
+        return _peak_rss_bytes()
+
+
+def _peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _server() -> dict:
+    uptime = int(now_ms() / 1000 - _start_time)
+    return {
+        'redis_version': SERVER_VERSION,
+        'redis_mode': 'standalone',
+        'os': f"{platform.system()} {platform.release()} {platform.machine()}",
+        'arch_bits': 64 if sys.maxsize > 2 ** 32 else 32,
+        'multiplexing_api': 'asyncio',
+        'python_version': platform.python_version(),
+        'process_id': os.getpid(),
+        'tcp_port': _tcp_port,
+        'server_time_usec': now_ms() * 1000,
+        'uptime_in_seconds': uptime,
+        'uptime_in_days': uptime // 86400,
+        'executable': sys.executable,
+    }
+
+
+def _clients() -> dict:
+    return {
+        'connected_clients': len(_client_states),
+        'blocked_clients': num_blocked_clients(),
+        'tracking_clients': len(_tracking_clients),
+        'pubsub_clients': len(_subscribers),
+        'watching_clients': len({client for clients in _watched_keys.values() for client in clients}),
+        'total_blocking_keys': num_blocking_keys(),
+        'total_watched_keys': len(_watched_keys),
+    }
+
+
+def _memory() -> dict:
+    # Python doesn't count its allocations: used_memory is the resident set size of the process.
+    rss, peak = _rss_bytes(), _peak_rss_bytes()
+    return {
+        'used_memory': rss,
+        'used_memory_human': _human_bytes(rss),
+        'used_memory_rss': rss,
+        'used_memory_rss_human': _human_bytes(rss),
+        'used_memory_peak': max(peak, rss),
+        'used_memory_peak_human': _human_bytes(max(peak, rss)),
+        'mem_allocator': 'pymalloc',
+        'lazyfree_pending_objects': lazy_free.lazyfree_pending_objects,
+        'lazyfreed_objects': lazy_free.lazyfreed_objects,
+    }
+
+
+def _persistence() -> dict:
+    # No RDB / AOF: the dataset only lives in memory.
+    return {
+        'loading': 0,
+        'rdb_changes_since_last_save': stat_counters['dirty'],
+        'rdb_bgsave_in_progress': 0,
+        'rdb_last_save_time': int(_start_time),
+        'aof_enabled': 0,
+    }
+
+
+def _stats() -> dict:
+    stats = {name: value for name, value in stat_counters.items() if name != 'dirty'}
+    stats.update({
+        'pubsub_channels': len(_channels),
+        'pubsub_patterns': len(_patterns),
+        'pubsubshard_channels': len(_shard_channels),
+        'tracking_total_keys': len(_tracking_table),
+        'tracking_total_prefixes': len(_bcast_prefixes),
+    })
+    return stats
+
+
+def _commandstats() -> dict:
+    result = {}
+    for name, (calls, duration_ns, failed) in sorted(command_stats().items()):
+        usec = duration_ns // 1000
+        result[f'cmdstat_{name.decode().lower()}'] = \
+            f"calls={calls},usec={usec},usec_per_call={usec / calls:.2f},rejected_calls=0,failed_calls={failed}"
+    return result
+
+
+def _keyspace() -> dict:
+    result = {}
+    # Empty databases are not listed.
+    for index, db in enumerate(databases):
+        if not db:
+            continue
+        result[f'db{index}'] = f"keys={len(db)},expires={len(db.expires)},avg_ttl={db.avg_ttl}"
+    return result
+
+
+_SECTION_BUILDERS = {
+    'server': _server,
+    'clients': _clients,
+    'memory': _memory,
+    'persistence': _persistence,
+    'stats': _stats,
+    'replication': get_replication_info,
+    'keyspace': _keyspace,
+    'commandstats': _commandstats,
+}
+
+
+def _section_lines(name: str, fields: dict) -> bytes:
+    lines = [b'# ' + name.capitalize().encode()]
+    lines += [f"{field}:{value}".encode() for field, value in fields.items()]
+    return CLRS.join(lines) + CLRS
+
+
+def handle_info_command(tokens) -> bytes:
+    requested = [token.decode().lower() for token in tokens[1:]] or ['default']
+    sections = []
+    for name in requested:
+        if name == 'default':
+            sections.extend(DEFAULT_SECTIONS)
+        elif name in ('all', 'everything'):
+            sections.extend(ALL_SECTIONS)
+        elif name in ALL_SECTIONS:
+            sections.append(name)
+        # Unknown sections are ignored (same as redis).
+
+    parts = []
+    for name in dict.fromkeys(sections):
+        parts.append(_section_lines(name, _SECTION_BUILDERS[name]()))
+    return serialize_msg(CLRS.join(parts), SerializedTypes.BULK_STRING)
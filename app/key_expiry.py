@@ -0,0 +1,186 @@
+"""
+Key expiry.
+
+EXPIRE key seconds [NX | XX | GT | LT]          PEXPIRE key milliseconds [NX | XX | GT | LT]
+EXPIREAT key unix-time-seconds [NX | XX | GT | LT]
+PEXPIREAT key unix-time-milliseconds [NX | XX | GT | LT]
+TTL key | PTTL key | EXPIRETIME key | PEXPIRETIME key
+PERSIST key
+(SET ... EX/PX/EXAT/PXAT/KEEPTTL, GETEX, SETEX and PSETEX are in redis_strings.py)
+
+Every expiry is stored as an absolute unix time in ms, computed from the time the request was received.
+A key is expired once that time has passed. Expired keys are deleted in two ways, like redis:
+- lazily: the next command that looks the key up deletes it (get_from_memstore).
+- actively: every ACTIVE_EXPIRE_CYCLE_INTERVAL_S, the active expire cycle pops the keys that expired from the
+  expiry heap of the keyspace (keyspace.py), so keys that are never read again don't stay in memory.
+  A cycle runs for at most ACTIVE_EXPIRE_CYCLE_BUDGET_US, so a mass expiry can't stall the event loop:
+  what's left is deleted by the next cycles, starting with the database where this one ran out of time.
+  The cycle also samples the TTLs of a few keys of each database it goes through (avg_ttl of INFO keyspace).
+"""
+import asyncio
+import time
+
+from app.client_tracking import flush_invalidations
+from app.errors import RedisCommandError, RedisSyntaxError
+from app.key_value_utils import NO_EXPIRY, NULL_VALUE_OBJ
+from app.latency_monitor import add_latency_sample
+from app import memory_management
+from app.memory_management import get_from_memstore, expire_key
+from app.redis_serialization_protocol import serialize_msg, SerializedTypes, parse_int_token
+from app.replication import propagate_as
+from app.server_clock import now_ms
+
+ACTIVE_EXPIRE_CYCLE_INTERVAL_S = 0.1
+# 25% of the interval (redis' slow cycle uses the same share of its time).
+ACTIVE_EXPIRE_CYCLE_BUDGET_US = 25_000
+# The time is checked once every this many deleted keys.
+_KEYS_PER_TIME_CHECK = 16
+
+# The database the next active expire cycle starts with.
+_next_cycle_db = 0
+
+# Larger expiry times would overflow a signed 64 bit integer in redis.
+_MAX_EXPIRY_MS = 2 ** 63 - 1
+
+# option -> (milliseconds per unit, absolute)
+_EXPIRE_UNITS = {
+    b'EX': (1000, False),
+    b'PX': (1, False),
+    b'EXAT': (1000, True),
+    b'PXAT': (1, True),
+}
+
+
+def parse_expiry(option: bytes, token: bytes, now_ms: int, cmd_name: str, allow_non_positive=False) -> int:
+    """
+    EX seconds | PX milliseconds | EXAT unix-time-seconds | PXAT unix-time-milliseconds -> unix_expiry_ms
+    """
+    unit_ms, absolute = _EXPIRE_UNITS[option]
+    value = parse_int_token(token)
+    if (value <= 0 and not allow_non_positive) or abs(value) > _MAX_EXPIRY_MS // unit_ms:
+        raise RedisCommandError(f"ERR invalid expire time in '{cmd_name}' command")
+    expiry_ms = value * unit_ms if absolute else now_ms + value * unit_ms
+    if expiry_ms > _MAX_EXPIRY_MS:
+        raise RedisCommandError(f"ERR invalid expire time in '{cmd_name}' command")
+    return expiry_ms
+
+
+def set_expiry_or_delete(key, expiry_ms: int, now_ms: int):
+    """
+    Change the expiry of an existing key. One that has already passed deletes the key right away (like redis).
+    """
+    if expiry_ms != NO_EXPIRY and expiry_ms <= now_ms:
+        del memory_management.redis_memstore[key]
+    else:
+        memory_management.redis_memstore.set_expiry(key, expiry_ms)
+
+
+def _parse_expire_conditions(tokens) -> set[bytes]:
+    flags = {token.upper() for token in tokens[3:]}
+    if not flags <= {b'NX', b'XX', b'GT', b'LT'}:
+        raise RedisCommandError(f"ERR Unsupported option {(flags - {b'NX', b'XX', b'GT', b'LT'}).pop().decode()}")
+    if b'NX' in flags and len(flags) > 1:
+        raise RedisCommandError("ERR NX and XX, GT or LT options at the same time are not compatible")
+    if b'GT' in flags and b'LT' in flags:
+        raise RedisCommandError("ERR GT and LT options at the same time are not compatible")
+    return flags
+
+
+def _expire(first_token, tokens, now_ms) -> bytes:
+    option = {b'EXPIRE': b'EX', b'PEXPIRE': b'PX', b'EXPIREAT': b'EXAT', b'PEXPIREAT': b'PXAT'}[first_token]
+    flags = _parse_expire_conditions(tokens)
+    # Unlike SET, EXPIRE accepts times in the past (the key is deleted).
+    expiry_ms = parse_expiry(option, tokens[2], now_ms, first_token.decode().lower(), allow_non_positive=True)
+    key = tokens[1]
+    value_obj = get_from_memstore(key, now_ms)
+    if value_obj is NULL_VALUE_OBJ:
+        propagate_as(None)
+        return serialize_msg(0, SerializedTypes.INTEGER)
+    current = value_obj.unix_expiry_ms
+    # No expiry counts as an infinite TTL for GT / LT.
+    if (b'NX' in flags and current != NO_EXPIRY) or (b'XX' in flags and current == NO_EXPIRY) or \
+            (b'GT' in flags and (current == NO_EXPIRY or expiry_ms <= current)) or \
+            (b'LT' in flags and current != NO_EXPIRY and expiry_ms >= current):
+        propagate_as(None)
+        return serialize_msg(0, SerializedTypes.INTEGER)
+    set_expiry_or_delete(key, expiry_ms, now_ms)
+    # Absolute, like SET ... PXAT (see redis_strings.py).
+    propagate_as([b'PEXPIREAT', key, str(expiry_ms).encode()])
+    return serialize_msg(1, SerializedTypes.INTEGER)
+
+
+def _ttl(first_token, key, now_ms) -> bytes:
+    value_obj = get_from_memstore(key, now_ms)
+    if value_obj is NULL_VALUE_OBJ:
+        return serialize_msg(-2, SerializedTypes.INTEGER)
+    expiry_ms = value_obj.unix_expiry_ms
+    if expiry_ms == NO_EXPIRY:
+        return serialize_msg(-1, SerializedTypes.INTEGER)
+    match first_token:
+        case b'TTL':
+            # Rounded, like redis.
+            result = (expiry_ms - now_ms + 500) // 1000
+        case b'PTTL':
+            result = expiry_ms - now_ms
+        case b'EXPIRETIME':
+            result = expiry_ms // 1000
+        case _:
+            result = expiry_ms
+    return serialize_msg(max(result, 0), SerializedTypes.INTEGER)
+
+
+def handle_expire_command(first_token, tokens, request_recv_time_ms):
+    now_ms = request_recv_time_ms
+    match first_token:
+        case b'EXPIRE' | b'PEXPIRE' | b'EXPIREAT' | b'PEXPIREAT':
+            return _expire(first_token, tokens, now_ms)
+        case b'TTL' | b'PTTL' | b'EXPIRETIME' | b'PEXPIRETIME' if len(tokens) == 2:
+            return _ttl(first_token, tokens[1], now_ms)
+        case b'PERSIST' if len(tokens) == 2:
+            value_obj = get_from_memstore(tokens[1], now_ms)
+            if value_obj is NULL_VALUE_OBJ or value_obj.unix_expiry_ms == NO_EXPIRY:
+                return serialize_msg(0, SerializedTypes.INTEGER)
+            memory_management.redis_memstore.set_expiry(tokens[1], NO_EXPIRY)
+            return serialize_msg(1, SerializedTypes.INTEGER)
+    raise RedisSyntaxError()
+
+
+def active_expire_cycle(now_ms: int, budget_us: int = ACTIVE_EXPIRE_CYCLE_BUDGET_US) -> int:
+    """
+    Delete the keys that expired before now_ms in every database, for at most budget_us.
+    Returns the number of keys deleted.
+    """
+    global _next_cycle_db
+    start_ns = time.perf_counter_ns()
+    num_expired = 0
+    out_of_time = False
+    num_dbs = len(memory_management.databases)
+    selected_db = memory_management.selected_db
+    for i in range(num_dbs):
+        index = (_next_cycle_db + i) % num_dbs
+        # expire_key() works on the selected database.
+        memory_management.select_db(index)
+        while not out_of_time:
+            key = memory_management.redis_memstore.pop_expired(now_ms)
+            if key is None:
+                break
+            expire_key(key)
+            num_expired += 1
+            out_of_time = num_expired % _KEYS_PER_TIME_CHECK == 0 and \
+                (time.perf_counter_ns() - start_ns) // 1000 >= budget_us
+        memory_management.redis_memstore.sample_ttls(now_ms)
+        if out_of_time:
+            _next_cycle_db = index
+            break
+    memory_management.select_db(selected_db)
+    if num_expired:
+        add_latency_sample('expire-cycle', (time.perf_counter_ns() - start_ns) // 1000)
+    return num_expired
+
+
+async def run_active_expire():
+    while True:
+        await asyncio.sleep(ACTIVE_EXPIRE_CYCLE_INTERVAL_S)
+        if active_expire_cycle(now_ms()):
+            # Clients with CLIENT TRACKING on cached the keys that expired.
+            flush_invalidations()
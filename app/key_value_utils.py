@@ -9,11 +9,15 @@ NO_EXPIRY = -1
 class ValueTypes(Enum):
     STRING=b'string'
     STREAM=b'stream'
+    HASH=b'hash'
+    LIST=b'list'
+    ZSET=b'zset'
+    SET=b'set'
     NONE=b'none'
 
     @classmethod
     def get_type(cls, val):
-        if isinstance(val, str) or isinstance(val, bytes):
+        if isinstance(val, str | bytes | bytearray):
             return cls.STRING
         if isinstance(val, dict):
             return cls.STREAM
@@ -0,0 +1,280 @@
+"""
+The keyspace (one per database, see memory_management.py) and incremental SCAN over it.
+
+SCAN has to hand out a cursor, let the client come back later with it, and continue from there,
+while other clients keep adding and deleting keys in between.
+Redis guarantees: a key that exists for the whole duration of the scan is returned (at least once),
+and a full iteration is O(n) overall but every single SCAN call is cheap.
+
+A python dict can't be iterated from the middle, and iterating it while it's being modified raises.
+So next to the dict, we keep the keys in insertion order in a list (the "slots").
+Every key gets a sequence number when it's inserted, and the cursor is simply a sequence number:
+"continue from the first key inserted at or after seq <cursor>".
+
+Deleting a key leaves a tombstone in its slot instead of shifting the list.
+Once there are too many tombstones we compact the list.
+Compaction changes the positions of keys in the list, but not their sequence numbers,
+so cursors that are already out there stay valid (we find the position again using bisect on the seqs).
+
+Overwriting an existing key keeps its slot. Re-adding a deleted key gives it a new seq, so at worst it is
+returned twice in the same scan (redis allows that too).
+"""
+import random
+from array import array
+from bisect import bisect_left
+from heapq import heappush, heappop, heapify
+
+from app.errors import RedisSyntaxError
+from app.key_value_utils import NO_EXPIRY
+from app.redis_serialization_protocol import parse_int_token
+
+_TOMBSTONE = object()
+
+# Don't bother compacting small indexes.
+_MIN_TOMBSTONES_FOR_COMPACTION = 1024
+_MIN_STALE_EXPIRY_ENTRIES_FOR_REBUILD = 1024
+# avg_ttl: keys sampled per active expire cycle, and the weight of the older samples (same as redis).
+_TTL_SAMPLES = 20
+_TTL_ESTIMATE_WEIGHT = 49 / 50
+
+
+class ScanCursorIndex:
+    """
+    Insertion ordered index of keys, with cursors that survive inserts/deletes. (See module docstring)
+    """
+
+    def __init__(self):
+        self._slot_keys: list = []
+        self._slot_seqs = array('q')
+        self._key_seq: dict = {}
+        self._next_seq = 1
+        self._num_tombstones = 0
+
+    def add(self, key):
+        if key in self._key_seq:
+            return
+        seq = self._next_seq
+        self._next_seq += 1
+        self._key_seq[key] = seq
+        self._slot_keys.append(key)
+        self._slot_seqs.append(seq)
+
+    def remove(self, key):
+        seq = self._key_seq.pop(key, None)
+        if seq is None:
+            return
+        pos = bisect_left(self._slot_seqs, seq)
+        self._slot_keys[pos] = _TOMBSTONE
+        self._num_tombstones += 1
+        if self._num_tombstones >= _MIN_TOMBSTONES_FOR_COMPACTION and self._num_tombstones > len(self._key_seq):
+            self._compact()
+
+    def clear(self):
+        self.__init__()
+
+    def _compact(self):
+        live = [(key, seq) for key, seq in zip(self._slot_keys, self._slot_seqs) if key is not _TOMBSTONE]
+        self._slot_keys = [key for key, _ in live]
+        self._slot_seqs = array('q', (seq for _, seq in live))
+        self._num_tombstones = 0
+
+    def scan(self, cursor: int, count: int) -> tuple[int, list]:
+        """
+        Return (next_cursor, keys). next_cursor == 0 means the iteration is complete.
+
+        Visits at most <count> keys. Tombstones are skipped, but we also stop after a bounded
+        number of them, so that a single call stays cheap even after a mass delete.
+        """
+        pos = bisect_left(self._slot_seqs, cursor) if cursor else 0
+        num_slots = len(self._slot_keys)
+        max_visits = count * 10
+        keys = []
+        visits = 0
+        while pos < num_slots and len(keys) < count and visits < max_visits:
+            key = self._slot_keys[pos]
+            if key is not _TOMBSTONE:
+                keys.append(key)
+            pos += 1
+            visits += 1
+        next_cursor = self._slot_seqs[pos] if pos < num_slots else 0
+        return next_cursor, keys
+
+
+class ScannableDict(dict):
+    """
+    A dict which also keeps a ScanCursorIndex of its keys up to date.
+
+    Reads (get, [], in, len) are plain dict operations.
+    Only the methods that add or remove keys are overridden.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.scan_index = ScanCursorIndex()
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self.scan_index.add(key)
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.scan_index.remove(key)
+
+    def pop(self, key, *default):
+        if key in self:
+            self.scan_index.remove(key)
+        return super().pop(key, *default)
+
+    def popitem(self):
+        key, value = super().popitem()
+        self.scan_index.remove(key)
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        super().clear()
+        self.scan_index.clear()
+
+    def scan(self, cursor: int, count: int) -> tuple[int, list]:
+        return self.scan_index.scan(cursor, count)
+
+
+class Keyspace(ScannableDict):
+    """
+    A database (memory_management.py): key -> ValueObj.
+
+    Also keeps expires: key -> unix_expiry_ms of the keys that have an expiry, so that counting them
+    (INFO keyspace, metrics) never walks the whole keyspace, and a min-heap of (unix_expiry_ms, key)
+    for the active expire cycle (key_expiry.py) to find the keys that expired in O(log n) each.
+
+    Setting or changing an expiry pushes a new heap entry (O(log n)). The old entry is not searched for:
+    an entry whose time doesn't match expires[key] anymore is stale, and skipped when it reaches the top.
+    Once stale entries outnumber the live ones, the heap is rebuilt.
+
+    avg_ttl is a running estimate of the TTL of the keys with an expiry (INFO keyspace), updated by the active
+    expire cycle from a few random heap entries (sample_ttls).
+
+    stats are the keyspace counters of this database alone (the totals are in server_stats.py).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.expires: dict = {}
+        self._expiry_heap: list[tuple[int, object]] = []
+        self.avg_ttl = 0
+        # Not reset by FLUSHDB (same as the global counters).
+        self.stats = {'keyspace_hits': 0, 'keyspace_misses': 0, 'expired_keys': 0}
+
+    def __setitem__(self, key, value_obj):
+        super().__setitem__(key, value_obj)
+        self._index_expiry(key, value_obj.unix_expiry_ms)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.expires.pop(key, None)
+
+    def pop(self, key, *default):
+        self.expires.pop(key, None)
+        return super().pop(key, *default)
+
+    def popitem(self):
+        key, value_obj = super().popitem()
+        self.expires.pop(key, None)
+        return key, value_obj
+
+    def clear(self):
+        super().clear()
+        self.expires.clear()
+        self._expiry_heap.clear()
+        self.avg_ttl = 0
+
+    def _index_expiry(self, key, expiry_ms: int):
+        if expiry_ms == NO_EXPIRY:
+            self.expires.pop(key, None)
+            return
+        if self.expires.get(key) == expiry_ms:
+            # Same expiry (KEEPTTL, overwrite with the same time): its heap entry is still valid.
+            return
+        self.expires[key] = expiry_ms
+        heappush(self._expiry_heap, (expiry_ms, key))
+        if len(self._expiry_heap) > 2 * len(self.expires) + _MIN_STALE_EXPIRY_ENTRIES_FOR_REBUILD:
+            self._expiry_heap = [(ms, k) for k, ms in self.expires.items()]
+            heapify(self._expiry_heap)
+
+    def set_expiry(self, key, expiry_ms: int):
+        """
+        Change the expiry of an existing key (NO_EXPIRY: PERSIST).
+        """
+        self[key].unix_expiry_ms = expiry_ms
+        self._index_expiry(key, expiry_ms)
+
+    def pop_expired(self, now_ms: int):
+        """
+        A key that expired before now_ms, None if there is none (the key is not removed).
+        """
+        heap = self._expiry_heap
+        while heap and heap[0][0] < now_ms:
+            expiry_ms, key = heappop(heap)
+            if self.expires.get(key) == expiry_ms:
+                return key
+        return None
+
+    def sample_ttls(self, now_ms: int):
+        """
+        Update avg_ttl with the TTLs of a few keys picked at random.
+        """
+        if not self.expires:
+            self.avg_ttl = 0
+            return
+        heap = self._expiry_heap
+        ttls = [expiry_ms - now_ms for expiry_ms, key in random.sample(heap, min(len(heap), _TTL_SAMPLES))
+                if expiry_ms > now_ms and self.expires.get(key) == expiry_ms]
+        if not ttls:
+            return
+        sample_avg = sum(ttls) / len(ttls)
+        if self.avg_ttl:
+            sample_avg = self.avg_ttl * _TTL_ESTIMATE_WEIGHT + sample_avg * (1 - _TTL_ESTIMATE_WEIGHT)
+        self.avg_ttl = int(sample_avg)
+
+
+######################################################################################################
+
+
+DEFAULT_SCAN_COUNT = 10
+
+def parse_scan_args(tokens, start_idx, allow_type=True):
+    """
+    SCAN cursor [MATCH pattern] [COUNT count] [TYPE type]
+    HSCAN key cursor [MATCH pattern] [COUNT count]
+
+    start_idx is the index of the cursor token.
+    return cursor, count, pattern, val_type (pattern and val_type are None when not given).
+    """
+    cursor = parse_int_token(tokens[start_idx])
+    count, pattern, val_type = DEFAULT_SCAN_COUNT, None, None
+    i = start_idx + 1
+    while i < len(tokens):
+        if i + 1 >= len(tokens):
+            raise RedisSyntaxError()
+        option, arg = tokens[i].upper(), tokens[i + 1]
+        if option == b'MATCH':
+            pattern = arg
+        elif option == b'COUNT':
+            count = parse_int_token(arg)
+            if count < 1:
+                raise RedisSyntaxError()
+        elif option == b'TYPE' and allow_type:
+            val_type = arg.lower()
+        else:
+            raise RedisSyntaxError()
+        i += 2
+    return cursor, count, pattern, val_type
@@ -0,0 +1,83 @@
+"""
+Keyspace notifications (notify-keyspace-events, config.py).
+
+Every change to a key can be published to pub/sub, on two channels (same as redis):
+    __keyspace@<db>__:<key>     message: the event name (set, del ...)
+    __keyevent@<db>__:<event>   message: the key
+
+notify-keyspace-events is a string of flags:
+    K   publish on the __keyspace@ channels         E   publish on the __keyevent@ channels
+    g   generic events (del)                        $   string events (set, incrby)
+    l   list   s   set   h   hash   z   sorted set   t   stream events (xadd)
+    x   expired events (the key's expiry passed)     e   evicted events (there is no maxmemory: never sent)
+    A   alias for g$lshzxet
+At least one of K / E and one event class are needed for anything to be published.
+
+The flags are parsed once (CONFIG SET) into notify_mask. The places that change keys check it before building
+anything, so with notifications disabled (the default) an event costs one bitmask test:
+    if keyspace_events.notify_mask & NOTIFY_STRING:
+        notify_keyspace_event(NOTIFY_STRING, b'set', key, db)
+"""
+from app.config import server_config, on_config_set
+from app.errors import RedisCommandError
+from app.pubsub import publish
+
+NOTIFY_KEYSPACE = 1 << 0
+NOTIFY_KEYEVENT = 1 << 1
+NOTIFY_GENERIC = 1 << 2
+NOTIFY_STRING = 1 << 3
+NOTIFY_LIST = 1 << 4
+NOTIFY_SET = 1 << 5
+NOTIFY_HASH = 1 << 6
+NOTIFY_ZSET = 1 << 7
+NOTIFY_EXPIRED = 1 << 8
+NOTIFY_EVICTED = 1 << 9
+NOTIFY_STREAM = 1 << 10
+
+_FLAGS = {
+    'K': NOTIFY_KEYSPACE, 'E': NOTIFY_KEYEVENT, 'g': NOTIFY_GENERIC, '$': NOTIFY_STRING, 'l': NOTIFY_LIST,
+    's': NOTIFY_SET, 'h': NOTIFY_HASH, 'z': NOTIFY_ZSET, 'x': NOTIFY_EXPIRED, 'e': NOTIFY_EVICTED,
+    't': NOTIFY_STREAM,
+}
+_ALL_CLASSES = NOTIFY_GENERIC | NOTIFY_STRING | NOTIFY_LIST | NOTIFY_SET | NOTIFY_HASH | NOTIFY_ZSET | \
+    NOTIFY_EXPIRED | NOTIFY_EVICTED | NOTIFY_STREAM
+
+# The event classes that are published. 0 unless K or E is set too.
+notify_mask = 0
+# NOTIFY_KEYSPACE | NOTIFY_KEYEVENT
+_channel_kinds = 0
+
+
+def parse_notify_flags(flags: str) -> int:
+    mask = 0
+    for flag in flags:
+        if flag == 'A':
+            mask |= _ALL_CLASSES
+        elif flag in _FLAGS:
+            mask |= _FLAGS[flag]
+        else:
+            raise RedisCommandError(f"ERR Invalid argument '{flags}' for CONFIG SET 'notify-keyspace-events'")
+    return mask
+
+
+def _set_notify_flags(flags: str):
+    global notify_mask, _channel_kinds
+    mask = parse_notify_flags(flags)
+    _channel_kinds = mask & (NOTIFY_KEYSPACE | NOTIFY_KEYEVENT)
+    notify_mask = mask & _ALL_CLASSES if _channel_kinds else 0
+
+
+on_config_set('notify-keyspace-events', _set_notify_flags)
+_set_notify_flags(server_config['notify-keyspace-events'])
+
+
+def notify_keyspace_event(event_class: int, event: bytes, key: bytes, db: int):
+    """
+    Publish the event. Callers check notify_mask & event_class first (see module docstring).
+    """
+    if not notify_mask & event_class:
+        return
+    if _channel_kinds & NOTIFY_KEYSPACE:
+        publish(b'__keyspace@%d__:' % db + key, event)
+    if _channel_kinds & NOTIFY_KEYEVENT:
+        publish(b'__keyevent@%d__:' % db + event, key)
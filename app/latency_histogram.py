@@ -0,0 +1,105 @@
+"""
+HDR style latency histogram.
+
+Values (eg: microseconds) are counted in log-linear buckets: exact below 256, then 128 buckets per power of two.
+So every recorded value is known within 1/128 (< 0.8%), whatever its magnitude, in a few KB,
+and recording is a dict increment: cheap enough to record every single request.
+"""
+import math
+
+_SUB_BUCKET_BITS = 8
+_SUB_BUCKET_HALF = 1 << (_SUB_BUCKET_BITS - 1)
+
+
+def bucket_index(value: int) -> int:
+    if value < (1 << _SUB_BUCKET_BITS):
+        return value
+    shift = value.bit_length() - _SUB_BUCKET_BITS
+    return shift * _SUB_BUCKET_HALF + (value >> shift)
+
+
+def bucket_range(index: int) -> tuple[int, int]:
+    """
+    Lowest and highest values counted in a bucket.
+    """
+    if index < (1 << _SUB_BUCKET_BITS):
+        return index, index
+    shift = index // _SUB_BUCKET_HALF - 1
+    low = (index - shift * _SUB_BUCKET_HALF) << shift
+    return low, low + (1 << shift) - 1
+
+
+class LatencyHistogram:
+
+    def __init__(self):
+        # bucket index -> count
+        self.counts: dict[int, int] = {}
+        self.total = 0
+        self.sum = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, value: int):
+        value = max(int(value), 0)
+        index = bucket_index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.total += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: 'LatencyHistogram'):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+        self.sum += other.sum
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent: float) -> int:
+        """
+        Highest value of the bucket holding the percent-th percentile (like HDR: never under-reports).
+        """
+        if not self.total:
+            return 0
+        rank = max(math.ceil(percent / 100 * self.total), 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(bucket_range(index)[1], self.max)
+        return self.max
+
+    def mean(self) -> float:
+        return self.sum / self.total if self.total else 0.0
+
+    def buckets(self) -> list[tuple[int, int]]:
+        """
+        (highest value of the bucket, count) for the non empty buckets, in increasing order.
+        """
+        return [(bucket_range(index)[1], self.counts[index]) for index in sorted(self.counts)]
+
+    def power_of_two_buckets(self) -> list[tuple[int, int]]:
+        """
+        (upper bound, cumulative count) with power of two upper bounds (LATENCY HISTOGRAM), non empty buckets only.
+        Each bucket is counted under the first power of two >= its lowest value.
+        """
+        result = []
+        seen = 0
+        for index in sorted(self.counts):
+            lowest = bucket_range(index)[0]
+            upper_bound = 1 << (max(lowest, 1) - 1).bit_length()
+            seen += self.counts[index]
+            if result and result[-1][0] == upper_bound:
+                result[-1] = (upper_bound, seen)
+            else:
+                result.append((upper_bound, seen))
+        return result
+
+    def summary(self, percents=(50, 99, 99.9)) -> dict:
+        result = {f'p{p:g}': self.percentile(p) for p in percents}
+        result.update({'min': self.min or 0, 'max': self.max, 'mean': round(self.mean(), 2), 'count': self.total})
+        return result
@@ -0,0 +1,135 @@
+"""
+Latency monitor.
+
+LATENCY LATEST | HISTORY event | RESET [event ...] | HISTOGRAM [name ...]
+
+Events slower than latency-monitor-threshold milliseconds (config.py, 0: off) are recorded per event name:
+the latest and the max sample, the last 160 samples (one per second at most, like redis) for HISTORY,
+and a log-bucketed histogram of every recorded sample (latency_histogram.py, a few KB per event).
+
+Events:
+command          a command took long to run (blocking commands: only the time they ran, not the wait)
+large-delete     DEL / UNLINK / FLUSHALL / FLUSHDB took long (freeing big values inline)
+eventloop        the event loop was stalled: a periodic timer fired late (monitor_event_loop())
+expire-cycle     an active expire cycle took long (key_expiry.py)
+
+There is no RDB / AOF in this server, so no fork or fsync events.
+
+LATENCY HISTOGRAM reports, in power of two buckets, the latency of the given commands (or of all of them)
+while latency-tracking is on (see server_stats.py), and of the given events.
+"""
+import asyncio
+import time
+from collections import deque
+
+from app.config import server_config
+from app.errors import RedisSyntaxError
+from app.latency_histogram import LatencyHistogram
+from app.redis_serialization_protocol import serialize_msg, SerializedTypes, get_resp_array_from_elems
+from app.server_clock import now_ms
+from app.server_stats import command_histograms
+
+LATENCY_HISTORY_LEN = 160
+DELETE_COMMANDS = frozenset({b'DEL', b'UNLINK', b'FLUSHALL', b'FLUSHDB'})
+
+# Period of the event loop stall probe.
+EVENT_LOOP_PROBE_INTERVAL_S = 0.1
+
+
+class LatencyEvent:
+    __slots__ = ('history', 'max_ms', 'histogram_us')
+
+    def __init__(self):
+        # (unix time in seconds, latency ms), one sample per second (the max of that second)
+        self.history: deque[list[int]] = deque(maxlen=LATENCY_HISTORY_LEN)
+        self.max_ms = 0
+        self.histogram_us = LatencyHistogram()
+
+
+_events: dict[str, LatencyEvent] = {}
+
+
+def add_latency_sample(event_name: str, duration_us: int):
+    """
+    Record an event if it is over the threshold. Cheap when the monitor is off: one config lookup.
+    """
+    threshold = server_config['latency-monitor-threshold']
+    duration_ms = duration_us // 1000
+    if not threshold or duration_ms < threshold:
+        return
+    event = _events.get(event_name)
+    if event is None:
+        event = _events[event_name] = LatencyEvent()
+    now = now_ms() // 1000
+    if event.history and event.history[-1][0] == now:
+        event.history[-1][1] = max(event.history[-1][1], duration_ms)
+    else:
+        event.history.append([now, duration_ms])
+    event.max_ms = max(event.max_ms, duration_ms)
+    event.histogram_us.record(duration_us)
+
+
+def add_command_latency(first_token: bytes, duration_us: int):
+    add_latency_sample('command', duration_us)
+    if first_token in DELETE_COMMANDS:
+        add_latency_sample('large-delete', duration_us)
+
+
+async def monitor_event_loop():
+    """
+    Detect event loop stalls: sleep for a fixed interval and measure how late we wake up.
+    """
+    interval = EVENT_LOOP_PROBE_INTERVAL_S
+    while True:
+        start = time.perf_counter_ns()
+        await asyncio.sleep(interval)
+        late_us = (time.perf_counter_ns() - start) // 1000 - int(interval * 1_000_000)
+        add_latency_sample('eventloop', late_us)
+
+
+def _integers(values) -> list[bytes]:
+    return [serialize_msg(value, SerializedTypes.INTEGER) for value in values]
+
+
+def _histogram_reply(name: bytes, histogram: LatencyHistogram) -> list[bytes]:
+    buckets = _integers(value for bucket in histogram.power_of_two_buckets() for value in bucket)
+    return [
+        serialize_msg(name, SerializedTypes.BULK_STRING),
+        get_resp_array_from_elems([
+            serialize_msg('calls', SerializedTypes.BULK_STRING),
+            serialize_msg(histogram.total, SerializedTypes.INTEGER),
+            serialize_msg('histogram_usec', SerializedTypes.BULK_STRING),
+            get_resp_array_from_elems(buckets),
+        ]),
+    ]
+
+
+def handle_latency_command(tokens):
+    sub_cmd = tokens[1].upper()
+    match sub_cmd:
+        case b'LATEST':
+            return get_resp_array_from_elems([
+                get_resp_array_from_elems([serialize_msg(name, SerializedTypes.BULK_STRING)] +
+                                          _integers(event.history[-1] + [event.max_ms]))
+                for name, event in _events.items()])
+        case b'HISTORY' if len(tokens) == 3:
+            event = _events.get(tokens[2].decode())
+            history = list(event.history) if event is not None else []
+            return get_resp_array_from_elems([get_resp_array_from_elems(_integers(sample)) for sample in history])
+        case b'RESET':
+            names = [token.decode() for token in tokens[2:]] or list(_events)
+            num_reset = 0
+            for name in names:
+                num_reset += _events.pop(name, None) is not None
+            return serialize_msg(num_reset, SerializedTypes.INTEGER)
+        case b'HISTOGRAM':
+            histograms = command_histograms()
+            names = [token.upper() for token in tokens[2:]] or sorted(histograms)
+            elems = []
+            for name in names:
+                if name in histograms:
+                    elems += _histogram_reply(name.lower(), histograms[name])
+                elif name.lower().decode() in _events:
+                    elems += _histogram_reply(name.lower(), _events[name.lower().decode()].histogram_us)
+            return get_resp_array_from_elems(elems)
+    raise RedisSyntaxError()
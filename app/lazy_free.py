@@ -0,0 +1,153 @@
+"""
+Lazy free (UNLINK, FLUSHALL ASYNC, FLUSHDB ASYNC).
+
+Dropping the last reference to a big value (eg: a RedisStream with millions of entries) makes CPython
+deallocate the whole object graph right there, inside the command that deleted it.
+On top of that, stream leaves point to each other (prev_leaf <-> next_leaf), so they form reference cycles
+and are only reclaimed by the cyclic GC, which has to walk all of them in one go.
+Either way the event loop is stuck and every other client waits.
+
+Approach:
+The key is detached from the memstore immediately (so the command itself is O(1)),
+and the value is handed over to this module.
+We tear the value down in small steps (bounded number of nodes per step),
+and run one batch of steps per event loop iteration using loop.call_soon().
+Other clients get served in between batches.
+
+Every step breaks the links of a single node, so nodes are freed by plain refcounting as we go
+and the cyclic GC never has to deal with them.
+"""
+import asyncio
+from collections import deque
+from typing import Iterator
+
+from app.redis_streams import RedisStream
+
+# Max number of teardown steps (roughly: nodes released) in one event loop iteration.
+LAZYFREE_STEPS_PER_BATCH = 1000
+
+# Values with an estimated effort below this are simply freed inline (same as redis LAZYFREE_THRESHOLD).
+# Not worth scheduling anything for a small string.
+LAZYFREE_THRESHOLD = 64
+
+# Values waiting to be reclaimed (each one is a generator that dismantles the value step by step).
+_pending: deque[Iterator] = deque()
+_drain_scheduled = False
+
+# Stats (for INFO)
+lazyfree_pending_objects = 0
+lazyfreed_objects = 0
+
+
+def _free_effort(obj) -> int:
+    """
+    Rough number of allocations that will be released when obj is freed.
+    """
+    if isinstance(obj, RedisStream):
+        # We don't track the stream length, assume it's big.
+        return LAZYFREE_THRESHOLD
+    if isinstance(obj, (dict, list, set, deque)) or hasattr(obj, 'dismantle'):
+        return len(obj)
+    return 1
+
+
+def _dismantle(obj) -> Iterator[None]:
+    """
+    Release obj one node at a time. Yields after every step.
+
+    Containers are emptied instead of being dropped in one go, nested containers are pushed on a stack
+    and dismantled later (iteratively, so deep values don't hit the recursion limit).
+    """
+    stack = [obj]
+    while stack:
+        node = stack.pop()
+        if hasattr(node, 'dismantle'):
+            # Data types that know how to tear themselves down (RedisStream, RedisHash ...).
+            yield from node.dismantle()
+        elif isinstance(node, dict):
+            while node:
+                _, val = node.popitem()
+                if _free_effort(val) > 1:
+                    stack.append(val)
+                yield
+        elif isinstance(node, (list, deque)):
+            while node:
+                val = node.pop()
+                if _free_effort(val) > 1:
+                    stack.append(val)
+                yield
+        elif isinstance(node, set):
+            while node:
+                node.pop()
+                yield
+        else:
+            yield
+
+
+def lazy_free(obj) -> None:
+    """
+    Reclaim obj in the background. The caller must have already dropped its own references to obj.
+    """
+    if _free_effort(obj) < LAZYFREE_THRESHOLD:
+        # Small value, let refcounting free it right away.
+        return
+    _queue(obj)
+
+
+def lazy_free_values(values: list) -> None:
+    """
+    FLUSHALL / FLUSHDB ASYNC: reclaim the values of a database, handed over in one list.
+    The threshold applies to the work of freeing them all, not to the number of values: a database holding
+    one big stream is reclaimed in the background too.
+    """
+    if len(values) < LAZYFREE_THRESHOLD and sum(_free_effort(val) for val in values) < LAZYFREE_THRESHOLD:
+        return
+    _queue(values)
+
+
+def _queue(obj):
+    global lazyfree_pending_objects
+    _pending.append(_dismantle(obj))
+    lazyfree_pending_objects += 1
+    _schedule_drain()
+
+
+def _schedule_drain():
+    global _drain_scheduled
+    if _drain_scheduled:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # No event loop (eg: unit tests or a script). Nobody to block, just free everything now.
+        drain_lazy_free()
+        return
+    _drain_scheduled = True
+    loop.call_soon(_run_batch)
+
+
+def _run_batch():
+    global _drain_scheduled
+    _drain_scheduled = False
+    if drain_lazy_free(LAZYFREE_STEPS_PER_BATCH):
+        _schedule_drain()
+
+
+def drain_lazy_free(max_steps: int | None = None) -> bool:
+    """
+    Run up to max_steps teardown steps (all of them if max_steps is None).
+
+    return True if there is still pending work.
+    """
+    global lazyfree_pending_objects, lazyfreed_objects
+    steps = 0
+    while _pending:
+        dismantler = _pending[0]
+        for _ in dismantler:
+            steps += 1
+            if max_steps is not None and steps >= max_steps:
+                return True
+        _pending.popleft()
+        lazyfree_pending_objects -= 1
+        lazyfreed_objects += 1
+    return False
@@ -1,64 +1,168 @@
 import socket  # noqa: F401
 import asyncio
-from collections import defaultdict
 from typing import Iterable
 import time
 import argparse
-
-from app.errors import InvalidStreamEventTsId, IncrOnStringValue
-from app.memory_management import redis_memstore, get_from_memstore, set_to_memstore, append_stream_event, \
-    pretty_print_stream, run_xread, incr_in_memstore
+from contextlib import contextmanager, suppress
+
+from app.client_state import get_client_state, remove_client_state, handle_client_command, too_many_clients, \
+    is_pause_active, wait_while_paused, clients_cron, client_type
+from app.client_tracking import track_keys, flush_invalidations, disable_tracking
+from app.command_table import COMMAND_TABLE, command_keys
+from app.blocking import blocking_disabled, is_blocking_allowed
+from app.config import get_config_matching, set_config, server_config
+from app.errors import InvalidStreamEventTsId, IncrOnStringValue, RedisCommandError, WrongTypeOperation, \
+    RedisSyntaxError
+from app.key_value_utils import ValueTypes
+from app import memory_management
+from app.memory_management import get_from_memstore, set_to_memstore, append_stream_event, \
+    pretty_print_stream, run_xread, incr_in_memstore, delete_from_memstore, unlink_from_memstore, flush_memstore, \
+    scan_memstore, keys_in_memstore, signal_modified_key, select_db, parse_db_index, swap_dbs, move_key, \
+    init_databases, reset_db_stats, get_typed_value
+from app.keyspace import parse_scan_args
+from app.pubsub import handle_pubsub_command, is_subscribed, remove_subscriber, SUBSCRIBED_MODE_COMMANDS
 from app.rdb import EMPTY_RDB_HEX
-from app.redis_serialization_protocol import parse_redis_bytes, serialize_msg, SerializedTypes, OK_SIMPLE_STRING, \
-    typecast_as_int, NULL_BULK_STRING, get_resp_array_from_elems, CLRS
-
+from app.redis_serialization_protocol import parse_client_commands, serialize_msg, SerializedTypes, OK_SIMPLE_STRING, \
+    typecast_as_int, NULL_BULK_STRING, NULL_ARRAY, get_resp_array_from_elems, CLRS, parse_int_token
+
+from app.redis_hash import handle_hash_command
+from app.redis_hyperloglog import handle_hyperloglog_command
+from app.redis_list import handle_list_command
+from app.redis_set import handle_set_command
+from app.redis_sorted_set import handle_sorted_set_command
+from app.redis_strings import handle_string_command
 from app.redis_streams import parse_xread_input
-from app.replication import get_replication_info, _init_master, _init_replica, get_master_replid, add_replica_conn, \
-    propagate_to_replica_if_write_cmd
-from app.transaction import Transaction
+from app.scripting import handle_scripting_command
+from app.server_clock import now_ms, run_clock_resync
+from app.server_stats import stat_counters, record_command_call, is_command_timing_on, reset_stats
+from app.slowlog import log_if_slow, handle_slowlog_command
+from app.latency_monitor import add_command_latency, handle_latency_command, monitor_event_loop
+from app.debug import handle_debug_command, handle_memory_command
+from app.profiling import profile_dispatch, handle_profile_command
+from app.output_buffer import is_over_output_limit, disconnect_over_limit, output_buffer_size
+from app.key_expiry import handle_expire_command, run_active_expire
+from app.info import handle_info_command, init_server_info
+from app.metrics import start_metrics_server
+from app.replication import _init_master, _init_replica, get_master_replid, add_replica_conn, propagate_write, \
+    append_to_replication_stream, record_replica_ack, remove_replica_conn, replication_frame, \
+    take_propagated_commands, on_command_from_master, propagate_as
+from app.transaction import watch_keys, unwatch_all, start_multi, discard_multi, queue_command
 
 
 ####################################################################################################
 # GLOBALS
 
-MAX_MSG_LEN = 1000
-
-TRANSACTION = Transaction(clients_in_transaction_mode=set(), commands_in_q=defaultdict(list))
+# Bytes read from a client socket at once. Commands can span reads, and one read can hold many (pipelining).
+MAX_MSG_LEN = 64 * 1024
+# A pipeline stops to wait for the client to read its replies when this many bytes are waiting to be sent.
+PIPELINE_DRAIN_THRESHOLD = 64 * 1024
 
 # For use by REDIS STREAM
 # This is to wait for xadd by calls like xread.
-# Each stream has an asyncio.Condition() to keep track of new xadds.
-xadd_conditions: dict[bytes,asyncio.Condition] = {}
+# Each (db index, stream) an XREAD BLOCK waits on has an asyncio.Condition() to keep track of new xadds.
+xadd_conditions: dict[tuple[int, bytes], asyncio.Condition] = {}
 
 
 ####################################################################################################
 # Utils
 
-def get_unix_time_ms():
-    # Get the current Unix timestamp as a floating-point number
-    unix_timestamp = time.time()
-    unix_ts_ms = int(unix_timestamp * 1000)
-    return unix_ts_ms
-
 ####################################################################################################
 # Handle command
 
-async def handle_command_when_in_transaction(addr, first_token, msg):
-    if first_token == b'EXEC':
-        # further calls to handle_command won't be queued.
-        TRANSACTION.clients_in_transaction_mode.remove(addr)
-        result = [await handle_command(msg, addr) for msg in TRANSACTION.commands_in_q[addr]]
+def _run_without_yielding(coro):
+    """
+    Run a command's coroutine to completion in one step: if it tried to wait for anything, it is cancelled.
+    """
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coro.close()
+    return serialize_msg("ERR command tried to wait inside a transaction or script", SerializedTypes.ERROR)
+
+
+_MULTI_FRAME = serialize_msg(['MULTI'], SerializedTypes.ARRAY)
+_EXEC_FRAME = serialize_msg(['EXEC'], SerializedTypes.ARRAY)
+
+# (db, tokens) of the write commands run by the current EXEC / script, propagated to the replicas together.
+# None: not batching.
+_propagation_batch: list[tuple[int, list[bytes]]] | None = None
+
+
+@contextmanager
+def _propagated_as_one_unit():
+    """
+    The write commands run inside this block reach the replicas as one MULTI ... EXEC (one append to the
+    replication stream). Nested blocks (EVAL inside EXEC) join the outer one.
+    """
+    global _propagation_batch
+    if _propagation_batch is not None:
+        yield
+        return
+    _propagation_batch = []
+    try:
+        yield
+    finally:
+        writes, _propagation_batch = _propagation_batch, None
+        if writes:
+            append_to_replication_stream(_MULTI_FRAME + b''.join(replication_frame(tokens, db) for db, tokens in writes)
+                                         + _EXEC_FRAME)
+
+
+def exec_transaction(client, addr, write_conn, request_recv_time_ms) -> bytes:
+    """
+    EXEC: run the queued commands as one batch, without giving the event loop a chance to run anything else.
+    """
+    queue, had_errors = client.multi_queue, client.multi_error
+    if had_errors:
+        discard_multi(client)
+        return serialize_msg("EXECABORT Transaction discarded because of previous errors.", SerializedTypes.ERROR)
+    if client.watched_keys:
+        # Watched keys that expired since WATCH count as modified (the lookup expires them).
+        for db, key in client.watched_keys:
+            select_db(db)
+            get_from_memstore(key, request_recv_time_ms)
+        select_db(client.db)
+        if client.watch_dirty:
+            discard_multi(client)
+            return NULL_ARRAY
+
+    # Further commands of this client are not queued anymore.
+    discard_multi(client)
+    with blocking_disabled(), _propagated_as_one_unit():
+        result = [_run_without_yielding(handle_command(tokens, addr, write_conn, request_recv_time_ms))
+                  for tokens in queue]
+    return get_resp_array_from_elems(result)
+
+
+def reset_connection(client, write_conn) -> bytes:
+    """
+    RESET: back to the state of a new connection (same id): no transaction nor watched keys, no subscriptions,
+    no client tracking, database 0, RESP2, no name.
+    """
+    discard_multi(client)
+    remove_subscriber(write_conn)
+    disable_tracking(client)
+    client.db = 0
+    select_db(0)
+    client.resp_version = 2
+    client.name = b''
+    client.no_evict = False
+    return serialize_msg('RESET', SerializedTypes.SIMPLE_STRING)
+
+
+def apply_command_from_master(tokens: list[bytes], master_conn):
+    """
+    A command of the replication stream, on a replica (replication.py). It runs like the commands of a client,
+    the master's: with its own selected database and MULTI state. It never waits (blocking pops are propagated
+    as the pops they did).
+    """
+    with blocking_disabled():
+        _run_without_yielding(handle_command(tokens, None, master_conn, now_ms()))
 
-        # Now delete the commands_in_q[addr]
-        del TRANSACTION.commands_in_q[addr]
 
-        return get_resp_array_from_elems(result)
-    if first_token == b'DISCARD':
-        TRANSACTION.discard_transaction(addr)
-        return OK_SIMPLE_STRING
+on_command_from_master(apply_command_from_master)
 
-    TRANSACTION.commands_in_q[addr].append(msg)
-    return serialize_msg('QUEUED', SerializedTypes.SIMPLE_STRING)
 
 async def handle_command(msg, addr, write_conn=None, request_recv_time_ms=None):
     """
@@ -83,10 +187,88 @@ async def handle_command(msg, addr, write_conn=None, request_recv_time_ms=None):
 
     # In transaction mode, we only queue the commands.
     # They are executed when EXEC is called.
-    if addr in TRANSACTION.clients_in_transaction_mode:
-        return await handle_command_when_in_transaction(addr, first_token, msg)
+    client = get_client_state(write_conn, addr) if write_conn is not None else None
+    # The client's database, resolved once for the whole command (see memory_management.py).
+    select_db(client.db if client is not None else 0)
+    # QUIT and RESET are not queued either: they run right away (same as redis).
+    if client is not None and client.in_multi and first_token not in (b'QUIT', b'RESET'):
+        match first_token:
+            case b'EXEC':
+                return exec_transaction(client, addr, write_conn, request_recv_time_ms)
+            case b'DISCARD':
+                discard_multi(client)
+                return OK_SIMPLE_STRING
+        return queue_command(client, tokens)
+
+    if write_conn is not None and is_subscribed(write_conn):
+        if first_token not in SUBSCRIBED_MODE_COMMANDS:
+            return serialize_msg(f"ERR Can't execute '{first_token.decode().lower()}': only (P|S)SUBSCRIBE / "
+                                 f"(P|S)UNSUBSCRIBE / PING / QUIT / RESET are allowed in this context",
+                                 SerializedTypes.ERROR)
+        if first_token == b'PING':
+            return handle_pubsub_command(first_token, tokens, write_conn)
+
+    timed = is_command_timing_on()
+    start_ns = time.perf_counter_ns() if timed else 0
+    try:
+        result = await profile_dispatch(_execute_command(first_token, tokens, addr, write_conn, request_recv_time_ms))
+    except RedisCommandError as e:
+        result = serialize_msg(str(e), SerializedTypes.ERROR)
+    finally:
+        # Set by this command only, even if it raised.
+        propagated = take_propagated_commands(tokens)
+    # Some commands reply with an error instead of raising it (INCR on a non integer ...).
+    failed = isinstance(result, bytes) and result.startswith(b'-')
+    if not failed:
+        # A command that waited (BLPOP, XREAD BLOCK ...) let other clients' commands select their database.
+        select_db(client.db if client is not None else 0)
+        _after_command(client, first_token, tokens, propagated)
+    if timed:
+        duration_ns = time.perf_counter_ns() - start_ns
+        record_command_call(first_token, duration_ns, failed)
+        spec = COMMAND_TABLE.get(first_token)
+        # The wait of a blocking command is not slow: it's just waiting for data.
+        if spec is not None and not spec.is_blocking:
+            log_if_slow(tokens, duration_ns // 1000, client)
+            add_command_latency(first_token, duration_ns // 1000)
+    else:
+        record_command_call(first_token, 0, failed)
+    flush_invalidations(client)
+    return result
 
 
+def _after_command(client, first_token, tokens, propagated: list[list[bytes]]):
+    """
+    Keyspace side effects common to all the commands that didn't fail: a write command signals the keys it
+    touched and reaches the replicas (as propagated, see replication.propagate_as), a read counts keyspace
+    hits / misses, and records the keys it read if the client has CLIENT TRACKING on.
+    """
+    spec = COMMAND_TABLE.get(first_token)
+    if spec is None:
+        return
+    if spec.is_write:
+        stat_counters['dirty'] += 1
+        for key in command_keys(spec, tokens):
+            signal_modified_key(key)
+        db = memory_management.selected_db
+        for command in propagated:
+            if _propagation_batch is not None:
+                _propagation_batch.append((db, command))
+            else:
+                propagate_write(command, db)
+    elif spec.is_readonly:
+        keys = command_keys(spec, tokens)
+        db = memory_management.redis_memstore
+        hits = sum(key in db for key in keys)
+        stat_counters['keyspace_hits'] += hits
+        stat_counters['keyspace_misses'] += len(keys) - hits
+        db.stats['keyspace_hits'] += hits
+        db.stats['keyspace_misses'] += len(keys) - hits
+        if client is not None and client.tracking:
+            track_keys(client, keys)
+
+
+async def _execute_command(first_token, tokens, addr, write_conn, request_recv_time_ms):
     match first_token:
         case b'ECHO':
             result = b' '.join(tokens[1:])
@@ -97,16 +279,11 @@ async def handle_command(msg, addr, write_conn=None, request_recv_time_ms=None):
         case b'GET':
             key = tokens[1]
             value_obj = get_from_memstore(key, request_recv_time_ms)
+            if value_obj.val_dtype not in (ValueTypes.STRING, ValueTypes.NONE):
+                raise WrongTypeOperation()
             result = value_obj.get_val_serialized()
             print("GET result:", result)
             return result
-        case b'SET':
-            key, val= tokens[1], tokens[2]
-            time_to_live_ms = None
-            if len(tokens) > 4:
-                time_to_live_ms = typecast_as_int(tokens[4])
-            set_to_memstore(key, val, request_recv_time_ms, time_to_live_ms)
-            return OK_SIMPLE_STRING
         case b'TYPE':
             key = tokens[1]
             value_obj = get_from_memstore(key, request_recv_time_ms)
@@ -120,6 +297,101 @@ async def handle_command(msg, addr, write_conn=None, request_recv_time_ms=None):
             result = serialize_msg(num, SerializedTypes.INTEGER)
             print("INCR result:", result)
             return result
+        case b'EXPIRE' | b'PEXPIRE' | b'EXPIREAT' | b'PEXPIREAT' | b'TTL' | b'PTTL' | b'EXPIRETIME' | b'PEXPIRETIME' \
+             | b'PERSIST':
+            return handle_expire_command(first_token, tokens, request_recv_time_ms)
+        case b'DEL':
+            num_deleted = sum(delete_from_memstore(key, request_recv_time_ms) for key in tokens[1:])
+            return serialize_msg(num_deleted, SerializedTypes.INTEGER)
+        case b'UNLINK':
+            # Same as DEL, but big values are reclaimed in the background (see lazy_free.py).
+            num_unlinked = sum(unlink_from_memstore(key, request_recv_time_ms) for key in tokens[1:])
+            return serialize_msg(num_unlinked, SerializedTypes.INTEGER)
+        case b'SCAN':
+            cursor, count, pattern, val_type = parse_scan_args(tokens, 1)
+            next_cursor, keys = scan_memstore(cursor, count, pattern, val_type, request_recv_time_ms)
+            return serialize_msg([str(next_cursor), keys], SerializedTypes.ARRAY)
+        case b'KEYS':
+            keys = keys_in_memstore(tokens[1], request_recv_time_ms)
+            return serialize_msg(keys, SerializedTypes.ARRAY)
+        case b'DBSIZE':
+            # dict keeps its size, O(1).
+            return serialize_msg(len(memory_management.redis_memstore), SerializedTypes.INTEGER)
+        case b'FLUSHALL' | b'FLUSHDB':
+            # FLUSHALL [ASYNC|SYNC]
+            asynchronous = len(tokens) > 1 and tokens[1].upper() == b'ASYNC'
+            flush_memstore(asynchronous, all_dbs=first_token == b'FLUSHALL')
+            return OK_SIMPLE_STRING
+        case b'QUIT':
+            # The connection is closed once the reply is written. (handle_client)
+            if write_conn is not None:
+                get_client_state(write_conn, addr).close_after_reply = True
+            return OK_SIMPLE_STRING
+        case b'RESET':
+            if write_conn is None:
+                raise RedisCommandError("ERR RESET is only available to connected clients")
+            return reset_connection(get_client_state(write_conn, addr), write_conn)
+        case b'SELECT':
+            # The database is per connection.
+            if write_conn is None:
+                raise RedisCommandError("ERR SELECT is only available to connected clients")
+            client = get_client_state(write_conn, addr)
+            client.db = parse_db_index(tokens[1])
+            select_db(client.db)
+            return OK_SIMPLE_STRING
+        case b'SWAPDB':
+            swap_dbs(parse_db_index(tokens[1]), parse_db_index(tokens[2]))
+            return OK_SIMPLE_STRING
+        case b'MOVE':
+            moved = move_key(tokens[1], parse_db_index(tokens[2]), request_recv_time_ms)
+            return serialize_msg(int(moved), SerializedTypes.INTEGER)
+
+
+        # Redis Strings (partial reads / writes) and Bitmaps
+
+        case b'SET' | b'SETEX' | b'PSETEX' | b'GETEX' | b'GETDEL' | b'APPEND' | b'SETRANGE' | b'GETRANGE' | b'STRLEN' \
+             | b'SETBIT' | b'GETBIT' | b'BITCOUNT' | b'BITPOS' | b'BITOP' | b'BITFIELD':
+            return handle_string_command(first_token, tokens, request_recv_time_ms)
+
+
+        # Redis HyperLogLogs
+
+        case b'PFADD' | b'PFCOUNT' | b'PFMERGE':
+            return handle_hyperloglog_command(first_token, tokens, request_recv_time_ms)
+
+
+        # Redis Hashes
+
+        case b'HSET' | b'HGET' | b'HMGET' | b'HDEL' | b'HINCRBY' | b'HGETALL' | b'HLEN' | b'HEXISTS' | b'HSCAN':
+            return handle_hash_command(first_token, tokens, request_recv_time_ms)
+
+
+        # Redis Lists
+
+        case b'LPUSH' | b'RPUSH' | b'LPUSHX' | b'RPUSHX' | b'LPOP' | b'RPOP' | b'LLEN' | b'LINDEX' | b'LRANGE' \
+             | b'LTRIM' | b'LMOVE' | b'BLPOP' | b'BRPOP' | b'BLMOVE':
+            return await handle_list_command(first_token, tokens, request_recv_time_ms)
+
+
+        # Redis Sets
+
+        case b'SADD' | b'SREM' | b'SISMEMBER' | b'SMISMEMBER' | b'SCARD' | b'SMEMBERS' | b'SINTER' | b'SUNION' \
+             | b'SDIFF' | b'SINTERSTORE' | b'SUNIONSTORE' | b'SDIFFSTORE' | b'SSCAN':
+            return handle_set_command(first_token, tokens, request_recv_time_ms)
+
+
+        # Redis Sorted Sets
+
+        case b'ZADD' | b'ZSCORE' | b'ZRANK' | b'ZREVRANK' | b'ZCARD' | b'ZRANGE' | b'ZREM' | b'ZREMRANGEBYSCORE' \
+             | b'ZPOPMIN' | b'BZPOPMIN':
+            return await handle_sorted_set_command(first_token, tokens, request_recv_time_ms)
+
+
+        # Pub/Sub
+
+        case b'PUBLISH' | b'SPUBLISH' | b'SUBSCRIBE' | b'UNSUBSCRIBE' | b'PSUBSCRIBE' | b'PUNSUBSCRIBE' \
+             | b'SSUBSCRIBE' | b'SUNSUBSCRIBE' | b'PUBSUB':
+            return handle_pubsub_command(first_token, tokens, write_conn)
 
 
         # Redis Streams
@@ -129,19 +401,27 @@ async def handle_command(msg, addr, write_conn=None, request_recv_time_ms=None):
             event_ts_id = tokens[2].decode()
             print(f"XADD {stream_name=} {event_ts_id=}")
             val_dict = {tokens[i]:tokens[i+1] for i in range(3,len(tokens),2)}
+            # WRONGTYPE if the key holds something else.
+            get_typed_value(stream_name, ValueTypes.STREAM, request_recv_time_ms)
             try:
                 event_ts_id = await append_stream_event(stream_name, event_ts_id, val_dict, xadd_conditions)
             except InvalidStreamEventTsId as e:
                 return serialize_msg(str(e), SerializedTypes.ERROR)
             pretty_print_stream(stream_name)
+            # With the id it got (* / <ms>-* would make the replicas pick their own).
+            propagate_as(tokens[:2] + [event_ts_id.encode()] + tokens[3:])
             return serialize_msg(event_ts_id, SerializedTypes.BULK_STRING)
         case b'XRANGE':
             stream_name = tokens[1]
             start, end = tokens[2].decode(), tokens[3].decode()
-            result = redis_memstore[stream_name].val.xrange(start, end)
+            stream = get_typed_value(stream_name, ValueTypes.STREAM, request_recv_time_ms)
+            result = stream.xrange(start, end) if stream is not None else []
             return serialize_msg(result, SerializedTypes.ARRAY)
         case b'XREAD':
             block_ms, starts, streams = parse_xread_input(tokens)
+            if not is_blocking_allowed():
+                # Inside EXEC.
+                block_ms = None
             print(f"{block_ms=}")
             # Query the memstore
             found_smth, results = await run_xread(starts, streams, xadd_conditions, block_ms)
@@ -151,28 +431,76 @@ async def handle_command(msg, addr, write_conn=None, request_recv_time_ms=None):
 
         # Redis transactions
 
-        # not adding replication support for these.
         case b'MULTI':
-            # Start a transaction for the client
-            if addr in TRANSACTION.clients_in_transaction_mode:
-                return serialize_msg(f"{addr} is already in transaction mode!!", SerializedTypes.ERROR)
-            TRANSACTION.clients_in_transaction_mode.add(addr)
-            return OK_SIMPLE_STRING
+            # Start a transaction for the client (the MULTI state is per connection).
+            if write_conn is None:
+                raise RedisCommandError("ERR MULTI is only available to connected clients")
+            return start_multi(get_client_state(write_conn, addr))
         case b'EXEC':
             # This is only possible if MULTI hasn't been called yet...
             # Return error
             return serialize_msg("ERR EXEC without MULTI", SerializedTypes.ERROR)
+        case b'WATCH' | b'UNWATCH':
+            if write_conn is None:
+                raise RedisCommandError(f"ERR {first_token.decode()} is only available to connected clients")
+            client = get_client_state(write_conn, addr)
+            if first_token == b'WATCH':
+                # Keys that are already expired are removed now, so that they can't "expire" before EXEC.
+                for key in tokens[1:]:
+                    get_from_memstore(key, request_recv_time_ms)
+                watch_keys(client, client.db, tokens[1:])
+            else:
+                unwatch_all(client)
+            return OK_SIMPLE_STRING
         case b'DISCARD':
             # This is only possibel is MULTI hasn't been called yet... (because transaction handling is done above)
             return serialize_msg("ERR DISCARD without MULTI", SerializedTypes.ERROR)
 
 
+        # Scripting
+
+        case b'EVAL' | b'EVALSHA' | b'SCRIPT':
+            # redis.call() runs the command to completion right away: the script is atomic.
+            def dispatch(script_tokens):
+                return _run_without_yielding(handle_command(script_tokens, addr, write_conn, request_recv_time_ms))
+            with blocking_disabled(), _propagated_as_one_unit():
+                return handle_scripting_command(first_token, tokens, dispatch)
+
+
+        # Server
+
+        case b'HELLO' | b'CLIENT':
+            client = get_client_state(write_conn, addr) if write_conn is not None else None
+            return handle_client_command(first_token, tokens, client)
+        case b'CONFIG':
+            sub_cmd = tokens[1].upper()
+            if sub_cmd == b'GET':
+                return serialize_msg(get_config_matching(tokens[2]), SerializedTypes.ARRAY)
+            if sub_cmd == b'SET':
+                set_config(tokens[2], tokens[3])
+                return OK_SIMPLE_STRING
+            if sub_cmd == b'RESETSTAT':
+                reset_stats()
+                reset_db_stats()
+                return OK_SIMPLE_STRING
+            raise RedisSyntaxError()
+        case b'SLOWLOG':
+            return handle_slowlog_command(tokens)
+        case b'LATENCY':
+            return handle_latency_command(tokens)
+        case b'DEBUG':
+            return handle_debug_command(tokens, request_recv_time_ms)
+        case b'MEMORY':
+            return handle_memory_command(tokens, request_recv_time_ms)
+        case b'PROFILE':
+            return handle_profile_command(tokens)
+
+
         # Redis Replication
 
         case b'INFO':
-            # Return whether I am a master or slave and some extra details.
-            info_map = get_replication_info()
-            return serialize_msg(info_map,  SerializedTypes.BULK_STRING)
+            # INFO [section ...] (the replication section says whether I am a master or slave)
+            return handle_info_command(tokens)
 
         case b'REPLCONF':
             # This command is used by the replica to send its config.
@@ -180,6 +508,10 @@ async def handle_command(msg, addr, write_conn=None, request_recv_time_ms=None):
 
             # Add the replica write_conn to list of replicas that master handles.
             add_replica_conn(write_conn)
+            if len(tokens) == 3 and tokens[1].upper() == b'ACK':
+                # "REPLCONF ACK <offset>": how far the replica got (replication lag). Acks get no reply.
+                record_replica_ack(write_conn, parse_int_token(tokens[2]))
+                return b''
             return OK_SIMPLE_STRING
 
         case b'PSYNC':
@@ -211,52 +543,100 @@ async def handle_command(msg, addr, write_conn=None, request_recv_time_ms=None):
 async def handle_client(reader, writer):
     addr = writer.get_extra_info('peername')
     print(f"Connected to {addr}")
-
-    while True:
-        data = await reader.read(MAX_MSG_LEN)
-        # VERY IMP: Note down the time the request was received (for TTL support)
-        # TO make sure the expiry time ms is calculated accurately.
-        # For SET: request_recv_time + time_to_live is set as value_obj.expiry_time
-        # For GET: request_recv_time < value_obj.expiry_time determines whether expired or not.
-        # If use some later time rather than request_recv_time, then my expiry will be inaccurate.
-        request_recv_time = get_unix_time_ms()
-        if not data:
-            # When no data, that means EOF was sent.
-            # Client has closed connection, so break out of loop.
-            print(f"Connection closed by {addr}")
-            break
-        print(f"Received from {addr}: {data}")
-        err_flag, message = parse_redis_bytes(data)
-        print(f"Parsed data: {message}")
-
-        # Note: commands are received as redis array. eg: "*2\r\n$4\r\nECHO\r\n$3\r\nhey\r\n"
-        # After parsing, this will become a list. so message is a list, not str.
-        response = await handle_command(message, addr, writer, request_recv_time)
-
-        await propagate_to_replica_if_write_cmd(data)
-
-        # Generally, the response is in bytes (the msg to send over network).
-        # However, for any reason if we have to send multiple messages in one go, then response can be a list of bytes.
-        if isinstance(response, tuple):
-            for sub_r in response:
-                writer.write(sub_r)
-        elif isinstance(response, bytes):
-            writer.write(response)
-        else:
-            raise ValueError(f"Invalid value, can't send {response} as response")
-
-        # A Replication Note.
-        # When we await writer.drain() to send RDB snapshot data to our replica as a response to PSYNC,
-        # we give up control to some other async task.
-        # Now if that async task sets some value to the master-cache (SET FOO 10),
-        # we need to propagate that cmd to our replica as well.
-        # The challenge is buffering those propagated commands, until writer.drain(rdb_file) completes.
-        # Can use asyncio.Condition.notify_all() just after writer.drain(rdb_file_data).
-        # On the green signal, the task that is buffering the commands will flush them to the replica.
+    stat_counters['total_connections_received'] += 1
+    if too_many_clients():
+        stat_counters['rejected_connections'] += 1
+        writer.write(serialize_msg("ERR max number of clients reached", SerializedTypes.ERROR))
         await writer.drain()
-
-    writer.close()
-    await writer.wait_closed()
+        writer.close()
+        await writer.wait_closed()
+        return
+    client = get_client_state(writer, addr)
+    # Received bytes not parsed yet (the start of a command split across reads).
+    buffer = bytearray()
+
+    try:
+        while True:
+            data = await reader.read(MAX_MSG_LEN)
+            # VERY IMP: Note down the time the request was received (for TTL support)
+            # TO make sure the expiry time ms is calculated accurately.
+            # For SET: request_recv_time + time_to_live is set as value_obj.expiry_time
+            # For GET: request_recv_time < value_obj.expiry_time determines whether expired or not.
+            # If use some later time rather than request_recv_time, then my expiry will be inaccurate.
+            # The server clock is read once per event loop iteration (server_clock.py).
+            request_recv_time = now_ms()
+            client.last_interaction = request_recv_time
+            if not data:
+                # When no data, that means EOF was sent.
+                # Client has closed connection, so break out of loop.
+                print(f"Connection closed by {addr}")
+                break
+            print(f"Received from {addr}: {data}")
+            stat_counters['total_net_input_bytes'] += len(data)
+            buffer += data
+            try:
+                commands, num_bytes_parsed = parse_client_commands(buffer)
+            except ValueError as e:
+                writer.write(serialize_msg(f"ERR {e}", SerializedTypes.ERROR))
+                break
+            print(f"Parsed data: {commands}")
+
+            # Pipelining: all the complete commands are run in order, and their replies are flushed together.
+            for message, _ in commands:
+                # Note: commands are received as redis array. eg: "*2\r\n$4\r\nECHO\r\n$3\r\nhey\r\n"
+                # After parsing, this will become a list. so message is a list, not str.
+                client.last_cmd = message[0]
+                client.in_command = True
+                if is_pause_active():
+                    await wait_while_paused(client, message)
+                response = await handle_command(message, addr, writer, request_recv_time)
+                client.in_command = False
+
+                # Generally, the response is in bytes (the msg to send over network).
+                # However, for any reason if we have to send multiple messages in one go, then response can be a list of bytes.
+                if isinstance(response, tuple):
+                    for sub_r in response:
+                        writer.write(sub_r)
+                        stat_counters['total_net_output_bytes'] += len(sub_r)
+                elif isinstance(response, bytes):
+                    writer.write(response)
+                    stat_counters['total_net_output_bytes'] += len(response)
+                else:
+                    raise ValueError(f"Invalid value, can't send {response} as response")
+                kind = client_type(client)
+                if is_over_output_limit(writer, kind):
+                    disconnect_over_limit(writer, kind)
+                    client.close_after_reply = True
+                elif output_buffer_size(writer) > PIPELINE_DRAIN_THRESHOLD:
+                    # Backpressure: don't run (or read) more of its commands until the client reads its replies.
+                    await writer.drain()
+                if client.close_after_reply:
+                    # CLIENT KILL: the rest of the pipeline is dropped.
+                    break
+            del buffer[:num_bytes_parsed]
+            client.query_buffer_size = len(buffer)
+
+            # A Replication Note.
+            # When we await writer.drain() to send RDB snapshot data to our replica as a response to PSYNC,
+            # we give up control to some other async task.
+            # Now if that async task sets some value to the master-cache (SET FOO 10),
+            # we need to propagate that cmd to our replica as well.
+            # The challenge is buffering those propagated commands, until writer.drain(rdb_file) completes.
+            # Can use asyncio.Condition.notify_all() just after writer.drain(rdb_file_data).
+            # On the green signal, the task that is buffering the commands will flush them to the replica.
+            await writer.drain()
+            if client.close_after_reply:
+                break
+    except ConnectionError:
+        # Reset by the client, or dropped by us (output buffer limits).
+        pass
+    finally:
+        remove_subscriber(writer)
+        remove_replica_conn(writer)
+        remove_client_state(writer)
+        writer.close()
+        with suppress(ConnectionError):
+            await writer.wait_closed()
 
 
 async def main():
@@ -264,6 +644,11 @@ async def main():
     if not args.port:
         args.port = 6379
     print(f"Server will run on port: {args.port}")
+    init_server_info(args.port)
+    if args.maxclients:
+        server_config['maxclients'] = args.maxclients
+    if args.databases:
+        init_databases(args.databases)
 
     if args.replicaof:
         # This instance is a replica.
@@ -278,8 +663,23 @@ async def main():
 
     server = await asyncio.start_server(handle_client, host='localhost', port=args.port)
     print(len(server.sockets))
-    async with server:
-        await server.serve_forever()
+    # Event loop stall probe for the latency monitor (a no-op while latency-monitor-threshold is 0).
+    loop_monitor = asyncio.create_task(monitor_event_loop())
+    # Deletes the keys that expired, even if no command reads them again (see key_expiry.py).
+    active_expire = asyncio.create_task(run_active_expire())
+    # Closes the clients idle for more than `timeout` seconds, or over their output buffer limits (config.py).
+    client_reaper = asyncio.create_task(clients_cron())
+    # Lets the server clock follow slow wall clock adjustments (see server_clock.py).
+    clock_resync = asyncio.create_task(run_clock_resync())
+    # Prometheus scrapes are served by the same event loop, between commands.
+    metrics_server = await start_metrics_server(args.metrics_port) if args.metrics_port else None
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if metrics_server is not None:
+            metrics_server.close()
+            await metrics_server.wait_closed()
 
 
 def get_args():
@@ -300,6 +700,24 @@ def get_args():
         required=False,
         help="To make this program a replica of given master"
     )
+    parser.add_argument(
+        "--maxclients",
+        type=int,
+        required=False,
+        help="Refuse connections past this many clients"
+    )
+    parser.add_argument(
+        "--databases",
+        type=int,
+        required=False,
+        help="Number of logical databases (SELECT 0 .. databases-1), 16 by default"
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        required=False,
+        help="Serve prometheus metrics on http://localhost:<metrics-port>/metrics"
+    )
 
     args = parser.parse_args()
     return args
@@ -1,14 +1,120 @@
 """
 Logic to manage the memory.
+
+Databases:
+There are server_config['databases'] logical databases (SELECT index), each one a Keyspace of its own
+(keys, expiry index, stats). redis_memstore is the database of the command being run: handle_command
+resolves the client's database once per command (select_db), and every helper here works on it without
+looking the client up again. SWAPDB swaps two entries of the databases list: O(1), whatever their sizes.
 """
 import asyncio
 from collections import defaultdict
 
-from app.errors import IncrOnStringValue
+from app import keyspace_events
+from app.client_tracking import invalidate_key, invalidate_all
+from app.config import server_config
+from app.errors import IncrOnStringValue, WrongTypeOperation, RedisCommandError
+from app.glob_pattern import compile_glob
 from app.key_value_utils import NO_EXPIRY, ValueObj, NULL_VALUE_OBJ, ValueTypes
+from app.keyspace import Keyspace
+from app.keyspace_events import notify_keyspace_event, NOTIFY_GENERIC, NOTIFY_STRING, NOTIFY_EXPIRED, NOTIFY_STREAM
+from app.lazy_free import lazy_free, lazy_free_values
+from app.redis_serialization_protocol import parse_int_token
 from app.redis_streams import RedisStream, NUM_DIGITS_TS, NUM_DIGITS_SEQ
+from app.server_stats import stat_counters
+from app.transaction import touch_watched_key, touch_all_watched_keys
+
+databases: list[Keyspace] = [Keyspace() for _ in range(server_config['databases'])]
+
+# The database selected for the command being run (see module docstring), and its index.
+redis_memstore: Keyspace[bytes, ValueObj] = databases[0]
+selected_db = 0
+
+
+def init_databases(num_databases: int):
+    """
+    --databases: called once at startup, before any data.
+    """
+    server_config['databases'] = num_databases
+    databases[:] = [Keyspace() for _ in range(num_databases)]
+    select_db(0)
+
+
+def select_db(index: int):
+    global redis_memstore, selected_db
+    redis_memstore = databases[index]
+    selected_db = index
+
+
+def parse_db_index(token: bytes) -> int:
+    index = parse_int_token(token)
+    if not 0 <= index < len(databases):
+        raise RedisCommandError("ERR DB index is out of range")
+    return index
+
+
+def swap_dbs(index1: int, index2: int):
+    """
+    SWAPDB: the clients connected to one database see the data of the other one right away.
+    """
+    databases[index1], databases[index2] = databases[index2], databases[index1]
+    select_db(selected_db)
+    # Every key of both databases may have changed.
+    invalidate_all()
+    touch_all_watched_keys((index1, index2))
 
-redis_memstore: [bytes, ValueObj] = {}
+
+def move_key(key, index: int, request_recv_time_ms) -> bool:
+    """
+    MOVE key db: only if key exists in the selected database and not in the other one. Keeps the expiry.
+    """
+    if index == selected_db:
+        raise RedisCommandError("ERR source and destination objects are the same")
+    value_obj = get_from_memstore(key, request_recv_time_ms)
+    if value_obj is NULL_VALUE_OBJ:
+        return False
+    dest = databases[index]
+    dest_value_obj = dest.get(key)
+    if dest_value_obj is not None and not is_expired(dest_value_obj, request_recv_time_ms):
+        return False
+    del redis_memstore[key]
+    dest[key] = value_obj
+    # (The source key is signaled by the command.)
+    touch_watched_key(key, index)
+    return True
+
+
+def reset_db_stats():
+    """
+    CONFIG RESETSTAT
+    """
+    for db in databases:
+        for name in db.stats:
+            db.stats[name] = 0
+
+
+def signal_modified_key(key):
+    """
+    Called for every key that was modified (by a write command, or because it expired).
+    """
+    invalidate_key(key)
+    touch_watched_key(key, selected_db)
+
+
+def is_expired(value_obj: ValueObj, request_recv_time_ms) -> bool:
+    return (value_obj.unix_expiry_ms != NO_EXPIRY) and (request_recv_time_ms > value_obj.unix_expiry_ms)
+
+
+def expire_key(key):
+    """
+    Delete a key whose expiry passed (found by a command, or by the active expire cycle).
+    """
+    del redis_memstore[key]
+    stat_counters['expired_keys'] += 1
+    redis_memstore.stats['expired_keys'] += 1
+    signal_modified_key(key)
+    if keyspace_events.notify_mask & NOTIFY_EXPIRED:
+        notify_keyspace_event(NOTIFY_EXPIRED, b'expired', key, selected_db)
 
 
 def get_from_memstore(key:bytes, request_recv_time_ms):
@@ -17,11 +123,11 @@ def get_from_memstore(key:bytes, request_recv_time_ms):
         print(f"{key=} expired")
         print(f"request time = {request_recv_time_ms}")
         print(f"expiry time = {value_obj.unix_expiry_ms}")
-        del redis_memstore[key]
+        expire_key(key)
         value_obj = NULL_VALUE_OBJ
     return value_obj
 
-def set_to_memstore(key, val, request_recv_time_ms=None, time_to_live_ms=None):
+def set_to_memstore(key, val, request_recv_time_ms=None, time_to_live_ms=None, notify=True):
     if time_to_live_ms is not None:
         expiry_time_ms = request_recv_time_ms + time_to_live_ms
     else:
@@ -29,6 +135,127 @@ def set_to_memstore(key, val, request_recv_time_ms=None, time_to_live_ms=None):
 
     val_type = ValueTypes.get_type(val)
     redis_memstore[key] = ValueObj(val=val, val_dtype=val_type, unix_expiry_ms=expiry_time_ms)
+    signal_modified_key(key)
+    if notify and keyspace_events.notify_mask & NOTIFY_STRING:
+        notify_keyspace_event(NOTIFY_STRING, b'set', key, selected_db)
+
+
+def get_typed_value(key, val_dtype: ValueTypes, request_recv_time_ms, create=None):
+    """
+    For commands that only work on one data type (HSET, LPUSH ...).
+
+    Returns the value stored at key, or None if key doesn't exist.
+    If create is given, a missing key is created with create() as its value.
+    Raises WrongTypeOperation if key holds some other data type.
+    """
+    value_obj = get_from_memstore(key, request_recv_time_ms)
+    if value_obj is NULL_VALUE_OBJ:
+        if create is None:
+            return None
+        val = create()
+        redis_memstore[key] = ValueObj(val=val, unix_expiry_ms=NO_EXPIRY, val_dtype=val_dtype)
+        return val
+    if value_obj.val_dtype != val_dtype:
+        raise WrongTypeOperation()
+    return value_obj.val
+
+def delete_key_if_empty(key, val):
+    """
+    Aggregate values (hash, list ...) are never stored empty. Removing the last element removes the key.
+    """
+    if len(val) == 0:
+        redis_memstore.pop(key, None)
+
+
+# Delete
+
+def _pop_live_value(key, request_recv_time_ms):
+    """
+    Remove key from the memstore and return its ValueObj (None if key is missing or already expired).
+    """
+    value_obj = redis_memstore.pop(key, None)
+    if value_obj is None or is_expired(value_obj, request_recv_time_ms):
+        return None
+    return value_obj
+
+def delete_from_memstore(key, request_recv_time_ms) -> bool:
+    """
+    DEL: the value is freed right here, in the calling command.
+    """
+    if _pop_live_value(key, request_recv_time_ms) is None:
+        return False
+    if keyspace_events.notify_mask & NOTIFY_GENERIC:
+        notify_keyspace_event(NOTIFY_GENERIC, b'del', key, selected_db)
+    return True
+
+def unlink_from_memstore(key, request_recv_time_ms) -> bool:
+    """
+    UNLINK: the key is removed right away, the value is reclaimed in the background.
+    """
+    value_obj = _pop_live_value(key, request_recv_time_ms)
+    if value_obj is None:
+        return False
+    lazy_free(value_obj.val)
+    if keyspace_events.notify_mask & NOTIFY_GENERIC:
+        notify_keyspace_event(NOTIFY_GENERIC, b'del', key, selected_db)
+    return True
+
+def flush_memstore(asynchronous=False, all_dbs=True):
+    """
+    FLUSHALL (every database) / FLUSHDB (the selected one).
+
+    With ASYNC, the databases are emptied right away and the old values are reclaimed in the background.
+    Note: collecting the values in a list only increments refcounts (no value is freed), which is way cheaper
+    than deallocating the values themselves.
+    """
+    for db in (databases if all_dbs else [redis_memstore]):
+        if asynchronous:
+            old_values = [value_obj.val for value_obj in db.values()]
+            db.clear()
+            lazy_free_values(old_values)
+        else:
+            db.clear()
+    invalidate_all()
+    touch_all_watched_keys(None if all_dbs else (selected_db,))
+
+
+# Enumerate keys
+
+def scan_memstore(cursor: int, count: int, pattern: bytes | None, val_type: bytes | None, request_recv_time_ms):
+    """
+    SCAN cursor [MATCH pattern] [COUNT count] [TYPE type]
+
+    Like redis, MATCH and TYPE are applied after the keys were picked,
+    so a call may return less than <count> keys (even none) while the cursor is not 0 yet.
+    """
+    next_cursor, keys = redis_memstore.scan(cursor, count)
+    glob = compile_glob(pattern) if pattern is not None else None
+    result = []
+    for key in keys:
+        if glob is not None and not glob.match(key):
+            continue
+        value_obj = redis_memstore[key]
+        if is_expired(value_obj, request_recv_time_ms):
+            continue
+        if val_type is not None and value_obj.val_dtype.value != val_type:
+            continue
+        result.append(key)
+    return next_cursor, result
+
+def keys_in_memstore(pattern: bytes, request_recv_time_ms) -> list[bytes]:
+    """
+    KEYS pattern (the glob is compiled once, see glob_pattern.py for the fast paths).
+    """
+    glob = compile_glob(pattern)
+    if glob.is_literal:
+        value_obj = redis_memstore.get(glob.literal_prefix)
+        if value_obj is None or is_expired(value_obj, request_recv_time_ms):
+            return []
+        return [glob.literal_prefix]
+    match = glob.match
+    match_all = glob.match_all()
+    return [key for key, value_obj in redis_memstore.items()
+            if (match_all or match(key)) and not is_expired(value_obj, request_recv_time_ms)]
 
 
 # Increment
@@ -37,9 +264,13 @@ def incr_in_memstore(key) -> int:
     value_obj = redis_memstore.get(key, NULL_VALUE_OBJ)
     if value_obj == NULL_VALUE_OBJ:
         # If not exists, set as 1
-        set_to_memstore(key, '1')
+        set_to_memstore(key, '1', notify=False)
+        if keyspace_events.notify_mask & NOTIFY_STRING:
+            notify_keyspace_event(NOTIFY_STRING, b'incrby', key, selected_db)
         return 1
 
+    if value_obj.val_dtype != ValueTypes.STRING:
+        raise WrongTypeOperation()
     # right now I am storing everything as string internally!
     try:
         value_obj.val = str(int(value_obj.val) + 1)
@@ -47,18 +278,31 @@ def incr_in_memstore(key) -> int:
         print(f"INCR on bad value {value_obj}")
         raise IncrOnStringValue(f"ERR value is not an integer or out of range")
 
+    signal_modified_key(key)
+    if keyspace_events.notify_mask & NOTIFY_STRING:
+        notify_keyspace_event(NOTIFY_STRING, b'incrby', key, selected_db)
     return int(value_obj.val)
 
 
 # Streams
 
-async def append_stream_event(stream_name:bytes, event_ts_id:str, val_dict, xadd_conditions: dict[bytes,asyncio.Condition]):
+# (db, stream) -> number of XREAD BLOCK waiting on its Condition (in xadd_conditions, same keys).
+# A Condition only exists while someone waits on it: the last waiter removes it.
+_xread_waiters: dict[tuple[int, bytes], int] = defaultdict(int)
+
+
+async def append_stream_event(stream_name:bytes, event_ts_id:str, val_dict,
+                              xadd_conditions: dict[tuple[int, bytes], asyncio.Condition]):
     if stream_name not in redis_memstore:
         redis_memstore[stream_name] = ValueObj(val=RedisStream(), unix_expiry_ms=NO_EXPIRY, val_dtype=ValueTypes.STREAM)
-        xadd_conditions[stream_name] = asyncio.Condition()
     event_ts_id = redis_memstore[stream_name].val.append(event_ts_id, val_dict)
-    async with xadd_conditions[stream_name]:
-        xadd_conditions[stream_name].notify_all()
+    if keyspace_events.notify_mask & NOTIFY_STREAM:
+        notify_keyspace_event(NOTIFY_STREAM, b'xadd', stream_name, selected_db)
+    # Streams are per database, like the clients blocked on them (same as blocking.py).
+    cond = xadd_conditions.get((selected_db, stream_name))
+    if cond is not None:
+        async with cond:
+            cond.notify_all()
     print(f"Appended {stream_name=} {event_ts_id=}:\n {val_dict}")
     return event_ts_id
 
@@ -69,10 +313,12 @@ def pretty_print_stream(stream_name):
     stream_obj = redis_memstore[stream_name].val
     stream_obj.pretty_print()
 
-async def run_xread(starts, streams, xadd_conditions: dict[bytes,asyncio.Condition], timeout_ms):
+async def run_xread(starts, streams, xadd_conditions: dict[tuple[int, bytes], asyncio.Condition], timeout_ms):
 
+    # The selected database changes while we wait (other clients' commands): keep ours.
+    db_index = selected_db
     # 1. first check if something is already present.
-    found_smth, results = xread_stream_storage(starts, streams)
+    found_smth, results = xread_stream_storage(starts, streams, databases[db_index])
 
     # If timeout is not set, it's non-blocking.
     if found_smth or timeout_ms is None:
@@ -83,41 +329,58 @@ async def run_xread(starts, streams, xadd_conditions: dict[bytes,asyncio.Conditi
     # Since Redis is single threaded, there is no race condition to worry about.
     print(f"xread: waiting on {streams}")
     wait_tasks = []
+    waited_on = [(db_index, stream) for stream in set(streams)]
+    for key in waited_on:
+        if key not in xadd_conditions:
+            xadd_conditions[key] = asyncio.Condition()
+        _xread_waiters[key] += 1
 
     for stream, start in zip(streams, starts):
-        cond = xadd_conditions[stream]
+        cond = xadd_conditions[db_index, stream]
 
-        async def wait_on(cond=cond):  # Use default arg to capture `cond`
+        async def wait_on(cond=cond, stream=stream, start=start):  # Use default args to capture them
             async with cond:
                 await cond.wait()
             return stream, start  # return the stream that woke us
 
         wait_tasks.append(asyncio.create_task(wait_on()))
 
-    if timeout_ms == 0:
-        # Then keep blocking till some input is received. (no timeout).
-        done, pending = await asyncio.wait(wait_tasks, return_when=asyncio.FIRST_COMPLETED)
-    else:
-        done, pending = await asyncio.wait(wait_tasks, return_when=asyncio.FIRST_COMPLETED, timeout=timeout_ms/1000)
+    try:
+        if timeout_ms == 0:
+            # Then keep blocking till some input is received. (no timeout).
+            done, pending = await asyncio.wait(wait_tasks, return_when=asyncio.FIRST_COMPLETED)
+        else:
+            done, pending = await asyncio.wait(wait_tasks, return_when=asyncio.FIRST_COMPLETED,
+                                               timeout=timeout_ms/1000)
+    finally:
+        for t in wait_tasks:
+            t.cancel()
+        for key in waited_on:
+            _xread_waiters[key] -= 1
+            if not _xread_waiters[key]:
+                del _xread_waiters[key]
+                del xadd_conditions[key]
 
     if not done:
         return False, []
 
-    for t in pending:
-        t.cancel()
-
     # Now xread only the ones that are from done to avoid unnecessary computation on others.
     completed_stream_starts = [d.result() for d in done]
     completed_streams, completed_starts = list(zip(*completed_stream_starts))
-    found_smth, results = xread_stream_storage(completed_starts, completed_streams)
+    # SWAPDB while we waited: the database index is what the client selected.
+    found_smth, results = xread_stream_storage(completed_starts, completed_streams, databases[db_index])
     return found_smth, results
 
 
-def xread_stream_storage(starts, streams):
+def xread_stream_storage(starts, streams, db):
     found_smth = False
     results = []
     for stream, start in zip(streams, starts):
-        result = redis_memstore[stream].val.xread(start)
+        value_obj = db.get(stream)
+        if value_obj is None:
+            # Not created yet (XREAD BLOCK waits for the first XADD).
+            continue
+        result = value_obj.val.xread(start)
         if result:
             found_smth = True
         results.append([stream, result])
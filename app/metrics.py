@@ -0,0 +1,195 @@
+"""
+Prometheus metrics endpoint (--metrics-port).
+
+A tiny HTTP server on the same event loop as the redis port: GET /metrics returns the text exposition
+format (version 0.0.4) of the server counters. Anything else is a 404.
+
+A scrape only reads counters that are kept up to date on the command path (server_stats.py, the sizes of
+a few registries, the expiry index and stats of every database): it never walks the keys, so scraping a big
+dataset costs the same as scraping an empty one.
+
+Latency histograms are exported with power of two buckets in seconds (le="0.000001", "0.000002", ...),
+the same buckets as LATENCY HISTOGRAM.
+"""
+import asyncio
+
+from app import info, lazy_free
+from app.blocking import num_blocked_clients
+from app.client_state import _client_states
+from app.latency_histogram import LatencyHistogram
+from app.latency_monitor import _events
+from app.memory_management import databases
+from app.pubsub import _channels, _patterns
+from app.replication import get_replication_info, get_replica_lags
+from app.server_stats import stat_counters, command_stats, command_histograms
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# A client has this long to send its request (headers included).
+REQUEST_TIMEOUT_S = 10
+
+# stat_counters name -> (metric name, help). All of them only go up (until CONFIG RESETSTAT).
+_COUNTERS = {
+    'total_connections_received': ('redis_connections_received_total', "Connections accepted"),
+    'rejected_connections': ('redis_rejected_connections_total', "Connections refused because of maxclients"),
+    'total_commands_processed': ('redis_commands_processed_total', "Commands processed"),
+    'total_net_input_bytes': ('redis_net_input_bytes_total', "Bytes read from clients"),
+    'total_net_output_bytes': ('redis_net_output_bytes_total', "Bytes written to clients"),
+    'expired_keys': ('redis_expired_keys_total', "Keys deleted because their expiry passed"),
+    'evicted_keys': ('redis_evicted_keys_total', "Keys evicted because of maxmemory"),
+    'keyspace_hits': ('redis_keyspace_hits_total', "Key lookups of read commands that found the key"),
+    'keyspace_misses': ('redis_keyspace_misses_total', "Key lookups of read commands that didn't find the key"),
+    'total_error_replies': ('redis_error_replies_total', "Error replies sent"),
+    'client_output_buffer_limit_disconnections': ('redis_client_output_buffer_limit_disconnections_total',
+                                                  "Clients disconnected because of their output buffer limits"),
+}
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + '}'
+
+
+def _add_metric(lines: list[str], name: str, metric_type: str, help_text: str, samples):
+    """
+    samples: (labels dict, value) pairs
+    """
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {metric_type}")
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(labels)} {value}")
+
+
+def _add_histograms(lines: list[str], name: str, help_text: str, histograms: list[tuple[dict, LatencyHistogram]]):
+    """
+    Microsecond histograms, as one prometheus histogram in seconds.
+    """
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for labels, histogram in histograms:
+        cumulative = dict(histogram.power_of_two_buckets())
+        count = 0
+        upper_us = 1
+        # Every power of two up to the largest one used, so that the le values are stable between scrapes.
+        while cumulative and upper_us <= max(cumulative):
+            count = cumulative.get(upper_us, count)
+            lines.append(f"{name}_bucket{_labels({**labels, 'le': f'{upper_us / 1e6:g}'})} {count}")
+            upper_us *= 2
+        lines.append(f"{name}_bucket{_labels({**labels, 'le': '+Inf'})} {histogram.total}")
+        lines.append(f"{name}_sum{_labels(labels)} {histogram.sum / 1e6}")
+        lines.append(f"{name}_count{_labels(labels)} {histogram.total}")
+
+
+def render_metrics() -> str:
+    lines = []
+    for counter_name, (name, help_text) in _COUNTERS.items():
+        _add_metric(lines, name, 'counter', help_text, [({}, stat_counters[counter_name])])
+
+    stats = sorted(command_stats().items())
+    _add_metric(lines, 'redis_commands_total', 'counter', "Calls per command",
+                [({'cmd': cmd.decode().lower()}, calls) for cmd, (calls, _, _) in stats])
+    _add_metric(lines, 'redis_commands_failed_total', 'counter', "Calls per command that replied with an error",
+                [({'cmd': cmd.decode().lower()}, failed) for cmd, (_, _, failed) in stats])
+    _add_metric(lines, 'redis_commands_duration_seconds_total', 'counter',
+                "Time spent running each command (0 unless command timing is on, see server_stats.py)",
+                [({'cmd': cmd.decode().lower()}, duration_ns / 1e9) for cmd, (_, duration_ns, _) in stats])
+    _add_histograms(lines, 'redis_command_latency_seconds', "Latency of each command (latency-tracking)",
+                    [({'cmd': cmd.decode().lower()}, histogram)
+                     for cmd, histogram in sorted(command_histograms().items())])
+    _add_histograms(lines, 'redis_latency_event_seconds', "Latency events above latency-monitor-threshold",
+                    [({'event': event_name}, event.histogram_us) for event_name, event in sorted(_events.items())])
+
+    _add_metric(lines, 'redis_connected_clients', 'gauge', "Connected clients", [({}, len(_client_states))])
+    _add_metric(lines, 'redis_blocked_clients', 'gauge', "Clients waiting in a blocking command",
+                [({}, num_blocked_clients())])
+    _add_metric(lines, 'redis_pubsub_channels', 'gauge', "Channels with subscribers", [({}, len(_channels))])
+    _add_metric(lines, 'redis_pubsub_patterns', 'gauge', "Subscribed patterns", [({}, len(_patterns))])
+
+    # Every database, even empty ones: a series that disappears looks like a scrape failure.
+    dbs = [({'db': f'db{index}'}, db) for index, db in enumerate(databases)]
+    _add_metric(lines, 'redis_db_keys', 'gauge', "Keys in the database", [(labels, len(db)) for labels, db in dbs])
+    _add_metric(lines, 'redis_db_keys_expiring', 'gauge', "Keys with an expiry",
+                [(labels, len(db.expires)) for labels, db in dbs])
+    for name in ('keyspace_hits', 'keyspace_misses', 'expired_keys'):
+        _add_metric(lines, f'redis_db_{name}_total', 'counter', f"{name} of the database (INFO stats: all of them)",
+                    [(labels, db.stats[name]) for labels, db in dbs])
+
+    rss = info._rss_bytes()
+    _add_metric(lines, 'redis_memory_used_bytes', 'gauge', "Resident set size of the server",
+                [({}, rss)])
+    _add_metric(lines, 'redis_memory_peak_bytes', 'gauge', "Peak resident set size of the server",
+                [({}, max(info._peak_rss_bytes(), rss))])
+    _add_metric(lines, 'redis_lazyfree_pending_objects', 'gauge', "Values waiting to be freed in the background",
+                [({}, lazy_free.lazyfree_pending_objects)])
+
+    replication = get_replication_info()
+    _add_metric(lines, 'redis_instance_info', 'gauge', "Role of this instance", [({'role': replication['role']}, 1)])
+    if replication['role'] == 'master':
+        _add_metric(lines, 'redis_connected_slaves', 'gauge', "Connected replicas",
+                    [({}, replication['connected_slaves'])])
+        _add_metric(lines, 'redis_master_repl_offset', 'gauge', "Bytes written to the replication stream",
+                    [({}, replication.get('master_repl_offset', 0))])
+        lags = get_replica_lags()
+        _add_metric(lines, 'redis_replica_lag_bytes', 'gauge', "Replication stream bytes not acked by the replica",
+                    [({'replica': addr}, lag_bytes) for addr, _, lag_bytes, _ in lags])
+        _add_metric(lines, 'redis_replica_last_ack_seconds', 'gauge', "Seconds since the last ack of the replica",
+                    [({'replica': addr}, round(lag_seconds, 3)) for addr, _, _, lag_seconds in lags])
+    else:
+        _add_metric(lines, 'redis_master_link_up', 'gauge', "1 if the connection to the master is up",
+                    [({}, int(replication['master_link_status'] == 'up'))])
+        _add_metric(lines, 'redis_slave_repl_offset', 'gauge', "Bytes of the replication stream processed",
+                    [({}, replication['slave_repl_offset'])])
+
+    # No RDB / AOF (see INFO persistence).
+    _add_metric(lines, 'redis_rdb_changes_since_last_save', 'gauge', "Writes since the last save",
+                [({}, stat_counters['dirty'])])
+    _add_metric(lines, 'redis_rdb_bgsave_in_progress', 'gauge', "1 while a background save runs", [({}, 0)])
+    _add_metric(lines, 'redis_aof_enabled', 'gauge', "1 if the append only file is on", [({}, 0)])
+    _add_metric(lines, 'redis_start_time_seconds', 'gauge', "Start time of the server, unix time",
+                [({}, int(info._start_time))])
+    return '\n'.join(lines) + '\n'
+
+
+def _http_response(status: str, body: bytes, content_type: str) -> bytes:
+    headers = f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n" \
+              f"Connection: close\r\n\r\n"
+    return headers.encode() + body
+
+
+async def _read_request_line(reader: asyncio.StreamReader) -> bytes:
+    request_line = await reader.readline()
+    # The headers don't matter, read them up to the blank line.
+    while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+        pass
+    return request_line
+
+
+async def handle_metrics_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await asyncio.wait_for(_read_request_line(reader), REQUEST_TIMEOUT_S)
+        parts = request_line.split()
+        if len(parts) >= 2 and parts[0] in (b'GET', b'HEAD') and parts[1].split(b'?')[0] == b'/metrics':
+            body = render_metrics().encode()
+            response = _http_response('200 OK', body, CONTENT_TYPE)
+            if parts[0] == b'HEAD':
+                response = response[:len(response) - len(body)]
+        else:
+            response = _http_response('404 Not Found', b'Not Found\n', 'text/plain')
+        writer.write(response)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError, ValueError):
+        # Slow or broken clients, too long lines (asyncio.LimitOverrunError is a ValueError).
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(port: int) -> asyncio.Server:
+    server = await asyncio.start_server(handle_metrics_client, host='localhost', port=port)
+    print(f"Metrics served on http://localhost:{port}/metrics")
+    return server
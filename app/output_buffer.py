@@ -0,0 +1,67 @@
+"""
+Output buffer limits: one slow reader must not grow the server's memory without bound.
+
+Replies, pub/sub messages and the replication stream are written to the client's transport without waiting
+for the client to read them. What it hasn't read yet stays in the transport's write buffer.
+Every client class (normal, replica, pubsub) has limits on that buffer (config.py), like redis'
+client-output-buffer-limit:
+    hard limit: the client is disconnected as soon as its buffer is over it.
+    soft limit + seconds: the client is disconnected if its buffer stays over the soft limit for that long.
+0 disables a limit.
+
+Below the limits, handle_client applies backpressure: while a client's buffer is over the transport's high
+water mark it waits for it to drain before running more of its commands, so it stops reading that client.
+"""
+from app.config import server_config
+from app.server_clock import now_ms
+from app.server_stats import stat_counters
+
+# class -> (hard limit, soft limit, soft seconds) config keys
+_LIMIT_CONFIGS = {
+    kind: (f'client-output-buffer-limit-{kind}', f'client-output-buffer-limit-{kind}-soft',
+           f'client-output-buffer-limit-{kind}-soft-seconds')
+    for kind in ('normal', 'replica', 'pubsub')
+}
+
+# writer -> server clock time (s) since when its buffer is over the soft limit
+_over_soft_limit_since: dict[object, float] = {}
+
+
+def output_buffer_size(writer) -> int:
+    transport = getattr(writer, 'transport', None)
+    return transport.get_write_buffer_size() if transport is not None else 0
+
+
+def is_over_output_limit(writer, kind: str, pending: int = 0) -> bool:
+    """
+    True if writer (a client of class kind) must be disconnected, once pending more bytes are written.
+    """
+    hard_key, soft_key, seconds_key = _LIMIT_CONFIGS[kind]
+    hard, soft = server_config[hard_key], server_config[soft_key]
+    if not hard and not soft:
+        return False
+    size = output_buffer_size(writer) + pending
+    if hard and size > hard:
+        return True
+    if soft and size > soft:
+        now = now_ms() / 1000
+        since = _over_soft_limit_since.setdefault(writer, now)
+        return now - since > server_config[seconds_key]
+    _over_soft_limit_since.pop(writer, None)
+    return False
+
+
+def disconnect_over_limit(writer, kind: str):
+    """
+    Drop the connection right away: its buffered output is discarded.
+    """
+    print(f"Disconnecting {kind} client: output buffer of {output_buffer_size(writer)} bytes over the limits")
+    stat_counters['client_output_buffer_limit_disconnections'] += 1
+    forget_writer(writer)
+    transport = getattr(writer, 'transport', None)
+    if transport is not None:
+        transport.abort()
+
+
+def forget_writer(writer):
+    _over_soft_limit_since.pop(writer, None)
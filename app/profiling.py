@@ -0,0 +1,240 @@
+"""
+Profile the live server, without restarting it under a profiler.
+
+PROFILE START [CPROFILE | SAMPLING] [SECONDS n | DISPATCHES n] [EVERY k] [INTERVAL ms]
+PROFILE STOP
+PROFILE STATUS
+
+CPROFILE (default): cProfile is enabled around the commands themselves (handle_command dispatches).
+    With EVERY k, only one dispatch out of k is profiled (per command sampling: the overhead of cProfile
+    is only paid on the sampled commands). Output: a pstats file (python -m pstats <file>).
+    A command that waits (BLPOP, XREAD BLOCK ...) is only profiled while it runs: the profiler is off while
+    it waits and the other clients' commands run (each one counted and sampled on its own).
+SAMPLING: a thread looks at the stack of the event loop thread every INTERVAL ms (default 5), and counts
+    the stacks it sees. The event loop itself runs at full speed (the thread holds the GIL only while it
+    copies one stack). Sees everything: commands, replication, the event loop itself.
+    Output: collapsed stacks ("frame;frame;frame count" lines), the input of flamegraph.pl / speedscope.
+
+The profile runs for SECONDS n (default 10), or for DISPATCHES n commands, or until PROFILE STOP,
+and is written to profile-dir (config.py). PROFILE STOP and STATUS return the path of the file.
+Profiling is off by default: the only cost on the command path is checking that no profile is running.
+"""
+import asyncio
+import cProfile
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from app.config import server_config
+from app.errors import RedisCommandError, RedisSyntaxError
+from app.redis_serialization_protocol import serialize_msg, SerializedTypes, OK_SIMPLE_STRING, parse_int_token
+
+DEFAULT_PROFILE_SECONDS = 10
+DEFAULT_SAMPLING_INTERVAL_MS = 5
+
+
+class _ProfileSession:
+
+    def __init__(self, mode: str, path: str, max_dispatches: int | None, every: int):
+        self.mode = mode
+        self.path = path
+        self.max_dispatches = max_dispatches
+        self.every = every
+        self.num_dispatches = 0
+        self.num_profiled = 0
+        self.profiler = cProfile.Profile() if mode == 'cprofile' else None
+        self.sampler: _StackSampler | None = None
+        self.timer: asyncio.TimerHandle | None = None
+
+
+class _StackSampler(threading.Thread):
+
+    def __init__(self, target_thread_id: int, interval_s: float):
+        super().__init__(name='stack-sampler', daemon=True)
+        self.target_thread_id = target_thread_id
+        self.interval_s = interval_s
+        self.stacks: Counter[str] = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval_s):
+            frame = sys._current_frames().get(self.target_thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+
+_session: _ProfileSession | None = None
+# Path of the last profile written.
+_last_output: str | None = None
+
+
+# Set while a dispatch runs (in the task of its client): the commands it runs itself (EXEC, scripts) are part of
+# it, not dispatches of their own.
+_in_dispatch: contextvars.ContextVar[bool] = contextvars.ContextVar('in_dispatch', default=False)
+
+
+def profile_dispatch(coro):
+    """
+    Called with the coroutine of every command: returns what to await to run it (the coroutine itself if no
+    profile is running).
+    """
+    session = _session
+    if session is None or _in_dispatch.get():
+        return coro
+    session.num_dispatches += 1
+    if session.mode == 'sampling':
+        # The sampler sees the commands on its own, only DISPATCHES n needs counting.
+        if session.max_dispatches is not None and session.num_dispatches >= session.max_dispatches:
+            stop_profile()
+        return coro
+    profiled = (session.num_dispatches - 1) % session.every == 0
+    if profiled:
+        session.num_profiled += 1
+    return _Dispatch(coro, session, profiled)
+
+
+class _Dispatch:
+    """
+    Runs the coroutine of a command one step at a time (between two awaits that wait), with _in_dispatch set,
+    and the profiler enabled if the command is profiled.
+    """
+
+    def __init__(self, coro, session: _ProfileSession, profiled: bool):
+        self.coro = coro
+        self.session = session
+        self.profiled = profiled
+
+    def __await__(self):
+        coro, session = self.coro, self.session
+        send, value = coro.send, None
+        try:
+            while True:
+                # PROFILE STOP may have been run while the command was waiting.
+                profiler = session.profiler if self.profiled and _session is session else None
+                token = _in_dispatch.set(True)
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    waiting_on = send(value)
+                except StopIteration as e:
+                    return e.value
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+                    _in_dispatch.reset(token)
+                try:
+                    value = yield waiting_on
+                    send = coro.send
+                except GeneratorExit:
+                    coro.close()
+                    raise
+                except BaseException as e:
+                    # Cancelled (the client disconnected ...): the command handles it.
+                    send, value = coro.throw, e
+        finally:
+            if _session is session and session.max_dispatches is not None \
+                    and session.num_dispatches >= session.max_dispatches:
+                stop_profile()
+
+
+def start_profile(mode: str, seconds: float | None, max_dispatches: int | None, every: int, interval_ms: float):
+    global _session
+    if _session is not None:
+        raise RedisCommandError("ERR a profile is already running, PROFILE STOP it first")
+    extension = 'pstats' if mode == 'cprofile' else 'collapsed'
+    path = os.path.join(server_config['profile-dir'],
+                        f"profile-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.{extension}")
+    session = _ProfileSession(mode, path, max_dispatches, every)
+    if mode == 'sampling':
+        session.sampler = _StackSampler(threading.get_ident(), interval_ms / 1000)
+        session.sampler.start()
+    if seconds is not None:
+        try:
+            session.timer = asyncio.get_running_loop().call_later(seconds, stop_profile)
+        except RuntimeError:
+            # No event loop (tests): only DISPATCHES / PROFILE STOP end the profile.
+            pass
+    _session = session
+
+
+def stop_profile() -> str | None:
+    global _session, _last_output
+    session = _session
+    if session is None:
+        return None
+    _session = None
+    if session.timer is not None:
+        session.timer.cancel()
+    if session.profiler is not None:
+        session.profiler.disable()
+        session.profiler.dump_stats(session.path)
+    else:
+        session.sampler.stopped.set()
+        session.sampler.join()
+        with open(session.path, 'w') as f:
+            for stack, count in session.sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+    print(f"Profile written to {session.path}")
+    _last_output = session.path
+    return session.path
+
+
+def _parse_start(tokens) -> tuple:
+    mode, seconds, max_dispatches, every, interval_ms = 'cprofile', None, None, 1, DEFAULT_SAMPLING_INTERVAL_MS
+    i = 2
+    while i < len(tokens):
+        option = tokens[i].upper()
+        if option in (b'CPROFILE', b'SAMPLING'):
+            mode = option.decode().lower()
+            i += 1
+            continue
+        if i + 1 >= len(tokens):
+            raise RedisSyntaxError()
+        value = parse_int_token(tokens[i + 1])
+        if value <= 0:
+            raise RedisCommandError(f"ERR {option.decode()} must be positive")
+        match option:
+            case b'SECONDS':
+                seconds = value
+            case b'DISPATCHES':
+                max_dispatches = value
+            case b'EVERY':
+                every = value
+            case b'INTERVAL':
+                interval_ms = value
+            case _:
+                raise RedisSyntaxError()
+        i += 2
+    if seconds is None and max_dispatches is None:
+        seconds = DEFAULT_PROFILE_SECONDS
+    return mode, seconds, max_dispatches, every, interval_ms
+
+
+def handle_profile_command(tokens):
+    sub_cmd = tokens[1].upper()
+    match sub_cmd:
+        case b'START':
+            start_profile(*_parse_start(tokens))
+            return OK_SIMPLE_STRING
+        case b'STOP':
+            path = stop_profile()
+            if path is None:
+                raise RedisCommandError("ERR no profile is running")
+            return serialize_msg(path, SerializedTypes.BULK_STRING)
+        case b'STATUS':
+            session = _session
+            if session is None:
+                status = f"running:0\r\nlast_output:{_last_output or ''}"
+            else:
+                status = f"running:1\r\nmode:{session.mode}\r\noutput:{session.path}\r\n" \
+                         f"dispatches:{session.num_dispatches}\r\nprofiled_dispatches:{session.num_profiled}"
+            return serialize_msg(status, SerializedTypes.BULK_STRING)
+    raise RedisSyntaxError()
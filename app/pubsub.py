@@ -0,0 +1,280 @@
+"""
+Pub/Sub.
+
+SUBSCRIBE channel [channel ...]         UNSUBSCRIBE [channel ...]
+PSUBSCRIBE pattern [pattern ...]        PUNSUBSCRIBE [pattern ...]
+SSUBSCRIBE shardchannel [...]           SUNSUBSCRIBE [shardchannel ...]
+PUBLISH channel message
+SPUBLISH shardchannel message
+PUBSUB CHANNELS [pattern] | NUMSUB [channel ...] | NUMPAT | SHARDCHANNELS [pattern] | SHARDNUMSUB [channel ...]
+
+
+Fan-out:
+PUBLISH serializes the message frame once (one frame per matching pattern for pmessage),
+and writes the very same bytes object to every subscriber's transport. No per-subscriber work except write().
+
+Patterns:
+Instead of matching the channel against every subscribed pattern, the patterns are stored in a trie keyed by their
+literal prefix ("news.*" is stored under "news."). Publishing walks the trie along the channel name,
+and only the patterns found on that path (ie: whose literal prefix is a prefix of the channel) are candidates.
+Candidates that are just "prefix*" match without any further check, the others are matched with their compiled glob.
+
+Slow subscribers:
+Writes never wait for the subscriber to read. If a subscriber's transport has buffered more than
+the pubsub output buffer limits allow (output_buffer.py), the connection is dropped and its buffer freed,
+instead of letting one slow reader grow the server's memory without bound.
+
+Shard channels:
+There is a single shard (no cluster), so SPUBLISH delivers to the SSUBSCRIBE subscribers of the shard channel,
+which live in their own namespace (separate from the SUBSCRIBE channels) and get "smessage" frames.
+"""
+from app.errors import RedisCommandError, RedisSyntaxError
+from app.glob_pattern import compile_glob, GlobPattern
+from app.output_buffer import is_over_output_limit, disconnect_over_limit
+from app.redis_serialization_protocol import serialize_msg, SerializedTypes, get_resp_array_from_elems, \
+    NULL_BULK_STRING
+
+# The only commands a client can run while it has subscriptions (RESP2).
+SUBSCRIBED_MODE_COMMANDS = frozenset({b'SUBSCRIBE', b'UNSUBSCRIBE', b'PSUBSCRIBE', b'PUNSUBSCRIBE', b'SSUBSCRIBE',
+                                      b'SUNSUBSCRIBE', b'PING', b'QUIT', b'RESET'})
+
+
+class Subscriber:
+    __slots__ = ('writer', 'channels', 'patterns', 'shard_channels')
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.channels: set[bytes] = set()
+        self.patterns: set[bytes] = set()
+        self.shard_channels: set[bytes] = set()
+
+    def num_subscriptions(self) -> int:
+        return len(self.channels) + len(self.patterns)
+
+    def send(self, frame: bytes) -> bool:
+        """
+        Write frame to the subscriber, False if it was disconnected because its output buffer is full.
+        """
+        if is_over_output_limit(self.writer, 'pubsub', len(frame)):
+            remove_subscriber(self.writer)
+            disconnect_over_limit(self.writer, 'pubsub')
+            return False
+        self.writer.write(frame)
+        return True
+
+
+class _TrieNode:
+    __slots__ = ('children', 'patterns')
+
+    def __init__(self):
+        self.children: dict[int, _TrieNode] = {}
+        # pattern -> compiled glob, for the patterns whose literal prefix ends at this node.
+        self.patterns: dict[bytes, GlobPattern] = {}
+
+
+class PatternTrie:
+
+    def __init__(self):
+        self._root = _TrieNode()
+
+    def add(self, pattern: bytes):
+        glob = compile_glob(pattern)
+        node = self._root
+        for byte in glob.literal_prefix:
+            node = node.children.setdefault(byte, _TrieNode())
+        node.patterns[pattern] = glob
+
+    def remove(self, pattern: bytes):
+        path = [self._root]
+        prefix = compile_glob(pattern).literal_prefix
+        for byte in prefix:
+            node = path[-1].children.get(byte)
+            if node is None:
+                return
+            path.append(node)
+        path[-1].patterns.pop(pattern, None)
+        # Prune the nodes that lead nowhere anymore.
+        for depth in range(len(prefix), 0, -1):
+            node = path[depth]
+            if node.patterns or node.children:
+                break
+            del path[depth - 1].children[prefix[depth - 1]]
+
+    def matching(self, channel: bytes) -> list[bytes]:
+        matches = []
+        node = self._root
+        depth = 0
+        while node is not None:
+            for pattern, glob in node.patterns.items():
+                # The trie already checked the literal prefix.
+                if glob.is_prefix_only or glob.match(channel):
+                    matches.append(pattern)
+            if depth == len(channel):
+                break
+            node = node.children.get(channel[depth])
+            depth += 1
+        return matches
+
+
+_subscribers: dict[object, Subscriber] = {}
+# channel -> subscribers (dicts used as insertion ordered sets)
+_channels: dict[bytes, dict[Subscriber, None]] = {}
+_patterns: dict[bytes, dict[Subscriber, None]] = {}
+_shard_channels: dict[bytes, dict[Subscriber, None]] = {}
+_pattern_trie = PatternTrie()
+
+
+def is_subscribed(writer) -> bool:
+    subscriber = _subscribers.get(writer)
+    return subscriber is not None and bool(subscriber.num_subscriptions() or subscriber.shard_channels)
+
+
+def _get_subscriber(writer) -> Subscriber:
+    if writer is None:
+        raise RedisCommandError("ERR Pub/Sub is only available to connected clients")
+    subscriber = _subscribers.get(writer)
+    if subscriber is None:
+        subscriber = _subscribers[writer] = Subscriber(writer)
+    return subscriber
+
+
+def _subscription_frame(kind: bytes, name: bytes | None, count: int) -> bytes:
+    return get_resp_array_from_elems([
+        serialize_msg(kind, SerializedTypes.BULK_STRING),
+        NULL_BULK_STRING if name is None else serialize_msg(name, SerializedTypes.BULK_STRING),
+        serialize_msg(count, SerializedTypes.INTEGER),
+    ])
+
+
+def _message_frame(*elems: bytes) -> bytes:
+    return get_resp_array_from_elems([serialize_msg(e, SerializedTypes.BULK_STRING) for e in elems])
+
+
+def _subscribe(subscriber: Subscriber, names, own: set, registry: dict, kind: bytes, count_of) -> bytes:
+    reply = b''
+    for name in names:
+        if name not in own:
+            own.add(name)
+            if name not in registry:
+                registry[name] = {}
+                if registry is _patterns:
+                    _pattern_trie.add(name)
+            registry[name][subscriber] = None
+        reply += _subscription_frame(kind, name, count_of(subscriber))
+    return reply
+
+
+def _unsubscribe(subscriber: Subscriber, names, own: set, registry: dict, kind: bytes, count_of) -> bytes:
+    # No names: unsubscribe from everything.
+    names = list(names or own)
+    if not names:
+        return _subscription_frame(kind, None, count_of(subscriber))
+    reply = b''
+    for name in names:
+        if name in own:
+            own.remove(name)
+            subscribers = registry[name]
+            del subscribers[subscriber]
+            if not subscribers:
+                del registry[name]
+                if registry is _patterns:
+                    _pattern_trie.remove(name)
+        reply += _subscription_frame(kind, name, count_of(subscriber))
+    return reply
+
+
+def remove_subscriber(writer):
+    """
+    Drop all the subscriptions of a connection (on disconnect).
+    """
+    subscriber = _subscribers.pop(writer, None)
+    if subscriber is None:
+        return
+    count = Subscriber.num_subscriptions
+    _unsubscribe(subscriber, None, subscriber.channels, _channels, b'unsubscribe', count)
+    _unsubscribe(subscriber, None, subscriber.patterns, _patterns, b'punsubscribe', count)
+    _unsubscribe(subscriber, None, subscriber.shard_channels, _shard_channels, b'sunsubscribe', count)
+
+
+def publish(channel: bytes, message: bytes) -> int:
+    receivers = 0
+    subscribers = _channels.get(channel)
+    if subscribers:
+        frame = _message_frame(b'message', channel, message)
+        # list(): a send can disconnect a subscriber (and modify the dict).
+        for subscriber in list(subscribers):
+            receivers += subscriber.send(frame)
+    if _patterns:
+        for pattern in _pattern_trie.matching(channel):
+            subscribers = _patterns.get(pattern)
+            if not subscribers:
+                continue
+            frame = _message_frame(b'pmessage', pattern, channel, message)
+            for subscriber in list(subscribers):
+                receivers += subscriber.send(frame)
+    return receivers
+
+
+def spublish(shard_channel: bytes, message: bytes) -> int:
+    subscribers = _shard_channels.get(shard_channel)
+    if not subscribers:
+        return 0
+    frame = _message_frame(b'smessage', shard_channel, message)
+    return sum(subscriber.send(frame) for subscriber in list(subscribers))
+
+
+def _names_matching(registry: dict, pattern: bytes | None) -> list[bytes]:
+    if pattern is None:
+        return list(registry)
+    glob = compile_glob(pattern)
+    return [name for name in registry if glob.match(name)]
+
+
+def _numsub(registry: dict, names) -> bytes:
+    elems = []
+    for name in names:
+        elems.append(serialize_msg(name, SerializedTypes.BULK_STRING))
+        elems.append(serialize_msg(len(registry.get(name, ())), SerializedTypes.INTEGER))
+    return get_resp_array_from_elems(elems)
+
+
+def handle_pubsub_command(first_token, tokens, writer):
+    match first_token:
+        case b'PUBLISH':
+            return serialize_msg(publish(tokens[1], tokens[2]), SerializedTypes.INTEGER)
+        case b'SPUBLISH':
+            return serialize_msg(spublish(tokens[1], tokens[2]), SerializedTypes.INTEGER)
+        case b'SUBSCRIBE' | b'UNSUBSCRIBE':
+            subscriber = _get_subscriber(writer)
+            func = _subscribe if first_token == b'SUBSCRIBE' else _unsubscribe
+            return func(subscriber, tokens[1:], subscriber.channels, _channels, first_token.lower(),
+                        Subscriber.num_subscriptions)
+        case b'PSUBSCRIBE' | b'PUNSUBSCRIBE':
+            subscriber = _get_subscriber(writer)
+            func = _subscribe if first_token == b'PSUBSCRIBE' else _unsubscribe
+            return func(subscriber, tokens[1:], subscriber.patterns, _patterns, first_token.lower(),
+                        Subscriber.num_subscriptions)
+        case b'SSUBSCRIBE' | b'SUNSUBSCRIBE':
+            subscriber = _get_subscriber(writer)
+            func = _subscribe if first_token == b'SSUBSCRIBE' else _unsubscribe
+            return func(subscriber, tokens[1:], subscriber.shard_channels, _shard_channels, first_token.lower(),
+                        lambda s: len(s.shard_channels))
+        case b'PUBSUB':
+            sub_cmd = tokens[1].upper()
+            match sub_cmd:
+                case b'CHANNELS' | b'SHARDCHANNELS':
+                    registry = _channels if sub_cmd == b'CHANNELS' else _shard_channels
+                    pattern = tokens[2] if len(tokens) > 2 else None
+                    return serialize_msg(_names_matching(registry, pattern), SerializedTypes.ARRAY)
+                case b'NUMSUB':
+                    return _numsub(_channels, tokens[2:])
+                case b'SHARDNUMSUB':
+                    return _numsub(_shard_channels, tokens[2:])
+                case b'NUMPAT':
+                    return serialize_msg(len(_patterns), SerializedTypes.INTEGER)
+            raise RedisSyntaxError()
+        case b'PING':
+            # PING in subscribed mode.
+            return _message_frame(b'pong', tokens[1] if len(tokens) > 1 else b'')
+        case _:
+            raise RedisSyntaxError()
@@ -0,0 +1,230 @@
+"""
+Hashes: key -> {field: value}
+
+HSET key field value [field value ...]
+HGET key field
+HMGET key field [field ...]
+HDEL key field [field ...]
+HINCRBY key field increment
+HGETALL key
+HLEN key
+HEXISTS key field
+HSCAN key cursor [MATCH pattern] [COUNT count]
+
+
+Encodings (same idea as redis):
+
+1. listpack: most hashes in practice are small objects (a user profile with 5-10 fields).
+A python dict has a lot of fixed overhead for that (hash table + index array, sized for growth),
+so small hashes are stored as a single flat list: [field1, value1, field2, value2, ...]
+Lookups are a linear scan, but list.index() runs in C, so for small hashes it's cheap.
+It is a memory/cpu tradeoff: roughly half the memory of the hashtable encoding,
+lookups get slower as the hash grows (numbers: python -m benchmarks.bench_hash_encoding).
+
+2. hashtable: a real dict. A hash is converted (one way, never back) once it has more than
+hash-max-listpack-entries fields, or once any field/value is longer than hash-max-listpack-value bytes.
+Both thresholds are in config.py.
+"""
+from app.config import server_config
+from app.errors import RedisCommandError, RedisSyntaxError, NotAnInteger
+from app.glob_pattern import compile_glob
+from app.key_value_utils import ValueTypes
+from app.keyspace import ScannableDict, parse_scan_args
+from app.memory_management import get_typed_value, delete_key_if_empty
+from app.redis_serialization_protocol import serialize_msg, SerializedTypes, parse_int_token, NULL_BULK_STRING
+
+ENCODING_LISTPACK = 'listpack'
+ENCODING_HASHTABLE = 'hashtable'
+
+_INT64_MIN, _INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+class RedisHash:
+
+    def __init__(self):
+        # listpack encoding: flat [field, value, field, value ...] list.
+        self._listpack: list | None = []
+        # hashtable encoding.
+        self._dict: ScannableDict | None = None
+
+    @property
+    def encoding(self):
+        return ENCODING_LISTPACK if self._dict is None else ENCODING_HASHTABLE
+
+    def __len__(self):
+        if self._dict is None:
+            return len(self._listpack) // 2
+        return len(self._dict)
+
+    def _find_field(self, field) -> int:
+        """
+        Index of field in the listpack, -1 if not present.
+        list.index() may also hit a value that happens to be equal to field (odd index), keep searching after it.
+        """
+        lp = self._listpack
+        pos = 0
+        while True:
+            try:
+                pos = lp.index(field, pos)
+            except ValueError:
+                return -1
+            if pos % 2 == 0:
+                return pos
+            pos += 1
+
+    def _convert_to_hashtable(self):
+        lp = self._listpack
+        self._dict = ScannableDict()
+        for i in range(0, len(lp), 2):
+            self._dict[lp[i]] = lp[i + 1]
+        self._listpack = None
+
+    def set(self, field, val) -> bool:
+        """
+        return True if field is new.
+        """
+        if self._dict is None:
+            max_len = server_config['hash-max-listpack-value']
+            if len(field) > max_len or len(val) > max_len:
+                self._convert_to_hashtable()
+            else:
+                pos = self._find_field(field)
+                if pos != -1:
+                    self._listpack[pos + 1] = val
+                    return False
+                if len(self) >= server_config['hash-max-listpack-entries']:
+                    self._convert_to_hashtable()
+                else:
+                    self._listpack.extend((field, val))
+                    return True
+        is_new = field not in self._dict
+        self._dict[field] = val
+        return is_new
+
+    def get(self, field):
+        if self._dict is None:
+            pos = self._find_field(field)
+            return None if pos == -1 else self._listpack[pos + 1]
+        return self._dict.get(field)
+
+    def delete(self, field) -> bool:
+        if self._dict is None:
+            pos = self._find_field(field)
+            if pos == -1:
+                return False
+            del self._listpack[pos:pos + 2]
+            return True
+        return self._dict.pop(field, None) is not None
+
+    def incrby(self, field, increment: int) -> int:
+        """
+        Values and increments are int64, like redis: the result can't overflow.
+        """
+        if not _INT64_MIN <= increment <= _INT64_MAX:
+            raise NotAnInteger()
+        cur = self.get(field)
+        try:
+            num = int(cur) if cur is not None else 0
+        except ValueError:
+            raise RedisCommandError("ERR hash value is not an integer")
+        if not _INT64_MIN <= num <= _INT64_MAX:
+            raise RedisCommandError("ERR hash value is not an integer")
+        num += increment
+        if not _INT64_MIN <= num <= _INT64_MAX:
+            raise RedisCommandError("ERR increment or decrement would overflow")
+        self.set(field, str(num).encode())
+        return num
+
+    def flat_items(self) -> list:
+        """
+        [field1, value1, field2, value2 ...] (HGETALL reply).
+        """
+        if self._dict is None:
+            return list(self._listpack)
+        result = []
+        for field, val in self._dict.items():
+            result.extend((field, val))
+        return result
+
+    def scan(self, cursor: int, count: int, pattern: bytes | None) -> tuple[int, list]:
+        """
+        Like redis, a listpack is small enough to be returned in one go (cursor 0).
+        A hashtable is scanned incrementally using its ScanCursorIndex.
+        """
+        if self._dict is None:
+            next_cursor, items = 0, self.flat_items()
+        else:
+            next_cursor, fields = self._dict.scan(cursor, count)
+            items = []
+            for field in fields:
+                items.extend((field, self._dict[field]))
+        if pattern is not None:
+            glob = compile_glob(pattern)
+            items = [x for i in range(0, len(items), 2) if glob.match(items[i]) for x in items[i:i + 2]]
+        return next_cursor, items
+
+    def dismantle(self):
+        """
+        For lazy free.
+        """
+        if self._dict is not None:
+            items, pop = self._dict, self._dict.popitem
+        else:
+            items, pop = self._listpack, self._listpack.pop
+        self._listpack, self._dict = [], None
+        while items:
+            pop()
+            yield
+
+
+######################################################################################################
+# Commands
+
+
+def handle_hash_command(first_token, tokens, request_recv_time_ms):
+    key = tokens[1]
+    match first_token:
+        case b'HSET':
+            if len(tokens) < 4 or len(tokens) % 2 != 0:
+                raise RedisCommandError("ERR wrong number of arguments for 'hset' command")
+            h = get_typed_value(key, ValueTypes.HASH, request_recv_time_ms, create=RedisHash)
+            num_new = sum(h.set(tokens[i], tokens[i + 1]) for i in range(2, len(tokens), 2))
+            return serialize_msg(num_new, SerializedTypes.INTEGER)
+        case b'HGET':
+            h = get_typed_value(key, ValueTypes.HASH, request_recv_time_ms)
+            val = h.get(tokens[2]) if h is not None else None
+            if val is None:
+                return NULL_BULK_STRING
+            return serialize_msg(val, SerializedTypes.BULK_STRING)
+        case b'HMGET':
+            h = get_typed_value(key, ValueTypes.HASH, request_recv_time_ms)
+            vals = [h.get(field) if h is not None else None for field in tokens[2:]]
+            return serialize_msg(vals, SerializedTypes.ARRAY)
+        case b'HDEL':
+            h = get_typed_value(key, ValueTypes.HASH, request_recv_time_ms)
+            if h is None:
+                return serialize_msg(0, SerializedTypes.INTEGER)
+            num_deleted = sum(h.delete(field) for field in tokens[2:])
+            delete_key_if_empty(key, h)
+            return serialize_msg(num_deleted, SerializedTypes.INTEGER)
+        case b'HINCRBY':
+            increment = parse_int_token(tokens[3])
+            h = get_typed_value(key, ValueTypes.HASH, request_recv_time_ms, create=RedisHash)
+            return serialize_msg(h.incrby(tokens[2], increment), SerializedTypes.INTEGER)
+        case b'HGETALL':
+            h = get_typed_value(key, ValueTypes.HASH, request_recv_time_ms)
+            return serialize_msg(h.flat_items() if h is not None else [], SerializedTypes.ARRAY)
+        case b'HLEN':
+            h = get_typed_value(key, ValueTypes.HASH, request_recv_time_ms)
+            return serialize_msg(len(h) if h is not None else 0, SerializedTypes.INTEGER)
+        case b'HEXISTS':
+            h = get_typed_value(key, ValueTypes.HASH, request_recv_time_ms)
+            exists = h is not None and h.get(tokens[2]) is not None
+            return serialize_msg(int(exists), SerializedTypes.INTEGER)
+        case b'HSCAN':
+            cursor, count, pattern, _ = parse_scan_args(tokens, 2, allow_type=False)
+            h = get_typed_value(key, ValueTypes.HASH, request_recv_time_ms)
+            next_cursor, items = h.scan(cursor, count, pattern) if h is not None else (0, [])
+            return serialize_msg([str(next_cursor), items], SerializedTypes.ARRAY)
+        case _:
+            raise RedisSyntaxError()
@@ -0,0 +1,521 @@
+"""
+HyperLogLog (count unique elements in 12KB max, with a ~0.81% standard error).
+
+PFADD key [element ...]
+PFCOUNT key [key ...]
+PFMERGE destkey [sourcekey ...]
+
+
+Same format as redis, so the values can be moved from / to a real redis with GET / SET:
+the HyperLogLog is a plain string value,
+
+    | 'HYLL' | encoding (1 byte) | 3 unused bytes | cached cardinality (8 bytes, little endian) | registers |
+
+16384 registers (the first 14 bits of the 64 bit MurmurHash64A of the element select the register,
+the register keeps the max "number of trailing zeros + 1" of the other 50 bits).
+
+Encodings:
+1. dense: 6 bits per register, packed (12288 bytes).
+2. sparse: run length encoded registers, for HyperLogLogs with few elements (most registers are 0):
+   ZERO 00xxxxxx:            xxxxxx + 1 registers set to 0 (1-64)
+   XZERO 01xxxxxx yyyyyyyy:  xxxxxxyyyyyyyy + 1 registers set to 0 (1-16384)
+   VAL 1vvvvvxx:             xx + 1 registers set to vvvvv + 1 (value 1-32, run 1-4)
+   Converted to dense when a register goes above 32, or it grows past hll-sparse-max-bytes. (config.py)
+   PFADD patches the opcode holding each register in place (see _sparse_set()), small batches never unpack
+   the sparse registers.
+
+Cached cardinality: PFCOUNT saves its result in the header, PFADD only invalidates it (most significant bit
+of the last byte) when a register actually changes. So PFCOUNT on a key that wasn't modified is O(1).
+
+Whole array operations:
+The registers are unpacked to one byte per register with bytes slicing + bytes.translate() (C loops),
+PFMERGE takes the max of all the registers at once with big int arithmetic (see _registers_max()),
+and PFADD hashes the whole batch of elements first, then updates each register once.
+"""
+import math
+import struct
+from itertools import groupby
+
+from app.config import server_config
+from app.errors import WrongTypeOperation
+from app.key_value_utils import ValueTypes, ValueObj, NO_EXPIRY, NULL_VALUE_OBJ
+from app import memory_management
+from app.memory_management import get_from_memstore
+from app.redis_serialization_protocol import serialize_msg, SerializedTypes, OK_SIMPLE_STRING
+from app.redis_strings import get_mutable_string
+
+HLL_P = 14
+HLL_Q = 64 - HLL_P
+HLL_REGISTERS = 1 << HLL_P
+HLL_REGISTER_MAX = (1 << 6) - 1
+HLL_DENSE_SIZE = HLL_REGISTERS * 6 // 8
+HLL_HDR_SIZE = 16
+HLL_DENSE = 0
+HLL_SPARSE = 1
+HLL_SPARSE_VAL_MAX_VALUE = 32
+HLL_SPARSE_VAL_MAX_LEN = 4
+HLL_SPARSE_ZERO_MAX_LEN = 64
+HLL_SPARSE_XZERO_MAX_LEN = 16384
+HLL_ALPHA_INF = 0.721347520444481703680
+
+_MAGIC = b'HYLL'
+_CARD_INVALID_BIT = 0x80
+
+
+class InvalidHyperLogLog(WrongTypeOperation):
+    def __init__(self, msg="WRONGTYPE Key is not a valid HyperLogLog string value."):
+        super().__init__(msg)
+
+
+######################################################################################################
+# Hashing
+
+
+_MURMUR_M = 0xc6a4a7935bd1e995
+_MURMUR_SEED = 0xadc83b19
+_MASK64 = (1 << 64) - 1
+
+
+def murmurhash64a(data: bytes, seed: int = _MURMUR_SEED) -> int:
+    """
+    MurmurHash64A, the hash redis uses for HyperLogLogs (same output, so registers match).
+    """
+    length = len(data)
+    h = (seed ^ (length * _MURMUR_M)) & _MASK64
+    num_blocks = length >> 3
+    for k in struct.unpack_from(f'<{num_blocks}Q', data):
+        k = (k * _MURMUR_M) & _MASK64
+        k ^= k >> 47
+        k = (k * _MURMUR_M) & _MASK64
+        h ^= k
+        h = (h * _MURMUR_M) & _MASK64
+    tail = data[num_blocks << 3:]
+    if tail:
+        h ^= int.from_bytes(tail, 'little')
+        h = (h * _MURMUR_M) & _MASK64
+    h ^= h >> 47
+    h = (h * _MURMUR_M) & _MASK64
+    h ^= h >> 47
+    return h
+
+
+def register_updates(elements) -> dict[int, int]:
+    """
+    Hash a batch of elements -> {register index: max count for that register}
+    """
+    updates = {}
+    for element in elements:
+        h = murmurhash64a(element)
+        index = h & (HLL_REGISTERS - 1)
+        # The sentinel bit at HLL_Q bounds the count to HLL_Q + 1.
+        h = (h >> HLL_P) | (1 << HLL_Q)
+        count = (h & -h).bit_length()
+        if count > updates.get(index, 0):
+            updates[index] = count
+    return updates
+
+
+######################################################################################################
+# Registers: packed dense <-> one byte per register
+
+
+def _table(f) -> bytes:
+    return bytes(f(b) & 0xff for b in range(256))
+
+
+_LOW6 = _table(lambda b: b & 63)
+_SHR2 = _table(lambda b: b >> 2)
+_SHR4 = _table(lambda b: b >> 4)
+_SHR6 = _table(lambda b: b >> 6)
+_SHL2 = _table(lambda b: b << 2)
+_LOW2_SHL4 = _table(lambda b: (b & 3) << 4)
+_LOW2_SHL6 = _table(lambda b: (b & 3) << 6)
+_LOW4_SHL2 = _table(lambda b: (b & 15) << 2)
+_LOW4_SHL4 = _table(lambda b: (b & 15) << 4)
+
+
+def _or(a: bytes, b: bytes) -> bytes:
+    return (int.from_bytes(a, 'little') | int.from_bytes(b, 'little')).to_bytes(len(a), 'little')
+
+
+def unpack_dense(dense) -> bytearray:
+    """
+    12288 bytes of 6 bit registers -> 16384 bytes, one per register.
+    Every 3 bytes hold 4 registers: r0 = b0[0:6], r1 = b0[6:8] + b1[0:4], r2 = b1[4:8] + b2[0:2], r3 = b2[2:8]
+    """
+    dense = bytes(dense)
+    b0, b1, b2 = dense[0::3], dense[1::3], dense[2::3]
+    registers = bytearray(HLL_REGISTERS)
+    registers[0::4] = b0.translate(_LOW6)
+    registers[1::4] = _or(b0.translate(_SHR6), b1.translate(_LOW4_SHL2))
+    registers[2::4] = _or(b1.translate(_SHR4), b2.translate(_LOW2_SHL4))
+    registers[3::4] = b2.translate(_SHR2)
+    return registers
+
+
+def pack_dense(registers) -> bytearray:
+    registers = bytes(registers)
+    r0, r1, r2, r3 = registers[0::4], registers[1::4], registers[2::4], registers[3::4]
+    dense = bytearray(HLL_DENSE_SIZE)
+    dense[0::3] = _or(r0, r1.translate(_LOW2_SHL6))
+    dense[1::3] = _or(r1.translate(_SHR2), r2.translate(_LOW4_SHL4))
+    dense[2::3] = _or(r2.translate(_SHR4), r3.translate(_SHL2))
+    return dense
+
+
+def _get_dense_register(buf, index) -> int:
+    byte, fb = HLL_HDR_SIZE + index * 6 // 8, index * 6 & 7
+    val = buf[byte] >> fb
+    if fb > 2:
+        val |= buf[byte + 1] << (8 - fb)
+    return val & HLL_REGISTER_MAX
+
+
+def _set_dense_register(buf: bytearray, index, val):
+    byte, fb = HLL_HDR_SIZE + index * 6 // 8, index * 6 & 7
+    buf[byte] = (buf[byte] & ~(HLL_REGISTER_MAX << fb) & 0xff) | ((val << fb) & 0xff)
+    if fb > 2:
+        buf[byte + 1] = (buf[byte + 1] & ~(HLL_REGISTER_MAX >> (8 - fb)) & 0xff) | (val >> (8 - fb))
+
+
+_LANES_HIGH_BITS = int.from_bytes(b'\x80' * HLL_REGISTERS, 'little')
+
+
+def _registers_max(a: bytes, b: bytes) -> bytes:
+    """
+    Per register max of two unpacked register arrays, without a python loop over the registers:
+    setting the high bit of every byte of a, then subtracting b, leaves the high bit set exactly in the bytes
+    where a >= b (registers are < 64, so no byte borrows from its neighbour).
+    """
+    x, y = int.from_bytes(a, 'little'), int.from_bytes(b, 'little')
+    a_ge_b = ((x | _LANES_HIGH_BITS) - y) & _LANES_HIGH_BITS
+    mask = (a_ge_b >> 7) * 0xff
+    return ((x & mask) | (y & ~mask)).to_bytes(HLL_REGISTERS, 'little')
+
+
+######################################################################################################
+# Sparse encoding
+
+
+def unpack_sparse(sparse) -> bytearray:
+    registers = bytearray()
+    i, n = 0, len(sparse)
+    while i < n:
+        op = sparse[i]
+        if op & 0xc0 == 0:
+            registers += bytes((op & 0x3f) + 1)
+            i += 1
+        elif op & 0xc0 == 0x40:
+            if i + 1 >= n:
+                raise InvalidHyperLogLog()
+            registers += bytes((((op & 0x3f) << 8) | sparse[i + 1]) + 1)
+            i += 2
+        else:
+            registers += bytes((((op >> 2) & 0x1f) + 1,)) * ((op & 3) + 1)
+            i += 1
+    if len(registers) != HLL_REGISTERS:
+        raise InvalidHyperLogLog()
+    return registers
+
+
+def _append_run(out: bytearray, val, run_len):
+    """
+    Encode run_len registers set to val (<= 32) at the end of out.
+    """
+    while run_len:
+        if val == 0:
+            if run_len > HLL_SPARSE_ZERO_MAX_LEN:
+                chunk = min(run_len, HLL_SPARSE_XZERO_MAX_LEN)
+                out += bytes((0x40 | ((chunk - 1) >> 8), (chunk - 1) & 0xff))
+            else:
+                chunk = run_len
+                out.append(chunk - 1)
+        else:
+            chunk = min(run_len, HLL_SPARSE_VAL_MAX_LEN)
+            out.append(0x80 | ((val - 1) << 2) | (chunk - 1))
+        run_len -= chunk
+
+
+def pack_sparse(registers) -> bytes | None:
+    """
+    None if some register can't be represented (> 32).
+    """
+    out = bytearray()
+    for val, run in groupby(registers):
+        if val > HLL_SPARSE_VAL_MAX_VALUE:
+            return None
+        _append_run(out, val, sum(1 for _ in run))
+    return bytes(out)
+
+
+def _sparse_op(sparse, i) -> tuple[int, int, int]:
+    """
+    The opcode at sparse[i] -> (register value, number of registers, opcode size in bytes)
+    """
+    op = sparse[i]
+    if op & 0xc0 == 0:
+        return 0, (op & 0x3f) + 1, 1
+    if op & 0xc0 == 0x40:
+        if i + 1 >= len(sparse):
+            raise InvalidHyperLogLog()
+        return 0, (((op & 0x3f) << 8) | sparse[i + 1]) + 1, 2
+    return ((op >> 2) & 0x1f) + 1, (op & 3) + 1, 1
+
+
+# Registers covered by a one byte opcode (ZERO or VAL).
+_SPARSE_RUN_LEN = bytes((op & 0x3f) + 1 if op < 0x80 else (op & 3) + 1 for op in range(256))
+
+
+def _sparse_set(buf: bytearray, index, count) -> bool | None:
+    """
+    Raise register index of the sparse HyperLogLog in buf to count, in place (like redis hllSparseSet()):
+    only the opcode holding the register is rewritten, merged with the opcodes around it, the rest of the
+    registers are never unpacked. True if the register changed, None if count doesn't fit a sparse register.
+    """
+    i, first, prev, end = HLL_HDR_SIZE, 0, None, len(buf)
+    # Find the opcode holding the register: skip whole opcodes, decoding only their lengths.
+    while i < end:
+        op = buf[i]
+        if op & 0xc0 == 0x40:
+            if i + 1 == end:
+                raise InvalidHyperLogLog()
+            run_len, size = (((op & 0x3f) << 8) | buf[i + 1]) + 1, 2
+        else:
+            run_len, size = _SPARSE_RUN_LEN[op], 1
+        if first + run_len > index:
+            break
+        prev = i
+        first += run_len
+        i += size
+    else:
+        raise InvalidHyperLogLog()
+    val = ((op >> 2) & 0x1f) + 1 if op & 0x80 else 0
+    if count <= val:
+        return False
+    if count > HLL_SPARSE_VAL_MAX_VALUE:
+        return None
+    # The run split around the register, between its neighbours (merged with them when they hold the same value).
+    runs = [(val, index - first), (count, 1), (val, first + run_len - index - 1)]
+    start, end = i, i + size
+    if prev is not None:
+        start = prev
+        runs.insert(0, _sparse_op(buf, prev)[:2])
+    if end < len(buf):
+        next_val, next_len, next_size = _sparse_op(buf, end)
+        runs.append((next_val, next_len))
+        end += next_size
+    out = bytearray()
+    run_val, run_len = runs[0]
+    for val, n in runs[1:]:
+        if val == run_val:
+            run_len += n
+        else:
+            _append_run(out, run_val, run_len)
+            run_val, run_len = val, n
+    _append_run(out, run_val, run_len)
+    buf[start:end] = out
+    return True
+
+
+######################################################################################################
+# The string value
+
+
+def _header(encoding, cardinality=None) -> bytes:
+    card = (cardinality or 0).to_bytes(8, 'little')
+    if cardinality is None:
+        card = card[:7] + bytes((_CARD_INVALID_BIT,))
+    return _MAGIC + bytes((encoding, 0, 0, 0)) + card
+
+
+def new_hll() -> bytearray:
+    return bytearray(_header(HLL_SPARSE, 0) + pack_sparse(bytes(HLL_REGISTERS)))
+
+
+def _validate(buf):
+    if len(buf) < HLL_HDR_SIZE or buf[:4] != _MAGIC or buf[4] not in (HLL_DENSE, HLL_SPARSE):
+        raise InvalidHyperLogLog()
+    if buf[4] == HLL_DENSE and len(buf) != HLL_HDR_SIZE + HLL_DENSE_SIZE:
+        raise InvalidHyperLogLog()
+
+
+def registers_of(buf) -> bytearray:
+    _validate(buf)
+    if buf[4] == HLL_DENSE:
+        return unpack_dense(memoryview(buf)[HLL_HDR_SIZE:])
+    return unpack_sparse(buf[HLL_HDR_SIZE:])
+
+
+def encode_registers(registers, cardinality=None) -> bytes:
+    """
+    The smallest encoding that fits: sparse if possible, dense otherwise.
+    """
+    sparse = pack_sparse(registers)
+    if sparse is not None and HLL_HDR_SIZE + len(sparse) <= server_config['hll-sparse-max-bytes']:
+        return _header(HLL_SPARSE, cardinality) + sparse
+    return _header(HLL_DENSE, cardinality) + pack_dense(registers)
+
+
+def _cached_cardinality(buf) -> int | None:
+    if buf[15] & _CARD_INVALID_BIT:
+        return None
+    return int.from_bytes(buf[8:16], 'little')
+
+
+def _invalidate_cache(buf: bytearray):
+    buf[15] |= _CARD_INVALID_BIT
+
+
+# Above this many registers to update, unpacking the sparse registers once beats walking the opcodes for each.
+_SPARSE_SET_MAX_UPDATES = 32
+
+
+def _sparse_add(buf: bytearray, updates: dict[int, int]) -> bool:
+    if len(updates) <= _SPARSE_SET_MAX_UPDATES:
+        changed = False
+        for index, count in updates.items():
+            patched = _sparse_set(buf, index, count)
+            if patched is None:
+                break
+            changed |= patched
+        else:
+            if len(buf) > server_config['hll-sparse-max-bytes']:
+                buf[:] = encode_registers(unpack_sparse(buf[HLL_HDR_SIZE:]))
+            return changed
+    registers = unpack_sparse(buf[HLL_HDR_SIZE:])
+    changed = False
+    for index, count in updates.items():
+        if count > registers[index]:
+            registers[index] = count
+            changed = True
+    if changed:
+        # Promoted to dense if it doesn't fit sparse anymore.
+        buf[:] = encode_registers(registers)
+    return changed
+
+
+def hll_add(buf: bytearray, elements) -> bool:
+    """
+    Add elements to the HyperLogLog in buf (in place). True if at least one register changed.
+    """
+    _validate(buf)
+    updates = register_updates(elements)
+    changed = False
+    if buf[4] == HLL_DENSE:
+        for index, count in updates.items():
+            if count > _get_dense_register(buf, index):
+                _set_dense_register(buf, index, count)
+                changed = True
+    else:
+        changed = _sparse_add(buf, updates)
+    if changed:
+        _invalidate_cache(buf)
+    return changed
+
+
+######################################################################################################
+# Cardinality estimation (same estimator as redis: "New cardinality estimation algorithms for HyperLogLog
+# sketches", Otmar Ertl)
+
+
+def _tau(x: float) -> float:
+    if x == 0. or x == 1.:
+        return 0.
+    y, z = 1.0, 1 - x
+    while True:
+        x = math.sqrt(x)
+        z_prev = z
+        y *= 0.5
+        z -= (1 - x) ** 2 * y
+        if z_prev == z:
+            return z / 3
+
+
+def _sigma(x: float) -> float:
+    if x == 1.:
+        return math.inf
+    y, z = 1.0, x
+    while True:
+        x *= x
+        z_prev = z
+        z += x * y
+        y += y
+        if z_prev == z:
+            return z
+
+
+def estimate_cardinality(registers) -> int:
+    registers = bytes(registers)
+    histogram = [registers.count(v) for v in range(HLL_Q + 2)]
+    m = HLL_REGISTERS
+    z = m * _tau((m - histogram[HLL_Q + 1]) / m)
+    for j in range(HLL_Q, 0, -1):
+        z += histogram[j]
+        z *= 0.5
+    z += m * _sigma(histogram[0] / m)
+    return round(HLL_ALPHA_INF * m * m / z)
+
+
+######################################################################################################
+# Commands
+
+
+def _get_hll(key, request_recv_time_ms):
+    """
+    The string at key (bytes or bytearray), None if missing.
+    """
+    value_obj = get_from_memstore(key, request_recv_time_ms)
+    if value_obj is NULL_VALUE_OBJ:
+        return None
+    if value_obj.val_dtype != ValueTypes.STRING or isinstance(value_obj.val, str):
+        raise InvalidHyperLogLog()
+    _validate(value_obj.val)
+    return value_obj.val
+
+
+def handle_hyperloglog_command(first_token, tokens, request_recv_time_ms):
+    match first_token:
+        case b'PFADD':
+            key = tokens[1]
+            created = _get_hll(key, request_recv_time_ms) is None
+            if created:
+                memory_management.redis_memstore[key] = ValueObj(val=new_hll(), unix_expiry_ms=NO_EXPIRY,
+                                                                 val_dtype=ValueTypes.STRING)
+            buf = get_mutable_string(key, request_recv_time_ms)
+            changed = hll_add(buf, tokens[2:])
+            return serialize_msg(int(created or changed), SerializedTypes.INTEGER)
+        case b'PFCOUNT':
+            if len(tokens) == 2:
+                buf = _get_hll(tokens[1], request_recv_time_ms)
+                if buf is None:
+                    return serialize_msg(0, SerializedTypes.INTEGER)
+                cardinality = _cached_cardinality(buf)
+                if cardinality is None:
+                    cardinality = estimate_cardinality(registers_of(buf))
+                    buf = get_mutable_string(tokens[1], request_recv_time_ms)
+                    buf[8:16] = cardinality.to_bytes(8, 'little')
+                return serialize_msg(cardinality, SerializedTypes.INTEGER)
+            # Several keys: the cardinality of their union, nothing is cached.
+            merged = bytes(HLL_REGISTERS)
+            for key in tokens[1:]:
+                buf = _get_hll(key, request_recv_time_ms)
+                if buf is not None:
+                    merged = _registers_max(merged, registers_of(buf))
+            return serialize_msg(estimate_cardinality(merged), SerializedTypes.INTEGER)
+        case b'PFMERGE':
+            dest_key = tokens[1]
+            merged = bytes(HLL_REGISTERS)
+            # The destination is part of the merge (redis semantics).
+            for key in tokens[1:]:
+                buf = _get_hll(key, request_recv_time_ms)
+                if buf is not None:
+                    merged = _registers_max(merged, registers_of(buf))
+            dest = memory_management.redis_memstore.get(dest_key)
+            value = bytearray(encode_registers(merged))
+            if dest is not None and dest.val_dtype == ValueTypes.STRING:
+                # Keep the TTL of the destination.
+                dest.val = value
+            else:
+                memory_management.redis_memstore[dest_key] = ValueObj(val=value, unix_expiry_ms=NO_EXPIRY,
+                                                                      val_dtype=ValueTypes.STRING)
+            return OK_SIMPLE_STRING
@@ -0,0 +1,390 @@
+"""
+Lists (work queues).
+
+LPUSH/RPUSH key element [element ...]
+LPOP/RPOP key [count]
+LRANGE key start stop
+LLEN key
+LINDEX key index
+LTRIM key start stop
+LMOVE source destination LEFT|RIGHT LEFT|RIGHT
+BLPOP/BRPOP key [key ...] timeout
+BLMOVE source destination LEFT|RIGHT LEFT|RIGHT timeout
+
+
+Storage: quicklist (same idea as redis).
+
+A python list (or deque) of bytes costs a full python object per element (~33 bytes of header + 8 bytes pointer)
+on top of the payload. For long queues of small jobs that's most of the memory.
+
+Instead the list is a deque of chunks, every chunk is a packed bytearray of elements plus an array of their lengths:
+
+deque:  [chunk1] <-> [chunk2] <-> [chunk3]
+chunk:  buf = b'job1job22job333', lens = [4, 5, 6]
+
+Chunks are bounded (list-max-listpack-size in config.py, same meaning as in redis:
+negative -> max bytes per chunk (-1: 4kb ... -5: 64kb), positive -> max elements per chunk).
+So push/pop at either end only touches one small chunk (memmove of a few kb at worst),
+and LINDEX/LRANGE skip over whole chunks using their element count, without looking at the elements.
+"""
+from array import array
+from collections import deque
+
+from app.blocking import block_on_keys, signal_key_as_ready
+from app.config import server_config
+from app.errors import RedisSyntaxError, RedisCommandError
+from app.key_value_utils import ValueTypes
+from app.memory_management import get_typed_value, delete_key_if_empty
+from app.redis_serialization_protocol import serialize_msg, SerializedTypes, parse_int_token, NULL_BULK_STRING, \
+    NULL_ARRAY
+from app.replication import propagate_as, also_propagate
+
+_CHUNK_BYTES_FOR_NEGATIVE_SIZE = {-1: 4096, -2: 8192, -3: 16384, -4: 32768, -5: 65536}
+
+
+def _chunk_has_room(chunk: '_ListChunk', elem: bytes) -> bool:
+    size_limit = server_config['list-max-listpack-size']
+    if size_limit > 0:
+        return len(chunk) < size_limit
+    max_bytes = _CHUNK_BYTES_FOR_NEGATIVE_SIZE.get(size_limit, 8192)
+    return len(chunk.buf) + len(elem) <= max_bytes
+
+
+class _ListChunk:
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.lens = array('I')
+
+    def __len__(self):
+        return len(self.lens)
+
+    def _offset(self, i):
+        return sum(self.lens[:i])
+
+    def append(self, elem: bytes):
+        self.buf += elem
+        self.lens.append(len(elem))
+
+    def appendleft(self, elem: bytes):
+        self.buf[0:0] = elem
+        self.lens.insert(0, len(elem))
+
+    def pop(self) -> bytes:
+        n = self.lens.pop()
+        start = len(self.buf) - n
+        elem = bytes(self.buf[start:])
+        del self.buf[start:]
+        return elem
+
+    def popleft(self) -> bytes:
+        n = self.lens.pop(0)
+        elem = bytes(self.buf[:n])
+        del self.buf[:n]
+        return elem
+
+    def get(self, i) -> bytes:
+        start = self._offset(i)
+        return bytes(self.buf[start:start + self.lens[i]])
+
+    def slice(self, i, j) -> list[bytes]:
+        """
+        Elements [i, j)
+        """
+        result = []
+        pos = self._offset(i)
+        buf = self.buf
+        for n in self.lens[i:j]:
+            result.append(bytes(buf[pos:pos + n]))
+            pos += n
+        return result
+
+    def keep(self, i, j):
+        """
+        Keep only elements [i, j)
+        """
+        start, end = self._offset(i), self._offset(j)
+        del self.buf[end:]
+        del self.buf[:start]
+        self.lens = self.lens[i:j]
+
+
+class RedisList:
+
+    def __init__(self):
+        self._chunks: deque[_ListChunk] = deque()
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    @property
+    def num_chunks(self):
+        return len(self._chunks)
+
+    def push_right(self, elem: bytes):
+        if not self._chunks or not _chunk_has_room(self._chunks[-1], elem):
+            self._chunks.append(_ListChunk())
+        self._chunks[-1].append(elem)
+        self._len += 1
+
+    def push_left(self, elem: bytes):
+        if not self._chunks or not _chunk_has_room(self._chunks[0], elem):
+            self._chunks.appendleft(_ListChunk())
+        self._chunks[0].appendleft(elem)
+        self._len += 1
+
+    def pop_right(self) -> bytes | None:
+        if not self._len:
+            return None
+        chunk = self._chunks[-1]
+        elem = chunk.pop()
+        if not len(chunk):
+            self._chunks.pop()
+        self._len -= 1
+        return elem
+
+    def pop_left(self) -> bytes | None:
+        if not self._len:
+            return None
+        chunk = self._chunks[0]
+        elem = chunk.popleft()
+        if not len(chunk):
+            self._chunks.popleft()
+        self._len -= 1
+        return elem
+
+    def _normalize_range(self, start, stop) -> tuple[int, int]:
+        """
+        Redis style inclusive (start, stop), negative indexes count from the end.
+        return python style [start, stop) clamped to the list, (0, 0) if empty.
+        """
+        if start < 0:
+            start += self._len
+        if stop < 0:
+            stop += self._len
+        start = max(start, 0)
+        stop = min(stop, self._len - 1)
+        if start > stop:
+            return 0, 0
+        return start, stop + 1
+
+    def _locate(self, index) -> tuple[int, int]:
+        """
+        (chunk number, index within chunk) of the element at index (0 <= index < len).
+        Walk from the nearer end, skipping whole chunks.
+        """
+        if index < self._len // 2:
+            for chunk_no, chunk in enumerate(self._chunks):
+                if index < len(chunk):
+                    return chunk_no, index
+                index -= len(chunk)
+        else:
+            from_end = self._len - 1 - index
+            for chunk_no in range(len(self._chunks) - 1, -1, -1):
+                chunk = self._chunks[chunk_no]
+                if from_end < len(chunk):
+                    return chunk_no, len(chunk) - 1 - from_end
+                from_end -= len(chunk)
+        raise IndexError(index)
+
+    def index(self, index) -> bytes | None:
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            return None
+        chunk_no, i = self._locate(index)
+        return self._chunks[chunk_no].get(i)
+
+    def range(self, start, stop) -> list[bytes]:
+        start, stop = self._normalize_range(start, stop)
+        if start == stop:
+            return []
+        chunk_no, i = self._locate(start)
+        result = []
+        remaining = stop - start
+        while remaining:
+            chunk = self._chunks[chunk_no]
+            elems = chunk.slice(i, i + remaining)
+            result.extend(elems)
+            remaining -= len(elems)
+            chunk_no, i = chunk_no + 1, 0
+        return result
+
+    def trim(self, start, stop):
+        start, stop = self._normalize_range(start, stop)
+        # Drop whole chunks at both ends first, then cut the edge chunks.
+        num_left, num_right = start, self._len - stop
+        while num_left and num_left >= len(self._chunks[0]):
+            num_left -= len(self._chunks.popleft())
+        while num_right and num_right >= len(self._chunks[-1]):
+            num_right -= len(self._chunks.pop())
+        if num_left:
+            first = self._chunks[0]
+            first.keep(num_left, len(first))
+        if num_right:
+            last = self._chunks[-1]
+            last.keep(0, len(last) - num_right)
+        self._len = stop - start
+
+    def dismantle(self):
+        """
+        For lazy free.
+        """
+        chunks, self._chunks, self._len = self._chunks, deque(), 0
+        while chunks:
+            chunks.pop()
+            yield
+
+
+######################################################################################################
+# Commands
+
+
+def _parse_side(token) -> bool:
+    """
+    LEFT|RIGHT -> True if LEFT
+    """
+    side = token.upper()
+    if side not in (b'LEFT', b'RIGHT'):
+        raise RedisSyntaxError()
+    return side == b'LEFT'
+
+
+def parse_timeout(token) -> float:
+    """
+    Timeout of a blocking command, in seconds (0: wait forever). Also used by BZPOPMIN (redis_sorted_set.py).
+    """
+    try:
+        timeout_s = float(token)
+    except ValueError:
+        raise RedisCommandError("ERR timeout is not a float or out of range")
+    if timeout_s < 0:
+        raise RedisCommandError("ERR timeout is negative")
+    return timeout_s
+
+
+def _pop(lst: RedisList, from_left: bool):
+    return lst.pop_left() if from_left else lst.pop_right()
+
+
+def push_to_list(key, elems, to_left: bool, request_recv_time_ms, only_if_exists=False) -> int:
+    lst = get_typed_value(key, ValueTypes.LIST, request_recv_time_ms, create=None if only_if_exists else RedisList)
+    if lst is None:
+        return 0
+    push = lst.push_left if to_left else lst.push_right
+    for elem in elems:
+        push(elem)
+    new_len = len(lst)
+    signal_key_as_ready(key)
+    return new_len
+
+
+def pop_from_list(key, from_left: bool, request_recv_time_ms):
+    lst = get_typed_value(key, ValueTypes.LIST, request_recv_time_ms)
+    if lst is None:
+        return None
+    elem = _pop(lst, from_left)
+    delete_key_if_empty(key, lst)
+    return elem
+
+
+def move_between_lists(source, destination, from_left, to_left, request_recv_time_ms):
+    """
+    LMOVE. return the moved element (None if source is empty).
+    """
+    # Check destination type before popping, so that a WRONGTYPE doesn't lose the element.
+    get_typed_value(destination, ValueTypes.LIST, request_recv_time_ms)
+    elem = pop_from_list(source, from_left, request_recv_time_ms)
+    if elem is not None:
+        push_to_list(destination, [elem], to_left, request_recv_time_ms)
+    return elem
+
+
+async def handle_list_command(first_token, tokens, request_recv_time_ms):
+    match first_token:
+        case b'LPUSH' | b'RPUSH' | b'LPUSHX' | b'RPUSHX':
+            if len(tokens) < 3:
+                raise RedisCommandError(f"ERR wrong number of arguments for '{first_token.decode().lower()}' command")
+            to_left = first_token.startswith(b'L')
+            only_if_exists = first_token.endswith(b'X')
+            new_len = push_to_list(tokens[1], tokens[2:], to_left, request_recv_time_ms, only_if_exists)
+            return serialize_msg(new_len, SerializedTypes.INTEGER)
+        case b'LPOP' | b'RPOP':
+            from_left = first_token == b'LPOP'
+            key = tokens[1]
+            if len(tokens) == 2:
+                elem = pop_from_list(key, from_left, request_recv_time_ms)
+                return NULL_BULK_STRING if elem is None else serialize_msg(elem, SerializedTypes.BULK_STRING)
+            count = parse_int_token(tokens[2])
+            if count < 0:
+                raise RedisCommandError("ERR value is out of range, must be positive")
+            lst = get_typed_value(key, ValueTypes.LIST, request_recv_time_ms)
+            if lst is None:
+                return NULL_ARRAY
+            elems = [_pop(lst, from_left) for _ in range(min(count, len(lst)))]
+            delete_key_if_empty(key, lst)
+            return serialize_msg(elems, SerializedTypes.ARRAY)
+        case b'LLEN':
+            lst = get_typed_value(tokens[1], ValueTypes.LIST, request_recv_time_ms)
+            return serialize_msg(len(lst) if lst is not None else 0, SerializedTypes.INTEGER)
+        case b'LINDEX':
+            lst = get_typed_value(tokens[1], ValueTypes.LIST, request_recv_time_ms)
+            elem = lst.index(parse_int_token(tokens[2])) if lst is not None else None
+            return NULL_BULK_STRING if elem is None else serialize_msg(elem, SerializedTypes.BULK_STRING)
+        case b'LRANGE':
+            start, stop = parse_int_token(tokens[2]), parse_int_token(tokens[3])
+            lst = get_typed_value(tokens[1], ValueTypes.LIST, request_recv_time_ms)
+            elems = lst.range(start, stop) if lst is not None else []
+            return serialize_msg(elems, SerializedTypes.ARRAY)
+        case b'LTRIM':
+            start, stop = parse_int_token(tokens[2]), parse_int_token(tokens[3])
+            lst = get_typed_value(tokens[1], ValueTypes.LIST, request_recv_time_ms)
+            if lst is not None:
+                lst.trim(start, stop)
+                delete_key_if_empty(tokens[1], lst)
+            return serialize_msg('OK', SerializedTypes.SIMPLE_STRING)
+        case b'LMOVE':
+            from_left, to_left = _parse_side(tokens[3]), _parse_side(tokens[4])
+            elem = move_between_lists(tokens[1], tokens[2], from_left, to_left, request_recv_time_ms)
+            return NULL_BULK_STRING if elem is None else serialize_msg(elem, SerializedTypes.BULK_STRING)
+
+        # Blocking variants: try right away, and only block if there's nothing to pop.
+        case b'BLPOP' | b'BRPOP':
+            from_left = first_token == b'BLPOP'
+            keys, timeout_s = tokens[1:-1], parse_timeout(tokens[-1])
+
+            def serve(key):
+                elem = pop_from_list(key, from_left, request_recv_time_ms)
+                if elem is None:
+                    return None
+                # The pop reaches the replicas (maybe after the push that served it), not the BLPOP.
+                also_propagate([b'LPOP' if from_left else b'RPOP', key])
+                return [key, elem]
+
+            for key in keys:
+                reply = serve(key)
+                if reply is not None:
+                    propagate_as(None)
+                    return serialize_msg(reply, SerializedTypes.ARRAY)
+            reply = await block_on_keys(keys, serve, timeout_s)
+            propagate_as(None)
+            return NULL_ARRAY if reply is None else serialize_msg(reply, SerializedTypes.ARRAY)
+        case b'BLMOVE':
+            source, destination = tokens[1], tokens[2]
+            from_left, to_left = _parse_side(tokens[3]), _parse_side(tokens[4])
+            timeout_s = parse_timeout(tokens[5])
+
+            def serve(key):
+                elem = move_between_lists(source, destination, from_left, to_left, request_recv_time_ms)
+                if elem is not None:
+                    also_propagate([b'LMOVE'] + tokens[1:5])
+                return elem
+
+            elem = serve(source)
+            if elem is None:
+                elem = await block_on_keys([source], serve, timeout_s)
+            propagate_as(None)
+            return NULL_BULK_STRING if elem is None else serialize_msg(elem, SerializedTypes.BULK_STRING)
+        case _:
+            raise RedisSyntaxError()
@@ -15,8 +15,11 @@ bulk string -> Bulk strings explicitly specify length, so they can include binar
 from enum import Enum
 from typing import Any, Iterable
 
+from app.errors import NotAnInteger
+
 CLRS = b'\r\n'
 NULL_BULK_STRING = b'$-1\r\n'
+NULL_ARRAY = b'*-1\r\n'
 OK_SIMPLE_STRING = b'+OK\r\n'
 
 class SerializedTypes(Enum):
@@ -25,6 +28,10 @@ class SerializedTypes(Enum):
     INTEGER = b':'
     BULK_STRING = b'$'
     ARRAY = b'*'
+    # RESP3 only (after HELLO 3)
+    NULL = b'_'
+    MAP = b'%'
+    PUSH = b'>'
 
 # All the functions take in the msg, start_index.
 # They only parse the prefix of the msg then return that parsed prefix and the index just after that parsed prefix.
@@ -106,6 +113,51 @@ def parse_redis_bytes_multiple_cmd(msg: bytes) -> list[tuple[Any, int]]:
     return result
 
 
+def parse_client_commands(buffer: bytes | bytearray) -> tuple[list[tuple[list[bytes], int]], int]:
+    """
+    Split what a client sent into commands.
+
+    A client can pipeline many commands in one write, and a command can be split across reads:
+    only the complete commands at the start of buffer are returned, each with its length in bytes,
+    along with the number of bytes they used. The rest is the start of a command that isn't fully received yet.
+
+    Commands are arrays of bulk strings. Inline commands ("PING\r\n", as typed in telnet) are split on spaces.
+    """
+    commands = []
+    index, end = 0, len(buffer)
+    while index < end:
+        line_end = buffer.find(CLRS, index)
+        if line_end == -1:
+            break
+        if buffer[index:index + 1] != SerializedTypes.ARRAY.value:
+            tokens = bytes(buffer[index:line_end]).split()
+            if tokens:
+                commands.append((tokens, line_end + 2 - index))
+            index = line_end + 2
+            continue
+        num_tokens = int(buffer[index + 1:line_end])
+        tokens = []
+        pos = line_end + 2
+        while len(tokens) < num_tokens:
+            line_end = buffer.find(CLRS, pos)
+            if line_end == -1:
+                break
+            if buffer[pos:pos + 1] != SerializedTypes.BULK_STRING.value:
+                raise ValueError(f"Protocol error: expected '$', got {bytes(buffer[pos:pos + 1])!r}")
+            str_start = line_end + 2
+            str_end = str_start + int(buffer[pos + 1:line_end])
+            if str_end + 2 > end:
+                break
+            tokens.append(bytes(buffer[str_start:str_end]))
+            pos = str_end + 2
+        if len(tokens) < num_tokens:
+            break
+        if tokens:
+            commands.append((tokens, pos - index))
+        index = pos
+    return commands, index
+
+
 ##################################################################################################
 
 def typecast_as_int(token) -> int:
@@ -116,9 +168,21 @@ def typecast_as_int(token) -> int:
     if isinstance(token, int):
         return token
 
+def parse_int_token(token) -> int:
+    """
+    For integer arguments sent by clients (eg: COUNT 10). Bad input is reported back as a redis error.
+    """
+    try:
+        return typecast_as_int(token)
+    except ValueError:
+        raise NotAnInteger()
+
 def typecast_as_bytes(msg) -> bytes:
     if isinstance(msg, bytes):
         return msg
+    if isinstance(msg, bytearray):
+        # Mutable strings (SETBIT, APPEND ...). The caller concatenates it with bytes, which copies it once.
+        return msg
     if isinstance(msg, int):
         return str(msg).encode()
     if isinstance(msg, str):
@@ -160,11 +224,30 @@ def serialize_msg(msg: int|bytes|str|list|dict, data_type: SerializedTypes):
         case SerializedTypes.ARRAY:
             serialized = SerializedTypes.ARRAY.value + str(len(msg)).encode() + CLRS
             for e in msg:
-                if isinstance(e, str|bytes|int):
+                if e is None:
+                    # eg: HMGET on a missing field.
+                    serialized += NULL_BULK_STRING
+                elif isinstance(e, str|bytes|bytearray|int):
                     serialized += serialize_msg(e, SerializedTypes.BULK_STRING)
                 else:
                     serialized += serialize_msg(e, SerializedTypes.ARRAY)
             return serialized
+        case SerializedTypes.PUSH:
+            # Out of band messages (eg: client tracking invalidations). Same layout as an array.
+            return SerializedTypes.PUSH.value + serialize_msg(msg, SerializedTypes.ARRAY)[1:]
+        case SerializedTypes.MAP:
+            serialized = SerializedTypes.MAP.value + str(len(msg)).encode() + CLRS
+            for k, v in msg.items():
+                serialized += serialize_msg(k, SerializedTypes.BULK_STRING)
+                if isinstance(v, int):
+                    serialized += serialize_msg(v, SerializedTypes.INTEGER)
+                elif isinstance(v, list):
+                    serialized += serialize_msg(v, SerializedTypes.ARRAY)
+                else:
+                    serialized += serialize_msg(v, SerializedTypes.BULK_STRING)
+            return serialized
+        case SerializedTypes.NULL:
+            return SerializedTypes.NULL.value + CLRS
         case _:
             raise ValueError(f"Unsupported data type: {data_type}")
 
@@ -0,0 +1,275 @@
+"""
+Sets (tag filtering).
+
+SADD key member [member ...]
+SREM key member [member ...]
+SISMEMBER key member
+SMISMEMBER key member [member ...]
+SCARD key
+SMEMBERS key
+SINTER/SUNION/SDIFF key [key ...]
+SINTERSTORE/SUNIONSTORE/SDIFFSTORE destination key [key ...]
+SSCAN key cursor [MATCH pattern] [COUNT count]
+
+
+Encodings (same as redis):
+
+1. intset: a set of small integers (ids are the common case) is a sorted array('q'):
+8 bytes per member, instead of a bytes object + a hash table slot per member.
+Membership is a bisect. Members are kept as ints and converted back to bytes when replying.
+Only canonical integers count ("12" yes, "012" / "+12" no), so that the bytes round trip is exact.
+
+2. hashtable: a python set of bytes. Converted (one way) as soon as a non integer member is added,
+or the intset grows past set-max-intset-entries. (config.py)
+
+
+Set algebra:
+SINTER iterates the smallest set and probes the others, smallest first, so the work is bounded by the
+size of the smallest set (and shrinks as the candidates get filtered out).
+When all the sets are hashtables this is exactly what set.intersection() does in C, so we use that.
+With mixed encodings, the python loop iterates the set with the fewest members, whatever its encoding
+(a hashtable can be smaller than an intset of up to set-max-intset-entries members), and probes the others:
+a bisect for an intset, a hash lookup for a hashtable.
+"""
+from array import array
+from bisect import bisect_left
+
+from app.config import server_config
+from app.errors import RedisSyntaxError
+from app.glob_pattern import compile_glob
+from app.key_value_utils import ValueTypes, ValueObj, NO_EXPIRY
+from app.keyspace import ScanCursorIndex, parse_scan_args
+from app import memory_management
+from app.memory_management import get_typed_value, delete_key_if_empty
+from app.redis_serialization_protocol import serialize_msg, SerializedTypes
+
+ENCODING_INTSET = 'intset'
+ENCODING_HASHTABLE = 'hashtable'
+
+_INT64_MIN, _INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def _as_int(member: bytes) -> int | None:
+    """
+    The int value of member if member is a canonical int64 ("12", "-5"), else None.
+    """
+    if not member or len(member) > 20:
+        return None
+    try:
+        num = int(member)
+    except ValueError:
+        return None
+    if not _INT64_MIN <= num <= _INT64_MAX or str(num).encode() != member:
+        return None
+    return num
+
+
+class RedisSet:
+
+    def __init__(self):
+        self._intset: array | None = array('q')
+        self._set: set | None = None
+        # Only created by the first SSCAN on a hashtable set, so sets that are never scanned don't pay for it.
+        self._scan_index: ScanCursorIndex | None = None
+
+    @classmethod
+    def from_members(cls, members) -> 'RedisSet':
+        s = cls()
+        for member in members:
+            s.add(member)
+        return s
+
+    @property
+    def encoding(self):
+        return ENCODING_INTSET if self._set is None else ENCODING_HASHTABLE
+
+    def __len__(self):
+        return len(self._intset) if self._set is None else len(self._set)
+
+    def _convert_to_hashtable(self):
+        self._set = {str(num).encode() for num in self._intset}
+        self._intset = None
+
+    def add(self, member: bytes) -> bool:
+        if self._set is None:
+            num = _as_int(member)
+            if num is not None:
+                pos = bisect_left(self._intset, num)
+                if pos < len(self._intset) and self._intset[pos] == num:
+                    return False
+                if len(self._intset) < server_config['set-max-intset-entries']:
+                    self._intset.insert(pos, num)
+                    return True
+            self._convert_to_hashtable()
+        if member in self._set:
+            return False
+        self._set.add(member)
+        if self._scan_index is not None:
+            self._scan_index.add(member)
+        return True
+
+    def remove(self, member: bytes) -> bool:
+        if self._set is None:
+            num = _as_int(member)
+            if num is None:
+                return False
+            pos = bisect_left(self._intset, num)
+            if pos < len(self._intset) and self._intset[pos] == num:
+                del self._intset[pos]
+                return True
+            return False
+        if member not in self._set:
+            return False
+        self._set.remove(member)
+        if self._scan_index is not None:
+            self._scan_index.remove(member)
+        return True
+
+    def contains(self, member: bytes) -> bool:
+        if self._set is None:
+            num = _as_int(member)
+            if num is None:
+                return False
+            pos = bisect_left(self._intset, num)
+            return pos < len(self._intset) and self._intset[pos] == num
+        return member in self._set
+
+    def members(self):
+        if self._set is None:
+            return [str(num).encode() for num in self._intset]
+        return self._set
+
+    def members_as_set(self) -> set:
+        """
+        A python set of the members (the set itself for the hashtable encoding: don't modify it).
+        """
+        return self._set if self._set is not None else set(self.members())
+
+    def scan(self, cursor: int, count: int, pattern: bytes | None) -> tuple[int, list]:
+        if self._set is None:
+            # Small, return everything in one go (same as redis).
+            next_cursor, members = 0, self.members()
+        else:
+            if self._scan_index is None:
+                self._scan_index = ScanCursorIndex()
+                for member in self._set:
+                    self._scan_index.add(member)
+            next_cursor, members = self._scan_index.scan(cursor, count)
+        if pattern is not None:
+            glob = compile_glob(pattern)
+            members = [m for m in members if glob.match(m)]
+        return next_cursor, list(members)
+
+    def dismantle(self):
+        """
+        For lazy free.
+        """
+        members, self._set, self._intset, self._scan_index = self._set, None, array('q'), None
+        while members:
+            members.pop()
+            yield
+
+
+######################################################################################################
+# Set algebra
+
+
+def set_intersection(sets: list[RedisSet | None]) -> set:
+    """
+    None is a missing key (ie: empty set).
+    """
+    if not sets or any(s is None or len(s) == 0 for s in sets):
+        return set()
+    sets = sorted(sets, key=len)
+    smallest, others = sets[0], sets[1:]
+    if all(s.encoding == ENCODING_HASHTABLE for s in sets):
+        # C loop over the smaller side, probing the other one.
+        result = smallest._set.intersection(others[0]._set) if others else set(smallest._set)
+        for other in others[1:]:
+            if not result:
+                break
+            result.intersection_update(other._set)
+        return result
+    return {m for m in smallest.members() if all(other.contains(m) for other in others)}
+
+
+def set_union(sets: list[RedisSet | None]) -> set:
+    result = set()
+    for s in sets:
+        if s is not None:
+            result.update(s.members())
+    return result
+
+
+def set_difference(sets: list[RedisSet | None]) -> set:
+    first, others = sets[0], [s for s in sets[1:] if s is not None]
+    if first is None:
+        return set()
+    result = set(first.members())
+    for other in others:
+        if not result:
+            break
+        if len(other) < len(result):
+            result.difference_update(other.members())
+        else:
+            result = {m for m in result if not other.contains(m)}
+    return result
+
+
+_SET_ALGEBRA = {b'SINTER': set_intersection, b'SUNION': set_union, b'SDIFF': set_difference}
+
+
+######################################################################################################
+# Commands
+
+
+def handle_set_command(first_token, tokens, request_recv_time_ms):
+    key = tokens[1]
+    match first_token:
+        case b'SADD':
+            s = get_typed_value(key, ValueTypes.SET, request_recv_time_ms, create=RedisSet)
+            num_added = sum(s.add(member) for member in tokens[2:])
+            delete_key_if_empty(key, s)
+            return serialize_msg(num_added, SerializedTypes.INTEGER)
+        case b'SREM':
+            s = get_typed_value(key, ValueTypes.SET, request_recv_time_ms)
+            if s is None:
+                return serialize_msg(0, SerializedTypes.INTEGER)
+            num_removed = sum(s.remove(member) for member in tokens[2:])
+            delete_key_if_empty(key, s)
+            return serialize_msg(num_removed, SerializedTypes.INTEGER)
+        case b'SISMEMBER':
+            s = get_typed_value(key, ValueTypes.SET, request_recv_time_ms)
+            return serialize_msg(int(s is not None and s.contains(tokens[2])), SerializedTypes.INTEGER)
+        case b'SMISMEMBER':
+            s = get_typed_value(key, ValueTypes.SET, request_recv_time_ms)
+            # Integers are sent as RESP integers, not bulk strings.
+            reply = b'*' + str(len(tokens) - 2).encode() + b'\r\n'
+            for member in tokens[2:]:
+                reply += serialize_msg(int(s is not None and s.contains(member)), SerializedTypes.INTEGER)
+            return reply
+        case b'SCARD':
+            s = get_typed_value(key, ValueTypes.SET, request_recv_time_ms)
+            return serialize_msg(len(s) if s is not None else 0, SerializedTypes.INTEGER)
+        case b'SMEMBERS':
+            s = get_typed_value(key, ValueTypes.SET, request_recv_time_ms)
+            return serialize_msg(list(s.members()) if s is not None else [], SerializedTypes.ARRAY)
+        case b'SINTER' | b'SUNION' | b'SDIFF':
+            sets = [get_typed_value(k, ValueTypes.SET, request_recv_time_ms) for k in tokens[1:]]
+            return serialize_msg(list(_SET_ALGEBRA[first_token](sets)), SerializedTypes.ARRAY)
+        case b'SINTERSTORE' | b'SUNIONSTORE' | b'SDIFFSTORE':
+            sets = [get_typed_value(k, ValueTypes.SET, request_recv_time_ms) for k in tokens[2:]]
+            result = _SET_ALGEBRA[first_token[:-len(b'STORE')]](sets)
+            # The destination is overwritten, whatever type it had.
+            memory_management.redis_memstore.pop(key, None)
+            if result:
+                memory_management.redis_memstore[key] = ValueObj(val=RedisSet.from_members(result),
+                                                                 unix_expiry_ms=NO_EXPIRY, val_dtype=ValueTypes.SET)
+            return serialize_msg(len(result), SerializedTypes.INTEGER)
+        case b'SSCAN':
+            cursor, count, pattern, _ = parse_scan_args(tokens, 2, allow_type=False)
+            s = get_typed_value(key, ValueTypes.SET, request_recv_time_ms)
+            next_cursor, members = s.scan(cursor, count, pattern) if s is not None else (0, [])
+            return serialize_msg([str(next_cursor), members], SerializedTypes.ARRAY)
+        case _:
+            raise RedisSyntaxError()
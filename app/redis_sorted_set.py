@@ -0,0 +1,626 @@
+"""
+Sorted sets (leaderboards, time bucketed indexes).
+
+ZADD key [NX|XX] [GT|LT] [CH] [INCR] score member [score member ...]
+ZSCORE key member
+ZRANK/ZREVRANK key member
+ZRANGE key start stop [BYSCORE|BYLEX] [REV] [LIMIT offset count] [WITHSCORES]
+ZREMRANGEBYSCORE key min max
+ZREM key member [member ...]
+ZCARD key
+ZPOPMIN key [count]
+BZPOPMIN key [key ...] timeout
+
+Elements are ordered by (score, member).
+
+Encodings (same as redis):
+
+1. listpack: for small sets. Two parallel python lists (scores, members) kept sorted by (score, member).
+Ranges and ranks are a bisect, a score lookup by member is a linear list.index() (in C).
+
+2. skiplist: a dict (member -> score) for O(1) ZSCORE,
+plus an indexed skiplist (every forward pointer also stores its span, ie: how many elements it jumps over).
+With the spans, we can compute the rank of any element, or find the element at a given rank, in O(log n).
+So every range query is: O(log n) to find the first element of the range (by rank, score or lex),
+then walk the level 0 pointers for the k elements in the range. Elements outside the range are never touched.
+
+Converted (one way) once the set has more than zset-max-listpack-entries members,
+or a member longer than zset-max-listpack-value bytes. (config.py)
+
+
+Range bounds:
+All range queries are turned into a [start_rank, end_rank) interval first.
+For a score/lex bound we count the elements below it (count_below), which is a bisect for the listpack,
+and a top-down walk over the spans for the skiplist.
+"""
+import math
+import random
+from bisect import bisect_left, bisect_right
+
+from app.blocking import block_on_keys, signal_key_as_ready
+from app.config import server_config
+from app.errors import RedisCommandError, RedisSyntaxError
+from app.key_value_utils import ValueTypes
+from app.memory_management import get_typed_value, delete_key_if_empty
+from app.redis_list import parse_timeout
+from app.redis_serialization_protocol import serialize_msg, SerializedTypes, parse_int_token, NULL_BULK_STRING, \
+    NULL_ARRAY
+from app.replication import propagate_as, also_propagate
+
+ENCODING_LISTPACK = 'listpack'
+ENCODING_SKIPLIST = 'skiplist'
+
+SKIPLIST_MAX_LEVEL = 32
+SKIPLIST_P = 0.25
+
+
+class _ListpackIndex:
+    """
+    Small sets: scores[i], members[i] sorted by (score, member).
+    """
+
+    def __init__(self):
+        self.scores: list[float] = []
+        self.members: list[bytes] = []
+
+    def __len__(self):
+        return len(self.members)
+
+    def score_of(self, member):
+        try:
+            return self.scores[self.members.index(member)]
+        except ValueError:
+            return None
+
+    def _position(self, score, member) -> int:
+        # Among the elements with the same score, members are sorted.
+        lo = bisect_left(self.scores, score)
+        hi = bisect_right(self.scores, score, lo)
+        return bisect_left(self.members, member, lo, hi)
+
+    def insert(self, score, member):
+        pos = self._position(score, member)
+        self.scores.insert(pos, score)
+        self.members.insert(pos, member)
+
+    def delete(self, score, member):
+        pos = self._position(score, member)
+        del self.scores[pos]
+        del self.members[pos]
+
+    def rank(self, score, member) -> int:
+        return self._position(score, member)
+
+    def count_below(self, value, inclusive: bool, by_lex: bool) -> int:
+        """
+        Number of elements < value (<= value if inclusive). by_lex compares members instead of scores.
+        """
+        keys = self.members if by_lex else self.scores
+        return bisect_right(keys, value) if inclusive else bisect_left(keys, value)
+
+    def iter_from_rank(self, rank, reverse=False):
+        if reverse:
+            for i in range(rank, -1, -1):
+                yield self.members[i], self.scores[i]
+        else:
+            for i in range(rank, len(self.members)):
+                yield self.members[i], self.scores[i]
+
+
+class _SkipNode:
+    __slots__ = ('score', 'member', 'forward', 'span', 'backward')
+
+    def __init__(self, level, score, member):
+        self.score = score
+        self.member = member
+        self.forward: list[_SkipNode | None] = [None] * level
+        self.span = [0] * level
+        self.backward = None
+
+
+def _random_level():
+    level = 1
+    while random.random() < SKIPLIST_P and level < SKIPLIST_MAX_LEVEL:
+        level += 1
+    return level
+
+
+class _SkipListIndex:
+    """
+    Indexed skiplist (port of redis zskiplist).
+    """
+
+    def __init__(self):
+        self.header = _SkipNode(SKIPLIST_MAX_LEVEL, None, None)
+        self.tail = None
+        self.length = 0
+        self.level = 1
+
+    def __len__(self):
+        return self.length
+
+    def _find_update_path(self, score, member):
+        """
+        For every level, the last node that is < (score, member). Also the rank of that node.
+        """
+        update = [None] * SKIPLIST_MAX_LEVEL
+        rank = [0] * SKIPLIST_MAX_LEVEL
+        x = self.header
+        for i in range(self.level - 1, -1, -1):
+            rank[i] = 0 if i == self.level - 1 else rank[i + 1]
+            nxt = x.forward[i]
+            while nxt is not None and (nxt.score < score or (nxt.score == score and nxt.member < member)):
+                rank[i] += x.span[i]
+                x = nxt
+                nxt = x.forward[i]
+            update[i] = x
+        return update, rank
+
+    def insert(self, score, member):
+        update, rank = self._find_update_path(score, member)
+        level = _random_level()
+        if level > self.level:
+            for i in range(self.level, level):
+                rank[i] = 0
+                update[i] = self.header
+                self.header.span[i] = self.length
+            self.level = level
+        x = _SkipNode(level, score, member)
+        for i in range(level):
+            x.forward[i] = update[i].forward[i]
+            update[i].forward[i] = x
+            x.span[i] = update[i].span[i] - (rank[0] - rank[i])
+            update[i].span[i] = (rank[0] - rank[i]) + 1
+        for i in range(level, self.level):
+            update[i].span[i] += 1
+        x.backward = None if update[0] is self.header else update[0]
+        if x.forward[0] is not None:
+            x.forward[0].backward = x
+        else:
+            self.tail = x
+        self.length += 1
+
+    def delete(self, score, member):
+        update, _ = self._find_update_path(score, member)
+        x = update[0].forward[0]
+        if x is None or x.score != score or x.member != member:
+            raise KeyError(member)
+        for i in range(self.level):
+            if update[i].forward[i] is x:
+                update[i].span[i] += x.span[i] - 1
+                update[i].forward[i] = x.forward[i]
+            else:
+                update[i].span[i] -= 1
+        if x.forward[0] is not None:
+            x.forward[0].backward = x.backward
+        else:
+            self.tail = x.backward
+        while self.level > 1 and self.header.forward[self.level - 1] is None:
+            self.level -= 1
+        self.length -= 1
+
+    def rank(self, score, member) -> int:
+        """
+        0 based rank of an existing element.
+        """
+        _, rank = self._find_update_path(score, member)
+        return rank[0]
+
+    def count_below(self, value, inclusive: bool, by_lex: bool) -> int:
+        x = self.header
+        count = 0
+        for i in range(self.level - 1, -1, -1):
+            nxt = x.forward[i]
+            while nxt is not None:
+                key = nxt.member if by_lex else nxt.score
+                if key < value or (inclusive and key == value):
+                    count += x.span[i]
+                    x = nxt
+                    nxt = x.forward[i]
+                else:
+                    break
+        return count
+
+    def _node_by_rank(self, rank) -> _SkipNode | None:
+        """
+        rank is 0 based.
+        """
+        traversed = 0
+        x = self.header
+        for i in range(self.level - 1, -1, -1):
+            while x.forward[i] is not None and traversed + x.span[i] <= rank + 1:
+                traversed += x.span[i]
+                x = x.forward[i]
+            if traversed == rank + 1:
+                return x
+        return None
+
+    def iter_from_rank(self, rank, reverse=False):
+        node = self._node_by_rank(rank)
+        while node is not None:
+            yield node.member, node.score
+            node = node.backward if reverse else node.forward[0]
+
+    def dismantle(self):
+        """
+        For lazy free: unlink nodes one by one (backward pointers make cycles).
+        """
+        node = self.header.forward[0]
+        self.header = _SkipNode(SKIPLIST_MAX_LEVEL, None, None)
+        self.tail, self.length, self.level = None, 0, 1
+        while node is not None:
+            nxt = node.forward[0]
+            node.forward = node.span = node.backward = None
+            node = nxt
+            yield
+
+
+class RedisSortedSet:
+
+    def __init__(self):
+        self._index: _ListpackIndex | _SkipListIndex = _ListpackIndex()
+        # member -> score, only for the skiplist encoding.
+        self._dict: dict | None = None
+
+    @property
+    def encoding(self):
+        return ENCODING_LISTPACK if self._dict is None else ENCODING_SKIPLIST
+
+    def __len__(self):
+        return len(self._index)
+
+    def score_of(self, member) -> float | None:
+        if self._dict is None:
+            return self._index.score_of(member)
+        return self._dict.get(member)
+
+    def _convert_to_skiplist(self):
+        small = self._index
+        self._index = _SkipListIndex()
+        self._dict = {}
+        for score, member in zip(small.scores, small.members):
+            self._index.insert(score, member)
+            self._dict[member] = score
+
+    def set_score(self, member, score):
+        old_score = self.score_of(member)
+        if old_score == score:
+            return
+        if old_score is not None:
+            self._index.delete(old_score, member)
+        elif self._dict is None and (len(self) >= server_config['zset-max-listpack-entries']
+                                     or len(member) > server_config['zset-max-listpack-value']):
+            self._convert_to_skiplist()
+        self._index.insert(score, member)
+        if self._dict is not None:
+            self._dict[member] = score
+
+    def remove(self, member) -> bool:
+        score = self.score_of(member)
+        if score is None:
+            return False
+        self._index.delete(score, member)
+        if self._dict is not None:
+            del self._dict[member]
+        return True
+
+    def rank(self, member, reverse=False) -> int | None:
+        score = self.score_of(member)
+        if score is None:
+            return None
+        rank = self._index.rank(score, member)
+        return len(self) - 1 - rank if reverse else rank
+
+    def items_in_rank_range(self, start, end, reverse=False, offset=0, count=-1) -> list[tuple[bytes, float]]:
+        """
+        Elements with rank in [start, end) (ranks are always in ascending order).
+        reverse walks the interval from the end. offset/count are LIMIT.
+        """
+        if count < 0:
+            count = end - start
+        first = start + offset
+        num = min(count, end - first)
+        if num <= 0 or first < start:
+            return []
+        result = []
+        rank = end - 1 - offset if reverse else first
+        for item in self._index.iter_from_rank(rank, reverse):
+            result.append(item)
+            if len(result) == num:
+                break
+        return result
+
+    def rank_interval(self, min_bound, max_bound, by_lex=False) -> tuple[int, int]:
+        """
+        bounds are (value, inclusive). [start, end) ranks of the elements within the bounds.
+        """
+        (min_val, min_inclusive), (max_val, max_inclusive) = min_bound, max_bound
+        start = self._count_below(min_val, not min_inclusive, by_lex)
+        end = self._count_below(max_val, max_inclusive, by_lex)
+        return start, max(start, end)
+
+    def _count_below(self, value, inclusive, by_lex):
+        if by_lex:
+            # '-' and '+' (lowest / highest possible member)
+            if value is _LEX_MIN:
+                return 0
+            if value is _LEX_MAX:
+                return len(self)
+        return self._index.count_below(value, inclusive, by_lex)
+
+    def dismantle(self):
+        """
+        For lazy free.
+        """
+        index, self._index, self._dict = self._index, _ListpackIndex(), None
+        if isinstance(index, _SkipListIndex):
+            yield from index.dismantle()
+
+
+######################################################################################################
+# Commands
+
+
+_LEX_MIN = object()
+_LEX_MAX = object()
+
+
+def format_score(score: float) -> bytes:
+    """
+    Same as redis: 1 -> '1', 1.5 -> '1.5', inf -> 'inf'
+    """
+    if math.isinf(score):
+        return b'inf' if score > 0 else b'-inf'
+    if score.is_integer() and abs(score) < 1e17:
+        return str(int(score)).encode()
+    return repr(score).encode()
+
+
+def parse_score(token) -> float:
+    try:
+        score = float(token)
+    except ValueError:
+        raise RedisCommandError("ERR value is not a valid float")
+    if math.isnan(score):
+        raise RedisCommandError("ERR value is not a valid float")
+    return score
+
+
+def parse_score_bound(token) -> tuple[float, bool]:
+    """
+    '1.5' -> (1.5, inclusive), '(1.5' -> (1.5, exclusive), also -inf/+inf
+    """
+    if token.startswith(b'('):
+        try:
+            return parse_score(token[1:]), False
+        except RedisCommandError:
+            raise RedisCommandError("ERR min or max is not a float")
+    try:
+        return parse_score(token), True
+    except RedisCommandError:
+        raise RedisCommandError("ERR min or max is not a float")
+
+
+def parse_lex_bound(token) -> tuple[object, bool]:
+    """
+    '[a' -> ('a', inclusive), '(a' -> ('a', exclusive), '-' / '+'
+    """
+    if token == b'-':
+        return _LEX_MIN, True
+    if token == b'+':
+        return _LEX_MAX, True
+    if token[:1] == b'[':
+        return token[1:], True
+    if token[:1] == b'(':
+        return token[1:], False
+    raise RedisCommandError("ERR min or max not valid string range item")
+
+
+def _items_reply(items, with_scores):
+    reply = []
+    for member, score in items:
+        reply.append(member)
+        if with_scores:
+            reply.append(format_score(score))
+    return reply
+
+
+def zadd(zset: RedisSortedSet, tokens, start_idx):
+    """
+    return (num_added_or_changed, is_incr, incr_result)
+    """
+    nx = xx = gt = lt = ch = incr = False
+    i = start_idx
+    while i < len(tokens):
+        flag = tokens[i].upper()
+        if flag == b'NX':
+            nx = True
+        elif flag == b'XX':
+            xx = True
+        elif flag == b'GT':
+            gt = True
+        elif flag == b'LT':
+            lt = True
+        elif flag == b'CH':
+            ch = True
+        elif flag == b'INCR':
+            incr = True
+        else:
+            break
+        i += 1
+    pairs = tokens[i:]
+    if not pairs or len(pairs) % 2 != 0:
+        raise RedisSyntaxError()
+    if nx and xx:
+        raise RedisCommandError("ERR XX and NX options at the same time are not compatible")
+    if (gt and lt) or (nx and (gt or lt)):
+        raise RedisCommandError("ERR GT, LT, and/or NX options at the same time are not compatible")
+    if incr and len(pairs) != 2:
+        raise RedisCommandError("ERR INCR option supports a single increment-element pair")
+    scores = [parse_score(pairs[j]) for j in range(0, len(pairs), 2)]
+
+    num_changed = 0
+    incr_result = None
+    for score, member in zip(scores, pairs[1::2]):
+        old_score = zset.score_of(member)
+        if (nx and old_score is not None) or (xx and old_score is None):
+            continue
+        new_score = score
+        if incr:
+            new_score = (old_score or 0.0) + score
+            if math.isnan(new_score):
+                raise RedisCommandError("ERR resulting score is not a number (NaN)")
+        if old_score is not None and ((gt and new_score <= old_score) or (lt and new_score >= old_score)):
+            continue
+        if old_score is None:
+            num_changed += 1
+        elif ch and new_score != old_score:
+            num_changed += 1
+        zset.set_score(member, new_score)
+        incr_result = new_score
+    return num_changed, incr, incr_result
+
+
+def zrange(zset: RedisSortedSet, tokens) -> list:
+    """
+    ZRANGE key start stop [BYSCORE|BYLEX] [REV] [LIMIT offset count] [WITHSCORES]
+    """
+    by_score = by_lex = rev = with_scores = False
+    offset, count = 0, -1
+    has_limit = False
+    i = 4
+    while i < len(tokens):
+        option = tokens[i].upper()
+        if option == b'BYSCORE':
+            by_score = True
+        elif option == b'BYLEX':
+            by_lex = True
+        elif option == b'REV':
+            rev = True
+        elif option == b'WITHSCORES':
+            with_scores = True
+        elif option == b'LIMIT' and i + 2 < len(tokens):
+            offset, count = parse_int_token(tokens[i + 1]), parse_int_token(tokens[i + 2])
+            has_limit = True
+            i += 2
+        else:
+            raise RedisSyntaxError()
+        i += 1
+    if by_score and by_lex:
+        raise RedisSyntaxError()
+    if has_limit and not (by_score or by_lex):
+        raise RedisCommandError("ERR syntax error, LIMIT is only supported in combination with either BYSCORE or BYLEX")
+    if with_scores and by_lex:
+        raise RedisSyntaxError()
+
+    if by_score or by_lex:
+        low, high = (tokens[3], tokens[2]) if rev else (tokens[2], tokens[3])
+        parse_bound = parse_lex_bound if by_lex else parse_score_bound
+        start, end = zset.rank_interval(parse_bound(low), parse_bound(high), by_lex=by_lex)
+        if offset < 0:
+            return []
+        items = zset.items_in_rank_range(start, end, reverse=rev, offset=offset, count=count)
+    else:
+        start, stop = parse_int_token(tokens[2]), parse_int_token(tokens[3])
+        length = len(zset)
+        if start < 0:
+            start += length
+        if stop < 0:
+            stop += length
+        start, stop = max(start, 0), min(stop, length - 1)
+        if start > stop:
+            return []
+        if rev:
+            # start/stop count from the highest score.
+            start, stop = length - 1 - stop, length - 1 - start
+        items = zset.items_in_rank_range(start, stop + 1, reverse=rev)
+    return _items_reply(items, with_scores)
+
+
+def pop_min(key, count, request_recv_time_ms) -> list:
+    zset = get_typed_value(key, ValueTypes.ZSET, request_recv_time_ms)
+    if zset is None:
+        return []
+    items = zset.items_in_rank_range(0, min(count, len(zset)))
+    for member, _ in items:
+        zset.remove(member)
+    delete_key_if_empty(key, zset)
+    return items
+
+
+async def handle_sorted_set_command(first_token, tokens, request_recv_time_ms):
+    key = tokens[1]
+    match first_token:
+        case b'ZADD':
+            zset = get_typed_value(key, ValueTypes.ZSET, request_recv_time_ms, create=RedisSortedSet)
+            try:
+                num_changed, is_incr, incr_result = zadd(zset, tokens, 2)
+            finally:
+                # A failed / no-op ZADD must not leave an empty key behind.
+                delete_key_if_empty(key, zset)
+            signal_key_as_ready(key)
+            if is_incr:
+                return NULL_BULK_STRING if incr_result is None else \
+                    serialize_msg(format_score(incr_result), SerializedTypes.BULK_STRING)
+            return serialize_msg(num_changed, SerializedTypes.INTEGER)
+        case b'ZSCORE':
+            zset = get_typed_value(key, ValueTypes.ZSET, request_recv_time_ms)
+            score = zset.score_of(tokens[2]) if zset is not None else None
+            return NULL_BULK_STRING if score is None else serialize_msg(format_score(score), SerializedTypes.BULK_STRING)
+        case b'ZRANK' | b'ZREVRANK':
+            zset = get_typed_value(key, ValueTypes.ZSET, request_recv_time_ms)
+            rank = zset.rank(tokens[2], reverse=first_token == b'ZREVRANK') if zset is not None else None
+            return NULL_BULK_STRING if rank is None else serialize_msg(rank, SerializedTypes.INTEGER)
+        case b'ZCARD':
+            zset = get_typed_value(key, ValueTypes.ZSET, request_recv_time_ms)
+            return serialize_msg(len(zset) if zset is not None else 0, SerializedTypes.INTEGER)
+        case b'ZRANGE':
+            zset = get_typed_value(key, ValueTypes.ZSET, request_recv_time_ms)
+            if zset is None:
+                zset = RedisSortedSet()
+            return serialize_msg(zrange(zset, tokens), SerializedTypes.ARRAY)
+        case b'ZREM':
+            zset = get_typed_value(key, ValueTypes.ZSET, request_recv_time_ms)
+            if zset is None:
+                return serialize_msg(0, SerializedTypes.INTEGER)
+            num_removed = sum(zset.remove(member) for member in tokens[2:])
+            delete_key_if_empty(key, zset)
+            return serialize_msg(num_removed, SerializedTypes.INTEGER)
+        case b'ZREMRANGEBYSCORE':
+            min_bound, max_bound = parse_score_bound(tokens[2]), parse_score_bound(tokens[3])
+            zset = get_typed_value(key, ValueTypes.ZSET, request_recv_time_ms)
+            if zset is None:
+                return serialize_msg(0, SerializedTypes.INTEGER)
+            start, end = zset.rank_interval(min_bound, max_bound)
+            items = zset.items_in_rank_range(start, end)
+            for member, _ in items:
+                zset.remove(member)
+            delete_key_if_empty(key, zset)
+            return serialize_msg(len(items), SerializedTypes.INTEGER)
+        case b'ZPOPMIN':
+            count = parse_int_token(tokens[2]) if len(tokens) > 2 else 1
+            if count < 0:
+                raise RedisCommandError("ERR value is out of range, must be positive")
+            items = pop_min(key, count, request_recv_time_ms)
+            return serialize_msg(_items_reply(items, with_scores=True), SerializedTypes.ARRAY)
+        case b'BZPOPMIN':
+            keys, timeout_s = tokens[1:-1], parse_timeout(tokens[-1])
+
+            def serve(key):
+                items = pop_min(key, 1, request_recv_time_ms)
+                if not items:
+                    return None
+                # The pop reaches the replicas (maybe after the push that served it), not the BZPOPMIN.
+                also_propagate([b'ZPOPMIN', key])
+                return [key] + _items_reply(items, with_scores=True)
+
+            for k in keys:
+                reply = serve(k)
+                if reply is not None:
+                    propagate_as(None)
+                    return serialize_msg(reply, SerializedTypes.ARRAY)
+            reply = await block_on_keys(keys, serve, timeout_s)
+            propagate_as(None)
+            return NULL_ARRAY if reply is None else serialize_msg(reply, SerializedTypes.ARRAY)
+        case _:
+            raise RedisSyntaxError()
@@ -55,11 +55,11 @@ so the timestamp_id becomes:
 <20digits of ms value><2 digits of seq num>
 
 """
-import time
 from dataclasses import dataclass, field
 from typing import Self
 
 from app.errors import InvalidStreamEventTsId
+from app.server_clock import now_ms
 
 NUM_DIGITS_TS = 20
 NUM_DIGITS_SEQ = 2
@@ -71,12 +71,6 @@ def as_x_digit_str(x, val:str) -> str:
     result = ('0' * (x-num_dig)) + val
     return result
 
-def get_unix_time_ms():
-    # Get the current Unix timestamp as a floating-point number
-    unix_timestamp = time.time()
-    unix_ts_ms = int(unix_timestamp * 1000)
-    return unix_ts_ms
-
 def _get_trie_key(event_ts_id):
     ts_str, seq_num_str = event_ts_id.split('-')
     trie_key = as_x_digit_str(NUM_DIGITS_TS, ts_str) + as_x_digit_str(NUM_DIGITS_SEQ, seq_num_str)
@@ -232,7 +226,7 @@ class RedisStream:
 
     def _resolve_event_ts_id(self, event_ts_id):
         if event_ts_id == '*':
-            ts_str = str(get_unix_time_ms())
+            ts_str = str(now_ms())
             seq_num_str = '*'
         else:
             ts_str, seq_num_str = event_ts_id.split('-')
@@ -288,6 +282,31 @@ class RedisStream:
         if (int(ts), int(seq_no)) <= ( int(latest_ts), int(latest_seq_num)):
             raise InvalidStreamEventTsId("ERR The ID specified in XADD is equal or smaller than the target stream top item")
 
+    def dismantle(self):
+        """
+        Tear down the stream one node at a time (used by lazy free). Yields after every node.
+
+        First unlink the leaves (this breaks the prev_leaf/next_leaf cycles, so leaves are freed by refcounting
+        and not by the cyclic GC), then empty the branch nodes from the root down.
+        """
+        leaf = self._latest_leaf
+        self._latest_leaf = None
+        while leaf:
+            prev_leaf = leaf.prev_leaf
+            leaf.prev_leaf = leaf.next_leaf = None
+            leaf = prev_leaf
+            yield
+
+        root, self._root = self._root, _BranchNode()
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            for child in node.children.values():
+                if isinstance(child, _BranchNode):
+                    stack.append(child)
+            node.children.clear()
+            yield
+
     def pretty_print(self):
         print("Here is the redis stream")
         cur_leaf = self._latest_leaf
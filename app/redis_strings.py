@@ -0,0 +1,537 @@
+"""
+String commands that set or get a whole value with options, modify or read part of a value, and bitmaps.
+
+SET key value [NX | XX] [GET] [EX seconds | PX milliseconds | EXAT unix-time-seconds | PXAT unix-time-milliseconds
+    | KEEPTTL]
+SETEX key seconds value | PSETEX key milliseconds value
+GETEX key [EX seconds | PX milliseconds | EXAT unix-time-seconds | PXAT unix-time-milliseconds | PERSIST]
+GETDEL key
+APPEND key value
+SETRANGE key offset value
+GETRANGE key start end
+STRLEN key
+SETBIT key offset 0|1
+GETBIT key offset
+BITCOUNT key [start end [BYTE|BIT]]
+BITPOS key bit [start [end [BYTE|BIT]]]
+BITOP AND|OR|XOR|NOT destkey key [key ...]
+BITFIELD key [GET type offset] [SET type offset value] [INCRBY type offset increment] [OVERFLOW WRAP|SAT|FAIL]
+
+
+Mutable encoding:
+SET stores the value as immutable bytes. If every SETBIT had to build a new bytes object,
+flipping one bit of a 100M bit bitmap (12.5MB) would copy 12.5MB.
+So the first command that modifies part of a string converts the value to a bytearray (one copy),
+and from then on every SETBIT/SETRANGE/APPEND/BITFIELD modifies it in place.
+A plain SET replaces it with bytes again. Reads work the same on both.
+
+Whole buffer operations:
+BITCOUNT and BITPOS never loop over bits (or bytes) in python:
+- BITCOUNT converts fixed size chunks of the buffer to an int and uses int.bit_count().
+- BITPOS skips the leading 0x00 (or 0xff) bytes with bytes.lstrip(), chunk by chunk.
+BITOP converts every operand to one big int (int.from_bytes) and does a single &, |, ^ or ~ on them.
+"""
+from app.errors import RedisCommandError, RedisSyntaxError, WrongTypeOperation, NotAnInteger
+from app.key_value_utils import ValueTypes, ValueObj, NO_EXPIRY, NULL_VALUE_OBJ
+from app.key_expiry import parse_expiry, set_expiry_or_delete
+from app import keyspace_events, memory_management
+from app.keyspace_events import notify_keyspace_event, NOTIFY_STRING
+from app.memory_management import get_from_memstore
+from app.replication import propagate_as
+from app.redis_serialization_protocol import serialize_msg, SerializedTypes, parse_int_token, NULL_BULK_STRING, \
+    get_resp_array_from_elems, OK_SIMPLE_STRING
+
+# Same limit as redis (512MB strings).
+MAX_STRING_BITS = 2 ** 32
+
+# Bytes converted to an int at once by BITCOUNT / BITPOS (keeps the temporary ints small).
+_CHUNK_BYTES = 1 << 20
+
+
+def _get_string_for_read(key, request_recv_time_ms) -> bytes | bytearray:
+    """
+    The string at key (b'' if missing), without converting it.
+    """
+    value_obj = get_from_memstore(key, request_recv_time_ms)
+    if value_obj is NULL_VALUE_OBJ:
+        return b''
+    if value_obj.val_dtype != ValueTypes.STRING:
+        raise WrongTypeOperation()
+    val = value_obj.val
+    return val.encode() if isinstance(val, str) else val
+
+
+def get_mutable_string(key, request_recv_time_ms, create=True) -> bytearray | None:
+    """
+    The string at key as a bytearray (converted in place the first time), to be modified in place.
+    A missing key is created empty if create, otherwise None is returned.
+    """
+    value_obj = get_from_memstore(key, request_recv_time_ms)
+    if value_obj is NULL_VALUE_OBJ:
+        if not create:
+            return None
+        val = bytearray()
+        memory_management.redis_memstore[key] = ValueObj(val=val, unix_expiry_ms=NO_EXPIRY, val_dtype=ValueTypes.STRING)
+        return val
+    if value_obj.val_dtype != ValueTypes.STRING:
+        raise WrongTypeOperation()
+    if not isinstance(value_obj.val, bytearray):
+        val = value_obj.val
+        value_obj.val = bytearray(val.encode() if isinstance(val, str) else val)
+    return value_obj.val
+
+
+def _ensure_size(buf: bytearray, num_bytes: int):
+    if len(buf) < num_bytes:
+        buf.extend(bytes(num_bytes - len(buf)))
+
+
+def _parse_bit_offset(token) -> int:
+    try:
+        offset = parse_int_token(token)
+    except NotAnInteger:
+        offset = -1
+    if not 0 <= offset < MAX_STRING_BITS:
+        raise RedisCommandError("ERR bit offset is not an integer or out of range")
+    return offset
+
+
+def _normalize_range(start, end, length) -> tuple[int, int]:
+    """
+    Inclusive redis range (negative counts from the end) -> python [start, end). Empty -> (0, 0)
+    """
+    if start < 0:
+        start = max(start + length, 0)
+    if end < 0:
+        end = end + length
+    end = min(end, length - 1)
+    if start > end:
+        return 0, 0
+    return start, end + 1
+
+
+######################################################################################################
+# Bit operations
+
+
+def setbit(buf: bytearray, offset: int, bit: int) -> int:
+    byte_idx = offset >> 3
+    _ensure_size(buf, byte_idx + 1)
+    mask = 1 << (7 - (offset & 7))
+    old = 1 if buf[byte_idx] & mask else 0
+    if bit:
+        buf[byte_idx] |= mask
+    else:
+        buf[byte_idx] &= ~mask & 0xff
+    return old
+
+
+def getbit(buf, offset: int) -> int:
+    byte_idx = offset >> 3
+    if byte_idx >= len(buf):
+        return 0
+    return 1 if buf[byte_idx] & (1 << (7 - (offset & 7))) else 0
+
+
+def _count_bits_in_bytes(buf, start, end) -> int:
+    view = memoryview(buf)
+    count = 0
+    for pos in range(start, end, _CHUNK_BYTES):
+        count += int.from_bytes(view[pos:min(pos + _CHUNK_BYTES, end)], 'big').bit_count()
+    return count
+
+
+def bitcount(buf, start=0, end=-1, bit_mode=False) -> int:
+    if not bit_mode:
+        start, end = _normalize_range(start, end, len(buf))
+        return _count_bits_in_bytes(buf, start, end)
+    start, end = _normalize_range(start, end, len(buf) * 8)
+    if start == end:
+        return 0
+    # Full bytes in the middle, then the partial edge bytes bit by bit (at most 7 + 7 bits).
+    first_full, last_full = (start + 7) >> 3, end >> 3
+    if first_full >= last_full:
+        return sum(getbit(buf, i) for i in range(start, end))
+    count = _count_bits_in_bytes(buf, first_full, last_full)
+    count += sum(getbit(buf, i) for i in range(start, first_full * 8))
+    count += sum(getbit(buf, i) for i in range(last_full * 8, end))
+    return count
+
+
+def _first_byte_not(buf, skip_byte: bytes, start, end) -> int:
+    """
+    Index of the first byte in buf[start:end] that isn't skip_byte, -1 if none.
+    """
+    view = memoryview(buf)
+    for pos in range(start, end, _CHUNK_BYTES):
+        chunk = bytes(view[pos:min(pos + _CHUNK_BYTES, end)])
+        stripped = chunk.lstrip(skip_byte)
+        if stripped:
+            return pos + len(chunk) - len(stripped)
+    return -1
+
+
+def _first_bit_in_byte(byte, bit) -> int:
+    """
+    Position (0 = most significant) of the first bit equal to <bit> in byte (which must have one).
+    """
+    if not bit:
+        byte ^= 0xff
+    return 8 - byte.bit_length()
+
+
+def bitpos(buf, bit: int, start=None, end=None, bit_mode=False) -> int:
+    end_given = end is not None
+    length = len(buf) * 8 if bit_mode else len(buf)
+    start, end = _normalize_range(start or 0, end if end_given else -1, length)
+    if start == end:
+        return -1 if (bit or end_given or length) else 0
+
+    if bit_mode:
+        # Partial bytes at the edges are checked bit by bit, the full bytes in between with the byte scan.
+        first_full, last_full = (start + 7) >> 3, end >> 3
+        if first_full >= last_full:
+            candidates = [range(start, end)]
+        else:
+            candidates = [range(start, first_full * 8), (first_full, last_full), range(last_full * 8, end)]
+    else:
+        candidates = [(start, end)]
+
+    skip_byte = b'\x00' if bit else b'\xff'
+    for candidate in candidates:
+        if isinstance(candidate, range):
+            for i in candidate:
+                if getbit(buf, i) == bit:
+                    return i
+            continue
+        byte_idx = _first_byte_not(buf, skip_byte, *candidate)
+        if byte_idx != -1:
+            return byte_idx * 8 + _first_bit_in_byte(buf[byte_idx], bit)
+
+    if bit == 0 and not end_given:
+        # Like redis: looking for a clear bit in a string of 1s, without an explicit end, the string is
+        # considered padded with zeros on the right.
+        return len(buf) * 8
+    return -1
+
+
+def bitop(op: bytes, operands: list) -> bytes:
+    max_len = max((len(b) for b in operands), default=0)
+    if max_len == 0:
+        return b''
+    # Shorter strings are padded with zeros (on the right, ie: the least significant side of a big endian int).
+    nums = [int.from_bytes(b, 'big') << (8 * (max_len - len(b))) for b in operands]
+    match op:
+        case b'AND':
+            result = nums[0]
+            for num in nums[1:]:
+                result &= num
+        case b'OR':
+            result = 0
+            for num in nums:
+                result |= num
+        case b'XOR':
+            result = 0
+            for num in nums:
+                result ^= num
+        case b'NOT':
+            if len(nums) != 1:
+                raise RedisCommandError("ERR BITOP NOT must be called with a single source key.")
+            result = ~nums[0] & ((1 << (8 * max_len)) - 1)
+        case _:
+            raise RedisSyntaxError()
+    return result.to_bytes(max_len, 'big')
+
+
+######################################################################################################
+# BITFIELD
+
+
+def _parse_bitfield_type(token) -> tuple[bool, int]:
+    """
+    i8 -> (signed, 8), u16 -> (unsigned, 16)
+    """
+    token = token.lower()
+    signed = token[:1] == b'i'
+    try:
+        bits = int(token[1:])
+    except ValueError:
+        bits = 0
+    if token[:1] not in (b'i', b'u') or not (1 <= bits <= (64 if signed else 63)):
+        raise RedisCommandError("ERR Invalid bitfield type. Use something like i16 u8. "
+                                "Note that u64 is not supported but i64 is.")
+    return signed, bits
+
+
+def _parse_bitfield_offset(token, bits) -> int:
+    """
+    '100' -> bit 100, '#3' -> bit 3 * bits
+    """
+    if token.startswith(b'#'):
+        return _parse_bit_offset(token[1:]) * bits
+    return _parse_bit_offset(token)
+
+
+def _read_field(buf, offset, bits, signed) -> int:
+    first_byte, last_byte = offset >> 3, (offset + bits - 1) >> 3
+    chunk = bytes(buf[first_byte:last_byte + 1]).ljust(last_byte - first_byte + 1, b'\x00')
+    num = int.from_bytes(chunk, 'big')
+    shift = (last_byte + 1) * 8 - (offset + bits)
+    num = (num >> shift) & ((1 << bits) - 1)
+    if signed and num >> (bits - 1):
+        num -= 1 << bits
+    return num
+
+
+def _write_field(buf: bytearray, offset, bits, value):
+    first_byte, last_byte = offset >> 3, (offset + bits - 1) >> 3
+    _ensure_size(buf, last_byte + 1)
+    num = int.from_bytes(buf[first_byte:last_byte + 1], 'big')
+    shift = (last_byte + 1) * 8 - (offset + bits)
+    mask = ((1 << bits) - 1) << shift
+    num = (num & ~mask) | ((value & ((1 << bits) - 1)) << shift)
+    buf[first_byte:last_byte + 1] = num.to_bytes(last_byte - first_byte + 1, 'big')
+
+
+def _handle_overflow(value, bits, signed, overflow) -> int | None:
+    """
+    The value to store according to the OVERFLOW policy, None for FAIL when out of range.
+    """
+    lo, hi = (-(1 << (bits - 1)), (1 << (bits - 1)) - 1) if signed else (0, (1 << bits) - 1)
+    if lo <= value <= hi:
+        return value
+    match overflow:
+        case b'WRAP':
+            return ((value - lo) % (1 << bits)) + lo
+        case b'SAT':
+            return hi if value > hi else lo
+        case _:
+            return None
+
+
+def bitfield(key, tokens, request_recv_time_ms) -> list[int | None]:
+    # Only create / convert the string if there is a write.
+    has_writes = any(token.upper() in (b'SET', b'INCRBY') for token in tokens[2::])
+    buf = get_mutable_string(key, request_recv_time_ms) if has_writes else \
+        _get_string_for_read(key, request_recv_time_ms)
+    overflow = b'WRAP'
+    results = []
+    i = 2
+    while i < len(tokens):
+        sub_cmd = tokens[i].upper()
+        if sub_cmd == b'OVERFLOW' and i + 1 < len(tokens):
+            overflow = tokens[i + 1].upper()
+            if overflow not in (b'WRAP', b'SAT', b'FAIL'):
+                raise RedisCommandError("ERR Invalid OVERFLOW type specified")
+            i += 2
+            continue
+        if sub_cmd == b'GET' and i + 2 < len(tokens):
+            signed, bits = _parse_bitfield_type(tokens[i + 1])
+            offset = _parse_bitfield_offset(tokens[i + 2], bits)
+            results.append(_read_field(buf, offset, bits, signed))
+            i += 3
+            continue
+        if sub_cmd in (b'SET', b'INCRBY') and i + 3 < len(tokens):
+            signed, bits = _parse_bitfield_type(tokens[i + 1])
+            offset = _parse_bitfield_offset(tokens[i + 2], bits)
+            arg = parse_int_token(tokens[i + 3])
+            old = _read_field(buf, offset, bits, signed)
+            new = _handle_overflow(arg if sub_cmd == b'SET' else old + arg, bits, signed, overflow)
+            if new is not None:
+                _write_field(buf, offset, bits, new)
+            # SET replies with the old value, INCRBY with the new one.
+            results.append(None if new is None else (old if sub_cmd == b'SET' else new))
+            i += 4
+            continue
+        raise RedisSyntaxError()
+    return results
+
+
+######################################################################################################
+# Commands
+
+
+def _parse_bit_mode(tokens, idx) -> bool:
+    if len(tokens) <= idx:
+        return False
+    unit = tokens[idx].upper()
+    if unit not in (b'BYTE', b'BIT'):
+        raise RedisSyntaxError()
+    return unit == b'BIT'
+
+
+def _get_string_value_obj(key, request_recv_time_ms) -> ValueObj:
+    value_obj = get_from_memstore(key, request_recv_time_ms)
+    if value_obj is not NULL_VALUE_OBJ and value_obj.val_dtype != ValueTypes.STRING:
+        raise WrongTypeOperation()
+    return value_obj
+
+
+def _set(tokens, now_ms) -> bytes:
+    key, val = tokens[1], tokens[2]
+    condition, get, keep_ttl, expiry_ms = None, False, False, NO_EXPIRY
+    has_expiry = False
+    i = 3
+    while i < len(tokens):
+        option = tokens[i].upper()
+        if option in (b'NX', b'XX') and condition in (None, option):
+            condition = option
+        elif option == b'GET':
+            get = True
+        elif option == b'KEEPTTL' and not has_expiry:
+            keep_ttl = True
+        elif option in (b'EX', b'PX', b'EXAT', b'PXAT') and not has_expiry and not keep_ttl and i + 1 < len(tokens):
+            expiry_ms = parse_expiry(option, tokens[i + 1], now_ms, 'set')
+            has_expiry = True
+            i += 1
+        else:
+            raise RedisSyntaxError()
+        i += 1
+
+    if get:
+        value_obj = _get_string_value_obj(key, now_ms)
+    else:
+        value_obj = get_from_memstore(key, now_ms)
+    exists = value_obj is not NULL_VALUE_OBJ
+    reply = value_obj.get_val_serialized() if get else OK_SIMPLE_STRING
+    if (condition == b'NX' and exists) or (condition == b'XX' and not exists):
+        # Not set: nothing for the replicas.
+        propagate_as(None)
+        return reply if get else NULL_BULK_STRING
+    if keep_ttl and exists:
+        expiry_ms = value_obj.unix_expiry_ms
+    if expiry_ms != NO_EXPIRY and expiry_ms <= now_ms:
+        # EXAT / PXAT in the past: the value is set and expires right away.
+        memory_management.redis_memstore.pop(key, None)
+    else:
+        memory_management.redis_memstore[key] = ValueObj(val=val, unix_expiry_ms=expiry_ms, val_dtype=ValueTypes.STRING)
+    if keyspace_events.notify_mask & NOTIFY_STRING:
+        notify_keyspace_event(NOTIFY_STRING, b'set', key, memory_management.selected_db)
+    propagate_as(_set_as_applied(key, val, expiry_ms if has_expiry else None, keep_ttl))
+    return reply
+
+
+def _set_as_applied(key, val, expiry_ms: int | None, keep_ttl=False) -> list[bytes]:
+    """
+    SET as propagated to the replicas, without the options that were only checked here (NX / XX / GET).
+    An expiry is sent as an absolute PXAT (like redis): counted from the replica's own clock, EX / PX would
+    expire it later there.
+    """
+    tokens = [b'SET', key, val]
+    if keep_ttl:
+        tokens.append(b'KEEPTTL')
+    elif expiry_ms is not None:
+        tokens += [b'PXAT', str(expiry_ms).encode()]
+    return tokens
+
+
+def _getex(tokens, now_ms) -> bytes:
+    key = tokens[1]
+    # None: the expiry is left alone.
+    expiry_ms = None
+    if len(tokens) == 3 and tokens[2].upper() == b'PERSIST':
+        expiry_ms = NO_EXPIRY
+    elif len(tokens) == 4 and tokens[2].upper() in (b'EX', b'PX', b'EXAT', b'PXAT'):
+        expiry_ms = parse_expiry(tokens[2].upper(), tokens[3], now_ms, 'getex')
+    elif len(tokens) != 2:
+        raise RedisSyntaxError()
+    value_obj = _get_string_value_obj(key, now_ms)
+    if value_obj is not NULL_VALUE_OBJ and expiry_ms is not None:
+        set_expiry_or_delete(key, expiry_ms, now_ms)
+        propagate_as([b'PERSIST', key] if expiry_ms == NO_EXPIRY else
+                     [b'PEXPIREAT', key, str(expiry_ms).encode()])
+    else:
+        # Nothing changed.
+        propagate_as(None)
+    return value_obj.get_val_serialized()
+
+
+def handle_string_command(first_token, tokens, request_recv_time_ms):
+    key = tokens[1]
+    match first_token:
+        case b'SET':
+            return _set(tokens, request_recv_time_ms)
+        case b'SETEX' | b'PSETEX':
+            option = b'EX' if first_token == b'SETEX' else b'PX'
+            expiry_ms = parse_expiry(option, tokens[2], request_recv_time_ms, first_token.decode().lower())
+            memory_management.redis_memstore[key] = ValueObj(val=tokens[3], unix_expiry_ms=expiry_ms,
+                                                             val_dtype=ValueTypes.STRING)
+            if keyspace_events.notify_mask & NOTIFY_STRING:
+                notify_keyspace_event(NOTIFY_STRING, b'set', key, memory_management.selected_db)
+            propagate_as(_set_as_applied(key, tokens[3], expiry_ms))
+            return OK_SIMPLE_STRING
+        case b'GETEX':
+            return _getex(tokens, request_recv_time_ms)
+        case b'GETDEL':
+            value_obj = _get_string_value_obj(key, request_recv_time_ms)
+            if value_obj is not NULL_VALUE_OBJ:
+                del memory_management.redis_memstore[key]
+            return value_obj.get_val_serialized()
+        case b'APPEND':
+            buf = get_mutable_string(key, request_recv_time_ms)
+            buf += tokens[2]
+            return serialize_msg(len(buf), SerializedTypes.INTEGER)
+        case b'SETRANGE':
+            offset = parse_int_token(tokens[2])
+            value = tokens[3]
+            if offset < 0 or offset + len(value) > MAX_STRING_BITS // 8:
+                raise RedisCommandError("ERR offset is out of range")
+            if not value:
+                # Nothing to write: don't create the key.
+                return serialize_msg(len(_get_string_for_read(key, request_recv_time_ms)), SerializedTypes.INTEGER)
+            buf = get_mutable_string(key, request_recv_time_ms)
+            _ensure_size(buf, offset)
+            buf[offset:offset + len(value)] = value
+            return serialize_msg(len(buf), SerializedTypes.INTEGER)
+        case b'GETRANGE':
+            buf = _get_string_for_read(key, request_recv_time_ms)
+            start, end = _normalize_range(parse_int_token(tokens[2]), parse_int_token(tokens[3]), len(buf))
+            return serialize_msg(bytes(buf[start:end]), SerializedTypes.BULK_STRING)
+        case b'STRLEN':
+            return serialize_msg(len(_get_string_for_read(key, request_recv_time_ms)), SerializedTypes.INTEGER)
+        case b'SETBIT':
+            offset = _parse_bit_offset(tokens[2])
+            if tokens[3] not in (b'0', b'1'):
+                raise RedisCommandError("ERR bit is not an integer or out of range")
+            buf = get_mutable_string(key, request_recv_time_ms)
+            return serialize_msg(setbit(buf, offset, int(tokens[3])), SerializedTypes.INTEGER)
+        case b'GETBIT':
+            offset = _parse_bit_offset(tokens[2])
+            buf = _get_string_for_read(key, request_recv_time_ms)
+            return serialize_msg(getbit(buf, offset), SerializedTypes.INTEGER)
+        case b'BITCOUNT':
+            buf = _get_string_for_read(key, request_recv_time_ms)
+            if len(tokens) == 2:
+                return serialize_msg(bitcount(buf), SerializedTypes.INTEGER)
+            if len(tokens) < 4:
+                raise RedisSyntaxError()
+            start, end = parse_int_token(tokens[2]), parse_int_token(tokens[3])
+            count = bitcount(buf, start, end, bit_mode=_parse_bit_mode(tokens, 4))
+            return serialize_msg(count, SerializedTypes.INTEGER)
+        case b'BITPOS':
+            if tokens[2] not in (b'0', b'1'):
+                raise RedisCommandError("ERR The bit argument must be 1 or 0.")
+            bit = int(tokens[2])
+            start = parse_int_token(tokens[3]) if len(tokens) > 3 else None
+            end = parse_int_token(tokens[4]) if len(tokens) > 4 else None
+            bit_mode = _parse_bit_mode(tokens, 5)
+            value_obj = get_from_memstore(key, request_recv_time_ms)
+            if value_obj is NULL_VALUE_OBJ:
+                return serialize_msg(-1 if bit else 0, SerializedTypes.INTEGER)
+            buf = _get_string_for_read(key, request_recv_time_ms)
+            return serialize_msg(bitpos(buf, bit, start, end, bit_mode), SerializedTypes.INTEGER)
+        case b'BITOP':
+            op, dest_key = tokens[1].upper(), tokens[2]
+            operands = [_get_string_for_read(k, request_recv_time_ms) for k in tokens[3:]]
+            result = bitop(op, operands)
+            memory_management.redis_memstore.pop(dest_key, None)
+            if result:
+                memory_management.redis_memstore[dest_key] = ValueObj(val=result, unix_expiry_ms=NO_EXPIRY,
+                                                                      val_dtype=ValueTypes.STRING)
+            return serialize_msg(len(result), SerializedTypes.INTEGER)
+        case b'BITFIELD':
+            results = bitfield(key, tokens, request_recv_time_ms)
+            return get_resp_array_from_elems([NULL_BULK_STRING if r is None else
+                                              serialize_msg(r, SerializedTypes.INTEGER) for r in results])
+        case _:
+            raise RedisSyntaxError()
@@ -1,14 +1,18 @@
 import asyncio
 from dataclasses import dataclass
+from typing import Callable
 from enum import Enum
 import socket
 
-from app.errors import IncrOnStringValue
-from app.memory_management import set_to_memstore, incr_in_memstore
+from app.client_tracking import flush_invalidations
+from app.output_buffer import is_over_output_limit, disconnect_over_limit
 from app.redis_serialization_protocol import serialize_msg, SerializedTypes, parse_redis_bytes, OK_SIMPLE_STRING, \
-    parse_redis_bytes_multiple_cmd, CLRS
+    parse_client_commands, CLRS
+from app.server_clock import now_ms
 
 MAX_MSG_LEN = 1000
+# Reads of the replication stream: a busy master sends many commands per read, applied together.
+MASTER_READ_SIZE = 64 * 1024
 
 class ReplicationRole(Enum):
     MASTER = 'master'
@@ -49,16 +53,41 @@ _master_conn_writer = None
 # to which replica replies "REPLCONF ACK <num_bytes>").
 num_bytes_processed = 0
 
+# Bytes received from master and not applied yet.
+_master_buffer = bytearray()
+
+# Runs a command from master on this replica (main.py registers it: see on_command_from_master).
+_apply_master_command: Callable[[list[bytes], object], object] | None = None
+
+
+def on_command_from_master(apply: Callable[[list[bytes], object], object]):
+    """
+    apply(tokens, master_conn) runs a command of the replication stream, like the command of a client
+    (the master's own client: its selected database, its MULTI state ...). Its reply is not sent.
+    """
+    global _apply_master_command
+    _apply_master_command = apply
+
+
+def is_master_conn(write_conn) -> bool:
+    return write_conn is not None and write_conn is _master_conn_writer
+
 
 def get_replication_info():
     info_map = {}
-    print('info map', info_map)
-    if _replication_meta.role == ReplicationRole.MASTER:
-        info_map['role'] = _replication_meta.role.value
-        info_map['master_repl_offset'] = _replication_meta.master_repl_offset
-        info_map['master_replid'] = _replication_meta.master_replid
+    role = get_replication_role()
+    info_map['role'] = role.value
+    if role == ReplicationRole.MASTER:
+        info_map['connected_slaves'] = len(_my_replicas)
+        if _replication_meta is not None:
+            info_map['master_replid'] = _replication_meta.master_replid
+            info_map['master_repl_offset'] = _replication_meta.master_repl_offset
+        for i, (addr, offset, lag_bytes, lag_seconds) in enumerate(get_replica_lags()):
+            info_map[f'slave{i}'] = f"addr={addr},offset={offset},lag={int(lag_seconds)},lag_bytes={lag_bytes}"
     else:
-        info_map['role'] = _replication_meta.role.value
+        info_map['master_host'], info_map['master_port'] = _replication_meta.master_addr
+        info_map['master_link_status'] = 'up' if _master_conn_writer is not None else 'down'
+        info_map['slave_repl_offset'] = num_bytes_processed
     return info_map
 
 
@@ -86,14 +115,16 @@ async def _init_replica(master_addr, port):
     await send_psync()
     # Now master returns whether I need to do FULLRESYNC or partial sync.
     # It also sends an RDB file.
-    sync_msg = await _master_conn_reader.read(MAX_MSG_LEN)
-    print(str(sync_msg))
-    # msg format: FULLRESYNC <master_id> <offset>\r\n<length>\r\n<rdb_snap_bytes><any_other_commands_might_also_be_here>
-    # The tcp packet sent by master MAY have extra commands just after the FULLRESYNC like SET/INCR/REPLCONF.
-    # So we need to parse the exact byte where FULLRESYNC part ends and next part starts.
-    remainder_bytes = get_bytes_after_fullresync(sync_msg)
-    if remainder_bytes:
-        await handle_propagated_cmds(remainder_bytes)
+    # msg format: +FULLRESYNC <master_id> <offset>\r\n$<length>\r\n<rdb_snap_bytes><any_other_commands_might_also_be_here>
+    # It may come in any number of reads, and the last one MAY have the first propagated commands (SET/INCR/REPLCONF).
+    while (sync_len := parse_fullresync(_master_buffer)) is None:
+        data = await _master_conn_reader.read(MASTER_READ_SIZE)
+        if not data:
+            raise ConnectionError("Connection closed by master during the sync")
+        _master_buffer.extend(data)
+    print(f"FULLRESYNC received ({sync_len} bytes)")
+    del _master_buffer[:sync_len]
+    apply_master_stream()
 
     # Now listen for propagated commands like SET/INCR
     # Start background listener.
@@ -101,38 +132,45 @@ async def _init_replica(master_addr, port):
     # We need to run this in background, so that we can continue and start the server to which clients can connect.
     asyncio.create_task(listen_to_master())
 
-def get_bytes_after_fullresync(resync_msg):
-    """
 
+def parse_fullresync(buffer: bytes | bytearray) -> int | None:
     """
-    SPACE = b' '
-    tokens = resync_msg.split(SPACE)
-    # ignore first two tokens (FULLRESYNC <master_id>)
-    # third token has rdb file followed immediately by the next command (without space).
-    # third token: <offset>\r\n$<length>\r\n<rdb_snapshot_bytes><any_other_commands_might_also_be_here>
-    third_token = tokens[2]
-    third_token_split = third_token.split(CLRS)
-    # The rdb_length is in format $<int_len>. So skip the $.
-    rdb_len = third_token_split[1][1:]
-    rdb_len = int(rdb_len)
+    The number of bytes the FULLRESYNC reply and the RDB that follows take at the start of buffer,
+    None if they aren't fully received yet.
 
-    bytes_after_rdb_len = CLRS.join(third_token_split[2:])
-    bytes_after_rdb = bytes_after_rdb_len[rdb_len:]
-    print('bytes after rdb', bytes_after_rdb)
-
-    # keep bytes after RDB from third_token and other tokens as is.
-    result = bytes_after_rdb
-    if tokens[3:]:
-        result += b' ' + b' '.join(tokens[3:])
-    print('bytes after FULLRESYNC', result)
-    return result
+    The RDB is skipped by its length prefix, never searched for delimiters: it's binary, CRLFs and spaces
+    included. (This replica starts empty: the snapshot itself is not loaded.)
+    """
+    line_end = buffer.find(CLRS)
+    if line_end == -1:
+        return None
+    length_end = buffer.find(CLRS, line_end + 2)
+    if length_end == -1:
+        return None
+    # $<length>
+    rdb_len = int(bytes(buffer[line_end + 2:length_end]).lstrip(b'$'))
+    rdb_end = length_end + 2 + rdb_len
+    return rdb_end if rdb_end <= len(buffer) else None
+
+
+def get_bytes_after_fullresync(resync_msg: bytes) -> bytes:
+    """
+    What master sent after the RDB (the first propagated commands), in a complete FULLRESYNC message.
+    """
+    sync_len = parse_fullresync(resync_msg)
+    if sync_len is None:
+        raise ValueError("Incomplete FULLRESYNC message")
+    return resync_msg[sync_len:]
 
 
 def get_replication_role():
+    if _replication_meta is None:
+        # Not initialized (no server running, eg: tests).
+        return ReplicationRole.MASTER
     return _replication_meta.role
 
 def is_master():
-    return _replication_meta.role == ReplicationRole.MASTER
+    return get_replication_role() == ReplicationRole.MASTER
 
 ########################################################################################
 # Methods on Replica end
@@ -221,42 +259,51 @@ async def send_psync():
 async def listen_to_master():
 
     while True:
-        data = await _master_conn_reader.read(MAX_MSG_LEN)
+        data = await _master_conn_reader.read(MASTER_READ_SIZE)
         if not data:
             # When no data, that means EOF was sent.
             # Client has closed connection, so break out of loop.
             print(f"Connection closed by master")
             break
-        print('data recvd from master', data)
-        await handle_propagated_cmds(data)
+        _master_buffer.extend(data)
+        apply_master_stream()
 
 
+def apply_master_stream() -> int:
+    """
+    Apply every complete command at the start of _master_buffer, and keep the rest (the start of a command split
+    across reads) for the next read. Returns the number of commands applied.
+    """
+    commands, used = parse_client_commands(_master_buffer)
+    if not commands:
+        return 0
+    del _master_buffer[:used]
+    handle_propagated_cmds(commands)
+    return len(commands)
+
 
+def handle_propagated_cmds(commands: list[tuple[list[bytes], int]]):
+    """
+    Apply (tokens, length in bytes) commands from master, all in one go (no yield in between).
+    num_bytes_processed is updated once at the end.
 
-async def handle_propagated_cmds(data: bytes):
+    Every command but REPLCONF runs through the same dispatch as the commands of clients (on_command_from_master),
+    so the replica applies whatever the master propagates: SELECT, MULTI ... EXEC, every data type.
+    """
     global num_bytes_processed
-    cmds = parse_redis_bytes_multiple_cmd(data)
-    print("cmds recvd from master:\n", cmds)
-    for message, data_len in cmds:
-        # for simplicity I am handling only simple SET and INCR, no TTL nothing (unless later challenges require it).
-        # This is good enough for POC.
-        tokens = list(message)
-        first_token = tokens[0].upper()
-        print('first token:', first_token)
-        match first_token:
-            case b'SET':
-                key, val = tokens[1], tokens[2]
-                set_to_memstore(key, val)
-            case b'INCR':
-                key = tokens[1]
-                num = incr_in_memstore(key)
-            case b'REPLCONF':
-                # This is the master's way of checking whether replica is in sync. (REPLCONF GETACK *)
-                # the replica has to return the offset of the num_bytes it has processed.
-                await write_to_master(serialize_msg(["replconf", "ACK", num_bytes_processed], SerializedTypes.ARRAY))
-
-        print("adding to num bytes", data_len)
-        num_bytes_processed += data_len
+    offset = num_bytes_processed
+    for tokens, data_len in commands:
+        if tokens[0].upper() == b'REPLCONF':
+            # This is the master's way of checking whether replica is in sync. (REPLCONF GETACK *)
+            # the replica has to return the offset of the num_bytes it has processed (before this command).
+            # No drain: the ack is tiny, and the batch must not yield.
+            _master_conn_writer.write(serialize_msg(["replconf", "ACK", offset], SerializedTypes.ARRAY))
+        else:
+            _apply_master_command(tokens, _master_conn_writer)
+        offset += data_len
+    num_bytes_processed = offset
+    # Clients of this replica with CLIENT TRACKING on.
+    flush_invalidations()
 
 
 
@@ -266,29 +313,140 @@ async def handle_propagated_cmds(data: bytes):
 # Stores replicas connected to this master.
 _my_replicas = set()
 
+# Database of the last command written to the replication stream.
+_stream_db = 0
+
+# replica write_conn -> (offset in its last "REPLCONF ACK <offset>", unix time of that ack)
+_replica_acks = {}
+
 def get_master_replid():
     return _replication_meta.master_replid
 
 
 def add_replica_conn(write_conn):
+    global _stream_db
+    if write_conn not in _my_replicas:
+        # Its link starts in db 0: the next command says which database it is for.
+        _stream_db = -1
     _my_replicas.add(write_conn)
+    # Until its first ack, a replica is as far behind as the whole stream.
+    _replica_acks.setdefault(write_conn, (0, now_ms() / 1000))
     print("num replicas connected to master:", len(_my_replicas))
 
 
-async def propagate_to_replica_if_write_cmd(data: bytes):
+def remove_replica_conn(write_conn):
+    _my_replicas.discard(write_conn)
+    _replica_acks.pop(write_conn, None)
+
+
+def is_replica_conn(write_conn) -> bool:
+    return write_conn in _my_replicas
+
+
+def record_replica_ack(write_conn, offset: int):
+    _replica_acks[write_conn] = (offset, now_ms() / 1000)
+
+
+def get_replica_lags() -> list[tuple[str, int, int, float]]:
+    """
+    (addr, acked offset, lag in bytes, seconds since the last ack) of every replica of this master.
+    """
+    master_offset = _replication_meta.master_repl_offset if _replication_meta is not None else 0
+    now = now_ms() / 1000
+    lags = []
+    for write_conn in _my_replicas:
+        offset, ack_time = _replica_acks.get(write_conn, (0, now))
+        peer = write_conn.get_extra_info('peername') if write_conn is not None else None
+        addr = f"{peer[0]}:{peer[1]}" if peer else '?'
+        lags.append((addr, offset, max(master_offset - offset, 0), now - ack_time))
+    return lags
+
+
+def append_to_replication_stream(data: bytes):
+    """
+    Write data to every replica, without waiting for it to be sent (no yield: used inside EXEC).
+    """
     # Only master can propagate commands.
-    if not is_master():
+    if get_replication_role() != ReplicationRole.MASTER:
         return
-    CMDS_TO_PROPAGATE = [b'SET', b'INCR']
-    err_flag, message = parse_redis_bytes(data)
-    tokens = list(message)
-    first_token = tokens[0].upper()
-    if first_token in CMDS_TO_PROPAGATE:
-        for w in _my_replicas:
+    if _replication_meta is not None:
+        _replication_meta.master_repl_offset += len(data)
+    too_slow = []
+    for w in _my_replicas:
+        if is_over_output_limit(w, 'replica', len(data)):
+            too_slow.append(w)
+        else:
             w.write(data)
+    for w in too_slow:
+        # It will have to resync from scratch.
+        remove_replica_conn(w)
+        disconnect_over_limit(w, 'replica')
+
+
+def replication_frame(tokens: list[bytes], db: int) -> bytes:
+    """
+    The command as written to the replication stream, after a SELECT if it's for another database than the
+    previous one.
+    """
+    global _stream_db
+    frame = serialize_msg(tokens, SerializedTypes.ARRAY)
+    if db != _stream_db:
+        _stream_db = db
+        frame = serialize_msg([b'SELECT', str(db).encode()], SerializedTypes.ARRAY) + frame
+    return frame
+
+
+def propagate_write(tokens: list[bytes], db: int):
+    """
+    A write command that ran on this master (outside of MULTI / scripts, which are propagated as one unit).
+    """
+    # Only master can propagate commands.
+    if not is_master():
+        return
+    # No drain: a slow replica must not hold back the client that wrote.
+    # What it hasn't read yet is bounded by the replica output buffer limits.
+    append_to_replication_stream(replication_frame(tokens, db))
 
-        # use asyncio.gather to simultaneously drain all replica writers.
-        await asyncio.gather(
-            *(w.drain() for w in _my_replicas)
-        )
+
+# How the write command being run reaches the replicas, when it's not as its own tokens.
+# Both are set while the command runs, and taken by handle_command once it has run (take_propagated_commands).
+_NOT_REWRITTEN = object()
+# The tokens to propagate instead of the command's own. None: nothing.
+_rewritten_command = _NOT_REWRITTEN
+# Writes done on behalf of the command, propagated after it (the pops of the blocked clients a push served).
+_also_propagated: list[list[bytes]] = []
+
+
+def propagate_as(tokens: list[bytes] | None):
+    """
+    For a write command that would not do the same on a replica, run as is: eg. XADD * (the replica would
+    pick its own id) is propagated with the id it got. None: nothing is propagated (nothing was written).
+    Called right before the command returns (after any wait).
+    """
+    global _rewritten_command
+    _rewritten_command = tokens
+
+
+def also_propagate(tokens: list[bytes]):
+    """
+    A write run inside the current command for another client (a blocked client served by a push, see
+    blocking.py): it reaches the replicas right after the current command.
+    """
+    _also_propagated.append(tokens)
+
+
+def take_propagated_commands(tokens: list[bytes]) -> list[list[bytes]]:
+    """
+    The commands the command that just ran (tokens) propagates, if it is a write command that didn't fail.
+    """
+    global _rewritten_command
+    rewritten, _rewritten_command = _rewritten_command, _NOT_REWRITTEN
+    if rewritten is _NOT_REWRITTEN:
+        commands = [tokens]
+    else:
+        commands = [rewritten] if rewritten is not None else []
+    if _also_propagated:
+        commands.extend(_also_propagated)
+        _also_propagated.clear()
+    return commands
 
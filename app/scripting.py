@@ -0,0 +1,455 @@
+"""
+Server side scripts.
+
+EVAL script numkeys [key ...] [arg ...]
+EVALSHA sha1 numkeys [key ...] [arg ...]
+SCRIPT LOAD script | EXISTS sha1 [sha1 ...] | FLUSH [ASYNC|SYNC]
+
+A script runs a read-modify-write flow (rate limiter, conditional append ...) in one round trip:
+
+    local current = redis.call('INCR', KEYS[1])
+    if current == 1 then redis.call('PEXPIRE', KEYS[1], ARGV[1]) end
+    return current
+
+Engines:
+1. Lua, through lupa (optional dependency: pip install lupa), with a sandboxed runtime: no os, io, require,
+   debug, coroutine ..., and no attribute of a python object can be read or set from Lua. The redis table of
+   a script only holds Lua functions, the python callables they call are out of the script's reach.
+2. A restricted python DSL, for scripts starting with "#!python". Without lupa, other scripts are refused rather
+   than run as python: KEYS[1] is the first key in Lua, the second one in python.
+   The script is the body of a function of KEYS, ARGV and redis. It is checked on the AST before it is compiled:
+   no imports, no attribute access except redis.call / redis.pcall / redis.error_reply / redis.status_reply,
+   no names starting with '_', no while loops, no def / class / lambda, and only a few builtins.
+
+       #!python
+       current = redis.call('INCR', KEYS[0])
+       if current == 1:
+           redis.call('PEXPIRE', KEYS[0], ARGV[0])
+       return current
+
+Compiled scripts are cached by the SHA1 of their source (EVALSHA / SCRIPT LOAD).
+
+Nothing else runs while a script runs (see below), so a script gets busy-reply-threshold ms: past that, it is
+stopped with an error (the writes it already made stay). Lua checks the time every 100k VM instructions
+(a debug hook), the DSL every 1000 iterations of each for loop / comprehension.
+
+redis.call() goes through the regular command dispatcher (the dispatch callable given by main.py),
+which runs the command without yielding to the event loop: the whole script is atomic.
+The write commands it runs are propagated to the replicas as a single MULTI ... EXEC (see main.py).
+
+Type conversions (same as redis):
+reply -> script:  integer -> int, bulk string -> bytes, nil -> False (Lua) / None (python), array -> table / list,
+                  status -> {ok=...}, error -> {err=...} (redis.pcall only, redis.call raises it)
+script -> reply:  int / float (truncated) -> integer, string -> bulk, table / list -> array, true -> 1,
+                  false / nil -> nil, {ok=...} -> status, {err=...} -> error
+"""
+import ast
+import hashlib
+import time
+from typing import Callable
+
+from app.config import server_config
+from app.errors import RedisCommandError, RedisSyntaxError
+from app.redis_serialization_protocol import serialize_msg, SerializedTypes, NULL_BULK_STRING, \
+    get_resp_array_from_elems, parse_int_token
+
+try:
+    from lupa import LuaRuntime, LuaError
+except ImportError:
+    LuaRuntime, LuaError = None, None
+
+PYTHON_SHEBANG = b'#!python'
+
+# Commands a script can't run.
+_NOT_ALLOWED_IN_SCRIPTS = frozenset({
+    b'EVAL', b'EVALSHA', b'SCRIPT', b'MULTI', b'EXEC', b'DISCARD', b'WATCH', b'UNWATCH', b'SUBSCRIBE',
+    b'UNSUBSCRIBE', b'PSUBSCRIBE', b'PUNSUBSCRIBE', b'SSUBSCRIBE', b'SUNSUBSCRIBE', b'HELLO', b'CLIENT',
+    b'PSYNC', b'REPLCONF',
+})
+
+
+class ScriptError(RedisCommandError):
+    """
+    An error reply raised inside a script (redis.call() error, redis.error_reply() ...).
+    """
+
+
+def _over_budget_message(time_limit_ms) -> str:
+    return f"script stopped after running for {time_limit_ms} ms (busy-reply-threshold)"
+
+
+######################################################################################################
+# RESP replies <-> plain python values
+
+
+def parse_reply(data: bytes, idx: int = 0):
+    """
+    A serialized reply -> (value, next idx). Errors are returned as {'err': msg}, statuses as {'ok': msg}.
+    """
+    kind, end = data[idx:idx + 1], data.index(b'\r\n', idx)
+    line = data[idx + 1:end]
+    idx = end + 2
+    match kind:
+        case b'+':
+            return {'ok': line}, idx
+        case b'-':
+            return {'err': line}, idx
+        case b':':
+            return int(line), idx
+        case b'_':
+            return None, idx
+        case b'$':
+            length = int(line)
+            if length == -1:
+                return None, idx
+            return data[idx:idx + length], idx + length + 2
+        case b'*' | b'>' | b'%':
+            length = int(line)
+            if length == -1:
+                return None, idx
+            if kind == b'%':
+                length *= 2
+            elems = []
+            for _ in range(length):
+                elem, idx = parse_reply(data, idx)
+                elems.append(elem)
+            return elems, idx
+    raise ValueError(f"Can't parse reply {data!r}")
+
+
+def _as_token(arg) -> bytes:
+    if isinstance(arg, bytes):
+        return arg
+    if isinstance(arg, bytearray):
+        return bytes(arg)
+    if isinstance(arg, bool):
+        raise ScriptError("ERR Lua redis lib command arguments must be strings or integers")
+    if isinstance(arg, float) and arg.is_integer():
+        arg = int(arg)
+    if isinstance(arg, int | float | str):
+        return str(arg).encode()
+    raise ScriptError("ERR Lua redis lib command arguments must be strings or integers")
+
+
+def serialize_script_result(value) -> bytes:
+    if value is None or value is False:
+        return NULL_BULK_STRING
+    if value is True:
+        return serialize_msg(1, SerializedTypes.INTEGER)
+    if isinstance(value, int | float):
+        return serialize_msg(int(value), SerializedTypes.INTEGER)
+    if isinstance(value, bytes | bytearray | str):
+        return serialize_msg(value, SerializedTypes.BULK_STRING)
+    if isinstance(value, dict):
+        if 'err' in value:
+            return serialize_msg(_as_token(value['err']), SerializedTypes.ERROR)
+        if 'ok' in value:
+            return serialize_msg(_as_token(value['ok']), SerializedTypes.SIMPLE_STRING)
+        raise ScriptError("ERR Error running script: can't convert a dict to a reply")
+    if isinstance(value, list | tuple):
+        return get_resp_array_from_elems([serialize_script_result(v) for v in value])
+    raise ScriptError(f"ERR Error running script: can't convert {type(value).__name__} to a reply")
+
+
+class RedisAPI:
+    """
+    The "redis" object of a script.
+    """
+
+    def __init__(self, dispatch: Callable[[list[bytes]], bytes]):
+        self._dispatch = dispatch
+
+    def pcall(self, *args):
+        if not args:
+            raise ScriptError("ERR Please specify at least one argument for this redis lib call")
+        tokens = [_as_token(arg) for arg in args]
+        if tokens[0].upper() in _NOT_ALLOWED_IN_SCRIPTS:
+            return {'err': b'ERR This Redis command is not allowed from script'}
+        return parse_reply(self._dispatch(tokens))[0]
+
+    def call(self, *args):
+        reply = self.pcall(*args)
+        if isinstance(reply, dict) and 'err' in reply:
+            raise ScriptError(reply['err'].decode(errors='replace'))
+        return reply
+
+    @staticmethod
+    def error_reply(msg):
+        return {'err': _as_token(msg)}
+
+    @staticmethod
+    def status_reply(msg):
+        return {'ok': _as_token(msg)}
+
+
+######################################################################################################
+# Restricted python DSL
+
+
+_ALLOWED_NODES = (
+    ast.Module, ast.Expr, ast.Assign, ast.AugAssign, ast.Return, ast.If, ast.For, ast.Break, ast.Continue, ast.Pass,
+    ast.Name, ast.Load, ast.Store, ast.Constant, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.Call,
+    ast.Attribute, ast.Subscript, ast.Slice, ast.List, ast.Tuple, ast.Dict, ast.IfExp, ast.ListComp,
+    ast.comprehension, ast.JoinedStr, ast.FormattedValue,
+    ast.operator, ast.cmpop, ast.boolop, ast.unaryop, ast.expr_context,
+)
+_REDIS_API_ATTRIBUTES = frozenset({'call', 'pcall', 'error_reply', 'status_reply'})
+
+
+def _tonumber(value):
+    try:
+        num = float(value)
+    except (TypeError, ValueError):
+        return None
+    return int(num) if num.is_integer() else num
+
+
+def _tostring(value) -> bytes:
+    return _as_token(value)
+
+
+_DSL_BUILTINS = {
+    'int': int, 'float': float, 'len': len, 'range': range, 'min': min, 'max': max, 'abs': abs,
+    'list': list, 'tonumber': _tonumber, 'tostring': _tostring, 'True': True, 'False': False, 'None': None,
+}
+
+
+# perf_counter() deadline of the running DSL script (0: no limit), and its budget. Scripts don't nest.
+_dsl_deadline = 0.0
+_dsl_time_limit_ms = 0
+_DSL_BUDGET_CHECK_EVERY = 1000
+
+
+def _budgeted(iterable):
+    """
+    Every for loop and comprehension of a DSL script iterates through this (there are no while loops).
+    """
+    for i, item in enumerate(iterable):
+        if not i % _DSL_BUDGET_CHECK_EVERY and _dsl_deadline and time.perf_counter() > _dsl_deadline:
+            raise ScriptError(f"ERR Error running script: {_over_budget_message(_dsl_time_limit_ms)}")
+        yield item
+
+
+class _BudgetLoops(ast.NodeTransformer):
+    """
+    for x in it / [... for x in it] -> ... in _budgeted(it). (Scripts can't name _budgeted: no '_' names.)
+    """
+
+    def _budgeted(self, node):
+        self.generic_visit(node)
+        node.iter = ast.Call(func=ast.Name(id='_budgeted', ctx=ast.Load()), args=[node.iter], keywords=[])
+        return node
+
+    visit_For = visit_comprehension = _budgeted
+
+
+def _check_dsl_ast(tree: ast.AST):
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise RedisCommandError(f"ERR Error compiling script: {type(node).__name__} is not allowed")
+        if isinstance(node, ast.Name) and node.id.startswith('_'):
+            raise RedisCommandError(f"ERR Error compiling script: name {node.id} is not allowed")
+        if isinstance(node, ast.Attribute) and not (
+                isinstance(node.value, ast.Name) and node.value.id == 'redis' and node.attr in _REDIS_API_ATTRIBUTES):
+            raise RedisCommandError(f"ERR Error compiling script: attribute {node.attr} is not allowed")
+
+
+def compile_python_script(source: bytes) -> Callable:
+    body = source[len(PYTHON_SHEBANG):] if source.startswith(PYTHON_SHEBANG) else source
+    try:
+        tree = ast.parse(body.decode(), mode='exec')
+    except (SyntaxError, UnicodeDecodeError) as e:
+        raise RedisCommandError(f"ERR Error compiling script: {e}")
+    _check_dsl_ast(tree)
+    tree = _BudgetLoops().visit(tree)
+    # The script is the body of a function, so that "return" works.
+    func = ast.FunctionDef(name='script', args=ast.arguments(
+        posonlyargs=[], args=[ast.arg('KEYS'), ast.arg('ARGV'), ast.arg('redis')], kwonlyargs=[], kw_defaults=[],
+        defaults=[]), body=tree.body or [ast.Pass()], decorator_list=[], returns=None, type_params=[])
+    module = ast.fix_missing_locations(ast.Module(body=[func], type_ignores=[]))
+    namespace = {'__builtins__': _DSL_BUILTINS, '_budgeted': _budgeted}
+    exec(compile(module, '<script>', 'exec'), namespace)
+    script = namespace['script']
+
+    def run(keys, argv, redis_api, time_limit_ms):
+        global _dsl_deadline, _dsl_time_limit_ms
+        _dsl_deadline = time.perf_counter() + time_limit_ms / 1000 if time_limit_ms > 0 else 0.0
+        _dsl_time_limit_ms = time_limit_ms
+        try:
+            return script(keys, argv, redis_api)
+        finally:
+            _dsl_deadline = 0.0
+    return run
+
+
+######################################################################################################
+# Lua (lupa)
+
+
+_lua = None
+# start_budget(seconds, message), stop_budget() and make_api(call, pcall, error_reply, status_reply) of _lua.
+_lua_helpers = None
+
+# Run once per runtime. The helpers keep what they need from os / debug in upvalues: scripts can't reach them.
+_LUA_SETUP = b"""
+local sethook, clock, error = debug.sethook, os.clock, error
+
+-- Sandbox: only the pure libraries (string, table, math ...).
+os = nil; io = nil; require = nil; dofile = nil; loadfile = nil; load = nil; package = nil; debug = nil
+python = nil; coroutine = nil
+
+local function start_budget(seconds, message)
+    local deadline = clock() + seconds
+    sethook(function()
+        if clock() > deadline then
+            -- From now on fail at every instruction, so that a pcall() in the script can't go on running.
+            sethook(function() error(message, 0) end, '', 1)
+            error(message, 0)
+        end
+    end, '', 100000)
+end
+
+local function make_api(call, pcall, error_reply, status_reply)
+    return {
+        call = function(...) return call(...) end,
+        pcall = function(...) return pcall(...) end,
+        error_reply = function(msg) return error_reply(msg) end,
+        status_reply = function(msg) return status_reply(msg) end,
+    }
+end
+
+return start_budget, sethook, make_api
+"""
+
+
+def _deny_attribute_access(obj, attr_name, is_setting):
+    """
+    lupa attribute_filter: scripts never see python attributes (obj.__globals__, obj.__class__ ...).
+    """
+    raise AttributeError("python attributes can't be accessed from scripts")
+
+
+def _lua_runtime():
+    global _lua, _lua_helpers
+    if _lua is None:
+        _lua = LuaRuntime(encoding=None, register_eval=False, register_builtins=False,
+                          attribute_filter=_deny_attribute_access)
+        _lua_helpers = _lua.execute(_LUA_SETUP)
+    return _lua
+
+
+def _from_lua(value):
+    if hasattr(value, 'keys') and not isinstance(value, dict):
+        # A Lua table: {ok=...} / {err=...} or an array (stops at the first nil, like redis).
+        for field in (b'err', b'ok'):
+            if value[field] is not None:
+                return {field.decode(): value[field]}
+        result, i = [], 1
+        while value[i] is not None:
+            result.append(_from_lua(value[i]))
+            i += 1
+        return result
+    return value
+
+
+def _to_lua(value):
+    lua = _lua_runtime()
+    if value is None:
+        return False
+    if isinstance(value, dict):
+        return lua.table_from({k.encode(): v for k, v in value.items()})
+    if isinstance(value, list):
+        return lua.table_from([_to_lua(v) for v in value])
+    return value
+
+
+def compile_lua_script(source: bytes) -> Callable:
+    lua = _lua_runtime()
+    try:
+        func = lua.eval(b'function(KEYS, ARGV, redis) ' + source + b'\nend')
+    except LuaError as e:
+        raise RedisCommandError(f"ERR Error compiling script: {e}")
+
+    def run(keys, argv, redis_api, time_limit_ms):
+        start_budget, stop_budget, make_api = _lua_helpers
+        api = make_api(lambda *args: _to_lua(redis_api.call(*args)),
+                       lambda *args: _to_lua(redis_api.pcall(*args)),
+                       lambda msg: _to_lua(redis_api.error_reply(msg)),
+                       lambda msg: _to_lua(redis_api.status_reply(msg)))
+        if time_limit_ms > 0:
+            start_budget(time_limit_ms / 1000, _over_budget_message(time_limit_ms).encode())
+        try:
+            return _from_lua(func(lua.table_from(keys), lua.table_from(argv), api))
+        except LuaError as e:
+            raise ScriptError(f"ERR Error running script: {e}")
+        finally:
+            stop_budget()
+    return run
+
+
+######################################################################################################
+# Script cache and commands
+
+
+# sha1 hex -> compiled script
+_script_cache: dict[bytes, Callable] = {}
+
+
+def script_sha1(source: bytes) -> bytes:
+    return hashlib.sha1(source).hexdigest().encode()
+
+
+def load_script(source: bytes) -> bytes:
+    sha = script_sha1(source)
+    if sha not in _script_cache:
+        if source.startswith(PYTHON_SHEBANG):
+            _script_cache[sha] = compile_python_script(source)
+        elif LuaRuntime is None:
+            raise RedisCommandError("ERR Lua engine not available, use #!python")
+        else:
+            _script_cache[sha] = compile_lua_script(source)
+    return sha
+
+
+def run_script(script: Callable, tokens, dispatch) -> bytes:
+    num_keys = parse_int_token(tokens[2])
+    if num_keys < 0:
+        raise RedisCommandError("ERR Number of keys can't be negative")
+    if num_keys > len(tokens) - 3:
+        raise RedisCommandError("ERR Number of keys can't be greater than number of args")
+    keys, argv = tokens[3:3 + num_keys], tokens[3 + num_keys:]
+    try:
+        result = script(keys, argv, RedisAPI(dispatch), server_config['busy-reply-threshold'])
+    except RedisCommandError:
+        raise
+    except Exception as e:
+        raise ScriptError(f"ERR Error running script: {type(e).__name__}: {e}")
+    return serialize_script_result(result)
+
+
+def handle_scripting_command(first_token, tokens, dispatch: Callable[[list[bytes]], bytes]):
+    """
+    dispatch(tokens) runs a command and returns its serialized reply.
+    """
+    match first_token:
+        case b'EVAL':
+            return run_script(_script_cache[load_script(tokens[1])], tokens, dispatch)
+        case b'EVALSHA':
+            script = _script_cache.get(tokens[1].lower())
+            if script is None:
+                raise RedisCommandError("NOSCRIPT No matching script. Please use EVAL.")
+            return run_script(script, tokens, dispatch)
+        case b'SCRIPT':
+            sub_cmd = tokens[1].upper()
+            match sub_cmd:
+                case b'LOAD' if len(tokens) == 3:
+                    return serialize_msg(load_script(tokens[2]), SerializedTypes.BULK_STRING)
+                case b'EXISTS' if len(tokens) > 2:
+                    return get_resp_array_from_elems([
+                        serialize_msg(int(sha.lower() in _script_cache), SerializedTypes.INTEGER) for sha in tokens[2:]])
+                case b'FLUSH':
+                    _script_cache.clear()
+                    return serialize_msg('OK', SerializedTypes.SIMPLE_STRING)
+            raise RedisSyntaxError()
+        case _:
+            raise RedisSyntaxError()
@@ -0,0 +1,74 @@
+"""
+The server clock: unix time in ms, shared by everything that needs "now" (expiry, XADD * ids, client idle times,
+stats), like redis' cached mstime.
+
+Cached:
+now_ms() reads the clock once per event loop iteration. Every client served in that iteration (and every
+command of a pipeline) sees the same value, and the clock is not read again for each of them.
+The cache is dropped by a call_soon() callback, which runs at the start of the next iteration.
+Outside of an event loop (tools, tests), the clock is read on every call.
+
+Monotonic:
+The time is time.monotonic() plus a fixed offset to unix time (measured at start), not time.time().
+If the wall clock jumps (manual change, NTP step, VM resume), TTLs still expire after the right duration.
+run_clock_resync() follows the wall clock while it only drifts slowly (NTP slewing, at most
+MAX_CLOCK_SLEW_MS per second), and ignores the jumps.
+"""
+import asyncio
+import time
+
+CLOCK_RESYNC_INTERVAL_S = 1
+MAX_CLOCK_SLEW_MS = 50
+
+# unix time in ms - monotonic time in ms
+_wall_offset_ms = time.time_ns() // 1_000_000 - time.monotonic_ns() // 1_000_000
+
+_cached_ms = 0
+# The event loop that _cached_ms belongs to (None: no cached value).
+_cached_loop = None
+
+
+def _read_clock_ms() -> int:
+    return time.monotonic_ns() // 1_000_000 + _wall_offset_ms
+
+
+def _drop_cache():
+    global _cached_loop
+    _cached_loop = None
+
+
+def now_ms() -> int:
+    """
+    Unix time in ms, cached for the current event loop iteration.
+    """
+    global _cached_ms, _cached_loop
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return _read_clock_ms()
+    if loop is _cached_loop:
+        return _cached_ms
+    _cached_ms = _read_clock_ms()
+    _cached_loop = loop
+    loop.call_soon(_drop_cache)
+    return _cached_ms
+
+
+def resync_wall_clock() -> int:
+    """
+    Follow a slow drift of the wall clock. Returns the difference that was ignored (a jump), 0 if none.
+    """
+    global _wall_offset_ms
+    offset = time.time_ns() // 1_000_000 - time.monotonic_ns() // 1_000_000
+    drift = offset - _wall_offset_ms
+    if abs(drift) <= MAX_CLOCK_SLEW_MS:
+        _wall_offset_ms = offset
+        return 0
+    print(f"Wall clock jumped by {drift}ms, ignored (expiry keeps following the monotonic clock)")
+    return drift
+
+
+async def run_clock_resync():
+    while True:
+        await asyncio.sleep(CLOCK_RESYNC_INTERVAL_S)
+        resync_wall_clock()
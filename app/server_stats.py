@@ -0,0 +1,83 @@
+"""
+Server counters (INFO stats / commandstats / persistence).
+
+Everything updated on the command path is a plain integer increment: no timestamps, no allocation.
+Command durations are only measured (time.perf_counter_ns, twice per command) while something needs them:
+latency-tracking (per command histograms, LATENCY HISTOGRAM), the slow log or the latency monitor (config.py).
+Otherwise usec stays 0 in INFO commandstats.
+"""
+from app.command_table import COMMAND_TABLE
+from app.config import server_config
+from app.latency_histogram import LatencyHistogram
+
+stat_counters: dict[str, int] = {
+    'total_connections_received': 0,
+    # Refused because of maxclients.
+    'rejected_connections': 0,
+    'total_commands_processed': 0,
+    'total_net_input_bytes': 0,
+    'total_net_output_bytes': 0,
+    'expired_keys': 0,
+    # There is no maxmemory, so nothing is ever evicted.
+    'evicted_keys': 0,
+    'keyspace_hits': 0,
+    'keyspace_misses': 0,
+    'total_error_replies': 0,
+    # Clients dropped because of their output buffer limits (output_buffer.py).
+    'client_output_buffer_limit_disconnections': 0,
+    # Write commands since the start (INFO persistence rdb_changes_since_last_save: there is no RDB save).
+    'dirty': 0,
+}
+
+# command name -> [calls, total duration in ns, failed calls]
+_command_stats: dict[bytes, list[int]] = {}
+# command name -> latency histogram in microseconds (latency-tracking)
+_command_histograms: dict[bytes, LatencyHistogram] = {}
+
+
+def is_latency_tracking_on() -> bool:
+    return server_config['latency-tracking'] == 'yes'
+
+
+def is_command_timing_on() -> bool:
+    return server_config['latency-tracking'] == 'yes' or server_config['slowlog-log-slower-than'] >= 0 or \
+        server_config['latency-monitor-threshold'] > 0
+
+
+def record_command_call(name: bytes, duration_ns: int, failed: bool):
+    stats = _command_stats.get(name)
+    if stats is None:
+        if name not in COMMAND_TABLE:
+            # Unknown commands don't get an entry each (a client could send millions of different names).
+            return
+        stats = _command_stats[name] = [0, 0, 0]
+    stats[0] += 1
+    stats[1] += duration_ns
+    stat_counters['total_commands_processed'] += 1
+    if duration_ns and is_latency_tracking_on():
+        histogram = _command_histograms.get(name)
+        if histogram is None:
+            histogram = _command_histograms[name] = LatencyHistogram()
+        histogram.record(duration_ns // 1000)
+    if failed:
+        stats[2] += 1
+        stat_counters['total_error_replies'] += 1
+
+
+def command_stats() -> dict[bytes, list[int]]:
+    return _command_stats
+
+
+def command_histograms() -> dict[bytes, LatencyHistogram]:
+    return _command_histograms
+
+
+def reset_stats():
+    """
+    CONFIG RESETSTAT
+    """
+    _command_stats.clear()
+    _command_histograms.clear()
+    for name in stat_counters:
+        if name != 'dirty':
+            stat_counters[name] = 0
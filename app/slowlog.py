@@ -0,0 +1,94 @@
+"""
+SLOWLOG GET [count] | LEN | RESET
+
+The last slowlog-max-len commands that took more than slowlog-log-slower-than microseconds (config.py).
+A bounded ring buffer (deque with maxlen): adding an entry is O(1) and the oldest entry falls off.
+Only the duration of the command itself counts: time spent blocked (BLPOP ...) is not logged.
+
+Long commands are not copied in full: at most 32 arguments of at most 128 bytes each are kept (same as redis).
+"""
+import itertools
+from collections import deque
+
+from app.config import server_config
+from app.errors import RedisSyntaxError
+from app.server_clock import now_ms
+from app.redis_serialization_protocol import serialize_msg, SerializedTypes, OK_SIMPLE_STRING, \
+    get_resp_array_from_elems, parse_int_token
+
+SLOWLOG_ENTRY_MAX_ARGC = 32
+SLOWLOG_ENTRY_MAX_STRING = 128
+
+
+class SlowlogEntry:
+    __slots__ = ('id', 'timestamp', 'duration_us', 'args', 'client_addr', 'client_name')
+
+    def __init__(self, entry_id, duration_us, args, client_addr, client_name):
+        self.id = entry_id
+        self.timestamp = now_ms() // 1000
+        self.duration_us = duration_us
+        self.args = args
+        self.client_addr = client_addr
+        self.client_name = client_name
+
+
+_entries: deque[SlowlogEntry] = deque(maxlen=server_config['slowlog-max-len'])
+_next_id = itertools.count()
+
+
+def _trimmed_args(tokens) -> list[bytes]:
+    args = []
+    for i, token in enumerate(tokens):
+        if i == SLOWLOG_ENTRY_MAX_ARGC - 1 and len(tokens) > SLOWLOG_ENTRY_MAX_ARGC:
+            args.append(b'... (%d more arguments)' % (len(tokens) - i))
+            break
+        if len(token) > SLOWLOG_ENTRY_MAX_STRING:
+            token = bytes(token[:SLOWLOG_ENTRY_MAX_STRING]) + b'... (%d more bytes)' % (len(token) - SLOWLOG_ENTRY_MAX_STRING)
+        args.append(bytes(token))
+    return args
+
+
+def log_if_slow(tokens, duration_us: int, client=None):
+    threshold = server_config['slowlog-log-slower-than']
+    if threshold < 0 or duration_us < threshold:
+        return
+    global _entries
+    max_len = max(server_config['slowlog-max-len'], 0)
+    if _entries.maxlen != max_len:
+        # CONFIG SET slowlog-max-len: keep the newest entries.
+        _entries = deque(_entries, maxlen=max_len)
+    addr, name = b'', b''
+    if client is not None:
+        if client.addr:
+            addr = f"{client.addr[0]}:{client.addr[1]}".encode()
+        name = client.name
+    _entries.append(SlowlogEntry(next(_next_id), duration_us, _trimmed_args(tokens), addr, name))
+
+
+def _serialize_entry(entry: SlowlogEntry) -> bytes:
+    return get_resp_array_from_elems([
+        serialize_msg(entry.id, SerializedTypes.INTEGER),
+        serialize_msg(entry.timestamp, SerializedTypes.INTEGER),
+        serialize_msg(entry.duration_us, SerializedTypes.INTEGER),
+        serialize_msg(entry.args, SerializedTypes.ARRAY),
+        serialize_msg(entry.client_addr, SerializedTypes.BULK_STRING),
+        serialize_msg(entry.client_name, SerializedTypes.BULK_STRING),
+    ])
+
+
+def handle_slowlog_command(tokens):
+    sub_cmd = tokens[1].upper()
+    match sub_cmd:
+        case b'GET' if len(tokens) <= 3:
+            count = parse_int_token(tokens[2]) if len(tokens) == 3 else 10
+            # Newest first. -1: all of them.
+            entries = list(reversed(_entries))
+            if count >= 0:
+                entries = entries[:count]
+            return get_resp_array_from_elems([_serialize_entry(entry) for entry in entries])
+        case b'LEN':
+            return serialize_msg(len(_entries), SerializedTypes.INTEGER)
+        case b'RESET':
+            _entries.clear()
+            return OK_SIMPLE_STRING
+    raise RedisSyntaxError()
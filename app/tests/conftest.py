@@ -0,0 +1,34 @@
+import asyncio
+
+import pytest
+
+from app import memory_management
+from app.client_state import _client_states, remove_client_state
+from app.main import handle_command
+from app.memory_management import databases
+
+
+def run(*tokens, writer=None, now=0):
+    """
+    Run one command like a client would (writer: its connection, None for a client without one).
+    """
+    return asyncio.run(handle_command(list(tokens), None, write_conn=writer, request_recv_time_ms=now))
+
+
+@pytest.fixture(autouse=True)
+def clean_databases():
+    """
+    Every test starts and ends with empty databases, in their original order (SWAPDB moves them: test modules
+    import redis_memstore, which must stay database 0), with database 0 selected and no client connected.
+    """
+    saved = list(databases)
+    for db in databases:
+        db.clear()
+    yield
+    databases[:] = saved
+    for db in databases:
+        # Keys, and their expires.
+        db.clear()
+    memory_management.select_db(0)
+    for writer in list(_client_states):
+        remove_client_state(writer)
@@ -0,0 +1,120 @@
+import asyncio
+import time
+
+import pytest
+
+from app import client_state
+from app.client_state import close_idle_clients, wait_while_paused, get_client_state
+from app.config import server_config
+from app.main import handle_client
+from app.redis_serialization_protocol import parse_redis_bytes
+from app.server_clock import now_ms
+from conftest import run
+
+
+class FakeWriter:
+    def __init__(self, port):
+        self.port = port
+        self.frames = []
+        self.closed = False
+
+    def write(self, data):
+        self.frames.append(data)
+
+    def close(self):
+        self.closed = True
+
+    def get_extra_info(self, name):
+        return ('127.0.0.1', 6379) if name == 'sockname' else ('127.0.0.1', self.port)
+
+
+def connect(port) -> FakeWriter:
+    writer = FakeWriter(port)
+    get_client_state(writer, ('127.0.0.1', port))
+    return writer
+
+
+@pytest.fixture(autouse=True)
+def clean_clients():
+    yield
+    client_state._pause_deadline = 0.0
+    server_config['timeout'] = 0
+    server_config['maxclients'] = 10_000
+
+
+def test_client_list_and_info():
+    a, b = connect(1001), connect(1002)
+    assert run(b'CLIENT', b'SETNAME', b'worker-1', writer=a) == b'+OK\r\n'
+    assert run(b'CLIENT', b'SETNAME', b'bad name', writer=a).startswith(b'-ERR Client names cannot contain')
+    run(b'MULTI', writer=b)
+    get_client_state(b).last_cmd = b'MULTI'
+    lines = parse_redis_bytes(run(b'CLIENT', b'LIST', writer=a))[1].decode().splitlines()
+    assert len(lines) == 2
+    fields = dict(field.split('=', 1) for field in lines[0].split(' '))
+    assert fields['addr'] == '127.0.0.1:1001' and fields['name'] == 'worker-1' and fields['flags'] == 'N'
+    assert 'flags=x ' in lines[1] and 'cmd=multi ' in lines[1]
+    info = parse_redis_bytes(run(b'CLIENT', b'INFO', writer=a))[1]
+    assert info.startswith(f"id={get_client_state(a).id} ".encode())
+    assert info.endswith(b' cmd=null user=default resp=2\n')
+    only_b = parse_redis_bytes(run(b'CLIENT', b'LIST', b'ID', str(get_client_state(b).id).encode(), writer=a))[1]
+    assert only_b.count(b'\n') == 1 and b'addr=127.0.0.1:1002 ' in only_b
+
+
+def test_client_kill():
+    me, other, third = connect(2001), connect(2002), connect(2003)
+    assert run(b'CLIENT', b'KILL', b'127.0.0.1:2002', writer=me) == b'+OK\r\n'
+    assert other.closed and get_client_state(other).close_after_reply
+    assert run(b'CLIENT', b'KILL', b'127.0.0.1:9999', writer=me) == b'-ERR No such client\r\n'
+    # SKIPME yes by default.
+    assert run(b'CLIENT', b'KILL', b'LADDR', b'127.0.0.1:6379', writer=me) == b':2\r\n'
+    assert third.closed and not me.closed
+    my_id = str(get_client_state(me).id).encode()
+    assert run(b'CLIENT', b'KILL', b'ID', my_id, b'SKIPME', b'no', writer=me) == b':1\r\n'
+    # Killing itself: closed by handle_client once the reply is sent.
+    assert get_client_state(me).close_after_reply and not me.closed
+
+
+def test_idle_clients_are_closed():
+    idle, busy, fresh = connect(3001), connect(3002), connect(3003)
+    now = now_ms()
+    get_client_state(idle).last_interaction = now - 100_000
+    get_client_state(busy).last_interaction = now - 100_000
+    get_client_state(busy).in_command = True
+    assert close_idle_clients(now) == 0
+    server_config['timeout'] = 10
+    assert close_idle_clients(now) == 1
+    assert idle.closed and not busy.closed and not fresh.closed
+
+
+def test_client_pause():
+    writer = connect(4001)
+    client = get_client_state(writer)
+    assert run(b'CLIENT', b'PAUSE', b'60000', b'WRITE', writer=writer) == b'+OK\r\n'
+    assert client_state._is_paused(client, b'SET')
+    assert not client_state._is_paused(client, b'GET')
+    assert run(b'CLIENT', b'UNPAUSE', writer=writer) == b'+OK\r\n'
+    assert not client_state._is_paused(client, b'SET')
+
+    run(b'CLIENT', b'PAUSE', b'50', writer=writer)
+    start = time.monotonic()
+    asyncio.run(wait_while_paused(client, [b'GET', b'k']))
+    assert time.monotonic() - start >= 0.04
+
+
+def test_maxclients():
+    async def connect_two():
+        server = await asyncio.start_server(handle_client, host='localhost', port=0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            _, first = await asyncio.open_connection('localhost', port)
+            first.write(b'*1\r\n$4\r\nPING\r\n')
+            await asyncio.sleep(0.05)
+            second_reader, second = await asyncio.open_connection('localhost', port)
+            refused = await second_reader.read()
+            first.close()
+            second.close()
+            await asyncio.sleep(0.05)
+            return refused
+
+    server_config['maxclients'] = 1
+    assert asyncio.run(connect_two()) == b'-ERR max number of clients reached\r\n'
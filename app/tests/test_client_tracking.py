@@ -0,0 +1,120 @@
+import pytest
+
+from app import client_tracking
+from app.config import server_config
+from conftest import run
+
+
+class FakeWriter:
+    def __init__(self):
+        self.frames = []
+
+    def write(self, data):
+        self.frames.append(data)
+
+
+def tracking_client(*options):
+    writer = FakeWriter()
+    run(b'HELLO', b'3', writer=writer)
+    assert run(b'CLIENT', b'TRACKING', b'ON', *options, writer=writer) == b'+OK\r\n'
+    return writer
+
+
+def invalidation(*keys):
+    return b'>2\r\n$10\r\ninvalidate\r\n*' + str(len(keys)).encode() + b'\r\n' + \
+        b''.join(b'$%d\r\n%s\r\n' % (len(k), k) for k in keys)
+
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    yield
+    client_tracking._tracking_table.clear()
+
+
+def test_hello():
+    writer = FakeWriter()
+    reply = run(b'HELLO', writer=writer)
+    assert reply.startswith(b'*14\r\n$6\r\nserver\r\n$5\r\nredis\r\n')
+    assert b'$5\r\nproto\r\n:2\r\n' in reply
+    reply = run(b'HELLO', b'3', writer=writer)
+    assert reply.startswith(b'%7\r\n')
+    assert b'$5\r\nproto\r\n:3\r\n' in reply
+    assert run(b'HELLO', b'4', writer=writer).startswith(b'-NOPROTO')
+
+
+def test_tracking_requires_resp3():
+    writer = FakeWriter()
+    assert run(b'CLIENT', b'TRACKING', b'ON', writer=writer).startswith(b'-ERR Client tracking requires RESP3')
+    run(b'HELLO', b'3', writer=writer)
+    assert run(b'CLIENT', b'TRACKING', b'ON', b'PREFIX', b'a', writer=writer).startswith(b'-ERR PREFIX')
+
+
+def test_default_mode_invalidates_keys_read():
+    cache = tracking_client()
+    run(b'SET', b'k', b'1')
+    run(b'GET', b'k', writer=cache)
+    run(b'HSET', b'h', b'f', b'v')
+    run(b'HGET', b'h', b'f', writer=cache)
+    assert cache.frames == []
+
+    run(b'SET', b'k', b'2')
+    assert cache.frames == [invalidation(b'k')]
+    # Forgotten until read again.
+    run(b'INCR', b'k')
+    assert len(cache.frames) == 1
+    # Any write command, not only SET / INCR.
+    run(b'HSET', b'h', b'f', b'v2')
+    assert cache.frames[-1] == invalidation(b'h')
+    # Keys never read are not sent.
+    run(b'SET', b'other', b'1')
+    assert len(cache.frames) == 2
+
+
+def test_expiry_invalidates():
+    cache = tracking_client()
+    run(b'SET', b'k', b'v', b'PX', b'100')
+    run(b'GET', b'k', writer=cache)
+    run(b'GET', b'k', now=1000)
+    assert cache.frames == [invalidation(b'k')]
+
+
+def test_bcast_prefixes_and_noloop():
+    users = tracking_client(b'BCAST', b'PREFIX', b'user:', b'NOLOOP')
+    everything = tracking_client(b'BCAST')
+    run(b'SET', b'user:1', b'a')
+    run(b'SET', b'order:1', b'b')
+    assert users.frames == [invalidation(b'user:1')]
+    assert everything.frames == [invalidation(b'user:1'), invalidation(b'order:1')]
+    # NOLOOP: not told about its own writes.
+    run(b'SET', b'user:2', b'c', writer=users)
+    assert len(users.frames) == 1
+    # One message for all the keys of a command.
+    run(b'DEL', b'user:1', b'order:1')
+    assert everything.frames[-1] == invalidation(b'user:1', b'order:1')
+
+
+def test_flushall_and_tracking_off():
+    cache = tracking_client()
+    run(b'SET', b'k', b'1')
+    run(b'GET', b'k', writer=cache)
+    run(b'FLUSHALL')
+    assert cache.frames == [b'>2\r\n$10\r\ninvalidate\r\n_\r\n']
+    run(b'CLIENT', b'TRACKING', b'OFF', writer=cache)
+    run(b'SET', b'k', b'1')
+    run(b'GET', b'k', writer=cache)
+    run(b'SET', b'k', b'2')
+    assert len(cache.frames) == 1
+
+
+def test_tracking_table_is_bounded():
+    server_config['tracking-table-max-keys'] = 2
+    try:
+        cache = tracking_client()
+        for key in (b'a', b'b', b'c'):
+            run(b'SET', key, b'1')
+            run(b'GET', key, writer=cache)
+        assert len(client_tracking._tracking_table) == 2
+        # The oldest key was evicted, so its client was invalidated.
+        assert cache.frames == [invalidation(b'a')]
+    finally:
+        server_config['tracking-table-max-keys'] = 1_000_000
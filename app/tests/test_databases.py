@@ -0,0 +1,172 @@
+import asyncio
+
+from app import memory_management, replication, transaction
+from app.client_state import get_client_state
+from app.key_expiry import active_expire_cycle
+import app.main
+from app.main import handle_command
+from app.memory_management import databases
+from app.redis_serialization_protocol import parse_redis_bytes
+from conftest import run
+
+
+class FakeWriter:
+    def __init__(self, port):
+        self.port = port
+        self.frames = []
+
+    def write(self, data):
+        self.frames.append(data)
+
+    def close(self):
+        pass
+
+    def get_extra_info(self, name):
+        return ('127.0.0.1', 6379) if name == 'sockname' else ('127.0.0.1', self.port)
+
+
+def connect(port) -> FakeWriter:
+    writer = FakeWriter(port)
+    get_client_state(writer, ('127.0.0.1', port))
+    return writer
+
+
+def test_select_is_per_connection():
+    a, b = connect(1), connect(2)
+    assert run(b'SELECT', b'1', writer=a) == b'+OK\r\n'
+    run(b'SET', b'k', b'in db1', writer=a)
+    assert run(b'GET', b'k', writer=b) == b'$-1\r\n'
+    assert run(b'DBSIZE', writer=b) == b':0\r\n'
+    run(b'SELECT', b'1', writer=b)
+    assert run(b'GET', b'k', writer=b) == b'$6\r\nin db1\r\n'
+    assert 'db=1 ' in parse_redis_bytes(run(b'CLIENT', b'INFO', writer=a))[1].decode()
+    assert run(b'SELECT', b'16', writer=a) == b'-ERR DB index is out of range\r\n'
+    assert run(b'SELECT', b'1') == b'-ERR SELECT is only available to connected clients\r\n'
+    # Inside a transaction, the commands after SELECT run on the new database.
+    run(b'MULTI', writer=a)
+    run(b'SELECT', b'2', writer=a)
+    run(b'SET', b'k', b'in db2', writer=a)
+    run(b'EXEC', writer=a)
+    assert databases[2][b'k'].val == b'in db2'
+    assert get_client_state(a).db == 2
+
+
+def test_swapdb_flushdb_and_move():
+    a = connect(1)
+    run(b'SET', b'k', b'v', b'PX', b'5000', writer=a)
+    db0, db3 = databases[0], databases[3]
+    assert run(b'SWAPDB', b'0', b'3', writer=a) == b'+OK\r\n'
+    # Pointer swap: the keyspaces themselves (keys, expiry index) moved.
+    assert databases[3] is db0 and databases[0] is db3
+    assert run(b'GET', b'k', writer=a) == b'$-1\r\n'
+    run(b'SELECT', b'3', writer=a)
+    assert run(b'PTTL', b'k', writer=a) == b':5000\r\n'
+
+    assert run(b'MOVE', b'k', b'3', writer=a) == b'-ERR source and destination objects are the same\r\n'
+    assert run(b'MOVE', b'k', b'4', writer=a) == b':1\r\n'
+    assert run(b'MOVE', b'k', b'4', writer=a) == b':0\r\n'
+    run(b'SELECT', b'4', writer=a)
+    assert run(b'PTTL', b'k', writer=a) == b':5000\r\n'
+    run(b'SET', b'other', b'v', writer=a)
+    run(b'SELECT', b'5', writer=a)
+    run(b'SET', b'k', b'v', writer=a)
+    # The key exists in the destination: not moved.
+    assert run(b'MOVE', b'k', b'4', writer=a) == b':0\r\n'
+
+    assert run(b'FLUSHDB', writer=a) == b'+OK\r\n'
+    assert not databases[5] and len(databases[4]) == 2
+    run(b'FLUSHALL', writer=a)
+    assert not databases[4]
+
+
+def test_expiry_and_stats_per_database():
+    a = connect(1)
+    expired_in_db0 = databases[0].stats['expired_keys']
+    run(b'SELECT', b'7', writer=a)
+    run(b'SET', b'k', b'v', b'PX', b'100', writer=a)
+    run(b'SET', b'forever', b'v', writer=a)
+    run(b'GET', b'forever', writer=a)
+    run(b'GET', b'missing', writer=a)
+    info = parse_redis_bytes(run(b'INFO', b'keyspace'))[1].decode()
+    assert 'db7:keys=2,expires=1' in info and 'db0:' not in info
+    assert active_expire_cycle(1_000_200) == 1
+    stats = databases[7].stats
+    assert (stats['keyspace_hits'], stats['keyspace_misses'], stats['expired_keys']) == (1, 1, 1)
+    assert databases[0].stats['expired_keys'] == expired_in_db0
+    # The cycle leaves the selected database alone.
+    assert memory_management.selected_db == 0
+
+
+def test_watch_is_per_database():
+    watcher, writer = connect(1), connect(2)
+
+    def watch_then_exec(key, *writes):
+        run(b'WATCH', key, writer=watcher)
+        for tokens in writes:
+            run(*tokens, writer=writer)
+        run(b'MULTI', writer=watcher)
+        run(b'INCR', b'n', writer=watcher)
+        return run(b'EXEC', writer=watcher)
+
+    # The watcher is on db 0. Same key name in another database, FLUSHDB of another database: EXEC runs.
+    run(b'SELECT', b'1', writer=writer)
+    assert watch_then_exec(b'x', [b'SET', b'x', b'1'], [b'FLUSHDB']) == b'*1\r\n:1\r\n'
+    assert watch_then_exec(b'x', [b'SELECT', b'0'], [b'SET', b'x', b'2']) == b'*-1\r\n'
+    # MOVE into the watched database.
+    run(b'SELECT', b'1', writer=writer)
+    assert watch_then_exec(b'moved', [b'SET', b'moved', b'v'], [b'MOVE', b'moved', b'0']) == b'*-1\r\n'
+    assert watch_then_exec(b'x', [b'SWAPDB', b'1', b'5']) == b'*1\r\n:2\r\n'
+    assert watch_then_exec(b'x', [b'SWAPDB', b'0', b'5']) == b'*-1\r\n'
+    assert watch_then_exec(b'x', [b'SELECT', b'0'], [b'FLUSHDB']) == b'*-1\r\n'
+    assert not transaction._watched_keys
+
+
+def test_blocked_clients_wait_on_their_database():
+    waiting, pusher = connect(1), connect(2)
+
+    async def scenario():
+        await handle_command([b'SELECT', b'1'], None, write_conn=waiting)
+        blpop = asyncio.create_task(handle_command([b'BLPOP', b'q', b'0'], None, write_conn=waiting,
+                                                   request_recv_time_ms=0))
+        await asyncio.sleep(0.01)
+        # Same key, other database: the blocked client is not served.
+        await handle_command([b'RPUSH', b'q', b'db0'], None, write_conn=pusher, request_recv_time_ms=0)
+        await asyncio.sleep(0.01)
+        assert not blpop.done()
+        await handle_command([b'SELECT', b'1'], None, write_conn=pusher)
+        await handle_command([b'RPUSH', b'q', b'db1'], None, write_conn=pusher, request_recv_time_ms=0)
+        return await asyncio.wait_for(blpop, 1)
+
+    assert parse_redis_bytes(asyncio.run(scenario()))[1] == [b'q', b'db1']
+    assert not databases[1] and len(databases[0][b'q'].val) == 1
+
+
+def test_xread_waits_on_its_database():
+    reader, writer = connect(1), connect(2)
+
+    async def scenario():
+        await handle_command([b'XADD', b's', b'1-1', b'a', b'b'], None, write_conn=writer, request_recv_time_ms=0)
+        xread = asyncio.create_task(handle_command([b'XREAD', b'block', b'0', b'streams', b's', b'1-1'], None,
+                                                   write_conn=reader, request_recv_time_ms=0))
+        await asyncio.sleep(0.01)
+        # Creates stream s in db 1: the reader on db 0 keeps waiting, on its own stream.
+        await handle_command([b'SELECT', b'1'], None, write_conn=writer)
+        await handle_command([b'XADD', b's', b'1-1', b'in', b'db1'], None, write_conn=writer, request_recv_time_ms=0)
+        await asyncio.sleep(0.01)
+        assert not xread.done()
+        await handle_command([b'SELECT', b'0'], None, write_conn=writer)
+        await handle_command([b'XADD', b's', b'2-1', b'in', b'db0'], None, write_conn=writer, request_recv_time_ms=0)
+        return await asyncio.wait_for(xread, 1)
+
+    assert parse_redis_bytes(asyncio.run(scenario()))[1] == [[b's', [[b'2-1', [b'in', b'db0']]]]]
+    # Nobody waits anymore.
+    assert not app.main.xadd_conditions and not memory_management._xread_waiters
+
+
+def test_replication_stream_selects_the_database():
+    replication._stream_db = 0
+    assert replication.replication_frame([b'SET', b'k', b'v'], 0) == b'*3\r\n$3\r\nSET\r\n$1\r\nk\r\n$1\r\nv\r\n'
+    assert replication.replication_frame([b'INCR', b'k'], 2) == \
+        b'*2\r\n$6\r\nSELECT\r\n$1\r\n2\r\n*2\r\n$4\r\nINCR\r\n$1\r\nk\r\n'
+    assert replication.replication_frame([b'INCR', b'k'], 2) == b'*2\r\n$4\r\nINCR\r\n$1\r\nk\r\n'
+    replication._stream_db = 0
@@ -0,0 +1,91 @@
+import asyncio
+import pstats
+import time
+
+import pytest
+
+from app.config import server_config
+from app.main import handle_command
+from conftest import run
+
+
+@pytest.fixture(autouse=True)
+def clear(tmp_path):
+    server_config['profile-dir'] = str(tmp_path)
+    yield
+    server_config['profile-dir'] = '.'
+
+
+def test_debug_object_encoding():
+    run(b'SET', b'int', b'12345')
+    run(b'SET', b'big', b'x' * 100)
+    run(b'HSET', b'h', b'f', b'v')
+    run(b'SADD', b's', b'1', b'2')
+    assert b'encoding:int serializedlength:5 ' in run(b'DEBUG', b'OBJECT', b'int')
+    assert b'encoding:raw serializedlength:100 ' in run(b'DEBUG', b'OBJECT', b'big')
+    assert b'encoding:listpack' in run(b'DEBUG', b'OBJECT', b'h')
+    assert b'encoding:intset' in run(b'DEBUG', b'OBJECT', b's')
+    assert run(b'DEBUG', b'OBJECT', b'missing') == b'-ERR no such key\r\n'
+
+
+def test_memory_usage_grows_with_the_value():
+    run(b'SET', b'small', b'x')
+    run(b'SET', b'large', b'x' * 10_000)
+    run(b'RPUSH', b'list', *[b'%d' % i for i in range(1000)])
+    small = int(run(b'MEMORY', b'USAGE', b'small')[1:-2])
+    large = int(run(b'MEMORY', b'USAGE', b'large')[1:-2])
+    assert large - small >= 9_999
+    assert run(b'MEMORY', b'USAGE', b'missing') == b'$-1\r\n'
+
+
+def test_memory_usage_sampling_is_close_to_exact():
+    run(b'HSET', b'h', *[x for i in range(1000) for x in (b'field%d' % i, b'value%d' % i)])
+    sampled = int(run(b'MEMORY', b'USAGE', b'h')[1:-2])
+    exact = int(run(b'MEMORY', b'USAGE', b'h', b'SAMPLES', b'0')[1:-2])
+    assert abs(sampled - exact) / exact < 0.1
+
+
+def test_debug_sleep():
+    start = time.perf_counter()
+    assert run(b'DEBUG', b'SLEEP', b'0.05') == b'+OK\r\n'
+    assert time.perf_counter() - start >= 0.05
+
+
+def test_cprofile_for_n_dispatches():
+    assert run(b'PROFILE', b'START', b'CPROFILE', b'DISPATCHES', b'3') == b'+OK\r\n'
+    for i in range(3):
+        run(b'SET', b'k%d' % i, b'v')
+    assert b'running:0' in run(b'PROFILE', b'STATUS')
+    path = run(b'PROFILE', b'STATUS').split(b'last_output:')[1][:-2].decode()
+    stats = pstats.Stats(path)
+    assert any(func[2] == '_set' for func in stats.stats)
+
+
+def test_cprofile_counts_commands_run_while_a_profiled_command_waits():
+    async def scenario():
+        assert await handle_command([b'PROFILE', b'START', b'DISPATCHES', b'3'], None) == b'+OK\r\n'
+        waiter = asyncio.create_task(handle_command([b'BLPOP', b'q', b'0'], None, request_recv_time_ms=0))
+        await asyncio.sleep(0)
+        for _ in range(2):
+            await handle_command([b'GET', b'k'], None, request_recv_time_ms=0)
+        status = await handle_command([b'PROFILE', b'STATUS'], None)
+        await handle_command([b'RPUSH', b'q', b'v'], None, request_recv_time_ms=0)
+        return status, await waiter
+
+    status, popped = asyncio.run(scenario())
+    # BLPOP and the 2 GETs: the profile stopped at its 3rd dispatch, without waiting for BLPOP.
+    assert b'running:0' in status
+    assert popped == b'*2\r\n$1\r\nq\r\n$1\r\nv\r\n'
+    stats = pstats.Stats(status.split(b'last_output:')[1][:-2].decode())
+    assert any(func[2] == 'get_from_memstore' for func in stats.stats)
+
+
+def test_sampling_profile():
+    assert run(b'PROFILE', b'START', b'SAMPLING', b'INTERVAL', b'1') == b'+OK\r\n'
+    assert run(b'PROFILE', b'START') == b'-ERR a profile is already running, PROFILE STOP it first\r\n'
+    time.sleep(0.05)
+    path = run(b'PROFILE', b'STOP').split(b'\r\n')[1].decode()
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert lines and all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+    assert run(b'PROFILE', b'STOP') == b'-ERR no profile is running\r\n'
@@ -0,0 +1,90 @@
+import pytest
+
+from app.config import server_config
+from app.key_expiry import active_expire_cycle
+from app.server_stats import reset_stats, stat_counters
+from conftest import run
+
+
+def info(*sections) -> dict[str, dict[str, str]]:
+    reply = run(b'INFO', *(s.encode() for s in sections), now=1000)
+    body = reply.split(b'\r\n', 1)[1][:-2].decode()
+    result = {}
+    for line in body.split('\r\n'):
+        if line.startswith('# '):
+            section = result[line[2:].lower()] = {}
+        elif line:
+            field, _, value = line.partition(':')
+            section[field] = value
+    return result
+
+
+@pytest.fixture(autouse=True)
+def clear():
+    reset_stats()
+    yield
+    server_config['latency-tracking'] = 'yes'
+    server_config['slowlog-log-slower-than'] = 10_000
+
+
+def test_default_sections():
+    sections = info()
+    assert list(sections) == ['server', 'clients', 'memory', 'persistence', 'stats', 'replication', 'keyspace']
+    assert sections['replication']['role'] == 'master'
+    assert int(sections['memory']['used_memory']) > 0
+    assert list(info('replication', 'KEYSPACE', 'nosuchsection')) == ['replication', 'keyspace']
+    assert 'commandstats' in info('all')
+
+
+def test_commandstats():
+    run(b'SET', b'k', b'1')
+    run(b'INCR', b'k')
+    run(b'INCR', b'k')
+    run(b'LPUSH', b'k', b'x')
+    stats = info('commandstats')['commandstats']
+    assert stats['cmdstat_set'].startswith('calls=1,')
+    assert stats['cmdstat_incr'].startswith('calls=2,')
+    assert stats['cmdstat_lpush'].endswith('failed_calls=1')
+    assert info('stats')['stats']['total_error_replies'] == '1'
+
+
+def test_usec_not_measured_when_nothing_needs_it():
+    server_config['latency-tracking'] = 'no'
+    server_config['slowlog-log-slower-than'] = -1
+    for _ in range(10):
+        run(b'SET', b'k', b'1')
+    assert 'usec=0,' in info('commandstats')['commandstats']['cmdstat_set']
+
+
+def test_keyspace_hits_misses_and_expired():
+    dirty = stat_counters['dirty']
+    run(b'SET', b'a', b'1')
+    run(b'SET', b'b', b'1', b'px', b'100')
+    run(b'GET', b'a')
+    run(b'GET', b'missing')
+    run(b'GET', b'b', now=500)
+    stats = info('stats')['stats']
+    assert (stats['keyspace_hits'], stats['keyspace_misses'], stats['expired_keys']) == ('1', '2', '1')
+    assert stat_counters['dirty'] == dirty + 2
+
+
+def test_keyspace_section():
+    run(b'SET', b'a', b'1')
+    run(b'SET', b'b', b'1', b'px', b'2000')
+    # avg_ttl is estimated by the active expire cycle.
+    assert info('keyspace')['keyspace'] == {'db0': 'keys=2,expires=1,avg_ttl=0'}
+    active_expire_cycle(1000)
+    assert info('keyspace')['keyspace'] == {'db0': 'keys=2,expires=1,avg_ttl=1000'}
+
+
+def test_avg_ttl_is_a_running_estimate():
+    for i in range(100):
+        run(b'SET', b'k%d' % i, b'v', b'PX', b'%d' % (1000 + 20 * i))
+    for _ in range(200):
+        active_expire_cycle(0)
+    avg_ttl = int(info('keyspace')['keyspace']['db0'].split('avg_ttl=')[1])
+    assert abs(avg_ttl - 1990) < 300
+    run(b'FLUSHDB')
+    run(b'SET', b'k', b'v')
+    active_expire_cycle(0)
+    assert info('keyspace')['keyspace'] == {'db0': 'keys=1,expires=0,avg_ttl=0'}
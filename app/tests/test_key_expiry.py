@@ -0,0 +1,92 @@
+import functools
+
+import conftest
+from app.key_expiry import active_expire_cycle
+from app.memory_management import redis_memstore
+from app.server_stats import stat_counters
+
+# Commands run at t=1000s unless told otherwise (some expiry times below are in the past).
+run = functools.partial(conftest.run, now=1_000_000)
+
+
+def test_set_options():
+    assert run(b'SET', b'lock', b'a', b'NX', b'PX', b'5000') == b'+OK\r\n'
+    assert run(b'SET', b'lock', b'b', b'NX', b'PX', b'5000') == b'$-1\r\n'
+    assert run(b'PTTL', b'lock') == b':5000\r\n'
+    assert run(b'SET', b'missing', b'x', b'XX') == b'$-1\r\n'
+    assert run(b'SET', b'lock', b'c', b'XX', b'GET', b'KEEPTTL') == b'$1\r\na\r\n'
+    assert run(b'GET', b'lock') == b'$1\r\nc\r\n'
+    assert run(b'PTTL', b'lock') == b':5000\r\n'
+    # A plain SET drops the expiry.
+    run(b'SET', b'lock', b'd')
+    assert run(b'TTL', b'lock') == b':-1\r\n'
+    run(b'SET', b'k', b'v', b'EX', b'10')
+    assert run(b'TTL', b'k') == b':10\r\n'
+    run(b'SET', b'k', b'v', b'EXAT', b'2000')
+    assert run(b'EXPIRETIME', b'k') == b':2000\r\n'
+    # An absolute time in the past: the key is gone.
+    assert run(b'SET', b'k', b'v', b'PXAT', b'1') == b'+OK\r\n'
+    assert run(b'GET', b'k') == b'$-1\r\n'
+    assert run(b'SET', b'k', b'v', b'EX', b'0') == b"-ERR invalid expire time in 'set' command\r\n"
+    assert run(b'SET', b'k', b'v', b'EX', b'10', b'PX', b'10') == b'-ERR syntax error\r\n'
+    assert run(b'SET', b'k', b'v', b'NX', b'XX') == b'-ERR syntax error\r\n'
+    run(b'RPUSH', b'list', b'a')
+    assert run(b'SET', b'list', b'v', b'GET').startswith(b'-WRONGTYPE')
+
+
+def test_expire_family():
+    run(b'SET', b'k', b'v')
+    assert run(b'TTL', b'missing') == b':-2\r\n'
+    assert run(b'EXPIRE', b'missing', b'10') == b':0\r\n'
+    assert run(b'EXPIRE', b'k', b'10', b'XX') == b':0\r\n'
+    assert run(b'EXPIRE', b'k', b'10', b'NX') == b':1\r\n'
+    assert run(b'PEXPIRE', b'k', b'5000', b'GT') == b':0\r\n'
+    assert run(b'PEXPIRE', b'k', b'5000', b'LT') == b':1\r\n'
+    assert run(b'PTTL', b'k') == b':5000\r\n'
+    # 1.5s left is rounded to 2.
+    assert run(b'TTL', b'k', now=1_003_500) == b':2\r\n'
+    assert run(b'PEXPIREAT', b'k', b'1010000') == b':1\r\n'
+    assert run(b'PEXPIRETIME', b'k') == b':1010000\r\n'
+    assert run(b'PERSIST', b'k') == b':1\r\n'
+    assert run(b'PERSIST', b'k') == b':0\r\n'
+    assert redis_memstore.expires == {}
+    assert run(b'EXPIRE', b'k', b'10', b'NX', b'GT') == \
+        b'-ERR NX and XX, GT or LT options at the same time are not compatible\r\n'
+    # An expiry in the past deletes the key.
+    assert run(b'EXPIRE', b'k', b'-1') == b':1\r\n'
+    assert run(b'GET', b'k') == b'$-1\r\n'
+
+
+def test_getex_getdel_setex():
+    assert run(b'SETEX', b'k', b'10', b'v') == b'+OK\r\n'
+    assert run(b'PTTL', b'k') == b':10000\r\n'
+    assert run(b'PSETEX', b'k', b'0', b'v') == b"-ERR invalid expire time in 'psetex' command\r\n"
+    assert run(b'GETEX', b'k', b'PERSIST') == b'$1\r\nv\r\n'
+    assert run(b'TTL', b'k') == b':-1\r\n'
+    assert run(b'GETEX', b'k', b'EX', b'100') == b'$1\r\nv\r\n'
+    assert run(b'TTL', b'k') == b':100\r\n'
+    assert run(b'GETEX', b'missing', b'EX', b'100') == b'$-1\r\n'
+    assert run(b'GETDEL', b'k') == b'$1\r\nv\r\n'
+    assert run(b'GETDEL', b'k') == b'$-1\r\n'
+    assert redis_memstore.expires == {}
+
+
+def test_active_expire_cycle():
+    for i in range(100):
+        run(b'SET', b'k%d' % i, b'v', b'PX', b'%d' % (10 + i))
+    run(b'SET', b'forever', b'v')
+    expired = stat_counters['expired_keys']
+    assert active_expire_cycle(1_000_050) == 40
+    # No time budget left: one batch per cycle.
+    assert active_expire_cycle(1_000_200, budget_us=0) == 16
+    assert active_expire_cycle(1_000_200) == 44
+    assert list(redis_memstore) == [b'forever']
+    assert stat_counters['expired_keys'] == expired + 100
+
+
+def test_expiry_heap_stays_bounded():
+    run(b'SET', b'k', b'v')
+    for i in range(3000):
+        run(b'PEXPIRE', b'k', b'%d' % (1000 + i))
+    assert len(redis_memstore._expiry_heap) <= 2 * len(redis_memstore.expires) + 1024
+    assert active_expire_cycle(1_000_000 + 5000) == 1
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from app.glob_pattern import compile_glob
+from app.keyspace import ScannableDict
+from app.main import handle_command
+from app.memory_management import set_to_memstore
+
+
+def scan_all(keyspace, count):
+    cursor, seen = 0, []
+    while True:
+        cursor, keys = keyspace.scan(cursor, count)
+        seen.extend(keys)
+        if cursor == 0:
+            return seen
+
+
+def test_scan_returns_every_key_once():
+    ks = ScannableDict()
+    for i in range(100):
+        ks[i] = i
+    seen = scan_all(ks, 7)
+    assert sorted(seen) == list(range(100))
+
+
+def test_scan_cursor_survives_deletes_and_compaction():
+    ks = ScannableDict()
+    for i in range(5000):
+        ks[i] = i
+    cursor, first_batch = ks.scan(0, 100)
+    # Delete enough keys (all before the cursor) to trigger a compaction.
+    for i in range(4000):
+        del ks[i]
+    assert len(ks.scan_index._slot_keys) < 5000
+    seen = list(first_batch)
+    while cursor:
+        cursor, keys = ks.scan(cursor, 100)
+        seen.extend(keys)
+    assert seen[:100] == list(range(100))
+    assert sorted(seen[100:]) == list(range(4000, 5000))
+
+
+def test_overwrite_keeps_slot():
+    ks = ScannableDict()
+    ks[b'a'] = 1
+    ks[b'b'] = 2
+    ks[b'a'] = 3
+    assert scan_all(ks, 10) == [b'a', b'b']
+
+
+@pytest.mark.parametrize("pattern, key, expected", [
+    (b'*', b'anything', True),
+    (b'user:*', b'user:1', True),
+    (b'user:*', b'usr:1', False),
+    (b'h?llo', b'hello', True),
+    (b'h[ae]llo', b'hillo', False),
+    (b'h[^e]llo', b'hallo', True),
+    (b'h[a-b]llo', b'hbllo', True),
+    (b'h\\*llo', b'h*llo', True),
+    (b'h\\*llo', b'hello', False),
+    (b'exact', b'exact', True),
+    (b'exact', b'exactly', False),
+])
+def test_glob_pattern(pattern, key, expected):
+    assert compile_glob(pattern).match(key) == expected
+
+
+def test_glob_fast_paths():
+    assert compile_glob(b'user:*').is_prefix_only
+    assert compile_glob(b'user:1').is_literal
+    assert not compile_glob(b'user:*:name').is_prefix_only
+
+
+def test_scan_and_keys_commands():
+    for i in range(20):
+        set_to_memstore(f'user:{i}'.encode(), b'x')
+    set_to_memstore(b'other', b'x')
+
+    result = asyncio.run(handle_command([b'KEYS', b'user:1*'], None, request_recv_time_ms=0))
+    assert result.count(b'user:1') == 11
+
+    result = asyncio.run(handle_command([b'SCAN', b'0', b'MATCH', b'other', b'COUNT', b'100'], None,
+                                        request_recv_time_ms=0))
+    assert result == b'*2\r\n$1\r\n0\r\n*1\r\n$5\r\nother\r\n'
+
+    result = asyncio.run(handle_command([b'SCAN', b'0', b'COUNT', b'abc'], None, request_recv_time_ms=0))
+    assert result.startswith(b'-ERR')
+
+    assert asyncio.run(handle_command([b'DBSIZE'], None)) == b':21\r\n'
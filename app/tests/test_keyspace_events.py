@@ -0,0 +1,76 @@
+import pytest
+
+from app import keyspace_events, pubsub
+from app.config import set_config
+from app.key_expiry import active_expire_cycle
+from app.redis_serialization_protocol import parse_redis_bytes
+from conftest import run
+
+
+class FakeWriter:
+    def __init__(self):
+        self.frames = []
+
+    def write(self, data):
+        self.frames.append(data)
+
+
+@pytest.fixture(autouse=True)
+def clean():
+    yield
+    set_config(b'notify-keyspace-events', b'')
+    for writer in list(pubsub._subscribers):
+        pubsub.remove_subscriber(writer)
+
+
+def subscribe(pattern: bytes) -> FakeWriter:
+    writer = FakeWriter()
+    run(b'PSUBSCRIBE', pattern, writer=writer)
+    writer.frames.clear()
+    return writer
+
+
+def messages(writer) -> list[tuple[bytes, bytes]]:
+    # pmessage pattern channel message
+    return [tuple(parse_redis_bytes(frame)[1][2:]) for frame in writer.frames]
+
+
+def test_keyspace_and_keyevent_channels():
+    sub = subscribe(b'__key*@*__:*')
+    assert run(b'CONFIG', b'SET', b'notify-keyspace-events', b'KEA') == b'+OK\r\n'
+    run(b'SET', b'k', b'v')
+    run(b'INCR', b'n')
+    run(b'XADD', b'stream', b'1-1', b'f', b'v')
+    run(b'DEL', b'k', b'missing')
+    assert messages(sub) == [
+        (b'__keyspace@0__:k', b'set'), (b'__keyevent@0__:set', b'k'),
+        (b'__keyspace@0__:n', b'incrby'), (b'__keyevent@0__:incrby', b'n'),
+        (b'__keyspace@0__:stream', b'xadd'), (b'__keyevent@0__:xadd', b'stream'),
+        (b'__keyspace@0__:k', b'del'), (b'__keyevent@0__:del', b'k'),
+    ]
+
+
+def test_event_classes_and_expired_events():
+    sub = subscribe(b'*')
+    # Only key events, only for expired keys.
+    run(b'CONFIG', b'SET', b'notify-keyspace-events', b'Ex')
+    run(b'SET', b'k', b'v', b'PX', b'100')
+    run(b'SET', b'lazy', b'v', b'PX', b'100')
+    assert sub.frames == []
+    assert active_expire_cycle(1_000_200) == 2
+    assert sorted(messages(sub)) == [(b'__keyevent@0__:expired', b'k'), (b'__keyevent@0__:expired', b'lazy')]
+    assert run(b'CONFIG', b'SET', b'notify-keyspace-events', b'Kq') == \
+        b"-ERR Invalid argument 'Kq' for CONFIG SET 'notify-keyspace-events'\r\n"
+
+
+def test_disabled_notifications_never_publish(monkeypatch):
+    def no_publish(*args):
+        raise AssertionError("published")
+    monkeypatch.setattr(keyspace_events, 'publish', no_publish)
+    # Classes without K / E, or K / E without classes: nothing to publish.
+    for flags in (b'', b'A', b'KE'):
+        run(b'CONFIG', b'SET', b'notify-keyspace-events', flags)
+        assert keyspace_events.notify_mask == 0
+        run(b'SET', b'k', b'v')
+        run(b'INCR', b'n')
+        run(b'DEL', b'k')
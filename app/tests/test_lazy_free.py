@@ -0,0 +1,91 @@
+import asyncio
+import time
+
+import pytest
+
+from app import lazy_free
+from app.key_value_utils import ValueObj, NO_EXPIRY, ValueTypes
+from app.lazy_free import drain_lazy_free
+from app.memory_management import redis_memstore, set_to_memstore, unlink_from_memstore, flush_memstore, \
+    delete_from_memstore
+from app.redis_streams import RedisStream
+
+
+@pytest.fixture(autouse=True)
+def drain():
+    yield
+    drain_lazy_free()
+
+
+def test_stream_dismantle_breaks_leaf_links():
+    r = RedisStream()
+    for i in range(1, 6):
+        r.append(f'{i}-0', {b'k': b'v'})
+    leaf = r._latest_leaf
+    leaves = []
+    while leaf:
+        leaves.append(leaf)
+        leaf = leaf.prev_leaf
+
+    for _ in r.dismantle():
+        pass
+
+    assert all(l.prev_leaf is None and l.next_leaf is None for l in leaves)
+    assert r._latest_leaf is None
+    assert r._root.children == {}
+
+
+def test_unlink_detaches_key_immediately():
+    set_to_memstore(b'foo', b'bar')
+    assert unlink_from_memstore(b'foo', 0)
+    assert b'foo' not in redis_memstore
+    assert not unlink_from_memstore(b'foo', 0)
+
+
+def test_del_skips_expired_keys():
+    set_to_memstore(b'foo', b'bar', request_recv_time_ms=0, time_to_live_ms=10)
+    assert not delete_from_memstore(b'foo', 100)
+
+
+def test_drain_is_bounded():
+    big = {i: [i] * 3 for i in range(10_000)}
+    # Queue it directly, lazy_free() would drain everything right away since no event loop is running.
+    lazy_free._pending.append(lazy_free._dismantle(big))
+    lazy_free.lazyfree_pending_objects += 1
+    assert drain_lazy_free(max_steps=100)
+    assert len(big) == 10_000 - 100
+    assert not drain_lazy_free()
+    assert big == {}
+
+
+def test_flushall_async_does_not_block_other_clients():
+    """
+    Latency monitor: while a big value is being reclaimed, a ticker task must keep getting the loop.
+    A database of a few keys counts the work of freeing them, not how many they are.
+    """
+    stream = RedisStream()
+    for i in range(1, 20_001):
+        stream.append(f'{i}-0', {b'k': b'v'})
+    set_to_memstore(b'small', b'x')
+    redis_memstore[b'big'] = ValueObj(val=stream, unix_expiry_ms=NO_EXPIRY, val_dtype=ValueTypes.STREAM)
+    latest_leaf = stream._latest_leaf
+    del stream
+
+    async def run():
+        max_gap = 0
+        flush_memstore(asynchronous=True)
+        assert len(redis_memstore) == 0
+        assert lazy_free.lazyfree_pending_objects == 1
+        last = time.perf_counter()
+        while lazy_free._pending:
+            await asyncio.sleep(0)
+            now = time.perf_counter()
+            max_gap = max(max_gap, now - last)
+            last = now
+        return max_gap
+
+    max_gap = asyncio.run(run())
+    # One batch is LAZYFREE_STEPS_PER_BATCH small steps, it should take way below a few ms.
+    assert max_gap < 0.05
+    # Dismantled: no leaf cycle left for the GC.
+    assert latest_leaf.prev_leaf is None and latest_leaf.next_leaf is None
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from app.memory_management import redis_memstore
+from app.metrics import render_metrics, handle_metrics_client
+from app.server_stats import reset_stats
+from conftest import run
+
+
+@pytest.fixture(autouse=True)
+def clear():
+    reset_stats()
+    yield
+
+
+def _samples(text: str) -> dict[str, str]:
+    return dict(line.rsplit(' ', 1) for line in text.splitlines() if not line.startswith('#'))
+
+
+def test_keyspace_keeps_an_expiry_index():
+    run(b'SET', b'a', b'1', b'PX', b'100000')
+    run(b'SET', b'b', b'1')
+    assert set(redis_memstore.expires) == {b'a'}
+    # Overwriting without an expiry drops it.
+    run(b'SET', b'a', b'2')
+    assert redis_memstore.expires == {}
+    run(b'SET', b'a', b'1', b'PX', b'100000')
+    run(b'DEL', b'a')
+    assert redis_memstore.expires == {}
+
+
+def test_render_metrics(monkeypatch):
+    run(b'SET', b'k', b'v', b'PX', b'100000')
+    run(b'SET', b'k2', b'v')
+    run(b'GET', b'k')
+    run(b'GET', b'missing')
+    run(b'LPUSH', b'k2', b'x')
+
+    # A scrape never walks the keyspace.
+    def no_walk(*args):
+        raise AssertionError("keyspace walked")
+    for method in ('values', 'items', 'keys', '__iter__'):
+        monkeypatch.setattr(redis_memstore, method, no_walk, raising=False)
+    samples = _samples(render_metrics())
+
+    assert samples['redis_commands_total{cmd="set"}'] == '2'
+    assert samples['redis_commands_failed_total{cmd="lpush"}'] == '1'
+    assert samples['redis_keyspace_hits_total'] == '1'
+    assert samples['redis_keyspace_misses_total'] == '1'
+    assert samples['redis_db_keys{db="db0"}'] == '2'
+    assert samples['redis_db_keys_expiring{db="db0"}'] == '1'
+    assert samples['redis_command_latency_seconds_count{cmd="get"}'] == '2'
+    assert samples['redis_command_latency_seconds_bucket{cmd="get",le="+Inf"}'] == '2'
+    assert int(samples['redis_memory_used_bytes']) > 0
+
+
+def test_metrics_http_endpoint():
+    async def scrape(path: bytes) -> bytes:
+        server = await asyncio.start_server(handle_metrics_client, host='localhost', port=0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            reader, writer = await asyncio.open_connection('localhost', port)
+            writer.write(b'GET ' + path + b' HTTP/1.1\r\nHost: localhost\r\n\r\n')
+            response = await reader.read()
+            writer.close()
+            return response
+
+    response = asyncio.run(scrape(b'/metrics'))
+    headers, body = response.split(b'\r\n\r\n', 1)
+    assert headers.startswith(b'HTTP/1.1 200 OK')
+    assert b'Content-Type: text/plain; version=0.0.4' in headers
+    assert b'# TYPE redis_connected_clients gauge' in body
+    assert asyncio.run(scrape(b'/')).startswith(b'HTTP/1.1 404')
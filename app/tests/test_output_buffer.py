@@ -0,0 +1,109 @@
+import asyncio
+import time
+
+import pytest
+
+from app import output_buffer, replication
+from app.client_state import close_clients_over_output_limits
+from app.config import server_config
+from app.main import handle_client
+from app.output_buffer import is_over_output_limit
+from app.server_stats import stat_counters
+
+
+class FakeTransport:
+    def __init__(self):
+        self.buffered = 0
+        self.aborted = False
+
+    def get_write_buffer_size(self):
+        return self.buffered
+
+    def abort(self):
+        self.aborted = True
+
+
+class FakeWriter:
+    def __init__(self):
+        self.transport = FakeTransport()
+        self.frames = []
+
+    def write(self, data):
+        self.frames.append(data)
+
+    def get_extra_info(self, name):
+        return ('127.0.0.1', 7000)
+
+
+@pytest.fixture(autouse=True)
+def restore_limits():
+    saved = dict(server_config)
+    yield
+    server_config.update(saved)
+    output_buffer._over_soft_limit_since.clear()
+
+
+def test_hard_and_soft_limits():
+    writer = FakeWriter()
+    server_config['client-output-buffer-limit-normal'] = 1000
+    server_config['client-output-buffer-limit-normal-soft'] = 100
+    server_config['client-output-buffer-limit-normal-soft-seconds'] = 10
+    writer.transport.buffered = 50
+    assert not is_over_output_limit(writer, 'normal')
+    assert not is_over_output_limit(writer, 'normal', pending=60)
+    # Over the soft limit for more than 10 seconds.
+    output_buffer._over_soft_limit_since[writer] -= 11
+    assert is_over_output_limit(writer, 'normal', pending=60)
+    # Back under the soft limit: the clock restarts.
+    assert not is_over_output_limit(writer, 'normal')
+    assert writer not in output_buffer._over_soft_limit_since
+    writer.transport.buffered = 1001
+    assert is_over_output_limit(writer, 'normal')
+    # normal clients have no limits by default.
+    server_config['client-output-buffer-limit-normal'] = 0
+    server_config['client-output-buffer-limit-normal-soft'] = 0
+    assert not is_over_output_limit(writer, 'normal')
+
+
+def test_slow_replica_is_dropped_from_the_stream():
+    slow, fast = FakeWriter(), FakeWriter()
+    replication.add_replica_conn(slow)
+    replication.add_replica_conn(fast)
+    try:
+        slow.transport.buffered = server_config['client-output-buffer-limit-replica']
+        disconnections = stat_counters['client_output_buffer_limit_disconnections']
+        replication.append_to_replication_stream(b'*1\r\n$4\r\nPING\r\n')
+        assert slow.transport.aborted and not slow.frames
+        assert fast.frames == [b'*1\r\n$4\r\nPING\r\n']
+        assert not replication.is_replica_conn(slow)
+        assert stat_counters['client_output_buffer_limit_disconnections'] == disconnections + 1
+    finally:
+        replication.remove_replica_conn(slow)
+        replication.remove_replica_conn(fast)
+
+
+def test_client_that_doesnt_read_is_disconnected():
+    async def flood():
+        server = await asyncio.start_server(handle_client, host='localhost', port=0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            reader, writer = await asyncio.open_connection('localhost', port)
+            writer.write(b'SET big ' + b'x' * 1_000_000 + b'\r\n')
+            # Never reads the replies: the server stops running its commands, its buffer stays over the soft limit.
+            writer.write(b'GET big\r\n' * 100)
+            await writer.drain()
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+                close_clients_over_output_limits()
+                if stat_counters['client_output_buffer_limit_disconnections'] > disconnections:
+                    break
+            # The connection was closed: read() gets to EOF.
+            await asyncio.wait_for(reader.read(), 5)
+            writer.close()
+
+    server_config['client-output-buffer-limit-normal-soft'] = 64 * 1024
+    server_config['client-output-buffer-limit-normal-soft-seconds'] = 0
+    disconnections = stat_counters['client_output_buffer_limit_disconnections']
+    asyncio.run(flood())
+    assert stat_counters['client_output_buffer_limit_disconnections'] == disconnections + 1
@@ -1,5 +1,5 @@
 import pytest
-from app.redis_serialization_protocol import parse_redis_bytes, SerializedTypes
+from app.redis_serialization_protocol import parse_redis_bytes, parse_client_commands, SerializedTypes
 
 
 def test_parse_redis_bytes_simple_string():
@@ -38,3 +38,18 @@ def test_parse_redis_bytes_array():
     assert not is_error
     assert isinstance(result, list)
     assert result == [b'ECHO', b'raspberry']
+
+
+def test_parse_client_commands_pipelined():
+    msg = b'*2\r\n$3\r\nGET\r\n$1\r\na\r\n*3\r\n$3\r\nSET\r\n$1\r\nb\r\n$4\r\n1\r\n2\r\nPING\r\n'
+    commands, num_bytes = parse_client_commands(msg)
+    assert commands == [([b'GET', b'a'], 20), ([b'SET', b'b', b'1\r\n2'], 30), ([b'PING'], 6)]
+    assert num_bytes == len(msg)
+
+@pytest.mark.parametrize('cut', range(1, 27))
+def test_parse_client_commands_partial(cut):
+    msg = b'*2\r\n$3\r\nGET\r\n$1\r\na\r\n*3\r\n$3\r\nSET\r\n$1\r\nb\r\n$1\r\n1\r\n'
+    commands, num_bytes = parse_client_commands(msg[:20 + cut])
+    # Only the first command is complete: the rest waits for the next read.
+    assert commands == [([b'GET', b'a'], 20)]
+    assert num_bytes == 20
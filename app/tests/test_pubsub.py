@@ -0,0 +1,128 @@
+import pytest
+
+from app.config import server_config
+from app import pubsub
+from app.client_state import get_client_state
+from app.pubsub import PatternTrie
+from conftest import run
+
+
+class FakeTransport:
+    def __init__(self):
+        self.buffered = 0
+        self.aborted = False
+
+    def get_write_buffer_size(self):
+        return self.buffered
+
+    def abort(self):
+        self.aborted = True
+
+
+class FakeWriter:
+    def __init__(self):
+        self.transport = FakeTransport()
+        self.frames = []
+
+    def write(self, data):
+        self.frames.append(data)
+
+
+@pytest.fixture(autouse=True)
+def clean_pubsub():
+    yield
+    for writer in list(pubsub._subscribers):
+        pubsub.remove_subscriber(writer)
+
+
+def test_subscribe_publish_unsubscribe():
+    sub = FakeWriter()
+    assert run(b'SUBSCRIBE', b'news', b'sport', writer=sub) == \
+           b'*3\r\n$9\r\nsubscribe\r\n$4\r\nnews\r\n:1\r\n*3\r\n$9\r\nsubscribe\r\n$5\r\nsport\r\n:2\r\n'
+    assert run(b'PUBLISH', b'news', b'hello') == b':1\r\n'
+    assert sub.frames == [b'*3\r\n$7\r\nmessage\r\n$4\r\nnews\r\n$5\r\nhello\r\n']
+    assert run(b'PUBLISH', b'weather', b'rain') == b':0\r\n'
+    assert run(b'UNSUBSCRIBE', writer=sub).count(b'unsubscribe') == 2
+    assert run(b'PUBLISH', b'news', b'hello') == b':0\r\n'
+    assert run(b'UNSUBSCRIBE', writer=sub) == b'*3\r\n$11\r\nunsubscribe\r\n$-1\r\n:0\r\n'
+
+
+def test_message_frame_is_serialized_once():
+    subs = [FakeWriter() for _ in range(3)]
+    for sub in subs:
+        run(b'SUBSCRIBE', b'ch', writer=sub)
+    assert run(b'PUBLISH', b'ch', b'msg') == b':3\r\n'
+    assert subs[0].frames[0] is subs[1].frames[0] is subs[2].frames[0]
+
+
+def test_pattern_subscriptions():
+    sub = FakeWriter()
+    run(b'PSUBSCRIBE', b'news.*', b'n?ws.sport', b'*', writer=sub)
+    assert run(b'PUBLISH', b'news.sport', b'goal') == b':3\r\n'
+    assert sorted(frame.split(b'\r\n')[4] for frame in sub.frames) == [b'*', b'n?ws.sport', b'news.*']
+    assert sub.frames[0].startswith(b'*4\r\n$8\r\npmessage\r\n')
+    assert run(b'PUBSUB', b'NUMPAT') == b':3\r\n'
+    run(b'PUNSUBSCRIBE', b'*', writer=sub)
+    assert run(b'PUBLISH', b'other', b'x') == b':0\r\n'
+
+
+def test_pattern_trie():
+    trie = PatternTrie()
+    for pattern in (b'a*', b'ab*', b'abc', b'a?c', b'*', b'b[xy]'):
+        trie.add(pattern)
+    assert sorted(trie.matching(b'abc')) == sorted([b'a*', b'ab*', b'abc', b'a?c', b'*'])
+    assert sorted(trie.matching(b'by')) == [b'*', b'b[xy]']
+    trie.remove(b'ab*')
+    trie.remove(b'abc')
+    assert sorted(trie.matching(b'abc')) == sorted([b'a*', b'a?c', b'*'])
+    # The 'b' branch of 'ab' is pruned.
+    assert not trie._root.children[ord('a')].children
+
+
+def test_subscribed_mode_restricts_commands():
+    sub = FakeWriter()
+    run(b'SUBSCRIBE', b'ch', writer=sub)
+    assert run(b'GET', b'k', writer=sub).startswith(b"-ERR Can't execute 'get'")
+    assert run(b'PING', writer=sub) == b'*2\r\n$4\r\npong\r\n$0\r\n\r\n'
+    run(b'UNSUBSCRIBE', writer=sub)
+    assert run(b'GET', b'k', writer=sub) == b'$-1\r\n'
+
+
+def test_reset_and_quit_in_subscribed_mode():
+    sub = FakeWriter()
+    run(b'SUBSCRIBE', b'ch', writer=sub)
+    assert run(b'RESET', writer=sub) == b'+RESET\r\n'
+    assert run(b'PUBLISH', b'ch', b'hi') == b':0\r\n'
+    assert run(b'GET', b'k', writer=sub) == b'$-1\r\n'
+    run(b'SUBSCRIBE', b'ch', writer=sub)
+    assert run(b'QUIT', writer=sub) == b'+OK\r\n'
+    assert get_client_state(sub).close_after_reply
+
+
+def test_pubsub_introspection_and_shard_channels():
+    a, b = FakeWriter(), FakeWriter()
+    run(b'SUBSCRIBE', b'c1', b'c2', writer=a)
+    run(b'SUBSCRIBE', b'c1', writer=b)
+    run(b'SSUBSCRIBE', b'shard', writer=b)
+    assert sorted(run(b'PUBSUB', b'CHANNELS').split(b'\r\n')[2::2]) == [b'c1', b'c2']
+    assert run(b'PUBSUB', b'CHANNELS', b'*2') == b'*1\r\n$2\r\nc2\r\n'
+    assert run(b'PUBSUB', b'NUMSUB', b'c1', b'c3') == b'*4\r\n$2\r\nc1\r\n:2\r\n$2\r\nc3\r\n:0\r\n'
+    assert run(b'PUBSUB', b'SHARDCHANNELS') == b'*1\r\n$5\r\nshard\r\n'
+    assert run(b'SPUBLISH', b'shard', b'hi') == b':1\r\n'
+    assert b.frames[-1] == b'*3\r\n$8\r\nsmessage\r\n$5\r\nshard\r\n$2\r\nhi\r\n'
+    # Shard channels are a separate namespace.
+    assert run(b'PUBLISH', b'shard', b'hi') == b':0\r\n'
+    pubsub.remove_subscriber(b)
+    assert run(b'PUBSUB', b'NUMSUB', b'c1') == b'*2\r\n$2\r\nc1\r\n:1\r\n'
+    assert run(b'PUBSUB', b'SHARDCHANNELS') == b'*0\r\n'
+
+
+def test_slow_subscriber_is_disconnected():
+    slow, fast = FakeWriter(), FakeWriter()
+    run(b'SUBSCRIBE', b'ch', writer=slow)
+    run(b'SUBSCRIBE', b'ch', writer=fast)
+    slow.transport.buffered = server_config['client-output-buffer-limit-pubsub']
+    assert run(b'PUBLISH', b'ch', b'msg') == b':1\r\n'
+    assert slow.transport.aborted and not slow.frames
+    assert len(fast.frames) == 1
+    assert run(b'PUBSUB', b'NUMSUB', b'ch') == b'*2\r\n$2\r\nch\r\n:1\r\n'
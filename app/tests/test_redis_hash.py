@@ -0,0 +1,93 @@
+from app.config import server_config
+from app.memory_management import redis_memstore
+from app.redis_hash import RedisHash, ENCODING_LISTPACK, ENCODING_HASHTABLE
+from conftest import run
+
+
+def test_listpack_set_get_delete():
+    h = RedisHash()
+    assert h.set(b'a', b'1')
+    assert h.set(b'b', b'a')
+    assert not h.set(b'a', b'2')
+    assert h.encoding == ENCODING_LISTPACK
+    assert h.get(b'a') == b'2'
+    assert len(h) == 2
+    assert h.delete(b'a')
+    assert h.get(b'a') is None
+    assert h.flat_items() == [b'b', b'a']
+
+
+def test_field_lookup_skips_values():
+    # The value of 'x' is equal to the field name 'y'.
+    h = RedisHash()
+    h.set(b'x', b'y')
+    assert h.get(b'y') is None
+    h.set(b'y', b'z')
+    assert h.get(b'y') == b'z'
+    assert len(h) == 2
+
+
+def test_converts_to_hashtable_past_entry_limit():
+    h = RedisHash()
+    for i in range(server_config['hash-max-listpack-entries']):
+        h.set(str(i).encode(), b'v')
+    assert h.encoding == ENCODING_LISTPACK
+    h.set(b'one-more', b'v')
+    assert h.encoding == ENCODING_HASHTABLE
+    assert len(h) == server_config['hash-max-listpack-entries'] + 1
+    assert h.get(b'0') == b'v'
+
+
+def test_converts_to_hashtable_on_big_value():
+    h = RedisHash()
+    h.set(b'a', b'1')
+    h.set(b'b', b'x' * (server_config['hash-max-listpack-value'] + 1))
+    assert h.encoding == ENCODING_HASHTABLE
+    assert h.get(b'a') == b'1'
+
+
+def test_hscan_hashtable_is_incremental():
+    h = RedisHash()
+    for i in range(1000):
+        h.set(str(i).encode(), b'v')
+    cursor, seen = 0, []
+    while True:
+        cursor, items = h.scan(cursor, 100, None)
+        assert len(items) <= 200
+        seen.extend(items[::2])
+        if cursor == 0:
+            break
+    assert sorted(seen) == sorted(str(i).encode() for i in range(1000))
+
+
+def test_hash_commands():
+    assert run(b'HSET', b'h', b'f1', b'1', b'f2', b'2') == b':2\r\n'
+    assert run(b'HGET', b'h', b'f1') == b'$1\r\n1\r\n'
+    assert run(b'HGET', b'h', b'nope') == b'$-1\r\n'
+    assert run(b'HMGET', b'h', b'f1', b'nope') == b'*2\r\n$1\r\n1\r\n$-1\r\n'
+    assert run(b'HINCRBY', b'h', b'f2', b'5') == b':7\r\n'
+    assert run(b'HGETALL', b'h') == b'*4\r\n$2\r\nf1\r\n$1\r\n1\r\n$2\r\nf2\r\n$1\r\n7\r\n'
+    assert run(b'TYPE', b'h') == b'+hash\r\n'
+    assert run(b'HDEL', b'h', b'f1', b'f2', b'nope') == b':2\r\n'
+    # Deleting the last field deletes the key.
+    assert b'h' not in redis_memstore
+
+
+def test_wrongtype():
+    run(b'SET', b's', b'x')
+    assert run(b'HGET', b's', b'f').startswith(b'-WRONGTYPE')
+    run(b'HSET', b'h', b'f', b'v')
+    assert run(b'GET', b'h').startswith(b'-WRONGTYPE')
+    # Commands of the other types too.
+    for tokens in ([b'INCR', b'h'], [b'XADD', b'h', b'*', b'a', b'b'], [b'XRANGE', b'h', b'-', b'+']):
+        assert run(*tokens).startswith(b'-WRONGTYPE')
+    run(b'HSET', b'h', b'f', b'abc')
+    assert run(b'HINCRBY', b'h', b'f', b'1') == b'-ERR hash value is not an integer\r\n'
+
+
+def test_hincrby_is_int64():
+    assert run(b'HINCRBY', b'h', b'f', b'9999999999999999999999') == \
+        b'-ERR value is not an integer or out of range\r\n'
+    assert run(b'HINCRBY', b'h', b'f', b'9223372036854775807') == b':9223372036854775807\r\n'
+    assert run(b'HINCRBY', b'h', b'f', b'1') == b'-ERR increment or decrement would overflow\r\n'
+    assert run(b'HGET', b'h', b'f') == b'$19\r\n9223372036854775807\r\n'
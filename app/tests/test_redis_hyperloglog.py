@@ -0,0 +1,119 @@
+import random
+
+from app.config import server_config
+from app.memory_management import redis_memstore
+from app.redis_hyperloglog import HLL_REGISTERS, HLL_HDR_SIZE, HLL_DENSE, HLL_SPARSE, pack_dense, unpack_dense, \
+    pack_sparse, unpack_sparse, new_hll, _sparse_set, _registers_max
+from conftest import run
+
+
+def test_register_packing_round_trips():
+    rng = random.Random(3)
+    registers = bytearray(rng.randrange(64) for _ in range(HLL_REGISTERS))
+    assert unpack_dense(pack_dense(registers)) == registers
+    sparse_registers = bytearray(HLL_REGISTERS)
+    sparse_registers[0:5] = b'\x01\x01\x01\x01\x01'
+    sparse_registers[9000] = 32
+    assert unpack_sparse(pack_sparse(sparse_registers)) == sparse_registers
+    sparse_registers[1] = 33
+    assert pack_sparse(sparse_registers) is None
+
+
+def test_registers_max_is_per_register():
+    rng = random.Random(4)
+    a = bytes(rng.randrange(64) for _ in range(HLL_REGISTERS))
+    b = bytes(rng.randrange(64) for _ in range(HLL_REGISTERS))
+    assert _registers_max(a, b) == bytes(max(x, y) for x, y in zip(a, b))
+
+
+def test_pfadd_pfcount():
+    assert run(b'PFADD', b'hll', b'a', b'b', b'c') == b':1\r\n'
+    assert run(b'PFADD', b'hll', b'a') == b':0\r\n'
+    assert run(b'PFCOUNT', b'hll') == b':3\r\n'
+    assert run(b'TYPE', b'hll') == b'+string\r\n'
+    # Creating an empty HyperLogLog counts as a change.
+    assert run(b'PFADD', b'empty') == b':1\r\n'
+    assert run(b'PFCOUNT', b'empty') == b':0\r\n'
+    assert run(b'PFCOUNT', b'missing') == b':0\r\n'
+    run(b'SET', b'str', b'not a hll')
+    assert run(b'PFADD', b'str', b'a').startswith(b'-WRONGTYPE')
+
+
+def test_cached_cardinality():
+    run(b'PFADD', b'hll', *[b'%d' % i for i in range(100)])
+    assert redis_memstore[b'hll'].val[15] & 0x80
+    count = run(b'PFCOUNT', b'hll')
+    assert not redis_memstore[b'hll'].val[15] & 0x80
+    assert run(b'PFCOUNT', b'hll') == count
+    # Not invalidated when no register changes.
+    run(b'PFADD', b'hll', b'1')
+    assert not redis_memstore[b'hll'].val[15] & 0x80
+    run(b'PFADD', b'hll', b'new element')
+    assert redis_memstore[b'hll'].val[15] & 0x80
+
+
+def test_sparse_to_dense_and_error_bound():
+    n = 20000
+    run(b'PFADD', b'hll', *[b'user:%d' % i for i in range(50)])
+    assert redis_memstore[b'hll'].val[4] == HLL_SPARSE
+    run(b'PFADD', b'hll', *[b'user:%d' % i for i in range(n)])
+    assert redis_memstore[b'hll'].val[4] == HLL_DENSE
+    assert len(redis_memstore[b'hll'].val) == 16 + 12288
+    count = int(run(b'PFCOUNT', b'hll')[1:-2])
+    assert abs(count - n) / n < 0.03
+
+
+def test_sparse_max_bytes_config():
+    server_config['hll-sparse-max-bytes'] = 100
+    try:
+        run(b'PFADD', b'hll', *[b'%d' % i for i in range(200)])
+        assert redis_memstore[b'hll'].val[4] == HLL_DENSE
+    finally:
+        server_config['hll-sparse-max-bytes'] = 3000
+
+
+def test_sparse_set_in_place():
+    rng = random.Random(5)
+    buf, registers = new_hll(), bytearray(HLL_REGISTERS)
+    for _ in range(2000):
+        # Clustered indexes, so runs get split and merged with their neighbours.
+        index, count = rng.randrange(0, HLL_REGISTERS, rng.choice((1, 7, 997))), rng.randrange(1, 6)
+        assert _sparse_set(buf, index, count) == (count > registers[index])
+        registers[index] = max(registers[index], count)
+        assert unpack_sparse(buf[HLL_HDR_SIZE:]) == registers
+    assert len(buf) <= HLL_HDR_SIZE + len(pack_sparse(registers)) * 2
+    assert _sparse_set(buf, 0, 33) is None
+
+
+def test_pfadd_one_by_one_stays_sparse_then_dense():
+    elements = [b'%d' % i for i in range(300)]
+    for element in elements:
+        run(b'PFADD', b'hll', element)
+    run(b'PFADD', b'batch', *elements)
+    assert redis_memstore[b'hll'].val[4] == HLL_SPARSE
+    assert unpack_sparse(redis_memstore[b'hll'].val[16:]) == unpack_sparse(redis_memstore[b'batch'].val[16:])
+    server_config['hll-sparse-max-bytes'] = 200
+    try:
+        run(b'PFADD', b'hll', b'one more')
+        run(b'PFADD', b'batch', b'one more')
+        assert redis_memstore[b'hll'].val[4] == HLL_DENSE
+        assert redis_memstore[b'hll'].val[16:] == redis_memstore[b'batch'].val[16:]
+    finally:
+        server_config['hll-sparse-max-bytes'] = 3000
+
+
+def test_pfmerge_and_multi_key_pfcount():
+    run(b'PFADD', b'a', *[b'%d' % i for i in range(0, 3000)])
+    run(b'PFADD', b'b', *[b'%d' % i for i in range(2000, 5000)])
+    union = int(run(b'PFCOUNT', b'a', b'b')[1:-2])
+    assert abs(union - 5000) / 5000 < 0.03
+    assert run(b'PFMERGE', b'dest', b'a', b'b') == b'+OK\r\n'
+    assert int(run(b'PFCOUNT', b'dest')[1:-2]) == union
+    # The destination's own registers are part of the merge.
+    run(b'PFADD', b'small', b'x')
+    run(b'PFMERGE', b'small', b'a')
+    assert abs(int(run(b'PFCOUNT', b'small')[1:-2]) - 3001) / 3001 < 0.03
+    # GET / SET round trip (same format as redis).
+    raw = redis_memstore[b'dest'].val
+    run(b'SET', b'copy', bytes(raw))
+    assert run(b'PFCOUNT', b'copy') == run(b'PFCOUNT', b'dest')
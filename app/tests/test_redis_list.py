@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+
+from app.config import server_config
+from app.main import handle_command
+from app.memory_management import redis_memstore
+from app.redis_list import RedisList
+from conftest import run
+
+
+@pytest.fixture
+def small_chunks():
+    old = server_config['list-max-listpack-size']
+    server_config['list-max-listpack-size'] = 4
+    yield
+    server_config['list-max-listpack-size'] = old
+
+
+def make_list(n):
+    lst = RedisList()
+    for i in range(n):
+        lst.push_right(str(i).encode())
+    return lst
+
+
+def test_push_pop_both_ends(small_chunks):
+    lst = RedisList()
+    for i in range(10):
+        lst.push_right(str(i).encode())
+        lst.push_left(str(-i).encode())
+    assert len(lst) == 20
+    assert lst.num_chunks > 1
+    assert lst.pop_left() == b'-9'
+    assert lst.pop_right() == b'9'
+    assert lst.range(0, -1) == [str(-i).encode() for i in range(8, -1, -1)] + [str(i).encode() for i in range(9)]
+
+
+def test_empty_elements(small_chunks):
+    lst = RedisList()
+    lst.push_right(b'')
+    lst.push_right(b'a')
+    assert lst.pop_right() == b'a'
+    assert lst.pop_right() == b''
+    assert lst.pop_right() is None
+
+
+def test_index_and_range_across_chunks(small_chunks):
+    lst = make_list(50)
+    expected = [str(i).encode() for i in range(50)]
+    for i in range(-50, 50):
+        assert lst.index(i) == expected[i]
+    assert lst.index(50) is None
+    assert lst.range(7, 23) == expected[7:24]
+    assert lst.range(-5, -1) == expected[-5:]
+    assert lst.range(10, 5) == []
+    assert lst.range(40, 100) == expected[40:]
+
+
+@pytest.mark.parametrize("start, stop", [(0, -1), (5, 20), (3, 3), (-10, -2), (20, 5), (0, 100)])
+def test_trim(small_chunks, start, stop):
+    lst = make_list(30)
+    expected = lst.range(start, stop)
+    lst.trim(start, stop)
+    assert len(lst) == len(expected)
+    assert lst.range(0, -1) == expected
+
+
+def test_list_commands():
+    assert run(b'RPUSH', b'q', b'a', b'b', b'c') == b':3\r\n'
+    assert run(b'LPUSH', b'q', b'z') == b':4\r\n'
+    assert run(b'LRANGE', b'q', b'0', b'-1') == b'*4\r\n$1\r\nz\r\n$1\r\na\r\n$1\r\nb\r\n$1\r\nc\r\n'
+    assert run(b'LINDEX', b'q', b'-1') == b'$1\r\nc\r\n'
+    assert run(b'LPOP', b'q') == b'$1\r\nz\r\n'
+    assert run(b'RPOP', b'q', b'5') == b'*3\r\n$1\r\nc\r\n$1\r\nb\r\n$1\r\na\r\n'
+    assert run(b'LPOP', b'q', b'-1') == b'-ERR value is out of range, must be positive\r\n'
+    assert b'q' not in redis_memstore
+    assert run(b'LPUSHX', b'q', b'a') == b':0\r\n'
+    assert run(b'TYPE', b'q') == b'+none\r\n'
+
+
+def test_blpop_serves_waiters_fifo_one_per_element():
+    async def scenario():
+        first = asyncio.create_task(handle_command([b'BLPOP', b'q', b'0'], None, request_recv_time_ms=0))
+        second = asyncio.create_task(handle_command([b'BLPOP', b'q', b'0'], None, request_recv_time_ms=0))
+        await asyncio.sleep(0)
+        assert await handle_command([b'RPUSH', b'q', b'job1'], None, request_recv_time_ms=0) == b':1\r\n'
+        await asyncio.sleep(0)
+        assert first.done() and not second.done()
+        await handle_command([b'RPUSH', b'q', b'job2', b'job3'], None, request_recv_time_ms=0)
+        # job3 is left in the list, nobody else is waiting.
+        return await first, await second, redis_memstore[b'q'].val.range(0, -1)
+
+    first, second, leftover = asyncio.run(scenario())
+    assert first == b'*2\r\n$1\r\nq\r\n$4\r\njob1\r\n'
+    assert second == b'*2\r\n$1\r\nq\r\n$4\r\njob2\r\n'
+    assert leftover == [b'job3']
+
+
+def test_blpop_timeout():
+    assert run(b'BLPOP', b'q', b'0.01') == b'*-1\r\n'
+
+
+def test_blmove_same_list():
+    async def scenario():
+        waiter = asyncio.create_task(handle_command([b'BLMOVE', b'q', b'q', b'LEFT', b'RIGHT', b'0'], None,
+                                                    request_recv_time_ms=0))
+        await asyncio.sleep(0)
+        await handle_command([b'RPUSH', b'q', b'a', b'b'], None, request_recv_time_ms=0)
+        return await waiter, redis_memstore[b'q'].val.range(0, -1)
+
+    moved, lst = asyncio.run(scenario())
+    assert moved == b'$1\r\na\r\n'
+    assert lst == [b'b', b'a']
@@ -0,0 +1,84 @@
+from app.config import server_config
+from app.memory_management import redis_memstore
+from app.redis_set import RedisSet, ENCODING_INTSET, ENCODING_HASHTABLE, set_intersection, set_difference
+from conftest import run
+
+
+def test_intset_encoding():
+    s = RedisSet.from_members([b'3', b'1', b'-2', b'1'])
+    assert s.encoding == ENCODING_INTSET
+    assert list(s._intset) == [-2, 1, 3]
+    assert s.contains(b'1')
+    # Not canonical integers, must not match 1.
+    assert not s.contains(b'01')
+    assert not s.contains(b'+1')
+    assert s.remove(b'3')
+    assert not s.remove(b'3')
+    s.add(b'01')
+    assert s.encoding == ENCODING_HASHTABLE
+    assert sorted(s.members()) == sorted([b'-2', b'1', b'01'])
+
+
+def test_intset_converts_past_max_entries():
+    s = RedisSet.from_members(str(i).encode() for i in range(server_config['set-max-intset-entries']))
+    assert s.encoding == ENCODING_INTSET
+    s.add(b'100000')
+    assert s.encoding == ENCODING_HASHTABLE
+    assert s.contains(b'100000') and s.contains(b'0')
+
+
+def test_intersection_mixed_encodings():
+    small = RedisSet.from_members([b'1', b'2', b'3'])
+    big = RedisSet.from_members([b'a', b'2', b'3'] + [str(i).encode() for i in range(1000, 2000)])
+    bigger = RedisSet.from_members([b'3', b'2', b'x'] + [str(i).encode() for i in range(5000)])
+    assert set_intersection([big, small, bigger]) == {b'2', b'3'}
+    assert set_intersection([big, bigger]) == {b'2', b'3'} | {str(i).encode() for i in range(1000, 2000)}
+    assert set_intersection([small, None]) == set()
+    assert set_difference([small, big]) == {b'1'}
+
+
+def test_intersection_iterates_the_fewest_members(monkeypatch):
+    # A hashtable smaller than an intset: the hashtable drives, the intset is only probed.
+    intset = RedisSet.from_members(str(i).encode() for i in range(500))
+    hashtable = RedisSet.from_members([b'1', b'2', b'x'])
+    assert (intset.encoding, hashtable.encoding) == (ENCODING_INTSET, ENCODING_HASHTABLE)
+    probed = []
+    real_contains = RedisSet.contains
+    monkeypatch.setattr(RedisSet, 'contains', lambda s, m: probed.append((s, m)) or real_contains(s, m))
+    assert set_intersection([intset, hashtable]) == {b'1', b'2'}
+    assert sorted(m for s, m in probed if s is intset) == [b'1', b'2', b'x']
+    assert all(s is intset for s, _ in probed)
+
+
+def test_sscan_hashtable():
+    s = RedisSet.from_members([b'm%d' % i for i in range(500)])
+    cursor, seen = 0, []
+    cursor, members = s.scan(cursor, 50, None)
+    seen.extend(members)
+    # Modifications during the scan: removed members are not returned, the others still are.
+    # (Added members may or may not be.)
+    removed = next(b'm%d' % i for i in range(500) if b'm%d' % i not in seen)
+    s.remove(removed)
+    s.add(b'new')
+    while cursor:
+        cursor, members = s.scan(cursor, 50, None)
+        seen.extend(members)
+    expected = {b'm%d' % i for i in range(500)} - {removed}
+    assert expected <= set(seen) <= expected | {b'new'}
+
+
+def test_set_commands():
+    assert run(b'SADD', b's1', b'a', b'b', b'c') == b':3\r\n'
+    assert run(b'SADD', b's2', b'b', b'c', b'd') == b':3\r\n'
+    assert run(b'SISMEMBER', b's1', b'a') == b':1\r\n'
+    assert run(b'SMISMEMBER', b's1', b'a', b'z') == b'*2\r\n:1\r\n:0\r\n'
+    assert run(b'SINTERSTORE', b'dst', b's1', b's2') == b':2\r\n'
+    assert sorted(redis_memstore[b'dst'].val.members()) == [b'b', b'c']
+    assert run(b'SUNIONSTORE', b'dst', b's1', b's2') == b':4\r\n'
+    assert run(b'SDIFF', b's1', b's2') == b'*1\r\n$1\r\na\r\n'
+    assert run(b'SDIFFSTORE', b'dst', b's1', b's1') == b':0\r\n'
+    assert b'dst' not in redis_memstore
+    assert run(b'SREM', b's1', b'a', b'b', b'c') == b':3\r\n'
+    assert b's1' not in redis_memstore
+    assert run(b'TYPE', b's2') == b'+set\r\n'
+    assert run(b'SCARD', b's2') == b':3\r\n'
@@ -0,0 +1,98 @@
+import asyncio
+import random
+
+import pytest
+
+from app.config import server_config
+from app.main import handle_command
+from app.memory_management import redis_memstore
+from app.redis_sorted_set import RedisSortedSet, ENCODING_SKIPLIST, ENCODING_LISTPACK, _SkipListIndex
+from conftest import run
+
+
+@pytest.mark.parametrize("num_members", [50, 1000])
+def test_matches_sorted_model(num_members):
+    rnd = random.Random(num_members)
+    zset = RedisSortedSet()
+    model = {}
+    for _ in range(num_members * 3):
+        member = b'm%d' % rnd.randrange(num_members)
+        if rnd.random() < 0.2:
+            assert zset.remove(member) == (member in model)
+            model.pop(member, None)
+        else:
+            score = float(rnd.randrange(100))
+            zset.set_score(member, score)
+            model[member] = score
+    expected = sorted(((score, member) for member, score in model.items()))
+    assert zset.encoding == (ENCODING_SKIPLIST if num_members > 128 else ENCODING_LISTPACK)
+    assert len(zset) == len(expected)
+    assert [(s, m) for m, s in zset.items_in_rank_range(0, len(zset))] == expected
+    for rank, (score, member) in enumerate(expected):
+        assert zset.rank(member) == rank
+        assert zset.score_of(member) == score
+    start, end = zset.rank_interval((10.0, True), (20.0, False))
+    assert [(s, m) for m, s in zset.items_in_rank_range(start, end)] == [(s, m) for s, m in expected if 10 <= s < 20]
+    rev = zset.items_in_rank_range(start, end, reverse=True, offset=1, count=3)
+    assert [(s, m) for m, s in rev] == [(s, m) for s, m in expected if 10 <= s < 20][::-1][1:4]
+
+
+def test_skiplist_range_does_not_walk_outside_range():
+    index = _SkipListIndex()
+    for i in range(10_000):
+        index.insert(float(i), b'%d' % i)
+    # The node at a rank is reached via spans, ie: ~log(n) hops.
+    assert next(index.iter_from_rank(9_000)) == (b'9000', 9000.0)
+    assert index.count_below(500.0, inclusive=False, by_lex=False) == 500
+    assert index.count_below(500.0, inclusive=True, by_lex=False) == 501
+
+
+def test_zadd_flags():
+    assert run(b'ZADD', b'z', b'1', b'a', b'2', b'b') == b':2\r\n'
+    assert run(b'ZADD', b'z', b'NX', b'5', b'a', b'3', b'c') == b':1\r\n'
+    assert run(b'ZSCORE', b'z', b'a') == b'$1\r\n1\r\n'
+    assert run(b'ZADD', b'z', b'XX', b'CH', b'5', b'a', b'9', b'new') == b':1\r\n'
+    assert run(b'ZADD', b'z', b'GT', b'CH', b'4', b'a') == b':0\r\n'
+    assert run(b'ZADD', b'z', b'LT', b'CH', b'4', b'a') == b':1\r\n'
+    assert run(b'ZADD', b'z', b'INCR', b'1.5', b'a') == b'$3\r\n5.5\r\n'
+    assert run(b'ZADD', b'z', b'NX', b'INCR', b'1', b'a') == b'$-1\r\n'
+    assert run(b'ZADD', b'z', b'NX', b'XX', b'1', b'a').startswith(b'-ERR')
+    assert run(b'ZADD', b'z', b'abc', b'a').startswith(b'-ERR')
+    assert run(b'ZCARD', b'z') == b':3\r\n'
+    assert run(b'ZADD', b'empty', b'XX', b'1', b'a') == b':0\r\n'
+    assert b'empty' not in redis_memstore
+
+
+def test_zrange_variants():
+    for score, member in [(1, b'a'), (2, b'b'), (3, b'c'), (4, b'd')]:
+        run(b'ZADD', b'z', str(score).encode(), member)
+    assert run(b'ZRANGE', b'z', b'0', b'1') == b'*2\r\n$1\r\na\r\n$1\r\nb\r\n'
+    assert run(b'ZRANGE', b'z', b'0', b'0', b'REV', b'WITHSCORES') == b'*2\r\n$1\r\nd\r\n$1\r\n4\r\n'
+    assert run(b'ZRANGE', b'z', b'(1', b'3', b'BYSCORE') == b'*2\r\n$1\r\nb\r\n$1\r\nc\r\n'
+    assert run(b'ZRANGE', b'z', b'+inf', b'-inf', b'BYSCORE', b'REV', b'LIMIT', b'1', b'2') == \
+        b'*2\r\n$1\r\nc\r\n$1\r\nb\r\n'
+    assert run(b'ZRANK', b'z', b'c') == b':2\r\n'
+    assert run(b'ZREVRANK', b'z', b'c') == b':1\r\n'
+    assert run(b'ZREMRANGEBYSCORE', b'z', b'2', b'(4') == b':2\r\n'
+    assert run(b'ZPOPMIN', b'z') == b'*2\r\n$1\r\na\r\n$1\r\n1\r\n'
+    assert run(b'ZPOPMIN', b'z', b'-1') == b'-ERR value is out of range, must be positive\r\n'
+    assert run(b'ZPOPMIN', b'z', b'0') == b'*0\r\n'
+    assert run(b'BZPOPMIN', b'z', b'-1') == b'-ERR timeout is negative\r\n'
+    assert run(b'BZPOPMIN', b'z', b'x') == b'-ERR timeout is not a float or out of range\r\n'
+
+
+def test_zrange_bylex():
+    for member in [b'a', b'b', b'c', b'd']:
+        run(b'ZADD', b'z', b'0', member)
+    assert run(b'ZRANGE', b'z', b'[b', b'(d', b'BYLEX') == b'*2\r\n$1\r\nb\r\n$1\r\nc\r\n'
+    assert run(b'ZRANGE', b'z', b'+', b'-', b'BYLEX', b'REV', b'LIMIT', b'0', b'1') == b'*1\r\n$1\r\nd\r\n'
+
+
+def test_bzpopmin_wakes_on_zadd():
+    async def scenario():
+        waiter = asyncio.create_task(handle_command([b'BZPOPMIN', b'z', b'0'], None, request_recv_time_ms=0))
+        await asyncio.sleep(0)
+        await handle_command([b'ZADD', b'z', b'2', b'b', b'1', b'a'], None, request_recv_time_ms=0)
+        return await waiter
+
+    assert asyncio.run(scenario()) == b'*3\r\n$1\r\nz\r\n$1\r\na\r\n$1\r\n1\r\n'
@@ -0,0 +1,129 @@
+import random
+
+from app.memory_management import redis_memstore
+from app.redis_strings import bitcount, bitpos, bitop
+from conftest import run
+
+
+def _bits(buf):
+    return [(byte >> (7 - i)) & 1 for byte in buf for i in range(8)]
+
+
+def test_append_setrange_getrange_strlen():
+    assert run(b'APPEND', b's', b'Hello') == b':5\r\n'
+    assert run(b'APPEND', b's', b' World') == b':11\r\n'
+    assert run(b'GET', b's') == b'$11\r\nHello World\r\n'
+    assert run(b'SETRANGE', b's', b'6', b'Redis') == b':11\r\n'
+    assert run(b'GETRANGE', b's', b'-5', b'-1') == b'$5\r\nRedis\r\n'
+    assert run(b'GETRANGE', b's', b'0', b'100') == b'$11\r\nHello Redis\r\n'
+    assert run(b'GETRANGE', b's', b'5', b'2') == b'$0\r\n\r\n'
+    # Zero padding.
+    assert run(b'SETRANGE', b'p', b'3', b'x') == b':4\r\n'
+    assert run(b'GET', b'p') == b'$4\r\n\x00\x00\x00x\r\n'
+    # An empty value doesn't create the key.
+    assert run(b'SETRANGE', b'e', b'3', b'') == b':0\r\n'
+    assert run(b'TYPE', b'e') == b'+none\r\n'
+    assert run(b'STRLEN', b's') == b':11\r\n'
+    assert run(b'STRLEN', b'missing') == b':0\r\n'
+
+
+def test_mutations_are_in_place():
+    run(b'SET', b's', b'abc')
+    run(b'APPEND', b's', b'd')
+    buf = redis_memstore[b's'].val
+    assert isinstance(buf, bytearray)
+    run(b'SETBIT', b's', b'0', b'1')
+    run(b'SETRANGE', b's', b'1', b'Z')
+    assert redis_memstore[b's'].val is buf
+    assert run(b'GET', b's') == b'$4\r\n\xe1Zcd\r\n'
+    # INCR still works on the converted value.
+    run(b'SET', b'n', b'1')
+    run(b'APPEND', b'n', b'0')
+    assert run(b'INCR', b'n') == b':11\r\n'
+
+
+def test_setbit_getbit():
+    assert run(b'SETBIT', b'b', b'7', b'1') == b':0\r\n'
+    assert run(b'SETBIT', b'b', b'7', b'1') == b':1\r\n'
+    assert run(b'GETBIT', b'b', b'7') == b':1\r\n'
+    assert run(b'GETBIT', b'b', b'6') == b':0\r\n'
+    assert run(b'GETBIT', b'b', b'1000') == b':0\r\n'
+    assert run(b'GET', b'b') == b'$1\r\n\x01\r\n'
+    assert run(b'SETBIT', b'b', b'100', b'1') == b':0\r\n'
+    assert run(b'STRLEN', b'b') == b':13\r\n'
+    assert run(b'SETBIT', b'b', b'7', b'0') == b':1\r\n'
+    assert run(b'SETBIT', b'b', b'-1', b'1').startswith(b'-ERR bit offset')
+    assert run(b'SETBIT', b'b', b'1', b'2').startswith(b'-ERR bit is not')
+    run(b'LPUSH', b'l', b'x')
+    assert run(b'SETBIT', b'l', b'1', b'1').startswith(b'-WRONGTYPE')
+
+
+def test_bitcount_and_bitpos_match_bit_by_bit_reference():
+    rng = random.Random(7)
+    for _ in range(200):
+        buf = bytes(rng.choice([0, 0xff, rng.randrange(256)]) for _ in range(rng.randrange(1, 12)))
+        bits = _bits(buf)
+        start, end = rng.randrange(-100, 100), rng.randrange(-100, 100)
+        bit_mode = rng.random() < 0.5
+        n = len(bits) if bit_mode else len(buf)
+        s, e = (start + n if start < 0 else start), (end + n if end < 0 else end)
+        s, e = max(s, 0), min(e, n - 1)
+        selected = [] if s > e else (bits[s:e + 1] if bit_mode else bits[s * 8:(e + 1) * 8])
+        assert bitcount(buf, start, end, bit_mode) == sum(selected)
+
+        bit = rng.randrange(2)
+        offset = s if bit_mode else s * 8
+        expected = next((offset + i for i, b in enumerate(selected) if b == bit), -1)
+        assert bitpos(buf, bit, start, end, bit_mode) == expected
+        if bit == 0 and expected == -1 and s <= e == n - 1:
+            # Without an explicit end, the string is considered padded with zeros.
+            assert bitpos(buf, 0, start, None, bit_mode) == len(bits)
+
+
+def test_bitcount_bitpos_commands():
+    run(b'SET', b'k', b'foobar')
+    assert run(b'BITCOUNT', b'k') == b':26\r\n'
+    assert run(b'BITCOUNT', b'k', b'0', b'0') == b':4\r\n'
+    assert run(b'BITCOUNT', b'k', b'1', b'1') == b':6\r\n'
+    assert run(b'BITCOUNT', b'k', b'5', b'30', b'BIT') == b':17\r\n'
+    assert run(b'BITCOUNT', b'missing') == b':0\r\n'
+    run(b'SET', b'p', b'\xff\xf0\x00')
+    assert run(b'BITPOS', b'p', b'0') == b':12\r\n'
+    assert run(b'BITPOS', b'p', b'1', b'2') == b':-1\r\n'
+    assert run(b'BITPOS', b'p', b'1', b'7', b'15', b'BIT') == b':7\r\n'
+    run(b'SET', b'ones', b'\xff\xff')
+    assert run(b'BITPOS', b'ones', b'0') == b':16\r\n'
+    assert run(b'BITPOS', b'ones', b'0', b'0', b'-1') == b':-1\r\n'
+    assert run(b'BITPOS', b'missing', b'0') == b':0\r\n'
+    assert run(b'BITPOS', b'missing', b'1') == b':-1\r\n'
+
+
+def test_bitop():
+    assert bitop(b'AND', [b'\xff\x0f', b'\x0f']) == b'\x0f\x00'
+    assert bitop(b'OR', [b'\xf0', b'\x0f\x01']) == b'\xff\x01'
+    assert bitop(b'XOR', [b'\xff', b'\x0f', b'\x01']) == b'\xf1'
+    assert bitop(b'NOT', [b'\x0f\xf0']) == b'\xf0\x0f'
+    run(b'SET', b'a', b'abc')
+    run(b'SET', b'b', b'a')
+    assert run(b'BITOP', b'AND', b'dest', b'a', b'b') == b':3\r\n'
+    assert run(b'GET', b'dest') == b'$3\r\na\x00\x00\r\n'
+    assert run(b'BITOP', b'NOT', b'dest', b'a', b'b').startswith(b'-ERR BITOP NOT')
+    # All sources missing: the destination is deleted.
+    assert run(b'BITOP', b'OR', b'dest', b'x', b'y') == b':0\r\n'
+    assert run(b'TYPE', b'dest') == b'+none\r\n'
+
+
+def test_bitfield():
+    assert run(b'BITFIELD', b'f', b'SET', b'i8', b'0', b'100', b'GET', b'u4', b'0') == b'*2\r\n:0\r\n:6\r\n'
+    assert run(b'BITFIELD', b'f', b'INCRBY', b'i8', b'0', b'100') == b'*1\r\n:-56\r\n'
+    assert run(b'BITFIELD', b'f', b'OVERFLOW', b'SAT', b'INCRBY', b'i8', b'0', b'-100') == b'*1\r\n:-128\r\n'
+    assert run(b'BITFIELD', b'f', b'OVERFLOW', b'FAIL', b'INCRBY', b'i8', b'0', b'-1') == b'*1\r\n$-1\r\n'
+    assert run(b'BITFIELD', b'f', b'GET', b'i8', b'0') == b'*1\r\n:-128\r\n'
+    # Unaligned, across bytes, #N offsets.
+    assert run(b'BITFIELD', b'u', b'SET', b'u5', b'#1', b'31', b'GET', b'u5', b'5', b'GET', b'u16', b'0') == \
+           b'*3\r\n:0\r\n:31\r\n:' + str(0b0000011111000000).encode() + b'\r\n'
+    assert run(b'BITFIELD', b'u', b'OVERFLOW', b'WRAP', b'INCRBY', b'u5', b'5', b'2') == b'*1\r\n:1\r\n'
+    assert run(b'BITFIELD', b'u', b'GET', b'u64', b'0').startswith(b'-ERR Invalid bitfield type')
+    # Reads of a missing key don't create it.
+    assert run(b'BITFIELD', b'none', b'GET', b'i64', b'0') == b'*1\r\n:0\r\n'
+    assert run(b'TYPE', b'none') == b'+none\r\n'
@@ -0,0 +1,146 @@
+import asyncio
+
+import pytest
+
+import app.main
+from app import replication
+from app.client_state import get_client_state
+from app.main import handle_command
+from app.memory_management import databases, flush_memstore
+from app.redis_serialization_protocol import parse_client_commands
+from app.replication import apply_master_stream
+from app.server_clock import now_ms
+from conftest import run
+
+
+class FakeWriter:
+    def __init__(self):
+        self.frames = []
+
+    def write(self, data):
+        self.frames.append(data)
+
+
+@pytest.fixture(autouse=True)
+def stream(monkeypatch):
+    """
+    What this master sends to its replicas.
+    """
+    appended = []
+    monkeypatch.setattr(replication, 'append_to_replication_stream', appended.append)
+    monkeypatch.setattr(app.main, 'append_to_replication_stream', appended.append)
+    monkeypatch.setattr(replication, '_master_conn_writer', FakeWriter(), raising=False)
+    replication._stream_db = -1
+    yield appended
+    replication._stream_db = 0
+    replication._master_buffer.clear()
+    replication.num_bytes_processed = 0
+
+
+def snapshot() -> dict:
+    """
+    The data of every database, as seen by the read commands.
+    """
+    reader = FakeWriter()
+    state = {}
+    for index, db in enumerate(databases):
+        run(b'SELECT', str(index).encode(), writer=reader)
+        for key in sorted(db):
+            kind = run(b'TYPE', key, writer=reader)
+            read = {b'+string\r\n': [b'GET', key], b'+hash\r\n': [b'HGETALL', key],
+                    b'+list\r\n': [b'LRANGE', key, b'0', b'-1'], b'+stream\r\n': [b'XRANGE', key, b'-', b'+'],
+                    b'+zset\r\n': [b'ZRANGE', key, b'0', b'-1', b'WITHSCORES']}[kind]
+            state[index, key] = (kind, run(*read, writer=reader))
+    return state
+
+
+def replay_on_replica(appended):
+    """
+    Start from empty data, and apply the stream like a replica does.
+    """
+    flush_memstore()
+    replication._master_buffer.extend(b''.join(appended))
+    apply_master_stream()
+
+
+def test_writes_reach_the_replica_as_they_ran(stream):
+    a, b = FakeWriter(), FakeWriter()
+    run(b'SET', b'n', b'1', writer=a)
+    run(b'HSET', b'h', b'f', b'v', writer=a)
+    run(b'SELECT', b'3', writer=a)
+    run(b'RPUSH', b'l', b'x', b'y', writer=a)
+    run(b'XADD', b's', b'*', b'f', b'v', writer=a)
+    run(b'ZADD', b'z', b'1', b'm', writer=a)
+    # Failed: not propagated, in or out of a transaction.
+    assert run(b'INCR', b'l', writer=a).startswith(b'-WRONGTYPE')
+    run(b'SET', b'text', b'abc', writer=b)
+    assert run(b'INCR', b'text', writer=b) == b'-ERR value is not an integer or out of range\r\n'
+    run(b'MULTI', writer=a)
+    run(b'INCR', b'l', writer=a)
+    run(b'LPUSH', b'l', b'w', writer=a)
+    run(b'DEL', b'missing', writer=a)
+    run(b'EXEC', writer=a)
+    assert b'INCR' not in b''.join(stream)
+    # (b's SET went to db 0 in between.)
+    assert stream[-1] == b'*1\r\n$5\r\nMULTI\r\n*2\r\n$6\r\nSELECT\r\n$1\r\n3\r\n' \
+                         b'*3\r\n$5\r\nLPUSH\r\n$1\r\nl\r\n$1\r\nw\r\n*2\r\n$3\r\nDEL\r\n$7\r\nmissing\r\n*1\r\n$4\r\nEXEC\r\n'
+
+    on_master = snapshot()
+    replay_on_replica(stream)
+    assert snapshot() == on_master
+    # The replica's own clients keep their database.
+    assert get_client_state(a).db == 3 and get_client_state(b).db == 0
+
+
+def test_blocked_pops_are_propagated_after_the_push(stream):
+    waiting, pusher = FakeWriter(), FakeWriter()
+
+    async def scenario():
+        blpop = asyncio.create_task(handle_command([b'BLPOP', b'q', b'other', b'0'], None, write_conn=waiting,
+                                                   request_recv_time_ms=0))
+        await asyncio.sleep(0.01)
+        await handle_command([b'RPUSH', b'q', b'a', b'b'], None, write_conn=pusher, request_recv_time_ms=0)
+        await handle_command([b'RPUSH', b'other', b'c'], None, write_conn=pusher, request_recv_time_ms=0)
+        await blpop
+        # Served right away.
+        await handle_command([b'BLPOP', b'other', b'q', b'0'], None, write_conn=waiting, request_recv_time_ms=0)
+
+    asyncio.run(scenario())
+    assert b''.join(stream) == b'*2\r\n$6\r\nSELECT\r\n$1\r\n0\r\n' \
+                               b'*4\r\n$5\r\nRPUSH\r\n$1\r\nq\r\n$1\r\na\r\n$1\r\nb\r\n*2\r\n$4\r\nLPOP\r\n$1\r\nq\r\n' \
+                               b'*3\r\n$5\r\nRPUSH\r\n$5\r\nother\r\n$1\r\nc\r\n' \
+                               b'*2\r\n$4\r\nLPOP\r\n$5\r\nother\r\n'
+    on_master = snapshot()
+    replay_on_replica(stream)
+    assert snapshot() == on_master == {(0, b'q'): (b'+list\r\n', b'*1\r\n$1\r\nb\r\n')}
+
+
+def test_set_reaches_the_replica_as_applied(stream):
+    a = FakeWriter()
+    now = now_ms()
+    run(b'SET', b'k', b'v', b'EX', b'100', writer=a, now=now)
+    # Not set.
+    assert run(b'SET', b'k', b'other', b'NX', writer=a, now=now) == b'$-1\r\n'
+    assert run(b'SET', b'new', b'v', b'XX', writer=a, now=now) == b'$-1\r\n'
+    run(b'SET', b'k', b'w', b'XX', b'KEEPTTL', b'GET', writer=a, now=now)
+    run(b'PSETEX', b'p', b'5000', b'v', writer=a, now=now)
+    run(b'SET', b'e', b'v', writer=a, now=now)
+    run(b'EXPIRE', b'e', b'50', writer=a, now=now)
+    run(b'EXPIRE', b'missing', b'50', writer=a, now=now)
+    run(b'GETEX', b'p', b'PERSIST', writer=a, now=now)
+    commands, _ = parse_client_commands(b''.join(stream))
+    assert [tokens for tokens, _ in commands] == [
+        [b'SELECT', b'0'],
+        [b'SET', b'k', b'v', b'PXAT', str(now + 100_000).encode()],
+        [b'SET', b'k', b'w', b'KEEPTTL'],
+        [b'SET', b'p', b'v', b'PXAT', str(now + 5000).encode()],
+        [b'SET', b'e', b'v'],
+        [b'PEXPIREAT', b'e', str(now + 50_000).encode()],
+        [b'PERSIST', b'p'],
+    ]
+
+    on_master = snapshot()
+    replay_on_replica(stream)
+    assert snapshot() == on_master
+    # The same expiry times as on the master, whenever the replica applies them.
+    assert (databases[0][b'k'].unix_expiry_ms, databases[0][b'e'].unix_expiry_ms) == (now + 100_000, now + 50_000)
@@ -0,0 +1,68 @@
+import pytest
+
+from app import replication
+# Registers the dispatch of the commands from master.
+import app.main  # noqa: F401
+from app.memory_management import databases
+from app.redis_serialization_protocol import serialize_msg, SerializedTypes, parse_redis_bytes
+from app.replication import parse_fullresync, apply_master_stream
+
+
+class FakeWriter:
+    def __init__(self):
+        self.frames = []
+
+    def write(self, data):
+        self.frames.append(data)
+
+
+def cmd(*tokens) -> bytes:
+    return serialize_msg(list(tokens), SerializedTypes.ARRAY)
+
+
+def feed(data: bytes) -> int:
+    replication._master_buffer.extend(data)
+    return apply_master_stream()
+
+
+@pytest.fixture(autouse=True)
+def master_link(monkeypatch):
+    writer = FakeWriter()
+    monkeypatch.setattr(replication, '_master_conn_writer', writer, raising=False)
+    replication._master_buffer.clear()
+    replication.num_bytes_processed = 0
+    yield writer
+    replication._master_buffer.clear()
+    replication.num_bytes_processed = 0
+
+
+def test_commands_split_across_reads_are_applied_once():
+    stream = cmd('SET', 'a', '1') + cmd('INCR', 'n') + cmd('SELECT', '2') + cmd('SET', 'b', 'x y\r\nz') + \
+        cmd('INCR', 'n')
+    # One byte per read: every command straddles reads.
+    applied = sum(feed(stream[i:i + 1]) for i in range(len(stream)))
+    assert applied == 5
+    assert not replication._master_buffer
+    assert replication.num_bytes_processed == len(stream)
+    assert databases[0][b'a'].val == b'1' and int(databases[0][b'n'].val) == 1
+    assert databases[2][b'b'].val == b'x y\r\nz' and int(databases[2][b'n'].val) == 1
+
+
+def test_getack_reports_the_offset_before_itself(master_link):
+    before = cmd('SET', 'a', '1') + cmd('SET', 'b', '2')
+    getack = cmd('REPLCONF', 'GETACK', '*')
+    # A whole batch in one read, with the start of the next command.
+    assert feed(before + getack + cmd('SET', 'c', '3')[:5]) == 3
+    assert replication.num_bytes_processed == len(before + getack)
+    assert [parse_redis_bytes(frame)[1] for frame in master_link.frames] == \
+        [[b'replconf', b'ACK', str(len(before)).encode()]]
+
+
+def test_fullresync_skips_a_binary_rdb_by_length():
+    rdb = b'REDIS0011\r\n$5\r\n*1 \xff\x00\r\n'
+    sync = b'+FULLRESYNC 8371b4fb1155b71f4a04d3e1bc3e18c4a990aeeb 0\r\n$%d\r\n' % len(rdb) + rdb
+    after = cmd('SET', 'k', 'v')
+    for split in range(len(sync)):
+        assert parse_fullresync(sync[:split]) is None
+    assert parse_fullresync(sync + after) == len(sync)
+    assert replication.get_bytes_after_fullresync(sync + after) == after
@@ -0,0 +1,164 @@
+import hashlib
+
+import pytest
+
+from app import scripting
+from app.config import server_config
+from conftest import run
+
+needs_lua = pytest.mark.skipif(scripting.LuaRuntime is None, reason="lupa is not installed")
+
+
+RATE_LIMITER = b"""#!python
+current = redis.call('INCR', KEYS[0])
+if current > int(ARGV[0]):
+    return redis.error_reply('ERR rate limited')
+return current
+"""
+
+
+@pytest.fixture(autouse=True)
+def clear():
+    scripting._script_cache.clear()
+    yield
+    scripting._script_cache.clear()
+
+
+def test_eval_calls_commands():
+    assert run(b'EVAL', RATE_LIMITER, b'1', b'hits', b'2') == b':1\r\n'
+    assert run(b'EVAL', RATE_LIMITER, b'1', b'hits', b'2') == b':2\r\n'
+    assert run(b'EVAL', RATE_LIMITER, b'1', b'hits', b'2') == b'-ERR rate limited\r\n'
+    assert run(b'GET', b'hits') == b'$1\r\n3\r\n'
+
+
+def test_reply_conversions():
+    script = b"#!python\nredis.call('RPUSH', 'l', 'a', 'b')\n" \
+             b"return [redis.call('LRANGE', 'l', 0, -1), redis.call('GET', 'missing'), 3.7, True, " \
+             b"redis.status_reply('FINE')]"
+    assert run(b'EVAL', script, b'0') == b'*5\r\n*2\r\n$1\r\na\r\n$1\r\nb\r\n$-1\r\n:3\r\n:1\r\n+FINE\r\n'
+    assert run(b'EVAL', b"#!python\nreturn redis.call('SET', 'k', 'v')", b'0') == b'+OK\r\n'
+
+
+def test_call_error_aborts_and_pcall_returns_it():
+    run(b'SET', b's', b'v')
+    assert run(b'EVAL', b"#!python\nredis.call('LPUSH', 's', 'x')\nreturn 1", b'0').startswith(b'-WRONGTYPE')
+    assert run(b'EVAL', b"#!python\nreturn redis.pcall('LPUSH', 's', 'x')", b'0').startswith(b'-WRONGTYPE')
+    run(b'HSET', b'h', b'f', b'1')
+    assert run(b'EVAL', b"#!python\nreturn redis.call('INCR', 'h')", b'0').startswith(b'-WRONGTYPE')
+    assert run(b'EVAL', b"#!python\nreturn redis.call('EVAL', 'return 1', 0)", b'0') == \
+        b'-ERR This Redis command is not allowed from script\r\n'
+
+
+def test_evalsha_and_script_commands():
+    sha = hashlib.sha1(RATE_LIMITER).hexdigest().encode()
+    assert run(b'EVALSHA', sha, b'1', b'hits', b'5').startswith(b'-NOSCRIPT')
+    assert run(b'SCRIPT', b'LOAD', RATE_LIMITER) == b'$40\r\n' + sha + b'\r\n'
+    assert run(b'SCRIPT', b'EXISTS', sha, b'0' * 40) == b'*2\r\n:1\r\n:0\r\n'
+    assert run(b'EVALSHA', sha.upper(), b'1', b'hits', b'5') == b':1\r\n'
+    assert run(b'SCRIPT', b'FLUSH') == b'+OK\r\n'
+    assert run(b'SCRIPT', b'EXISTS', sha) == b'*1\r\n:0\r\n'
+
+
+def test_numkeys_errors():
+    assert run(b'EVAL', b'#!python\nreturn 1', b'2', b'k') == \
+        b"-ERR Number of keys can't be greater than number of args\r\n"
+    assert run(b'EVAL', b'#!python\nreturn 1', b'-1') == b"-ERR Number of keys can't be negative\r\n"
+
+
+@pytest.mark.parametrize('source', [
+    b'import os',
+    b'return ().__class__',
+    b'return __import__("os")',
+    b'while True:\n    pass',
+    b'def f():\n    return 1',
+    b'return open("/etc/passwd")',
+])
+def test_python_dsl_is_restricted(source):
+    result = run(b'EVAL', b'#!python\n' + source, b'0')
+    assert result.startswith(b'-ERR Error')
+
+
+def test_script_writes_are_one_replication_append(monkeypatch):
+    import app.main
+    appended = []
+    monkeypatch.setattr(app.main, 'append_to_replication_stream', appended.append)
+    script = b"#!python\nredis.call('SET', KEYS[0], ARGV[0])\nredis.call('GET', KEYS[0])\nredis.call('INCR', KEYS[0])"
+    run(b'EVAL', script, b'1', b'k', b'1')
+    assert appended == [b'*1\r\n$5\r\nMULTI\r\n*3\r\n$3\r\nSET\r\n$1\r\nk\r\n$1\r\n1\r\n*2\r\n$4\r\nINCR\r\n$1\r\nk\r\n'
+                        b'*1\r\n$4\r\nEXEC\r\n']
+    # Read only scripts propagate nothing.
+    appended.clear()
+    run(b'EVAL', b"#!python\nreturn redis.call('GET', 'k')", b'0')
+    assert appended == []
+
+
+def test_without_lua_only_python_scripts_run(monkeypatch):
+    monkeypatch.setattr(scripting, 'LuaRuntime', None)
+    # Not run as python: KEYS[1] would be the second key.
+    assert run(b'EVAL', b"return redis.call('GET', KEYS[1])", b'2', b'a', b'b') == \
+        b'-ERR Lua engine not available, use #!python\r\n'
+    assert run(b'SCRIPT', b'LOAD', b'return 1') == b'-ERR Lua engine not available, use #!python\r\n'
+    assert run(b'EVAL', b'#!python\nreturn 1', b'0') == b':1\r\n'
+
+
+@pytest.mark.parametrize('source', [
+    b'for i in range(10 ** 12):\n    pass',
+    b'return len([i for i in range(10 ** 12)])',
+])
+def test_python_loops_have_a_time_budget(monkeypatch, source):
+    monkeypatch.setitem(server_config, 'busy-reply-threshold', 50)
+    script = b"#!python\nredis.call('SET', 'before', 1)\n" + source
+    assert run(b'EVAL', script, b'0') == \
+        b'-ERR Error running script: script stopped after running for 50 ms (busy-reply-threshold)\r\n'
+    # What ran before stays.
+    assert run(b'GET', b'before') == b'$1\r\n1\r\n'
+    assert run(b'EVAL', b'#!python\nn = 0\nfor i in range(5000):\n    n += i\nreturn n', b'0') == b':12497500\r\n'
+
+
+@needs_lua
+def test_lua_scripts():
+    script = b"redis.call('RPUSH', KEYS[1], ARGV[1], ARGV[2])\n" \
+             b"return {redis.call('LRANGE', KEYS[1], 0, -1), redis.call('GET', 'missing'), 3.7, true, " \
+             b"redis.status_reply('FINE')}"
+    assert run(b'EVAL', script, b'1', b'l', b'a', b'b') == \
+        b'*5\r\n*2\r\n$1\r\na\r\n$1\r\nb\r\n$-1\r\n:3\r\n:1\r\n+FINE\r\n'
+    assert run(b'EVAL', b"return redis.call('INCR', KEYS[1])", b'1', b'l').startswith(b'-WRONGTYPE')
+    assert run(b'EVAL', b"return redis.pcall('INCR', KEYS[1])['err']", b'1', b'l') == \
+        b'$65\r\nWRONGTYPE Operation against a key holding the wrong kind of value\r\n'
+    assert run(b'EVAL', b"return redis.error_reply('ERR nope')", b'0') == b'-ERR nope\r\n'
+
+
+@needs_lua
+@pytest.mark.parametrize('source', [
+    b'return tostring(redis.call.__globals__)',
+    b'return tostring(redis.call.__class__)',
+    # A python exception caught by pcall() is a python object.
+    b"local ok, e = pcall(redis.call, 'INCR', 'l'); return tostring(e.__class__)",
+    b"local ok, e = pcall(redis.call, 'INCR', 'l'); return tostring(e['__traceback__'])",
+    b"local ok, e = pcall(redis.call, 'INCR', 'l'); e.args = 1",
+    b"return tostring(python.eval('1'))",
+    b"return os.execute('true')",
+    b"return io.open('/etc/passwd')",
+    b"return require('os')",
+    b"return load('return 1')()",
+    b'return debug.getinfo(1)',
+    b'return coroutine.create(print)',
+])
+def test_lua_sandbox(source):
+    run(b'RPUSH', b'l', b'x')
+    result = run(b'EVAL', source, b'0')
+    assert result.startswith(b'-ERR Error running script'), result
+    assert b'app.scripting' not in result
+
+
+@needs_lua
+@pytest.mark.parametrize('source', [
+    b'while true do end',
+    b'while true do pcall(function() while true do end end) end',
+])
+def test_lua_scripts_have_a_time_budget(monkeypatch, source):
+    monkeypatch.setitem(server_config, 'busy-reply-threshold', 50)
+    assert run(b'EVAL', source, b'0') == \
+        b'-ERR Error running script: script stopped after running for 50 ms (busy-reply-threshold)\r\n'
+    # The next script has a budget of its own.
+    assert run(b'EVAL', b'local n = 0 for i = 1, 100000 do n = n + 1 end return n', b'0') == b':100000\r\n'
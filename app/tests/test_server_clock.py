@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+import pytest
+
+from app import server_clock
+from app.main import handle_client
+from app.server_clock import now_ms, resync_wall_clock
+
+
+@pytest.fixture(autouse=True)
+def restore_offset():
+    saved = server_clock._wall_offset_ms
+    yield
+    server_clock._wall_offset_ms = saved
+
+
+def test_cached_per_loop_iteration():
+    async def read_twice():
+        first = now_ms()
+        time.sleep(0.005)
+        same_iteration = now_ms()
+        await asyncio.sleep(0.005)
+        return first, same_iteration, now_ms()
+
+    first, same_iteration, next_iteration = asyncio.run(read_twice())
+    assert same_iteration == first
+    assert next_iteration >= first + 5
+    assert abs(now_ms() - time.time_ns() // 1_000_000) < 50
+
+
+def test_wall_clock_jumps_are_ignored(monkeypatch):
+    before = now_ms()
+    real_time_ns = time.time_ns
+    monkeypatch.setattr(time, 'time_ns', lambda: real_time_ns() + 3600 * 10 ** 9)
+    assert abs(resync_wall_clock() - 3_600_000) < 50
+    assert now_ms() - before < 50
+    # A slow drift is followed.
+    monkeypatch.setattr(time, 'time_ns', lambda: real_time_ns() + 20 * 10 ** 6)
+    assert resync_wall_clock() == 0
+    assert 15 <= now_ms() - before < 70
+
+
+def test_ttl_accuracy_under_load():
+    async def scenario():
+        server = await asyncio.start_server(handle_client, host='localhost', port=0)
+        port = server.sockets[0].getsockname()[1]
+        stop = False
+
+        async def hammer():
+            reader, writer = await asyncio.open_connection('localhost', port)
+            while not stop:
+                writer.write(b'SET load x\r\nGET load\r\n' * 50)
+                await writer.drain()
+                await reader.readexactly(len(b'+OK\r\n$1\r\nx\r\n') * 50)
+            writer.close()
+
+        async with server:
+            load = [asyncio.create_task(hammer()) for _ in range(20)]
+            reader, writer = await asyncio.open_connection('localhost', port)
+            # The expiry is counted from the time the server received the SET: after set_sent, before start.
+            set_sent = time.monotonic()
+            writer.write(b'SET k v PX 300\r\n')
+            await writer.drain()
+            assert await reader.readline() == b'+OK\r\n'
+            start = time.monotonic()
+            samples = []
+            while True:
+                sent = time.monotonic() - start
+                writer.write(b'GET k\r\n')
+                await writer.drain()
+                reply = await reader.readline()
+                if reply == b'$-1\r\n':
+                    break
+                await reader.readline()
+                samples.append(sent)
+                await asyncio.sleep(0.005)
+            expired_after = time.monotonic() - set_sent
+            stop = True
+            await asyncio.gather(*load)
+            writer.close()
+            return samples, sent, expired_after
+
+    samples, last_sent, expired_after = asyncio.run(scenario())
+    # Still there until its TTL passed (a GET sent later would have been received later), gone soon after.
+    assert samples and samples[-1] < 0.31
+    assert expired_after >= 0.29
+    assert last_sent < 0.5
@@ -0,0 +1,76 @@
+import pytest
+
+from app import latency_monitor, slowlog
+from app.config import server_config
+from app.latency_histogram import LatencyHistogram
+from app.redis_serialization_protocol import parse_redis_bytes
+from app.server_stats import reset_stats
+from conftest import run
+
+
+@pytest.fixture(autouse=True)
+def clear():
+    reset_stats()
+    slowlog._entries.clear()
+    latency_monitor._events.clear()
+    yield
+    server_config['slowlog-log-slower-than'] = 10_000
+    server_config['slowlog-max-len'] = 128
+    server_config['latency-monitor-threshold'] = 0
+
+
+def test_slowlog_ring_buffer():
+    server_config['slowlog-log-slower-than'] = 0
+    server_config['slowlog-max-len'] = 3
+    for i in range(5):
+        run(b'SET', b'k%d' % i, b'v')
+    # The SLOWLOG commands themselves are logged too.
+    assert run(b'SLOWLOG', b'LEN') == b':3\r\n'
+    entries = parse_redis_bytes(run(b'SLOWLOG', b'GET', b'2'))[1]
+    assert [entry[3] for entry in entries] == [[b'SLOWLOG', b'LEN'], [b'SET', b'k4', b'v']]
+    assert entries[0][0] > entries[1][0]
+    server_config['slowlog-log-slower-than'] = -1
+    assert run(b'SLOWLOG', b'RESET') == b'+OK\r\n'
+    assert run(b'SLOWLOG', b'LEN') == b':0\r\n'
+
+
+def test_slowlog_trims_long_commands():
+    server_config['slowlog-log-slower-than'] = 0
+    run(b'SADD', b's', *[b'%d' % i for i in range(100)])
+    run(b'SET', b'k', b'x' * 1000)
+    set_entry, sadd_entry = parse_redis_bytes(run(b'SLOWLOG', b'GET'))[1]
+    assert len(sadd_entry[3]) == 32
+    assert sadd_entry[3][-1] == b'... (71 more arguments)'
+    assert set_entry[3][2] == b'x' * 128 + b'... (872 more bytes)'
+
+
+def test_latency_events():
+    latency_monitor.add_latency_sample('eventloop', 50_000)
+    assert run(b'LATENCY', b'LATEST') == b'*0\r\n'
+    server_config['latency-monitor-threshold'] = 10
+    latency_monitor.add_latency_sample('eventloop', 5_000)
+    latency_monitor.add_latency_sample('eventloop', 50_000)
+    latency_monitor.add_latency_sample('eventloop', 20_000)
+    (name, _, latest, max_ms), = parse_redis_bytes(run(b'LATENCY', b'LATEST'))[1]
+    # One HISTORY sample per second: the max of that second.
+    assert (name, latest, max_ms) == (b'eventloop', 50, 50)
+    assert len(parse_redis_bytes(run(b'LATENCY', b'HISTORY', b'eventloop'))[1]) == 1
+    assert latency_monitor._events['eventloop'].histogram_us.total == 2
+    assert run(b'LATENCY', b'RESET') == b':1\r\n'
+
+
+def test_latency_histogram_of_commands():
+    run(b'SET', b'k', b'v')
+    run(b'GET', b'k')
+    run(b'GET', b'k')
+    name, (_, calls, _, buckets) = parse_redis_bytes(run(b'LATENCY', b'HISTOGRAM', b'get'))[1]
+    assert (name, calls) == (b'get', 2)
+    # Cumulative counts, ending with all the calls.
+    assert buckets[-1] == 2
+
+
+def test_power_of_two_buckets():
+    histogram = LatencyHistogram()
+    for value in (1, 3, 4, 5, 1000, 1024, 1025):
+        histogram.record(value)
+    assert histogram.power_of_two_buckets() == [(1, 1), (4, 3), (8, 4), (1024, 7)]
@@ -0,0 +1,139 @@
+import pytest
+
+from app import transaction
+from app.client_state import get_client_state
+from conftest import run
+
+
+class FakeWriter:
+    def __init__(self, peer):
+        self.peer = peer
+
+    def write(self, data):
+        pass
+
+
+def connect(peer) -> FakeWriter:
+    writer = FakeWriter(peer)
+    get_client_state(writer, peer)
+    return writer
+
+
+@pytest.fixture
+def clients():
+    return connect(('127.0.0.1', 1)), connect(('127.0.0.1', 2))
+
+
+def test_exec_runs_when_watched_keys_unchanged(clients):
+    a, b = clients
+    run(b'SET', b'balance', b'10', writer=a)
+    assert run(b'WATCH', b'balance', writer=a) == b'+OK\r\n'
+    run(b'GET', b'balance', writer=b)
+    run(b'MULTI', writer=a)
+    assert run(b'INCR', b'balance', writer=a) == b'+QUEUED\r\n'
+    assert run(b'EXEC', writer=a) == b'*1\r\n:11\r\n'
+    # EXEC unwatches everything.
+    assert not transaction._watched_keys
+
+
+def test_exec_aborts_when_watched_key_changed(clients):
+    a, b = clients
+    run(b'WATCH', b'balance', b'other', writer=a)
+    run(b'SET', b'balance', b'5', writer=b)
+    run(b'MULTI', writer=a)
+    run(b'INCR', b'balance', writer=a)
+    assert run(b'EXEC', writer=a) == b'*-1\r\n'
+    assert run(b'GET', b'balance', writer=a) == b'$1\r\n5\r\n'
+    assert not transaction._watched_keys
+    # Any write command counts, not only SET.
+    run(b'WATCH', b'h', writer=a)
+    run(b'HSET', b'h', b'f', b'v', writer=b)
+    run(b'MULTI', writer=a)
+    assert run(b'EXEC', writer=a) == b'*-1\r\n'
+
+
+def test_unwatch_discard_and_watch_inside_multi(clients):
+    a, b = clients
+    run(b'WATCH', b'k', writer=a)
+    assert run(b'UNWATCH', writer=a) == b'+OK\r\n'
+    run(b'SET', b'k', b'1', writer=b)
+    run(b'MULTI', writer=a)
+    assert run(b'WATCH', b'k', writer=a).startswith(b'-ERR WATCH inside MULTI')
+    assert run(b'EXEC', writer=a) == b'*0\r\n'
+
+    run(b'WATCH', b'k', writer=a)
+    run(b'MULTI', writer=a)
+    assert run(b'DISCARD', writer=a) == b'+OK\r\n'
+    assert not transaction._watched_keys
+
+
+def test_flushall_and_expiry_touch_watched_keys(clients):
+    a, b = clients
+    run(b'WATCH', b'missing', writer=a)
+    run(b'FLUSHALL', writer=b)
+    run(b'MULTI', writer=a)
+    assert run(b'EXEC', writer=a) == b'*-1\r\n'
+
+    run(b'SET', b'k', b'v', b'PX', b'100', writer=a)
+    run(b'WATCH', b'k', writer=a)
+    run(b'MULTI', writer=a)
+    assert run(b'EXEC', writer=a, now=1000) == b'*-1\r\n'
+
+
+def test_queue_time_checks_abort_exec(clients):
+    a, _ = clients
+    run(b'MULTI', writer=a)
+    assert run(b'SET', b'k', b'v', writer=a) == b'+QUEUED\r\n'
+    assert run(b'GET', writer=a) == b"-ERR wrong number of arguments for 'get' command\r\n"
+    assert run(b'NOSUCHCMD', b'x', writer=a).startswith(b"-ERR unknown command 'NOSUCHCMD'")
+    assert run(b'MULTI', writer=a).startswith(b'-ERR MULTI calls can not be nested')
+    assert run(b'EXEC', writer=a).startswith(b'-EXECABORT')
+    # Nothing ran.
+    assert run(b'GET', b'k', writer=a) == b'$-1\r\n'
+    assert run(b'EXEC', writer=a) == b'-ERR EXEC without MULTI\r\n'
+
+
+def test_queue_is_per_connection(clients):
+    # Two connections from the same peer address must not share a queue.
+    a = clients[0]
+    a2 = connect(a.peer)
+    run(b'MULTI', writer=a)
+    run(b'SET', b'k', b'1', writer=a)
+    assert run(b'GET', b'k', writer=a2) == b'$-1\r\n'
+    assert run(b'EXEC', writer=a) == b'*1\r\n+OK\r\n'
+
+
+def test_blocking_commands_do_not_block_inside_exec(clients):
+    a, _ = clients
+    run(b'MULTI', writer=a)
+    run(b'BLPOP', b'empty', b'0', writer=a)
+    run(b'RPUSH', b'l', b'x', writer=a)
+    run(b'BLPOP', b'l', b'0', writer=a)
+    assert run(b'EXEC', writer=a) == b'*3\r\n*-1\r\n:1\r\n*2\r\n$1\r\nl\r\n$1\r\nx\r\n'
+
+
+def test_exec_is_one_replication_append(clients, monkeypatch):
+    import app.main
+    appended = []
+    monkeypatch.setattr(app.main, 'append_to_replication_stream', appended.append)
+    a, _ = clients
+    run(b'MULTI', writer=a)
+    run(b'SET', b'k', b'1', writer=a)
+    run(b'GET', b'k', writer=a)
+    run(b'INCR', b'k', writer=a)
+    run(b'EXEC', writer=a)
+    assert appended == [b'*1\r\n$5\r\nMULTI\r\n*3\r\n$3\r\nSET\r\n$1\r\nk\r\n$1\r\n1\r\n*2\r\n$4\r\nINCR\r\n$1\r\nk\r\n'
+                        b'*1\r\n$4\r\nEXEC\r\n']
+
+
+def test_reset_is_not_queued_and_drops_the_transaction(clients):
+    a, _ = clients
+    run(b'SELECT', b'3', writer=a)
+    run(b'WATCH', b'k', writer=a)
+    run(b'MULTI', writer=a)
+    run(b'SET', b'k', b'1', writer=a)
+    assert run(b'RESET', writer=a) == b'+RESET\r\n'
+    client = get_client_state(a)
+    assert (client.in_multi, client.watched_keys, client.db) == (False, set(), 0)
+    assert run(b'EXEC', writer=a) == b'-ERR EXEC without MULTI\r\n'
+    assert run(b'GET', b'k', writer=a) == b'$-1\r\n'
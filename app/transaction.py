@@ -1,24 +1,107 @@
-from collections import defaultdict
-from dataclasses import dataclass
+"""
+MULTI / EXEC / DISCARD, and optimistic locking with WATCH / UNWATCH.
 
+The MULTI state and queue live on the connection's ClientState (client_state.py), so they go away with it.
+Commands are checked (known command, arity) when queued: a bad command is answered with an error right away,
+and the EXEC that follows fails with EXECABORT, without running anything.
+EXEC (main.py) runs the whole queue without yielding to the event loop (blocking commands don't block inside it),
+so no other client can run a command in the middle of a transaction.
 
-@dataclass
-class Transaction:
+WATCH keeps an index (db, key) -> clients watching it: the same key name in another database is another key.
+Every modified key is passed to touch_watched_key() (through memory_management.signal_modified_key()),
+which marks its watchers dirty. EXEC of a dirty client
+returns a null reply without running the queued commands.
+Writes to keys nobody watches pay a single dict lookup (nothing at all while no key is watched).
+"""
+from app.command_table import COMMAND_TABLE
+from app.redis_serialization_protocol import serialize_msg, SerializedTypes, OK_SIMPLE_STRING
 
-    # This stores which clients are currently in transaction_mode,
-    # In transaction mode we queue commands until EXEC is called.
-    # To enter transaction mode, use the MULTI command.
-    clients_in_transaction_mode: set[str]
+QUEUED_SIMPLE_STRING = b'+QUEUED\r\n'
 
+def start_multi(client) -> bytes:
+    if client.in_multi:
+        return serialize_msg("ERR MULTI calls can not be nested", SerializedTypes.ERROR)
+    client.in_multi = True
+    client.multi_queue = []
+    client.multi_error = False
+    return OK_SIMPLE_STRING
 
-    # transaction commands queue (every addr is mapped to the queued commands).
-    commands_in_q: defaultdict[str,list]
 
-    def discard_transaction(self, addr):
-        self.clients_in_transaction_mode.remove(addr)
-        del self.commands_in_q[addr]
+def discard_multi(client):
+    client.in_multi = False
+    client.multi_queue = []
+    client.multi_error = False
+    unwatch_all(client)
 
-    def is_in_transaction_mode(self, addr) -> bool:
-        return addr in self.clients_in_transaction_mode
 
+def _check_command(tokens) -> str | None:
+    """
+    The error message if the command can't run (unknown command, wrong number of arguments), else None.
+    """
+    name = tokens[0].upper()
+    spec = COMMAND_TABLE.get(name)
+    if spec is None:
+        args = ' '.join(f"'{t.decode(errors='replace')}'" for t in tokens[1:])
+        return f"ERR unknown command '{tokens[0].decode(errors='replace')}', with args beginning with: {args}"
+    if (spec.arity > 0 and len(tokens) != spec.arity) or len(tokens) < -spec.arity:
+        return f"ERR wrong number of arguments for '{name.decode().lower()}' command"
+    return None
 
+
+def queue_command(client, tokens) -> bytes:
+    """
+    Between MULTI and EXEC: check the command and queue it.
+    A command that can't run is not queued, and makes the EXEC fail (EXECABORT).
+    """
+    first_token = tokens[0].upper()
+    if first_token == b'MULTI':
+        return serialize_msg("ERR MULTI calls can not be nested", SerializedTypes.ERROR)
+    if first_token == b'WATCH':
+        return serialize_msg("ERR WATCH inside MULTI is not allowed", SerializedTypes.ERROR)
+    error = _check_command(tokens)
+    if error is not None:
+        client.multi_error = True
+        return serialize_msg(error, SerializedTypes.ERROR)
+    client.multi_queue.append(tokens)
+    return QUEUED_SIMPLE_STRING
+
+
+# (db, key) -> clients watching it
+_watched_keys: dict[tuple[int, bytes], set] = {}
+
+
+def watch_keys(client, db: int, keys):
+    for key in keys:
+        db_key = (db, key)
+        if db_key in client.watched_keys:
+            continue
+        client.watched_keys.add(db_key)
+        _watched_keys.setdefault(db_key, set()).add(client)
+
+
+def unwatch_all(client):
+    for db_key in client.watched_keys:
+        watchers = _watched_keys.get(db_key)
+        if watchers is not None:
+            watchers.discard(client)
+            if not watchers:
+                del _watched_keys[db_key]
+    client.watched_keys.clear()
+    client.watch_dirty = False
+
+
+def touch_watched_key(key, db: int):
+    if _watched_keys:
+        for client in _watched_keys.get((db, key), ()):
+            client.watch_dirty = True
+
+
+def touch_all_watched_keys(dbs=None):
+    """
+    FLUSHALL (dbs None: all of them), FLUSHDB, SWAPDB: every watched key of these databases (that existed or not)
+    counts as modified.
+    """
+    for (db, _), watchers in _watched_keys.items():
+        if dbs is None or db in dbs:
+            for client in watchers:
+                client.watch_dirty = True
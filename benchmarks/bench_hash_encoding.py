@@ -0,0 +1,67 @@
+"""
+Memory per hash and ops/sec for both hash encodings (listpack vs hashtable).
+
+Run from the repo root:
+python -m benchmarks.bench_hash_encoding
+"""
+import time
+import tracemalloc
+
+from app.config import server_config
+from app.redis_hash import RedisHash
+
+NUM_HASHES = 2000
+NUM_OPS = 200_000
+
+
+def build_hashes(num_fields, force_hashtable):
+    hashes = []
+    for h_idx in range(NUM_HASHES):
+        h = RedisHash()
+        if force_hashtable:
+            h._convert_to_hashtable()
+        for i in range(num_fields):
+            h.set(b'field:%d' % i, b'value:%d' % i)
+        hashes.append(h)
+    return hashes
+
+
+def measure_memory(num_fields, force_hashtable) -> float:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    hashes = build_hashes(num_fields, force_hashtable)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(hashes) == NUM_HASHES
+    return (after - before) / NUM_HASHES
+
+
+def measure_ops(num_fields, force_hashtable) -> tuple[float, float]:
+    h = build_hashes(num_fields, force_hashtable)[0]
+    fields = [b'field:%d' % (i % num_fields) for i in range(NUM_OPS)]
+
+    start = time.perf_counter()
+    for f in fields:
+        h.get(f)
+    get_ops = NUM_OPS / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for f in fields:
+        h.set(f, b'new')
+    set_ops = NUM_OPS / (time.perf_counter() - start)
+    return get_ops, set_ops
+
+
+def main():
+    print(f"{'fields':>6} {'encoding':>10} {'bytes/hash':>11} {'HGET ops/s':>12} {'HSET ops/s':>12}")
+    for num_fields in (5, 20, 64, 128):
+        for force_hashtable in (False, True):
+            encoding = 'hashtable' if force_hashtable else 'listpack'
+            mem = measure_memory(num_fields, force_hashtable)
+            get_ops, set_ops = measure_ops(num_fields, force_hashtable)
+            print(f"{num_fields:>6} {encoding:>10} {mem:>11.0f} {get_ops:>12,.0f} {set_ops:>12,.0f}")
+    print(f"(hash-max-listpack-entries={server_config['hash-max-listpack-entries']})")
+
+
+if __name__ == "__main__":
+    main()
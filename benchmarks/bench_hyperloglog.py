@@ -0,0 +1,50 @@
+"""
+Counting unique elements: HyperLogLog (PFADD / PFCOUNT) vs an exact set (SADD / SCARD).
+Memory per key, estimation error, and PFADD throughput.
+
+Run from the repo root:
+python -m benchmarks.bench_hyperloglog
+"""
+import time
+import tracemalloc
+
+from app.redis_hyperloglog import new_hll, hll_add, estimate_cardinality, registers_of
+from app.redis_set import RedisSet
+
+BATCH_SIZE = 1000
+
+
+def measure_set(elements) -> int:
+    """
+    Bytes used by the set itself (the member bytes objects already exist, so this is a lower bound).
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    s = RedisSet.from_members(elements)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(s) == len(elements)
+    return after - before
+
+
+def measure_hll(elements) -> tuple[int, float, float]:
+    hll = new_hll()
+    start = time.perf_counter()
+    for i in range(0, len(elements), BATCH_SIZE):
+        hll_add(hll, elements[i:i + BATCH_SIZE])
+    add_ops = len(elements) / (time.perf_counter() - start)
+    error = estimate_cardinality(registers_of(hll)) / len(elements) - 1
+    return len(hll), error, add_ops
+
+
+def main():
+    print(f"{'uniques':>9} {'set bytes':>12} {'hll bytes':>10} {'hll error':>10} {'PFADD elems/s':>14}")
+    for num_uniques in (100, 1_000, 10_000, 100_000, 1_000_000):
+        elements = [b'visitor:%d' % i for i in range(num_uniques)]
+        set_bytes = measure_set(elements)
+        hll_bytes, error, add_ops = measure_hll(elements)
+        print(f"{num_uniques:>9,} {set_bytes:>12,} {hll_bytes:>10,} {error:>+10.2%} {add_ops:>14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Replica lag: how far behind a busy master the replica applies the replication stream.
+
+A fake master (in this process) does the handshake, sends FULLRESYNC with the empty RDB, then streams SETs at a
+fixed rate, in 1ms ticks. The replica is the real one (replication._init_replica). Every tick's commands are
+written in one go, and are applied once num_bytes_processed covers them: lag is the time in between.
+
+Run from the repo root:
+python -m benchmarks.bench_replica_lag
+"""
+import asyncio
+import statistics
+import time
+
+from app import replication
+from app.memory_management import flush_memstore
+from app.rdb import EMPTY_RDB_HEX
+from app.redis_serialization_protocol import serialize_msg, SerializedTypes
+
+DURATION_S = 3
+TICK_S = 0.001
+NUM_KEYS = 10_000
+
+
+async def run_master(reader, writer, writes_per_sec, sent):
+    # PING, REPLCONF listening-port, REPLCONF capa
+    for reply in (b'+PONG\r\n', b'+OK\r\n', b'+OK\r\n'):
+        await reader.read(1000)
+        writer.write(reply)
+        await writer.drain()
+    await reader.read(1000)
+    rdb = bytes.fromhex(EMPTY_RDB_HEX)
+    writer.write(b'+FULLRESYNC %s 0\r\n$%d\r\n' % (b'a' * 40, len(rdb)) + rdb)
+
+    # Serialized up front: the master's own cost stays out of the measure.
+    per_tick = round(writes_per_sec * TICK_S)
+    commands = [serialize_msg([b'SET', b'key:%d' % i, b'value'], SerializedTypes.ARRAY) for i in range(NUM_KEYS)]
+    batches = [b''.join(commands[i:i + per_tick]) for i in range(0, NUM_KEYS, per_tick)]
+    offset, tick = 0, 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < DURATION_S:
+        batch = batches[tick % len(batches)]
+        writer.write(batch)
+        offset += len(batch)
+        sent.append((offset, time.perf_counter()))
+        await writer.drain()
+        # Hold the rate: sleep until the next tick (behind schedule: no sleep).
+        tick += 1
+        await asyncio.sleep(max(0.0, start + tick * TICK_S - time.perf_counter()))
+    return tick * per_tick
+
+
+async def measure(writes_per_sec) -> tuple[float, list[float]]:
+    sent = []
+    master_done = asyncio.get_running_loop().create_future()
+
+    async def on_replica(reader, writer):
+        master_done.set_result(await run_master(reader, writer, writes_per_sec, sent))
+
+    server = await asyncio.start_server(on_replica, host='localhost', port=0)
+    port = server.sockets[0].getsockname()[1]
+    replication.num_bytes_processed = 0
+    async with server:
+        await replication._init_replica(('localhost', port), 0)
+        lags, applied = [], 0
+        start = time.perf_counter()
+        # Sample the replica's offset once per loop iteration (the replica applies whole reads in one go).
+        while not master_done.done() or applied < len(sent):
+            while applied < len(sent) and replication.num_bytes_processed >= sent[applied][0]:
+                lags.append(time.perf_counter() - sent[applied][1])
+                applied += 1
+            await asyncio.sleep(0)
+        elapsed = time.perf_counter() - start
+        num_writes = master_done.result()
+        replication._master_conn_writer.close()
+    flush_memstore()
+    return num_writes / elapsed, lags
+
+
+def main():
+    print(f"{'target writes/s':>16} {'applied/s':>10} {'lag p50 ms':>11} {'lag p99 ms':>11} {'lag max ms':>11}")
+    for writes_per_sec in (10_000, 50_000, 100_000):
+        throughput, lags = asyncio.run(measure(writes_per_sec))
+        lags_ms = sorted(lag * 1000 for lag in lags)
+        p99 = lags_ms[int(len(lags_ms) * 0.99)]
+        print(f"{writes_per_sec:>16,} {throughput:>10,.0f} {statistics.median(lags_ms):>11.2f} {p99:>11.2f} "
+              f"{lags_ms[-1]:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
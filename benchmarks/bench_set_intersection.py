@@ -0,0 +1,30 @@
+"""
+SINTER of 3 to 5 sets with 100k members each (tag filtering workload).
+
+Run from the repo root:
+python -m benchmarks.bench_set_intersection
+"""
+import random
+import time
+
+from app.redis_set import RedisSet, set_intersection
+
+SET_SIZE = 100_000
+ID_SPACE = 400_000
+NUM_RUNS = 20
+
+
+def main():
+    rnd = random.Random(0)
+    sets = [RedisSet.from_members(b'item:%d' % i for i in rnd.sample(range(ID_SPACE), SET_SIZE))
+            for _ in range(5)]
+    for num_sets in (3, 4, 5):
+        start = time.perf_counter()
+        for _ in range(NUM_RUNS):
+            result = set_intersection(sets[:num_sets])
+        elapsed_ms = (time.perf_counter() - start) * 1000 / NUM_RUNS
+        print(f"SINTER {num_sets} x {SET_SIZE} members: {elapsed_ms:.2f} ms ({len(result)} members in result)")
+
+
+if __name__ == "__main__":
+    main()
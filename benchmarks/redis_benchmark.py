@@ -0,0 +1,283 @@
+"""
+Load generator for the server (in the spirit of redis-benchmark).
+
+Many connections send a random mix of commands, each with up to --pipeline commands in flight,
+and the latency of every command is recorded (from the write of its batch to the read of its reply).
+Reports ops/sec and p50 / p99 / p99.9 latency, overall and per command.
+Blocking commands (XREAD) run on their own --blocking-clients connections, one at a time, and are left out
+of TOTAL: their latency is mostly the wait for data, and pipelined with the other commands, whole batches
+would wait for it.
+
+Run from the repo root, against a running server:
+python -m benchmarks.redis_benchmark --port 6379 --clients 50 --requests 100000 --pipeline 16
+
+or let it start one (python -m app.main, output discarded):
+python -m benchmarks.redis_benchmark --spawn-server
+
+Regression check: save a run with --json, then compare later runs to it:
+python -m benchmarks.redis_benchmark --spawn-server --json baseline.json
+python -m benchmarks.redis_benchmark --spawn-server --baseline baseline.json --max-regression 0.1
+The process exits with 1 when ops/sec dropped, or p99 grew, by more than --max-regression.
+
+Command mix (--mix, weights):
+GET / SET / INCR     on key:<n>, n random in --keyspace, SET values are --value-size bytes
+XADD                 XADD stream:<n> * field <value>, n random in --stream-keys
+XRANGE               XRANGE stream:<n> - +   (keep --stream-keys high enough, streams grow during the run)
+XREAD                XREAD block <--xread-block-ms> streams stream:<n> <now>: waits for the next XADD (blocking)
+"""
+import argparse
+import asyncio
+import json
+import random
+import socket
+import subprocess
+import sys
+import time
+
+from app.latency_histogram import LatencyHistogram
+from app.redis_serialization_protocol import serialize_msg, SerializedTypes
+
+DEFAULT_MIX = 'GET:50,SET:40,INCR:5,XADD:3,XRANGE:1,XREAD:1'
+BLOCKING_COMMANDS = {'XREAD'}
+
+
+def parse_mix(mix: str) -> tuple[list[str], list[int]]:
+    names, weights = [], []
+    for part in mix.split(','):
+        name, _, weight = part.partition(':')
+        name = name.strip().upper()
+        if name not in COMMAND_BUILDERS:
+            raise SystemExit(f"Unknown command in --mix: {name} (one of {', '.join(COMMAND_BUILDERS)})")
+        names.append(name)
+        weights.append(int(weight or 1))
+    return names, weights
+
+
+def _key(args) -> bytes:
+    return b'key:%d' % random.randrange(args.keyspace)
+
+
+def _stream(args) -> bytes:
+    return b'stream:%d' % random.randrange(args.stream_keys)
+
+
+COMMAND_BUILDERS = {
+    'GET': lambda args, value: [b'GET', _key(args)],
+    'SET': lambda args, value: [b'SET', _key(args), value],
+    'INCR': lambda args, value: [b'INCR', b'counter:%d' % random.randrange(args.keyspace)],
+    'XADD': lambda args, value: [b'XADD', _stream(args), b'*', b'field', value],
+    'XRANGE': lambda args, value: [b'XRANGE', _stream(args), b'-', b'+'],
+    'XREAD': lambda args, value: [b'XREAD', b'block', str(args.xread_block_ms).encode(), b'streams', _stream(args),
+                                  b'%d-0' % int(time.time() * 1000)],
+}
+
+
+async def read_reply(reader: asyncio.StreamReader):
+    """
+    Read one reply. Errors are returned (not raised) as RuntimeError instances.
+    """
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Connection closed by the server")
+    kind, payload = line[:1], line[1:-2]
+    if kind == b'$':
+        length = int(payload)
+        return None if length < 0 else (await reader.readexactly(length + 2))[:-2]
+    if kind in (b'*', b'>', b'%'):
+        length = int(payload)
+        if kind == b'%':
+            length *= 2
+        return None if length < 0 else [await read_reply(reader) for _ in range(length)]
+    if kind == b'-':
+        return RuntimeError(payload.decode())
+    if kind == b':':
+        return int(payload)
+    return payload
+
+
+class Stats:
+
+    def __init__(self):
+        self.latency_us: dict[str, LatencyHistogram] = {}
+        self.errors: dict[str, int] = {}
+
+    def record(self, name: str, latency_us: int, reply):
+        histogram = self.latency_us.get(name)
+        if histogram is None:
+            histogram = self.latency_us[name] = LatencyHistogram()
+        histogram.record(latency_us)
+        if isinstance(reply, RuntimeError):
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+
+async def run_connection(args, names, weights, value, remaining: list[int], stats: Stats, pipeline: int):
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    try:
+        while remaining[0] > 0:
+            batch_size = min(pipeline, remaining[0])
+            remaining[0] -= batch_size
+            batch = random.choices(names, weights, k=batch_size)
+            payload = b''.join(serialize_msg(COMMAND_BUILDERS[name](args, value), SerializedTypes.ARRAY)
+                               for name in batch)
+            start = time.perf_counter_ns()
+            writer.write(payload)
+            for name in batch:
+                reply = await read_reply(reader)
+                stats.record(name, (time.perf_counter_ns() - start) // 1000, reply)
+    finally:
+        writer.close()
+
+
+async def prepare_keyspace(args, value):
+    """
+    Streams must exist before XREAD / XRANGE (and GETs should mostly hit).
+    """
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    commands = [[b'XADD', b'stream:%d' % n, b'*', b'field', value] for n in range(args.stream_keys)]
+    commands += [[b'SET', b'key:%d' % n, value] for n in range(min(args.keyspace, 10_000))]
+    for i in range(0, len(commands), 100):
+        chunk = commands[i:i + 100]
+        writer.write(b''.join(serialize_msg(cmd, SerializedTypes.ARRAY) for cmd in chunk))
+        for _ in chunk:
+            await read_reply(reader)
+    writer.close()
+
+
+async def run_benchmark(args) -> dict:
+    names, weights = parse_mix(args.mix)
+    value = b'x' * args.value_size
+    random.seed(args.seed)
+    await prepare_keyspace(args, value)
+
+    # The blocking commands get their share of --requests, on their own connections.
+    blocking = [(name, weight) for name, weight in zip(names, weights) if name in BLOCKING_COMMANDS]
+    others = [(name, weight) for name, weight in zip(names, weights) if name not in BLOCKING_COMMANDS]
+    if not args.blocking_clients:
+        blocking = []
+    blocking_remaining = [round(args.requests * sum(w for _, w in blocking) / sum(w for _, w in blocking + others))]
+    remaining = [args.requests - blocking_remaining[0]]
+
+    stats = Stats()
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(run_connection(args, *zip(*blocking), value, blocking_remaining, stats, pipeline=1)
+          for _ in range(args.blocking_clients if blocking else 0)),
+        *(run_connection(args, *zip(*others), value, remaining, stats, pipeline=args.pipeline)
+          for _ in range(args.clients if others else 0)))
+    elapsed = time.perf_counter() - start
+
+    total = LatencyHistogram()
+    commands = {}
+    for name, histogram in sorted(stats.latency_us.items()):
+        if name not in BLOCKING_COMMANDS:
+            total.merge(histogram)
+        commands[name] = {'ops_per_sec': round(histogram.total / elapsed, 1), 'errors': stats.errors.get(name, 0),
+                          'latency_us': histogram.summary()}
+    return {
+        'config': {k: getattr(args, k) for k in ('clients', 'requests', 'pipeline', 'keyspace', 'value_size', 'mix',
+                                                 'blocking_clients', 'stream_keys', 'xread_block_ms', 'seed')},
+        'elapsed_sec': round(elapsed, 3),
+        'total': {'ops_per_sec': round(total.total / elapsed, 1),
+                  'errors': sum(n for name, n in stats.errors.items() if name not in BLOCKING_COMMANDS),
+                  'latency_us': total.summary()},
+        'commands': commands,
+    }
+
+
+def compare_to_baseline(result: dict, baseline: dict, max_regression: float) -> list[str]:
+    """
+    Regressions of result vs baseline: ops/sec lower, or p99 higher, by more than max_regression (a ratio).
+    """
+    regressions = []
+    pairs = [('total', result['total'], baseline['total'])]
+    pairs += [(name, stats, baseline['commands'][name]) for name, stats in result['commands'].items()
+              if name in baseline.get('commands', {})]
+    for name, new, old in pairs:
+        if new['ops_per_sec'] < old['ops_per_sec'] * (1 - max_regression):
+            regressions.append(f"{name}: ops/sec {old['ops_per_sec']} -> {new['ops_per_sec']}")
+        if new['latency_us']['p99'] > old['latency_us']['p99'] * (1 + max_regression):
+            regressions.append(f"{name}: p99 {old['latency_us']['p99']}us -> {new['latency_us']['p99']}us")
+    return regressions
+
+
+def print_report(result: dict):
+    print(f"{result['config']}")
+    print(f"{'command':<8} {'ops/sec':>12} {'p50 us':>10} {'p99 us':>10} {'p99.9 us':>10} {'max us':>10} {'errors':>7}")
+    rows = list(result['commands'].items()) + [('TOTAL', result['total'])]
+    for name, stats in rows:
+        latency = stats['latency_us']
+        print(f"{name:<8} {stats['ops_per_sec']:>12,.0f} {latency['p50']:>10} {latency['p99']:>10} "
+              f"{latency['p99.9']:>10} {latency['max']:>10} {stats['errors']:>7}")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def spawn_server(port: int) -> subprocess.Popen:
+    server = subprocess.Popen([sys.executable, '-m', 'app.main', '--port', str(port)],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            return server
+        except OSError:
+            time.sleep(0.05)
+    server.kill()
+    raise SystemExit("The server did not start")
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('--spawn-server', action='store_true', help="Start a server on a free port for the run")
+    parser.add_argument('--clients', type=int, default=50, help="Number of connections")
+    parser.add_argument('--requests', type=int, default=100_000, help="Total number of commands")
+    parser.add_argument('--pipeline', type=int, default=1, help="Commands in flight per connection")
+    parser.add_argument('--keyspace', type=int, default=100_000, help="Number of distinct keys")
+    parser.add_argument('--value-size', type=int, default=3, help="SET / XADD value size in bytes")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="Command weights, eg: GET:80,SET:20")
+    parser.add_argument('--stream-keys', type=int, default=16, help="Number of distinct streams")
+    parser.add_argument('--xread-block-ms', type=int, default=10)
+    parser.add_argument('--blocking-clients', type=int, default=4,
+                        help="Connections running the blocking commands of the mix (XREAD), 0: leave them out")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="Save the results to this file")
+    parser.add_argument('--baseline', help="Compare the results to this saved run")
+    parser.add_argument('--max-regression', type=float, default=0.1)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    server = None
+    if args.spawn_server:
+        args.host, args.port = '127.0.0.1', _free_port()
+        server = spawn_server(args.port)
+    try:
+        result = asyncio.run(run_benchmark(args))
+    finally:
+        if server is not None:
+            server.kill()
+            server.wait()
+
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(result, json.load(f), args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regression vs {args.baseline} (max {args.max_regression:.0%})")
+
+
+if __name__ == '__main__':
+    main()